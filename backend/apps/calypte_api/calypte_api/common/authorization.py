@@ -1,15 +1,42 @@
+import asyncio
+import base64
+import hashlib
+import hmac
 import http
 import time
 
-from calypte_api.common.settings import get_settings
-from fastapi import HTTPException, Request
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Any, NamedTuple
+
+import orjson
+
+from calypte_api.common.bloom import BloomFilter
+from calypte_api.common.databases import get_redis_client
+from calypte_api.common.settings import JwtBackend, get_settings
+from fastapi import Depends, HTTPException, Request
 from fastapi.security import HTTPBearer
-from jose import jwt
+from jose import JWTError, jwt
 from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
 
 settings = get_settings()
 
+# access token ids scored by the expiry of their token, and `dev.<device id>`
+# scored by the expiry of the last revoked token of the device
+REVOKED_TOKENS_KEY = "jwt:revoked"
+REVOCATION_CHANNEL = "jwt:revocations"
+
+DEVICE_TOKEN_PREFIX = "dev."
+
+_HMAC_DIGESTS = {
+    "HS256": hashlib.sha256,
+    "HS384": hashlib.sha384,
+    "HS512": hashlib.sha512,
+}
+
 
 class JwtUserSchema(BaseModel):
     id: str
@@ -24,24 +51,317 @@ class JwtClaims(BaseModel):
     iat: int
 
 
+class DeviceClaims(NamedTuple):
+    user_id: str
+    device_id: str
+    type_id: str
+    exp: int
+
+
+class TokenCache:
+    """
+    Bounded LRU of verified tokens, keyed by their digest
+
+    A hit skips the signature check and the claims validation, an entry is
+    dropped once its token expires. Cached claims are shared between requests
+    and must not be mutated.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: OrderedDict[bytes, JwtClaims] = OrderedDict()
+
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def get(self, token: str, now: float) -> JwtClaims | None:
+        key = self._key(token)
+        claims = self._entries.get(key)
+        if claims is None:
+            return None
+
+        if claims.exp < now:
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return claims
+
+    def set(self, token: str, claims: JwtClaims) -> None:
+        self._entries[self._key(token)] = claims
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class RevokedTokens:
+    """
+    Access token ids revoked before their expiry, held in a bloom filter
+
+    The filter is rebuilt from `jwt:revoked` now and then so expired
+    revocations are forgotten, revocations published on `jwt:revocations` in
+    between are added as they come. A token the filter does not know is valid
+    without a Redis round trip, a hit is confirmed in `jwt:revoked`, which a
+    valid token needs with a chance of `jwt_revocation_error_rate`.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._filter = BloomFilter(capacity, error_rate)
+
+    def add(self, jti: str | bytes) -> None:
+        self._filter.add(jti)
+
+    def replace(self, jtis: list[bytes]) -> None:
+        bloom = BloomFilter(max(self.capacity, 2 * len(jtis)), self.error_rate)
+        for jti in jtis:
+            bloom.add(jti)
+        self._filter = bloom
+
+    def __contains__(self, jti: str | bytes) -> bool:
+        return jti in self._filter
+
+
+token_cache = TokenCache(max_size=settings.jwt_cache_max_size)
+revoked_tokens = RevokedTokens(
+    capacity=settings.jwt_revocation_capacity,
+    error_rate=settings.jwt_revocation_error_rate,
+)
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+def _decode_with_jose(token: str) -> Any:
+    return jwt.decode(
+        token,
+        settings.jwt_secret_key,
+        algorithms=[settings.jwt_encoding_algorithm],
+    )
+
+
+def _decode_with_hmac(token: str) -> Any:
+    header_segment, payload_segment, signature_segment = token.split(".")
+    header = orjson.loads(_b64decode(header_segment))
+    if not isinstance(header, dict):
+        raise ValueError("Invalid header.")
+    if header.get("alg") != settings.jwt_encoding_algorithm:
+        raise ValueError("Unexpected algorithm.")
+
+    signature = hmac.new(
+        settings.jwt_secret_key.encode(),
+        f"{header_segment}.{payload_segment}".encode(),
+        _HMAC_DIGESTS[settings.jwt_encoding_algorithm],
+    ).digest()
+    if not hmac.compare_digest(signature, _b64decode(signature_segment)):
+        raise ValueError("Invalid signature.")
+
+    return orjson.loads(_b64decode(payload_segment))
+
+
+def _get_decoder() -> Callable[[str], Any]:
+    if settings.jwt_backend == JwtBackend.JOSE:
+        return _decode_with_jose
+
+    if settings.jwt_encoding_algorithm not in _HMAC_DIGESTS:
+        raise ValueError(
+            f"The hmac JWT backend does not support "
+            f"{settings.jwt_encoding_algorithm}."
+        )
+    return _decode_with_hmac
+
+
+_decode = _get_decoder()
+
+
 def decode_token(token: str) -> JwtClaims | None:
+    now = time.time()
+    jwt_claims = token_cache.get(token, now)
+    if jwt_claims is None:
+        try:
+            jwt_claims = JwtClaims.model_validate(_decode(token))
+        # malformed tokens, bad signatures and invalid claims, pydantic's
+        # ValidationError is a ValueError
+        except (JWTError, ValueError):
+            return None
+
+        if jwt_claims.exp < now:
+            return None
+        token_cache.set(token, jwt_claims)
+
+    return jwt_claims
+
+
+def _device_revocation(device_id: str) -> str:
+    # the tokens of a device are revoked together, by the id of the device
+    return f"{DEVICE_TOKEN_PREFIX}{device_id}"
+
+
+def _revocation_member(token: JwtClaims | DeviceClaims) -> str:
+    if isinstance(token, DeviceClaims):
+        return _device_revocation(token.device_id)
+
+    return token.access_jti
+
+
+async def is_revoked(redis_client: Redis, token: JwtClaims | DeviceClaims) -> bool:
+    """
+    Check whether an access token or a device token has been revoked
+
+    Only an id the bloom filter knows is looked up in `jwt:revoked`, so a
+    false positive of the filter does not reject a valid token. While Redis
+    is unreachable the ids the filter knows stay rejected.
+
+    Args:
+        redis_client (Redis): redis client
+        token (JwtClaims | DeviceClaims): claims of the token
+    """
+    member = _revocation_member(token)
+    if member not in revoked_tokens:
+        return False
+
     try:
-        decoded_token = jwt.decode(
-            token,
-            settings.jwt_secret_key,
-            algorithms=[settings.jwt_encoding_algorithm],
-        )
-        jwt_claims = JwtClaims(**decoded_token)
-        return jwt_claims if jwt_claims.exp >= time.time() else None
-    except Exception:
+        revoked_until = await redis_client.zscore(REVOKED_TOKENS_KEY, member)
+    except RedisError:
+        return True
+
+    # tokens of a device issued after its revocation expire later
+    return revoked_until is not None and token.exp <= revoked_until
+
+
+_device_token_key = (
+    settings.device_token_secret_key or settings.jwt_secret_key
+).encode()
+
+
+def _sign_device_token(payload: str) -> bytes:
+    signature = hmac.new(_device_token_key, payload.encode(), hashlib.sha256)
+    return base64.urlsafe_b64encode(signature.digest()).rstrip(b"=")
+
+
+def create_device_token(user_id: str, device_id: str, type_id: str, exp: int) -> str:
+    """
+    Create a token a device authenticates its firmware downloads with
+
+    The token is `dev.<user id>.<device id>.<type id>.<exp>.<signature>`, the
+    signature an HMAC-SHA256 of the rest of it.
+
+    Args:
+        user_id (str): id of the owner of the device
+        device_id (str): id of the device
+        type_id (str): id of the type of the device
+        exp (int): unix time the token expires at
+    """
+    payload = f"{DEVICE_TOKEN_PREFIX}{user_id}.{device_id}.{type_id}.{exp}"
+    return f"{payload}.{_sign_device_token(payload).decode()}"
+
+
+def decode_device_token(token: str) -> DeviceClaims | None:
+    payload, _, signature = token.rpartition(".")
+    if not hmac.compare_digest(
+        _sign_device_token(payload), signature.encode(errors="replace")
+    ):
         return None
 
+    # the payload was signed by us, it is well-formed
+    user_id, device_id, type_id, exp = payload.removeprefix(
+        DEVICE_TOKEN_PREFIX
+    ).split(".")
+    if int(exp) < time.time():
+        return None
+
+    return DeviceClaims(
+        user_id=user_id, device_id=device_id, type_id=type_id, exp=int(exp)
+    )
+
+
+async def revoke_token(redis_client: Redis, jwt_claims: JwtClaims) -> None:
+    """
+    Revoke an access token on every worker until it expires
+
+    Args:
+        redis_client (Redis): redis client
+        jwt_claims (JwtClaims): claims of the token
+    """
+    revoked_tokens.add(jwt_claims.access_jti)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(REVOKED_TOKENS_KEY, {jwt_claims.access_jti: jwt_claims.exp})
+        pipe.publish(REVOCATION_CHANNEL, jwt_claims.access_jti)
+        await pipe.execute()
+
+
+async def revoke_device_tokens(redis_client: Redis, device_id: str) -> None:
+    """
+    Revoke the tokens issued to a device so far on every worker
+
+    Device tokens are not recorded, the revocation rejects every token of
+    the device that expires before one issued now would, which includes
+    those issued in the second of the revocation.
+
+    Args:
+        redis_client (Redis): redis client
+        device_id (str): id of the device
+    """
+    member = _device_revocation(device_id)
+    revoked_until = int(time.time()) + settings.device_token_expire_in_seconds
+    revoked_tokens.add(member)
+    async with redis_client.pipeline(transaction=True) as pipe:
+        pipe.zadd(REVOKED_TOKENS_KEY, {member: revoked_until})
+        pipe.publish(REVOCATION_CHANNEL, member)
+        await pipe.execute()
+
+
+async def _load_revocations(redis_client: Redis) -> None:
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.zremrangebyscore(REVOKED_TOKENS_KEY, "-inf", time.time())
+        pipe.zrange(REVOKED_TOKENS_KEY, 0, -1)
+        _, jtis = await pipe.execute()
+
+    revoked_tokens.replace(jtis)
+
+
+async def listen_for_revocations(redis_client: Redis) -> None:
+    """
+    Keep the revoked tokens of this worker in sync with Redis
+
+    Runs until cancelled, reconnecting when Redis goes away. The filter is
+    rebuilt on every (re)subscribe and every
+    `jwt_revocation_rebuild_interval_in_seconds`, while Redis is unreachable
+    the last known revocations keep being enforced.
+
+    Args:
+        redis_client (Redis): redis client
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(REVOCATION_CHANNEL)
+                while True:
+                    await _load_revocations(redis_client)
+                    rebuild_at = (
+                        time.monotonic()
+                        + settings.jwt_revocation_rebuild_interval_in_seconds
+                    )
+                    while time.monotonic() < rebuild_at:
+                        message = await pubsub.get_message(
+                            ignore_subscribe_messages=True, timeout=1.0
+                        )
+                        if message is not None:
+                            revoked_tokens.add(message["data"])
+        except RedisError:
+            await asyncio.sleep(1)
+
 
 class JWTBearer(HTTPBearer):
-    def __init__(self, auto_error: bool = True):
+    def __init__(self, auto_error: bool = True, allow_devices: bool = False):
         super().__init__(auto_error=auto_error)
+        self.allow_devices = allow_devices
 
-    async def __call__(self, request: Request) -> JwtClaims:  # type: ignore
+    async def __call__(  # type: ignore
+        self, request: Request, redis_client: Redis = Depends(get_redis_client)
+    ) -> JwtClaims | DeviceClaims:
         credentials = await super().__call__(request)
         if not credentials:
             raise HTTPException(
@@ -55,7 +375,18 @@ class JWTBearer(HTTPBearer):
                 detail="Only Bearer token might be accepted",
             )
 
-        decoded_token = decode_token(credentials.credentials)
+        decoded_token: JwtClaims | DeviceClaims | None
+        if self.allow_devices and credentials.credentials.startswith(
+            DEVICE_TOKEN_PREFIX
+        ):
+            decoded_token = decode_device_token(credentials.credentials)
+        else:
+            decoded_token = decode_token(credentials.credentials)
+
+        if decoded_token is not None and await is_revoked(
+            redis_client, decoded_token
+        ):
+            decoded_token = None
 
         if not decoded_token:
             raise HTTPException(
@@ -0,0 +1,169 @@
+import struct
+
+from collections.abc import Iterable, Iterator
+
+
+_CONTAINER_BITS = 16
+_LOW_MASK = (1 << _CONTAINER_BITS) - 1
+_FULL_CONTAINER = (1 << (1 << _CONTAINER_BITS)) - 1
+_BITSET_BYTES = (1 << _CONTAINER_BITS) // 8
+
+# past this cardinality a container is smaller as a bitset than as an array
+_ARRAY_MAX_CARDINALITY = _BITSET_BYTES // 2
+
+_HEADER = struct.Struct("<I")
+_CONTAINER_HEADER = struct.Struct("<IH")
+
+# positions of the set bits of every byte
+_BYTE_BITS = tuple(
+    tuple(bit for bit in range(8) if byte >> bit & 1) for byte in range(256)
+)
+
+
+def _container_values(container: int) -> Iterator[int]:
+    for index, byte in enumerate(container.to_bytes(_BITSET_BYTES, "little")):
+        if byte:
+            base = index * 8
+            for bit in _BYTE_BITS[byte]:
+                yield base + bit
+
+
+def _container_from_values(values: Iterable[int]) -> int:
+    buffer = bytearray(_BITSET_BYTES)
+    for value in values:
+        buffer[value >> 3] |= 1 << (value & 7)
+    return int.from_bytes(buffer, "little")
+
+
+class Bitmap:
+    """
+    Roaring-style compressed bitmap of non-negative integers
+
+    Values are split on their high bits into containers of 2**16 values, a
+    container is a Python int used as a bitset so AND, OR and AND NOT run a
+    machine word at a time. Sparse containers are serialized as sorted uint16
+    arrays and dense ones as 8 KiB bitsets. Bitmaps are never mutated, the
+    operators return new ones.
+    """
+
+    __slots__ = ("_containers", "_cardinality")
+
+    def __init__(self, containers: dict[int, int] | None = None):
+        self._containers = containers or {}
+        self._cardinality: int | None = None
+
+    @classmethod
+    def from_values(cls, values: Iterable[int]) -> "Bitmap":
+        buffers: dict[int, bytearray] = {}
+        for value in values:
+            key, low = value >> _CONTAINER_BITS, value & _LOW_MASK
+            buffer = buffers.get(key)
+            if buffer is None:
+                buffer = buffers[key] = bytearray(_BITSET_BYTES)
+            buffer[low >> 3] |= 1 << (low & 7)
+
+        return cls(
+            {key: int.from_bytes(buffer, "little") for key, buffer in buffers.items()}
+        )
+
+    @classmethod
+    def deserialize(cls, data: bytes) -> "Bitmap":
+        (count,) = _HEADER.unpack_from(data)
+        offset = _HEADER.size
+        containers = {}
+        for _ in range(count):
+            key, cardinality = _CONTAINER_HEADER.unpack_from(data, offset)
+            offset += _CONTAINER_HEADER.size
+            cardinality += 1
+            if cardinality <= _ARRAY_MAX_CARDINALITY:
+                lows = struct.unpack_from(f"<{cardinality}H", data, offset)
+                containers[key] = _container_from_values(lows)
+                offset += cardinality * 2
+            else:
+                containers[key] = int.from_bytes(
+                    data[offset : offset + _BITSET_BYTES], "little"
+                )
+                offset += _BITSET_BYTES
+
+        return cls(containers)
+
+    def serialize(self) -> bytes:
+        chunks = [_HEADER.pack(len(self._containers))]
+        for key in sorted(self._containers):
+            container = self._containers[key]
+            cardinality = container.bit_count()
+            chunks.append(_CONTAINER_HEADER.pack(key, cardinality - 1))
+            if cardinality <= _ARRAY_MAX_CARDINALITY:
+                lows = tuple(_container_values(container))
+                chunks.append(struct.pack(f"<{cardinality}H", *lows))
+            else:
+                chunks.append(container.to_bytes(_BITSET_BYTES, "little"))
+
+        return b"".join(chunks)
+
+    def iter_from(self, start: int = 0) -> Iterator[int]:
+        """
+        Iterate the values from `start` in ascending order
+
+        Args:
+            start (int): smallest value to return
+        """
+        start_key = start >> _CONTAINER_BITS
+        for key in sorted(key for key in self._containers if key >= start_key):
+            container = self._containers[key]
+            if key == start_key:
+                container &= ~((1 << (start & _LOW_MASK)) - 1)
+
+            base = key << _CONTAINER_BITS
+            for low in _container_values(container):
+                yield base + low
+
+    def __iter__(self) -> Iterator[int]:
+        return self.iter_from(0)
+
+    def __len__(self) -> int:
+        if self._cardinality is None:
+            self._cardinality = sum(
+                container.bit_count() for container in self._containers.values()
+            )
+
+        return self._cardinality
+
+    def __bool__(self) -> bool:
+        return bool(self._containers)
+
+    def __contains__(self, value: int) -> bool:
+        container = self._containers.get(value >> _CONTAINER_BITS, 0)
+        return bool(container >> (value & _LOW_MASK) & 1)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Bitmap):
+            return NotImplemented
+
+        return self._containers == other._containers
+
+    def __and__(self, other: "Bitmap") -> "Bitmap":
+        containers = {}
+        for key in self._containers.keys() & other._containers.keys():
+            if container := self._containers[key] & other._containers[key]:
+                containers[key] = container
+
+        return Bitmap(containers)
+
+    def __or__(self, other: "Bitmap") -> "Bitmap":
+        containers = dict(self._containers)
+        for key, container in other._containers.items():
+            containers[key] = containers.get(key, 0) | container
+
+        return Bitmap(containers)
+
+    def __sub__(self, other: "Bitmap") -> "Bitmap":
+        containers = {}
+        for key, container in self._containers.items():
+            if key in other._containers:
+                # a negative int would be converted to two's complement
+                container &= other._containers[key] ^ _FULL_CONTAINER
+            if container:
+                containers[key] = container
+
+        return Bitmap(containers)
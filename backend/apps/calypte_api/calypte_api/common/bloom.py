@@ -0,0 +1,51 @@
+import hashlib
+import math
+
+
+class BloomFilter:
+    """
+    Bloom filter over strings
+
+    Answers "maybe present" for every added item and for `error_rate` of the
+    others, never "absent" for an added item. Positions come from one blake2b
+    digest split into two hashes combined by enhanced double hashing, which
+    keeps the error rate on target for many hashes over a small filter.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        capacity = max(capacity, 1)
+        self.size = max(
+            math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2), 8
+        )
+        self.hash_count = max(round(self.size / capacity * math.log(2)), 1)
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _hashes(self, item: str | bytes) -> tuple[int, int]:
+        if isinstance(item, str):
+            item = item.encode()
+
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        return (
+            int.from_bytes(digest[:8], "little"),
+            int.from_bytes(digest[8:], "little") | 1,
+        )
+
+    def add(self, item: str | bytes) -> None:
+        position, step = self._hashes(item)
+        for i in range(self.hash_count):
+            bit = position % self.size
+            self._bits[bit >> 3] |= 1 << (bit & 7)
+            position += step
+            step += i
+
+    def __contains__(self, item: str | bytes) -> bool:
+        # most lookups are absent items, stop at the first clear bit
+        position, step = self._hashes(item)
+        for i in range(self.hash_count):
+            bit = position % self.size
+            if not self._bits[bit >> 3] >> (bit & 7) & 1:
+                return False
+            position += step
+            step += i
+
+        return True
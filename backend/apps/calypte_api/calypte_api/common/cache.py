@@ -0,0 +1,496 @@
+import asyncio
+import contextlib
+import hashlib
+import time
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable, Iterable
+from enum import StrEnum
+from typing import Annotated, Any, TypeVar
+from uuid import UUID, uuid4
+
+import orjson
+
+from calypte_api.common.bitmaps import Bitmap
+from calypte_api.common.dependencies import RedisClientType
+from calypte_api.common.settings import get_settings
+from fastapi import Depends
+from pydantic import BaseModel
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+settings = get_settings()
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+Loader = Callable[[], Awaitable[BaseModel | None]]
+
+Dump = Callable[[Any], bytes]
+
+INVALIDATION_CHANNEL = "cache:invalidations"
+
+# Store the value only if the loader still holds the fill lock, an
+# invalidation deletes the lock so a value read before a write is dropped.
+_FILL_SCRIPT = """
+if redis.call("GET", KEYS[2]) == ARGV[1] then
+    redis.call("SET", KEYS[1], ARGV[2], "EX", ARGV[3])
+    redis.call("DEL", KEYS[2])
+    return 1
+end
+return 0
+"""
+
+_RELEASE_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+end
+"""
+
+# In-flight loads of this worker, concurrent misses of a key share one load.
+_inflight: dict[str, asyncio.Future[bytes]] = {}
+
+
+class CacheResource(StrEnum):
+    DEVICES = "devices"
+    TAGS = "tags"
+    FIRMWARE_INFO = "firmware-info"
+    ROLLOUTS = "rollouts"
+
+
+def type_rollouts_item(type_id: UUID) -> str:
+    # the active rollouts of a type, dropped by every change to one of them
+    return f"type:{type_id}"
+
+
+class LocalCache:
+    """
+    Bounded LRU with a TTL in front of Redis, one per worker process
+
+    Entries are dropped when another worker publishes an invalidation, the
+    TTL only bounds staleness while the invalidation listener reconnects.
+    Cached objects are shared between requests and must not be mutated.
+    """
+
+    def __init__(self, max_size: int, expire_in_seconds: float):
+        self.max_size = max_size
+        self.expire_in_seconds = expire_in_seconds
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> tuple[bool, Any]:
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] <= time.monotonic():
+            del self._entries[key]
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return False, None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry[1]
+
+    def set(self, key: str, value: Any, version: int) -> None:
+        # an invalidation since the value was read from Redis may have been
+        # for this very key
+        if version != self.version:
+            return
+
+        self._entries[key] = (time.monotonic() + self.expire_in_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def discard(self, keys: Iterable[str]) -> None:
+        self.version += 1
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        self.version += 1
+        self._entries.clear()
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._entries),
+            "max_size": self.max_size,
+        }
+
+
+local_cache = LocalCache(
+    max_size=settings.local_cache_max_size,
+    expire_in_seconds=settings.local_cache_expire_in_seconds,
+)
+
+
+def dump_response(response: BaseModel | None) -> bytes:
+    if response is None:
+        return b"null"
+
+    return orjson.dumps(response.model_dump(mode="json", by_alias=True))
+
+
+async def listen_for_invalidations(redis_client: Redis) -> None:
+    """
+    Apply the invalidations published by every worker to the local cache
+
+    Runs until cancelled, reconnecting when Redis goes away. Invalidations
+    published while disconnected are lost, so the local cache is emptied on
+    every (re)subscribe.
+
+    Args:
+        redis_client (Redis): redis client
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                local_cache.clear()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        local_cache.discard(orjson.loads(message["data"]))
+        except RedisError:
+            local_cache.clear()
+            await asyncio.sleep(1)
+
+
+class IResponseCache(ABC):
+    @abstractmethod
+    async def get_item(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_id: UUID | str,
+        load: Loader,
+    ) -> bytes:
+        """
+        Get a serialized item, loading and caching it on a miss
+
+        Args:
+            user_id (UUID): user id
+            resource (CacheResource): resource the item belongs to
+            item_id (UUID | str): item id or name of a derived lookup
+            load (Loader): loads the response on a miss
+
+        returns:
+            bytes: JSON response body
+        """
+
+    @abstractmethod
+    async def get_object(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_id: UUID | str,
+        model: type[ModelT],
+        load: Callable[[], Awaitable[ModelT | None]],
+    ) -> ModelT | None:
+        """
+        Get an item from the local cache, then Redis, then the loader
+
+        Meant for rarely changing objects read on hot paths, it shares the
+        Redis entry with `get_item`.
+
+        Args:
+            user_id (UUID): user id
+            resource (CacheResource): resource the item belongs to
+            item_id (UUID | str): item id or name of a derived lookup
+            model (type[ModelT]): model to parse the cached JSON into
+            load (Callable[[], Awaitable[ModelT | None]]): loads the object
+                on a miss, None is cached as well
+
+        returns:
+            ModelT | None: cached object
+        """
+
+    @abstractmethod
+    async def get_list(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        query_params: BaseModel,
+        load: Loader,
+    ) -> bytes:
+        """
+        Get a serialized page, loading and caching it on a miss
+
+        Args:
+            user_id (UUID): user id
+            resource (CacheResource): resource the page lists
+            query_params (BaseModel): filters and pagination of the page
+            load (Loader): loads the response on a miss
+
+        returns:
+            bytes: JSON response body
+        """
+
+    @abstractmethod
+    async def get_bitmap(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        name: str,
+        load: Callable[[], Awaitable[Bitmap]],
+    ) -> Bitmap:
+        """
+        Get a bitmap index from the local cache, then Redis, then the loader
+
+        Bitmaps belong to the current generation of the resource pages, any
+        invalidation of the resource replaces all of them.
+
+        Args:
+            user_id (UUID): user id
+            resource (CacheResource): resource the bitmap indexes
+            name (str): name of the bitmap
+            load (Callable[[], Awaitable[Bitmap]]): builds the bitmap on a miss
+
+        returns:
+            Bitmap: cached bitmap
+        """
+
+    @abstractmethod
+    async def invalidate(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_ids: Iterable[UUID | str] = (),
+    ) -> None:
+        """
+        Drop the given items and every cached page of the resource
+
+        The items are dropped from the local cache of every worker too. When
+        Redis is unavailable only the local cache of this worker is cleared,
+        the other entries expire after `expire_in_seconds`.
+
+        Args:
+            user_id (UUID): user id
+            resource (CacheResource): changed resource
+            item_ids (Iterable[UUID | str]): changed items and derived lookups
+        """
+
+
+class RedisResponseCache(IResponseCache):
+    def __init__(
+        self,
+        redis_client: Redis,
+        expire_in_seconds: int,
+        fill_timeout_in_seconds: float,
+    ):
+        self.redis_client = redis_client
+        self.expire_in_seconds = expire_in_seconds
+        self.fill_timeout_in_seconds = fill_timeout_in_seconds
+
+    async def get_item(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_id: UUID | str,
+        load: Loader,
+    ) -> bytes:
+        return await self._get_or_load(
+            key=self._item_key(user_id=user_id, resource=resource, item_id=item_id),
+            load=load,
+        )
+
+    async def get_object(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_id: UUID | str,
+        model: type[ModelT],
+        load: Callable[[], Awaitable[ModelT | None]],
+    ) -> ModelT | None:
+        key = self._item_key(user_id=user_id, resource=resource, item_id=item_id)
+        found, value = local_cache.get(key)
+        if found:
+            return value
+
+        version = local_cache.version
+        content = await self._get_or_load(key=key, load=load)
+        value = None if content == b"null" else model.model_validate_json(content)
+        local_cache.set(key, value, version=version)
+        return value
+
+    async def get_list(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        query_params: BaseModel,
+        load: Loader,
+    ) -> bytes:
+        generation_key = self._generation_key(user_id=user_id, resource=resource)
+        try:
+            generation = int(await self.redis_client.get(generation_key) or 0)
+        except RedisError:
+            return dump_response(await load())
+
+        params_digest = hashlib.blake2b(
+            type(query_params).__name__.encode()
+            + orjson.dumps(
+                query_params.model_dump(mode="json"),
+                option=orjson.OPT_SORT_KEYS,
+            ),
+            digest_size=16,
+        ).hexdigest()
+        return await self._get_or_load(
+            key=f"{generation_key}:{generation}:{params_digest}", load=load
+        )
+
+    async def get_bitmap(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        name: str,
+        load: Callable[[], Awaitable[Bitmap]],
+    ) -> Bitmap:
+        generation_key = self._generation_key(user_id=user_id, resource=resource)
+        try:
+            generation = int(await self.redis_client.get(generation_key) or 0)
+        except RedisError:
+            return await load()
+
+        key = f"{generation_key}:{generation}:bitmap:{name}"
+        found, value = local_cache.get(key)
+        if found:
+            return value
+
+        version = local_cache.version
+        content = await self._get_or_load(
+            key=key, load=load, dump=lambda bitmap: bitmap.serialize()
+        )
+        value = Bitmap.deserialize(content)
+        local_cache.set(key, value, version=version)
+        return value
+
+    async def invalidate(
+        self,
+        user_id: UUID,
+        resource: CacheResource,
+        item_ids: Iterable[UUID | str] = (),
+    ) -> None:
+        keys = [
+            self._item_key(user_id=user_id, resource=resource, item_id=item_id)
+            for item_id in item_ids
+        ]
+        local_cache.discard(keys)
+
+        # pages are not tracked one by one, a new generation orphans all of
+        # them and they expire on their own; the write has already been
+        # committed, without Redis stale entries live until they expire
+        with contextlib.suppress(RedisError):
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                if keys:
+                    pipe.delete(*keys, *(f"{key}:lock" for key in keys))
+                    pipe.publish(INVALIDATION_CHANNEL, orjson.dumps(keys))
+                pipe.incr(self._generation_key(user_id=user_id, resource=resource))
+                await pipe.execute()
+
+    def _item_key(
+        self, user_id: UUID, resource: CacheResource, item_id: UUID | str
+    ) -> str:
+        return f"cache:{user_id}:{resource}:{item_id}"
+
+    def _generation_key(self, user_id: UUID, resource: CacheResource) -> str:
+        return f"cache:{user_id}:{resource}:lists"
+
+    async def _get_or_load(
+        self, key: str, load: Loader, dump: Dump = dump_response
+    ) -> bytes:
+        try:
+            value = await self.redis_client.get(key)
+        except RedisError:
+            return dump(await load())
+        if value is not None:
+            return value
+
+        inflight = _inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight)
+
+        future = asyncio.get_running_loop().create_future()
+        # the exception is re-raised to the caller, waiters may be gone
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        _inflight[key] = future
+        try:
+            value = await self._fill(key=key, load=load, dump=dump)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            del _inflight[key]
+
+    async def _fill(self, key: str, load: Loader, dump: Dump) -> bytes:
+        """
+        Load the value in one worker while the others wait for it
+
+        Args:
+            key (str): cache key
+            load (Loader): loads the response
+            dump (Dump): serializes the loaded value
+
+        returns:
+            bytes: serialized value
+        """
+        lock_key = f"{key}:lock"
+        token = uuid4().hex
+        deadline = time.monotonic() + self.fill_timeout_in_seconds
+        delay = 0.005
+
+        try:
+            while not await self.redis_client.set(
+                lock_key,
+                token,
+                nx=True,
+                px=int(self.fill_timeout_in_seconds * 1000),
+            ):
+                if time.monotonic() >= deadline:
+                    return dump(await load())
+
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.1)
+
+                value = await self.redis_client.get(key)
+                if value is not None:
+                    return value
+        except RedisError:
+            return dump(await load())
+
+        try:
+            value = dump(await load())
+        except BaseException:
+            with contextlib.suppress(RedisError):
+                await self.redis_client.eval(_RELEASE_SCRIPT, 1, lock_key, token)
+            raise
+
+        with contextlib.suppress(RedisError):
+            await self.redis_client.eval(
+                _FILL_SCRIPT, 2, key, lock_key, token, value, self.expire_in_seconds
+            )
+        return value
+
+
+def get_response_cache(redis_client: RedisClientType) -> IResponseCache:
+    return RedisResponseCache(
+        redis_client=redis_client,
+        expire_in_seconds=settings.cache_expire_in_seconds,
+        fill_timeout_in_seconds=settings.cache_fill_timeout_in_seconds,
+    )
+
+
+ResponseCacheType = Annotated[IResponseCache, Depends(get_response_cache)]
@@ -1,5 +1,10 @@
-from collections.abc import AsyncGenerator
+import functools
+import inspect
 
+from collections.abc import AsyncIterator, Callable
+from typing import Any, TypeVar
+
+from aiobotocore.client import AioBaseClient
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
@@ -8,19 +13,12 @@ from sqlalchemy.ext.asyncio import (
 )
 
 
+RepoT = TypeVar("RepoT")
+
 async_session: async_sessionmaker | None
 engine: None | AsyncEngine = None
 redis: None | Redis = None
-
-
-async def get_db_session() -> AsyncGenerator[None, AsyncSession]:
-    global async_session
-
-    if async_session is None:
-        raise RuntimeError("SQL client has not been defined.")
-
-    async with async_session() as db:
-        yield db
+s3_client: None | AioBaseClient = None
 
 
 async def get_redis_client() -> Redis:
@@ -28,3 +26,76 @@ async def get_redis_client() -> Redis:
         raise RuntimeError("Redis client has not been defined.")
 
     return redis
+
+
+async def get_s3_client() -> AioBaseClient:
+    if s3_client is None:
+        raise RuntimeError("S3 client has not been defined.")
+
+    return s3_client
+
+
+async def _release(db_session: AsyncSession, depth: int) -> None:
+    db_session.info["depth"] = depth
+    if depth == 0:
+        # ends the transaction, the session opens a new one when used again
+        await db_session.close()
+
+
+def _release_after_call(method: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(method)
+    async def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+        depth = self.db_session.info.get("depth", 0)
+        self.db_session.info["depth"] = depth + 1
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            await _release(self.db_session, depth)
+
+    return wrapper
+
+
+def _release_before_streaming(method: Callable[..., Any]) -> Callable[..., Any]:
+    @functools.wraps(method)
+    async def wrapper(self: Any, *args: Any, **kwargs: Any) -> AsyncIterator[Any]:
+        depth = self.db_session.info.get("depth", 0)
+        self.db_session.info["depth"] = depth + 1
+        released = False
+        try:
+            async for item in method(self, *args, **kwargs):
+                if not released:
+                    await _release(self.db_session, depth)
+                    released = True
+                yield item
+        finally:
+            if not released:
+                await _release(self.db_session, depth)
+
+    return wrapper
+
+
+def releases_connection(cls: type[RepoT]) -> type[RepoT]:
+    """
+    Give the connection of the `db_session` of a repository back to the pool
+    as soon as a public method returns
+
+    Repositories commit what they write, so a call ends its transaction and
+    the next one checks out a connection again only if it uses the
+    database. A streaming method gives the connection back before its first
+    item, the lookups it needs happen before that. Calls made from within a
+    call release the connection when the outermost one returns.
+
+    Args:
+        cls (type[RepoT]): repository class with a `db_session`
+    """
+    for name in dir(cls):
+        if name.startswith("_"):
+            continue
+
+        method = getattr(cls, name)
+        if inspect.iscoroutinefunction(method):
+            setattr(cls, name, _release_after_call(method))
+        elif inspect.isasyncgenfunction(method):
+            setattr(cls, name, _release_before_streaming(method))
+
+    return cls
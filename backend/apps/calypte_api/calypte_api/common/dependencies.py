@@ -3,34 +3,42 @@ import http
 from collections.abc import Callable, Coroutine
 from typing import Annotated
 
-from calypte_api.common.authorization import JWTBearer, JwtClaims
-from calypte_api.common.databases import get_db_session, get_redis_client
-from calypte_api.common.settings import get_settings
+from calypte_api.common.authorization import DeviceClaims, JWTBearer, JwtClaims
+from calypte_api.common.databases import get_redis_client
+from calypte_api.common.rate_limiting import RateLimit, RateLimiter, page_cost
+from calypte_api.common.replicas import get_routed_db_session
+from calypte_api.common.settings import RateLimitGroup
 from fastapi import Depends, HTTPException
-from fastapi_limiter.depends import RateLimiter
 from redis.asyncio import Redis
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
-settings = get_settings()
-
-DBSessionType = Annotated[AsyncSession, Depends(get_db_session)]
+DBSessionType = Annotated[AsyncSession, Depends(get_routed_db_session)]
 RedisClientType = Annotated[Redis, Depends(get_redis_client)]
 UserTokenType = Annotated[JwtClaims, Depends(JWTBearer())]
-RateLimiterType = Annotated[
-    RateLimiter,
-    Depends(
-        RateLimiter(
-            times=settings.rate_limiter_times,
-            seconds=settings.rate_limiter_seconds,
-        )
-    ),
+UserOrDeviceTokenType = Annotated[
+    JwtClaims | DeviceClaims, Depends(JWTBearer(allow_devices=True))
+]
+RateLimiterType = Annotated[RateLimit, Depends(RateLimiter())]
+PageRateLimiterType = Annotated[RateLimit, Depends(RateLimiter(cost=page_cost))]
+BulkRateLimiterType = Annotated[
+    RateLimit, Depends(RateLimiter(group=RateLimitGroup.BULK))
+]
+CheckInRateLimiterType = Annotated[
+    RateLimit, Depends(RateLimiter(group=RateLimitGroup.CHECK_IN))
+]
+DownloadRateLimiterType = Annotated[
+    RateLimit, Depends(RateLimiter(group=RateLimitGroup.DOWNLOAD))
 ]
 
 CheckPermissionType = Callable[
     [UserTokenType],
     Coroutine[None, None, JwtClaims],
 ]
+CheckDeviceOrPermissionType = Callable[
+    [UserOrDeviceTokenType],
+    Coroutine[None, None, JwtClaims | DeviceClaims],
+]
 
 
 def check_permission(user_role: str) -> CheckPermissionType:
@@ -44,3 +52,40 @@ def check_permission(user_role: str) -> CheckPermissionType:
         return user_token
 
     return _check_permission
+
+
+def check_device_or_permission(user_role: str) -> CheckDeviceOrPermissionType:
+    """
+    Accept a device token as well as a user token with the given role
+
+    A device token is verified with a single HMAC and no database access.
+
+    Args:
+        user_role (str): role a user token has to have
+    """
+
+    async def _check_device_or_permission(
+        token: UserOrDeviceTokenType,
+    ) -> JwtClaims | DeviceClaims:
+        if isinstance(token, JwtClaims) and user_role != token.user.role:
+            raise HTTPException(
+                status_code=http.HTTPStatus.FORBIDDEN,
+                detail="User does not have a permission to perform this action.",
+            )
+
+        return token
+
+    return _check_device_or_permission
+
+
+def get_owner_id(token: JwtClaims | DeviceClaims) -> str:
+    """
+    Get the id of the user acting, directly or through one of their devices
+
+    Args:
+        token (JwtClaims | DeviceClaims): decoded token
+    """
+    if isinstance(token, DeviceClaims):
+        return token.user_id
+
+    return token.user.id
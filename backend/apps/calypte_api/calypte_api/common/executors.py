@@ -0,0 +1,11 @@
+from concurrent.futures import ProcessPoolExecutor
+
+
+process_pool: None | ProcessPoolExecutor = None
+
+
+async def get_process_pool() -> ProcessPoolExecutor:
+    if process_pool is None:
+        raise RuntimeError("Process pool has not been defined.")
+
+    return process_pool
@@ -0,0 +1,78 @@
+import http
+
+from fastapi import HTTPException
+from pydantic import BaseModel
+
+
+class ByteRange(BaseModel):
+    start: int
+    end: int
+
+    @property
+    def length(self) -> int:
+        return self.end - self.start + 1
+
+    def content_range(self, size: int) -> str:
+        return f"bytes {self.start}-{self.end}/{size}"
+
+
+def parse_range_header(range_header: str | None, size: int) -> ByteRange | None:
+    """
+    Parse a single `Range: bytes=...` header value
+
+    Multi-range and malformed headers are ignored and the whole
+    representation is served, as RFC 9110 allows.
+
+    Args:
+        range_header (str | None): value of the Range header
+        size (int): size of the representation in bytes
+
+    Raises:
+        HTTPException: 416 if the range can not be satisfied
+    """
+    if not range_header:
+        return None
+
+    unit, _, ranges = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in ranges:
+        return None
+
+    first, sep, last = ranges.strip().partition("-")
+    if not sep or not (first or last):
+        return None
+    if (first and not first.isdigit()) or (last and not last.isdigit()):
+        return None
+
+    if not first:
+        suffix_length = int(last)
+        if suffix_length == 0 or size == 0:
+            raise _range_not_satisfiable(size)
+        return ByteRange(start=max(size - suffix_length, 0), end=size - 1)
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size:
+        raise _range_not_satisfiable(size)
+    if end < start:
+        return None
+
+    return ByteRange(start=start, end=end)
+
+
+def etag_matches(header_value: str | None, etag: str) -> bool:
+    if not header_value:
+        return False
+
+    if header_value.strip() == "*":
+        return True
+
+    candidates = (tag.strip().removeprefix("W/") for tag in header_value.split(","))
+    return etag in candidates
+
+
+def _range_not_satisfiable(size: int) -> HTTPException:
+    return HTTPException(
+        status_code=http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE,
+        detail="Requested range not satisfiable.",
+        headers={"Content-Range": f"bytes */{size}"},
+    )
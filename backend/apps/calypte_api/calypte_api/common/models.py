@@ -1,10 +1,20 @@
 import uuid
 
 from datetime import datetime
+from enum import StrEnum
 
+from sqlalchemy import (
+    BigInteger,
+    ForeignKey,
+    Identity,
+    Index,
+    String,
+    UniqueConstraint,
+    text,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.asyncio import AsyncAttrs
-from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
+from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 
 
@@ -25,3 +35,153 @@ class TimeStampedMixin:
     modified_at: Mapped[datetime] = mapped_column(
         default=func.now(), onupdate=func.now()
     )
+
+
+# relationships are `lazy="raise"`, every query states what it loads with
+# `selectinload` so a page never falls back to a lazy load per row
+
+# listings are paginated by `(created_at, id)` per user, the composite
+# indexes let a cursor seek straight to its page
+
+
+class Type(UUIDMixin, TimeStampedMixin, Base):
+    __tablename__ = "types"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(), index=True)
+    name: Mapped[str]
+
+
+class FirmwareStatus(StrEnum):
+    # created, its image is being stored
+    PENDING = "pending"
+    READY = "ready"
+
+
+# firmware is created pending and turns ready in the transaction that
+# references its image, pending firmware is invisible and reaped once it is
+# older than `firmware_pending_expire_in_seconds`
+
+
+class FirmwareInfo(UUIDMixin, TimeStampedMixin, Base):
+    __tablename__ = "firmware_info"
+    __table_args__ = (
+        UniqueConstraint("user_id", "type_id", "version"),
+        Index("ix_firmware_info_user_id_created_at_id", "user_id", "created_at", "id"),
+        Index(
+            "ix_firmware_info_pending_created_at",
+            "created_at",
+            postgresql_where=text(f"status = '{FirmwareStatus.PENDING}'"),
+        ),
+        Index(
+            "ix_firmware_info_type_id_released_at",
+            "type_id",
+            "released_at",
+            postgresql_where=text("released_at IS NOT NULL"),
+        ),
+    )
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID())
+    type_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("types.id", ondelete="CASCADE"), index=True
+    )
+    name: Mapped[str]
+    version: Mapped[str]
+    description: Mapped[str]
+    status: Mapped[str] = mapped_column(
+        String(16),
+        default=FirmwareStatus.READY,
+        server_default=FirmwareStatus.READY,
+    )
+    # set when the firmware is released to every device of its type, the
+    # most recently released firmware is what devices outside rollouts get
+    released_at: Mapped[datetime | None] = mapped_column(default=None)
+
+
+class Tag(UUIDMixin, TimeStampedMixin, Base):
+    __tablename__ = "tags"
+    __table_args__ = (
+        Index("ix_tags_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID())
+    type_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("types.id", ondelete="CASCADE"), index=True
+    )
+    name: Mapped[str]
+
+    device_lookups: Mapped[list["TagDeviceLookUp"]] = relationship(
+        lazy="raise", passive_deletes=True
+    )
+
+
+class Device(UUIDMixin, TimeStampedMixin, Base):
+    __tablename__ = "devices"
+    __table_args__ = (
+        Index("ix_devices_user_id_created_at_id", "user_id", "created_at", "id"),
+    )
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID())
+    type_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("types.id", ondelete="CASCADE"), index=True
+    )
+    registered_at: Mapped[datetime | None]
+    # dense integer id, the position of the device in the bitmap indexes
+    seq: Mapped[int] = mapped_column(BigInteger, Identity(), unique=True)
+
+    tag_lookups: Mapped[list["TagDeviceLookUp"]] = relationship(
+        lazy="raise", passive_deletes=True
+    )
+    firmware_info_lookups: Mapped[list["FirmwareInfoDeviceLookUp"]] = relationship(
+        order_by="FirmwareInfoDeviceLookUp.created_at",
+        lazy="raise",
+        passive_deletes=True,
+    )
+
+
+class TagDeviceLookUp(UUIDMixin, Base):
+    __tablename__ = "tag_device_lookups"
+    __table_args__ = (UniqueConstraint("tag_id", "device_id"),)
+
+    tag_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("tags.id", ondelete="CASCADE")
+    )
+    device_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("devices.id", ondelete="CASCADE"), index=True
+    )
+
+
+class FirmwareInfoDeviceLookUp(UUIDMixin, Base):
+    __tablename__ = "firmware_info_device_lookups"
+
+    firmware_info_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("firmware_info.id", ondelete="CASCADE"), index=True
+    )
+    device_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("devices.id", ondelete="CASCADE"), index=True
+    )
+
+    created_at: Mapped[datetime] = mapped_column(default=func.now())
+
+
+# a rollout is a single row whatever the size of its tag, devices are bucketed
+# by hashing their id and nothing is written per device until it checks in
+
+
+class Rollout(UUIDMixin, TimeStampedMixin, Base):
+    __tablename__ = "rollouts"
+    __table_args__ = (
+        UniqueConstraint("firmware_info_id", "tag_id"),
+        Index("ix_rollouts_user_id_type_id", "user_id", "type_id"),
+    )
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID())
+    type_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("types.id", ondelete="CASCADE")
+    )
+    firmware_info_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("firmware_info.id", ondelete="CASCADE"), index=True
+    )
+    tag_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("tags.id", ondelete="CASCADE"), index=True
+    )
+    percentage: Mapped[float]
@@ -0,0 +1,165 @@
+import binascii
+import http
+
+from collections.abc import Sequence
+from datetime import datetime
+from enum import StrEnum
+from typing import Any, Generic, TypeVar
+from uuid import UUID
+
+import orjson
+
+from fastapi import HTTPException, Query
+from fastapi_pagination.cursor import CursorPage as BaseCursorPage
+from fastapi_pagination.cursor import CursorParams as BaseCursorParams
+from fastapi_pagination.cursor import decode_cursor
+from pydantic import Field
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+T = TypeVar("T")
+
+Keyset = tuple[datetime, UUID]
+
+
+class PageTotal(StrEnum):
+    NONE = "none"
+    ESTIMATE = "estimate"
+    EXACT = "exact"
+
+
+class CursorParams(BaseCursorParams):
+    total: PageTotal = Query(
+        PageTotal.NONE,
+        description=(
+            "Whether to count the matching items, `estimate` uses "
+            "the planner statistics instead of scanning them"
+        ),
+    )
+
+
+class CursorPage(BaseCursorPage[T], Generic[T]):
+    total: int | None = Field(default=None, description="Total number of items")
+
+    __params_type__ = CursorParams
+
+
+def decode_keyset(cursor: str | None) -> Keyset | None:
+    """
+    Decode a `(created_at, id)` cursor
+
+    Args:
+        cursor (str | None): cursor from the previous page
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    if not cursor:
+        return None
+
+    try:
+        created_at, _, id_ = decode_cursor(cursor).partition("|")
+        return datetime.fromisoformat(created_at), UUID(id_)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=http.HTTPStatus.BAD_REQUEST,
+            detail="Invalid cursor.",
+        )
+
+
+def decode_position(cursor: str | None) -> int | None:
+    """
+    Decode a cursor holding the last position returned from a bitmap index
+
+    Args:
+        cursor (str | None): cursor from the previous page
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    if not cursor:
+        return None
+
+    try:
+        return int(decode_cursor(cursor))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(
+            status_code=http.HTTPStatus.BAD_REQUEST,
+            detail="Invalid cursor.",
+        )
+
+
+def paginate_by_keyset(
+    query: Select, model: Any, keyset: Keyset | None, size: int
+) -> Select:
+    """
+    Seek past the `(created_at, id)` keyset instead of skipping rows
+
+    The row comparison is served by an index on `(user_id, created_at, id)`,
+    a deep page costs the same as the first one.
+
+    Args:
+        query (Select): filtered query
+        model (Any): model with `created_at` and `id` columns
+        keyset (Keyset | None): last item of the previous page
+        size (int): page size, one more row is fetched to detect a next page
+    """
+    if keyset is not None:
+        query = query.where(tuple_(model.created_at, model.id) > tuple_(*keyset))
+
+    return query.order_by(model.created_at, model.id).limit(size + 1)
+
+
+def create_cursor_page(
+    items: Sequence[T], params: CursorParams, total: int | None = None
+) -> CursorPage[T]:
+    """
+    Create a page from up to `size + 1` items fetched after the cursor
+
+    Args:
+        items (Sequence[T]): items with `created_at` and `id`, ordered by them
+        params (CursorParams): page params
+        total (int | None): exact or estimated total
+    """
+    next_page = None
+    if len(items) > params.size:
+        items = items[: params.size]
+        next_page = f"{items[-1].created_at.isoformat()}|{items[-1].id}"
+
+    return CursorPage.create(
+        items=items,
+        params=params,
+        current=decode_cursor(params.cursor),
+        next_=next_page,
+        total=total,
+    )
+
+
+class _Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, query: Select) -> None:
+        self.query = query
+
+
+@compiles(_Explain, "postgresql")
+def _compile_explain(element: _Explain, compiler: Any, **kwargs: Any) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.query, **kwargs)}"
+
+
+async def estimate_count(db_session: AsyncSession, query: Select) -> int:
+    """
+    Estimate the number of rows a query returns from the planner statistics
+
+    Args:
+        db_session (AsyncSession): database session
+        query (Select): filtered query, without ordering or limit
+    """
+    plan = await db_session.scalar(_Explain(query))
+    if isinstance(plan, str | bytes):
+        plan = orjson.loads(plan)
+
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,235 @@
+import time
+
+from contextvars import ContextVar
+from typing import Any
+from uuid import uuid4
+
+from calypte_api.common.settings import Settings
+from sqlalchemy import exc
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, ConnectionPoolEntry
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+
+# upper bounds in seconds of the checkout wait and hold histograms
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 1.0, float("inf"))
+HOLD_BUCKETS = (0.01, 0.1, 1.0, 10.0, float("inf"))
+
+
+class RequestPoolStats:
+    """
+    Connections a request checked out and for how long it held them
+    """
+
+    __slots__ = ("checkouts", "wait_seconds", "hold_seconds")
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.hold_seconds = 0.0
+
+
+# set for every request by `PoolStatsMiddleware`
+request_pool_stats: ContextVar[RequestPoolStats | None] = ContextVar(
+    "request_pool_stats", default=None
+)
+
+
+def _observe(buckets: list[int], bounds: tuple[float, ...], value: float) -> None:
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            buckets[index] += 1
+            break
+
+
+class PoolMetrics:
+    """
+    Checkout counters of a connection pool of this worker
+    """
+
+    def __init__(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+        self.checkins = 0
+        self.hold_seconds_total = 0.0
+        self.hold_seconds_max = 0.0
+        self.hold_buckets = [0] * len(HOLD_BUCKETS)
+
+    def observe_checkout(self, wait_seconds: float) -> None:
+        self.checkouts += 1
+        self.wait_seconds_total += wait_seconds
+        self.wait_seconds_max = max(self.wait_seconds_max, wait_seconds)
+        _observe(self.wait_buckets, WAIT_BUCKETS, wait_seconds)
+
+        stats = request_pool_stats.get()
+        if stats is not None:
+            stats.checkouts += 1
+            stats.wait_seconds += wait_seconds
+
+    def observe_checkin(self, hold_seconds: float) -> None:
+        self.checkins += 1
+        self.hold_seconds_total += hold_seconds
+        self.hold_seconds_max = max(self.hold_seconds_max, hold_seconds)
+        _observe(self.hold_buckets, HOLD_BUCKETS, hold_seconds)
+
+        stats = request_pool_stats.get()
+        if stats is not None:
+            stats.hold_seconds += hold_seconds
+
+
+class MeteredQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that records how long checkouts wait for a connection and
+    how long it is held
+
+    A checkout that finds an idle connection returns right away, one that
+    opens a connection waits for the connect and the others wait for the
+    time requests queue because the pool is exhausted.
+    """
+
+    def __init__(self, *args: Any, max_overflow: int = 10, **kwargs: Any) -> None:
+        super().__init__(*args, max_overflow=max_overflow, **kwargs)
+        self.max_overflow = max_overflow
+        self.metrics = PoolMetrics()
+
+    def _do_get(self) -> ConnectionPoolEntry:
+        started_at = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.timeouts += 1
+            raise
+
+        checked_out_at = time.perf_counter()
+        connection.info["checked_out_at"] = checked_out_at
+        self.metrics.observe_checkout(checked_out_at - started_at)
+        return connection
+
+    def _do_return_conn(self, record: ConnectionPoolEntry) -> None:
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            self.metrics.observe_checkin(time.perf_counter() - checked_out_at)
+
+        super()._do_return_conn(record)
+
+
+def create_engine(settings: Settings, dsn: str | None = None) -> AsyncEngine:
+    """
+    Create an engine with the pool and statement cache of the settings
+
+    Args:
+        settings (Settings): settings
+        dsn (str | None): database to connect to, the primary by default
+    """
+    connect_args: dict[str, Any] = {
+        "prepared_statement_cache_size": settings.postgres_statement_cache_size,
+    }
+    if settings.postgres_pgbouncer:
+        # a transaction pooler hands every transaction a different server
+        # connection, named prepared statements must neither be cached nor
+        # reused under the same name
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+
+    return create_async_engine(
+        dsn or settings.postgres_dsn(),
+        echo=settings.debug,
+        future=True,
+        poolclass=MeteredQueuePool,
+        pool_size=settings.postgres_pool_size,
+        max_overflow=settings.postgres_max_overflow,
+        pool_timeout=settings.postgres_pool_timeout_in_seconds,
+        pool_recycle=settings.postgres_pool_recycle_in_seconds,
+        pool_pre_ping=settings.postgres_pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+
+def pool_stats(engine: AsyncEngine) -> dict[str, Any]:
+    """
+    Get the state and the checkout metrics of a pool of this worker
+
+    `saturation` is the share of the connections the pool may open that are
+    checked out, requests start to queue at 1.
+
+    Args:
+        engine (AsyncEngine): engine created by `create_engine`
+
+    Raises:
+        TypeError: if the engine does not use a `MeteredQueuePool`
+    """
+    pool = engine.pool
+    if not isinstance(pool, MeteredQueuePool):
+        raise TypeError(
+            f"Pool stats need a MeteredQueuePool, got {type(pool).__name__}."
+        )
+
+    # a negative max_overflow lifts the limit, only the pool size is known
+    capacity = pool.size() + max(pool.max_overflow, 0)
+    checked_out = pool.checkedout()
+    return {
+        "size": pool.size(),
+        "max_overflow": pool.max_overflow,
+        "checked_out": checked_out,
+        "idle": pool.checkedin(),
+        "overflow": pool.overflow(),
+        "saturation": checked_out / capacity if capacity else 0.0,
+        "checkouts": pool.metrics.checkouts,
+        "timeouts": pool.metrics.timeouts,
+        "wait_seconds_total": pool.metrics.wait_seconds_total,
+        "wait_seconds_max": pool.metrics.wait_seconds_max,
+        "wait_seconds_buckets": {
+            str(bound): count
+            for bound, count in zip(WAIT_BUCKETS, pool.metrics.wait_buckets)
+        },
+        "hold_seconds_total": pool.metrics.hold_seconds_total,
+        "hold_seconds_max": pool.metrics.hold_seconds_max,
+        "hold_seconds_buckets": {
+            str(bound): count
+            for bound, count in zip(HOLD_BUCKETS, pool.metrics.hold_buckets)
+        },
+    }
+
+
+class PoolStatsMiddleware:
+    """
+    Report the connections a request used in a `Server-Timing` header
+
+    `db-wait` is the time spent waiting for connections and `db-hold` the
+    time they were held, both in milliseconds and up to the start of the
+    response, `db-checkouts` the number of checkouts.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestPoolStats()
+        token = request_pool_stats.set(stats)
+
+        async def send_with_stats(message: Message) -> None:
+            if message["type"] == "http.response.start" and stats.checkouts:
+                headers = MutableHeaders(scope=message)
+                headers.append(
+                    "Server-Timing",
+                    f"db-wait;dur={stats.wait_seconds * 1000:.1f}, "
+                    f"db-hold;dur={stats.hold_seconds * 1000:.1f}, "
+                    f'db-checkouts;desc="{stats.checkouts}"',
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            request_pool_stats.reset(token)
@@ -0,0 +1,397 @@
+import asyncio
+import http
+import math
+import time
+
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import Annotated, NamedTuple
+
+from calypte_api.common.authorization import (
+    DEVICE_TOKEN_PREFIX,
+    decode_device_token,
+    decode_token,
+)
+from calypte_api.common.databases import get_redis_client
+from calypte_api.common.settings import (
+    RateLimitGroup,
+    RateLimitPolicy,
+    get_settings,
+)
+from fastapi import Depends, HTTPException, Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+
+
+settings = get_settings()
+
+RATE_LIMIT_PREFIX = "rate"
+EGRESS_PREFIX = "egress"
+
+RateLimitCost = Callable[[Request], int]
+
+
+class LocalBucket:
+    """
+    Cost units of one key leased by this worker for the current window
+
+    `lease` is the in-flight lease from Redis, concurrent requests that find
+    the bucket empty wait for it instead of leasing again. Once the budget of
+    the window is spent the bucket is `exhausted` and rejects requests it can
+    not pay for until the next window without asking Redis.
+    """
+
+    __slots__ = ("window", "tokens", "lease", "exhausted")
+
+    def __init__(self, window: int):
+        self.window = window
+        self.tokens = 0
+        self.lease: asyncio.Future[None] | None = None
+        self.exhausted = False
+
+
+class LocalBuckets:
+    """
+    Bounded LRU of the buckets of this worker
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._buckets: OrderedDict[str, LocalBucket] = OrderedDict()
+
+    def get(self, key: str, window: int) -> LocalBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None or bucket.window != window:
+            # tokens left from a previous window are not carried over
+            bucket = self._buckets[key] = LocalBucket(window)
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+
+        return bucket
+
+
+local_buckets = LocalBuckets(max_size=settings.rate_limiter_local_max_size)
+
+# monotonic time until which Redis is not asked again after an error
+_redis_unavailable_until = 0.0
+
+
+class RateLimitIdentity(NamedTuple):
+    key: str
+    tenant_id: str | None = None
+    device_type_id: str | None = None
+
+
+def get_rate_limit_identity(request: Request) -> RateLimitIdentity:
+    """
+    Identify the client a request is counted against
+
+    A device or a user when the request carries a valid token, the client
+    address otherwise. Tokens are verified from the caches of
+    `authorization`, the endpoint verifies them again at no cost.
+
+    Args:
+        request (Request): request
+    """
+    scheme, _, credentials = request.headers.get("authorization", "").partition(" ")
+    if scheme == "Bearer" and credentials:
+        if credentials.startswith(DEVICE_TOKEN_PREFIX):
+            device_claims = decode_device_token(credentials)
+            if device_claims is not None:
+                return RateLimitIdentity(
+                    key=f"device:{device_claims.device_id}",
+                    tenant_id=device_claims.user_id,
+                    device_type_id=device_claims.type_id,
+                )
+        else:
+            jwt_claims = decode_token(credentials)
+            if jwt_claims is not None:
+                return RateLimitIdentity(
+                    key=f"user:{jwt_claims.user.id}", tenant_id=jwt_claims.user.id
+                )
+
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return RateLimitIdentity(key=f"ip:{forwarded.split(',')[0].strip()}")
+
+    return RateLimitIdentity(key=f"ip:{request.client.host if request.client else ''}")
+
+
+def get_rate_limit_policy(
+    group: RateLimitGroup, identity: RateLimitIdentity
+) -> RateLimitPolicy:
+    """
+    Get the policy of a group for a client
+
+    The policy of the device type wins over the one of the tenant, which wins
+    over the one of the group, `rate_limiter_times` per `rate_limiter_seconds`
+    applies to groups without a policy.
+
+    Args:
+        group (RateLimitGroup): group of the route
+        identity (RateLimitIdentity): client
+    """
+    for policies in (
+        settings.rate_limiter_device_type_policies.get(identity.device_type_id or ""),
+        settings.rate_limiter_tenant_policies.get(identity.tenant_id or ""),
+        settings.rate_limiter_policies,
+    ):
+        if policies and group in policies:
+            return policies[group]
+
+    return RateLimitPolicy(
+        times=settings.rate_limiter_times, seconds=settings.rate_limiter_seconds
+    )
+
+
+def page_cost(request: Request) -> int:
+    """
+    Charge a unit per `rate_limiter_cost_rows` rows of the requested page
+
+    Args:
+        request (Request): request with an optional `size` query parameter
+    """
+    try:
+        size = int(request.query_params.get("size", 50))
+    except ValueError:
+        # the endpoint rejects the parameter
+        size = 1
+
+    return max(math.ceil(size / settings.rate_limiter_cost_rows), 1)
+
+
+def bytes_cost(size: int) -> int:
+    """
+    Charge a unit per `rate_limiter_cost_bytes` bytes served
+
+    Args:
+        size (int): number of bytes
+    """
+    return max(math.ceil(size / settings.rate_limiter_cost_bytes), 1)
+
+
+class RateLimit:
+    """
+    Budget of one client in one rate limit group for the current request
+
+    Returned by `RateLimiter` once the cost of the route has been paid, a
+    route that learns its real cost later, like the size of a download, pays
+    the rest with `consume`.
+    """
+
+    def __init__(
+        self,
+        limiter: "RateLimiter",
+        redis_client: Redis,
+        key: str,
+        policy: RateLimitPolicy,
+    ):
+        self.limiter = limiter
+        self.redis_client = redis_client
+        self.key = key
+        self.policy = policy
+
+    async def consume(self, cost: int) -> None:
+        """
+        Take cost units from the budget
+
+        Args:
+            cost (int): cost units
+
+        Raises:
+            HTTPException: 429 if the budget of the window is spent,
+                503 if Redis is unavailable and `fail_open` is off
+        """
+        # a request worth more than a whole window spends the whole window
+        cost = min(cost, self.policy.times)
+        now = time.time()
+        window = int(now // self.policy.seconds)
+        bucket = local_buckets.get(self.key, window)
+        while bucket.tokens < cost:
+            if bucket.exhausted:
+                retry_after = math.ceil((window + 1) * self.policy.seconds - now)
+                raise HTTPException(
+                    status_code=http.HTTPStatus.TOO_MANY_REQUESTS,
+                    detail="Too Many Requests",
+                    headers={"Retry-After": str(retry_after)},
+                )
+
+            if bucket.lease is None:
+                amount = max(
+                    min(self.limiter.batch_size, self.policy.times),
+                    cost - bucket.tokens,
+                )
+                bucket.lease = asyncio.ensure_future(self._fill(bucket, amount))
+            # a cancelled request must not cancel the lease others wait for
+            await asyncio.shield(bucket.lease)
+
+        bucket.tokens -= cost
+
+    async def _fill(self, bucket: LocalBucket, amount: int) -> None:
+        try:
+            granted = await self._lease(bucket.window, amount)
+        finally:
+            bucket.lease = None
+
+        bucket.tokens += granted
+        bucket.exhausted = granted < amount
+
+    async def _lease(self, window: int, amount: int) -> int:
+        """
+        Lease cost units of the window budget of the key
+
+        Args:
+            window (int): current window
+            amount (int): cost units to lease
+
+        Raises:
+            HTTPException: 503 if Redis is unavailable and `fail_open` is off
+
+        returns:
+            int: number of leased units, less than `amount` if the budget is
+                spent
+        """
+        global _redis_unavailable_until
+
+        if time.monotonic() >= _redis_unavailable_until:
+            try:
+                async with self.redis_client.pipeline(transaction=False) as pipe:
+                    pipe.incrby(f"{self.key}:{window}", amount)
+                    pipe.expire(f"{self.key}:{window}", self.policy.seconds + 1)
+                    leased, _ = await pipe.execute()
+                remaining = self.policy.times - (leased - amount)
+                return max(min(amount, remaining), 0)
+            except RedisError:
+                _redis_unavailable_until = (
+                    time.monotonic() + self.limiter.retry_after_error_in_seconds
+                )
+
+        if self.limiter.fail_open:
+            return amount
+
+        raise HTTPException(
+            status_code=http.HTTPStatus.SERVICE_UNAVAILABLE,
+            detail="Rate limiter is unavailable.",
+        )
+
+
+class RateLimiter:
+    """
+    Fixed-window rate limiter with the counting done in per-worker buckets
+
+    Every client may spend the `times` cost units of its policy per window of
+    `seconds` on the routes of a group, GET routes are `read` and the others
+    `write` unless the limiter names a group. A request costs 1 unit unless
+    `cost` computes its cost, e.g. from the requested page size.
+
+    Instead of asking Redis on every request, a worker leases up to
+    `batch_size` units of the window budget of a client at a time with one
+    INCRBY and serves them from its local bucket, so Redis sees about one
+    command per `batch_size` units. The budget is never exceeded, a client
+    spread over many workers may be limited up to `batch_size` units per
+    worker early.
+
+    When Redis is unavailable requests are let through or rejected with 503
+    depending on `fail_open`, and Redis is not asked again for
+    `retry_after_error_in_seconds`.
+    """
+
+    def __init__(
+        self,
+        group: RateLimitGroup | None = None,
+        cost: RateLimitCost | None = None,
+        batch_size: int = settings.rate_limiter_batch_size,
+        fail_open: bool = settings.rate_limiter_fail_open,
+        retry_after_error_in_seconds: float = (
+            settings.rate_limiter_retry_after_error_in_seconds
+        ),
+    ):
+        self.group = group
+        self.cost = cost
+        self.batch_size = max(batch_size, 1)
+        self.fail_open = fail_open
+        self.retry_after_error_in_seconds = retry_after_error_in_seconds
+
+    async def __call__(
+        self,
+        request: Request,
+        redis_client: Annotated[Redis, Depends(get_redis_client)],
+    ) -> RateLimit:
+        group = self.group
+        if group is None:
+            group = (
+                RateLimitGroup.READ
+                if request.method in ("GET", "HEAD")
+                else RateLimitGroup.WRITE
+            )
+
+        identity = get_rate_limit_identity(request)
+        rate_limit = RateLimit(
+            limiter=self,
+            redis_client=redis_client,
+            key=f"{RATE_LIMIT_PREFIX}:{identity.key}:{group}",
+            policy=get_rate_limit_policy(group, identity),
+        )
+        await rate_limit.consume(self.cost(request) if self.cost else 1)
+        return rate_limit
+
+
+class EgressAdmission:
+    """
+    Admission control of the streamed firmware downloads of all workers
+
+    The bytes of every admitted download are added to a Redis counter of the
+    current window of `window_in_seconds`. A download is refused with 503
+    once the downloads admitted in the window reach `max_bytes_per_second`
+    on average, so the download path sheds load before the egress link is
+    saturated instead of slowing every transfer down. A download is let
+    through when Redis is unavailable.
+    """
+
+    def __init__(self, max_bytes_per_second: int | None, window_in_seconds: int):
+        self.max_bytes_per_second = max_bytes_per_second
+        self.window_in_seconds = window_in_seconds
+
+    async def admit(self, redis_client: Redis, size: int) -> None:
+        """
+        Admit a download of `size` bytes
+
+        Args:
+            redis_client (Redis): redis client
+            size (int): number of bytes to be sent
+
+        Raises:
+            HTTPException: 503 if the egress ceiling is reached
+        """
+        if self.max_bytes_per_second is None or size <= 0:
+            return
+
+        now = time.time()
+        window = int(now // self.window_in_seconds)
+        key = f"{EGRESS_PREFIX}:{window}"
+        try:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.incrby(key, size)
+                pipe.expire(key, self.window_in_seconds + 1)
+                admitted, _ = await pipe.execute()
+
+            if admitted - size < self.max_bytes_per_second * self.window_in_seconds:
+                return
+
+            await redis_client.decrby(key, size)
+        except RedisError:
+            return
+
+        retry_after = math.ceil((window + 1) * self.window_in_seconds - now)
+        raise HTTPException(
+            status_code=http.HTTPStatus.SERVICE_UNAVAILABLE,
+            detail="Firmware downloads are over capacity.",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+
+egress_admission = EgressAdmission(
+    max_bytes_per_second=settings.firmware_egress_max_bytes_per_second,
+    window_in_seconds=settings.firmware_egress_window_in_seconds,
+)
@@ -0,0 +1,263 @@
+import asyncio
+import contextlib
+import random
+import time
+
+from collections import OrderedDict
+from collections.abc import AsyncGenerator
+
+from calypte_api.common import databases
+from calypte_api.common.rate_limiting import get_rate_limit_identity
+from calypte_api.common.settings import PostgresReplica, get_settings
+from fastapi import Request
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
+from sqlalchemy.orm import ORMExecuteState, Session, UOWTransaction
+
+
+settings = get_settings()
+
+WRITES_CHANNEL = "db:writes"
+
+# seconds the replayed transactions are behind, 0 when everything received
+# has been replayed and NULL on a primary
+_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+_READ_METHODS = ("GET", "HEAD")
+
+
+class Replica:
+    """
+    Read replica of this worker with the health seen by the last check
+    """
+
+    def __init__(self, config: PostgresReplica, engine: AsyncEngine):
+        self.config = config
+        self.engine = engine
+        self.session = async_sessionmaker(engine, expire_on_commit=False)
+        self.healthy = False
+        self.lag_seconds: float | None = None
+
+
+class RecentWriters:
+    """
+    Bounded LRU of the users that wrote within the read-your-writes window
+    """
+
+    def __init__(self, max_size: int, window_in_seconds: float):
+        self.max_size = max_size
+        self.window_in_seconds = window_in_seconds
+        self._writes: OrderedDict[str, float] = OrderedDict()
+
+    def add(self, writer: str) -> None:
+        self._writes[writer] = time.monotonic() + self.window_in_seconds
+        self._writes.move_to_end(writer)
+        while len(self._writes) > self.max_size:
+            self._writes.popitem(last=False)
+
+    def __contains__(self, writer: str) -> bool:
+        until = self._writes.get(writer)
+        if until is None:
+            return False
+
+        if until <= time.monotonic():
+            del self._writes[writer]
+            return False
+
+        return True
+
+
+class _WriteTrackingSession(Session):
+    """
+    Session that notes in `info["wrote"]` whether its transaction wrote
+    """
+
+
+@event.listens_for(_WriteTrackingSession, "do_orm_execute")
+def _note_statement(orm_execute_state: ORMExecuteState) -> None:
+    if (
+        orm_execute_state.is_insert
+        or orm_execute_state.is_update
+        or orm_execute_state.is_delete
+    ):
+        orm_execute_state.session.info["wrote"] = True
+
+
+@event.listens_for(_WriteTrackingSession, "after_flush")
+def _note_flush(session: Session, flush_context: UOWTransaction) -> None:
+    # only called when the flush had changes to write
+    session.info["wrote"] = True
+
+
+@event.listens_for(_WriteTrackingSession, "after_rollback")
+def _forget_writes(session: Session) -> None:
+    session.info.pop("wrote", None)
+
+
+class WriteTrackingSession(AsyncSession):
+    """
+    Session on the primary that starts the read-your-writes window of
+    `info["writer"]` when a transaction that wrote commits
+
+    The window starts before the response is sent, requests that only read,
+    fail before committing or commit nothing do not start it.
+    """
+
+    sync_session_class = _WriteTrackingSession
+
+    async def commit(self) -> None:
+        await super().commit()
+        wrote = self.info.pop("wrote", False)
+        writer = self.info.get("writer")
+        if wrote and writer is not None:
+            await mark_writer(writer)
+
+
+replicas: list[Replica] = []
+recent_writers = RecentWriters(
+    max_size=100_000, window_in_seconds=settings.postgres_read_your_writes_in_seconds
+)
+
+# monotonic time until which every read goes to the primary, writes of other
+# workers may have been missed before it
+_primary_only_until = 0.0
+
+
+def choose_replica() -> Replica | None:
+    """
+    Pick a healthy replica by weight, None if there is none
+    """
+    if time.monotonic() < _primary_only_until:
+        return None
+
+    healthy = [replica for replica in replicas if replica.healthy]
+    if not healthy:
+        return None
+
+    return random.choices(
+        healthy, weights=[replica.config.weight for replica in healthy]
+    )[0]
+
+
+def use_primary(request: Request) -> None:
+    """
+    Route dependency of GET routes that may write, their session is on the
+    primary
+    """
+    request.state.use_primary = True
+
+
+async def mark_writer(writer: str) -> None:
+    """
+    Send the reads of a user that just wrote to the primary on every worker
+
+    Args:
+        writer (str): tenant or client key of the user
+    """
+    recent_writers.add(writer)
+    if replicas and databases.redis is not None:
+        with contextlib.suppress(RedisError):
+            await databases.redis.publish(WRITES_CHANNEL, writer)
+
+
+async def get_routed_db_session(
+    request: Request,
+) -> AsyncGenerator[AsyncSession, None]:
+    """
+    Get a session on a replica for reads and on the primary for writes
+
+    GET requests go to a healthy replica unless their route depends on
+    `use_primary` or their user wrote within the last
+    `postgres_read_your_writes_in_seconds`, other requests go to the primary.
+    A commit that wrote starts that window for the user on every worker, see
+    `WriteTrackingSession`.
+
+    Args:
+        request (Request): request
+    """
+    if databases.async_session is None:
+        raise RuntimeError("SQL client has not been defined.")
+
+    identity = get_rate_limit_identity(request)
+    writer = identity.tenant_id or identity.key
+    reads = request.method in _READ_METHODS and not getattr(
+        request.state, "use_primary", False
+    )
+
+    session = databases.async_session
+    if reads and writer not in recent_writers:
+        replica = choose_replica()
+        if replica is not None:
+            session = replica.session
+
+    async with session() as db:
+        db.info["writer"] = writer
+        yield db
+
+
+async def _check_replica(replica: Replica) -> None:
+    try:
+        async with asyncio.timeout(
+            settings.postgres_replica_health_check_interval_in_seconds
+        ):
+            async with replica.engine.connect() as connection:
+                lag = await connection.scalar(_LAG_QUERY)
+    # whatever fails, the replica can not serve reads
+    except Exception:
+        replica.healthy = False
+        replica.lag_seconds = None
+        return
+
+    replica.lag_seconds = float(lag) if lag is not None else 0.0
+    replica.healthy = (
+        replica.lag_seconds <= settings.postgres_replica_max_lag_in_seconds
+    )
+
+
+async def check_replicas() -> None:
+    """
+    Check the health and the lag of the replicas until cancelled
+
+    A replica that can not be reached or lags more than
+    `postgres_replica_max_lag_in_seconds` gets no reads until it recovers.
+    """
+    while True:
+        await asyncio.gather(*(_check_replica(replica) for replica in replicas))
+        await asyncio.sleep(settings.postgres_replica_health_check_interval_in_seconds)
+
+
+async def listen_for_writes(redis_client: Redis) -> None:
+    """
+    Send the reads of users that wrote on another worker to the primary
+
+    Runs until cancelled, reconnecting when Redis goes away. Writes published
+    while disconnected are lost, so reads go to the primary for a window after
+    every (re)subscribe.
+
+    Args:
+        redis_client (Redis): redis client
+    """
+    while True:
+        try:
+            async with redis_client.pubsub() as pubsub:
+                await pubsub.subscribe(WRITES_CHANNEL)
+                _hold_reads()
+                async for message in pubsub.listen():
+                    if message["type"] == "message":
+                        recent_writers.add(message["data"].decode())
+        except RedisError:
+            _hold_reads()
+            await asyncio.sleep(1)
+
+
+def _hold_reads() -> None:
+    global _primary_only_until
+
+    _primary_only_until = (
+        time.monotonic() + settings.postgres_read_your_writes_in_seconds
+    )
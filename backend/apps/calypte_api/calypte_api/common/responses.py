@@ -0,0 +1,18 @@
+from fastapi.responses import StreamingResponse
+from starlette.types import Receive, Scope, Send
+
+
+class RequestStreamingResponse(StreamingResponse):
+    """
+    Response streamed while the request body is still being read
+
+    `StreamingResponse` listens for the client disconnect on the same channel
+    the request body arrives on and would swallow the body, here a disconnect
+    surfaces as `ClientDisconnect` from `Request.stream()` instead.
+    """
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await self.stream_response(send)
+
+        if self.background is not None:
+            await self.background()
@@ -1,12 +1,55 @@
+from enum import StrEnum
 from functools import lru_cache
 from pathlib import Path
 
+from pydantic import BaseModel, Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 
 
+class JwtBackend(StrEnum):
+    JOSE = "jose"
+    HMAC = "hmac"
+
+
+class RateLimitGroup(StrEnum):
+    READ = "read"
+    WRITE = "write"
+    BULK = "bulk"
+    CHECK_IN = "check-in"
+    DOWNLOAD = "download"
+
+
+class RateLimitPolicy(BaseModel):
+    # cost units per window, a request costs 1 unless its route says otherwise
+    times: int
+    seconds: int
+
+
+# policies of some rate limit groups, keyed by tenant or device type
+RateLimitPolicies = dict[RateLimitGroup, RateLimitPolicy]
+
+
+class PostgresReplica(BaseModel):
+    host: str
+    port: int = 5432
+    # share of the reads of this replica among the healthy ones
+    weight: int = 1
+
+
+class FirmwareStorageBackend(StrEnum):
+    LOCAL = "local"
+    S3 = "s3"
+
+
+class FirmwareDownloadMode(StrEnum):
+    STREAM = "stream"
+    REDIRECT = "redirect"
+    ACCEL = "accel"
+
+
 class Settings(BaseSettings):
     model_config = SettingsConfigDict(
         env_file=BASE_DIR / ".env",
@@ -19,11 +62,29 @@ class Settings(BaseSettings):
     postgres_password: str
     postgres_host: str
     postgres_port: int
+    # per worker, the pool may open `postgres_max_overflow` more under load
+    postgres_pool_size: int = 10
+    postgres_max_overflow: int = 10
+    postgres_pool_timeout_in_seconds: float = 10
+    postgres_pool_recycle_in_seconds: int = 1800
+    postgres_pool_pre_ping: bool = True
+    postgres_statement_cache_size: int = 256
+    # turns the statement caches off for PgBouncer in transaction mode
+    postgres_pgbouncer: bool = False
+    # GET requests read from these unless their user wrote recently
+    postgres_replicas: list[PostgresReplica] = []
+    postgres_replica_max_lag_in_seconds: float = 5
+    postgres_replica_health_check_interval_in_seconds: float = 5
+    # longer than the replica lag, so a user reads their own writes
+    postgres_read_your_writes_in_seconds: float = 10
 
     redis_host: str
     redis_port: int
 
     cache_expire_in_seconds: int
+    cache_fill_timeout_in_seconds: float = 5
+    local_cache_max_size: int = 10_000
+    local_cache_expire_in_seconds: float = 60
 
     service_name: str
     service_description: str
@@ -35,14 +96,88 @@ class Settings(BaseSettings):
 
     jwt_encoding_algorithm: str = "HS256"
     jwt_secret_key: str
+    # `hmac` verifies HS256/384/512 tokens with the standard library only
+    jwt_backend: JwtBackend = JwtBackend.JOSE
+    jwt_cache_max_size: int = 10_000
+    jwt_revocation_capacity: int = 100_000
+    jwt_revocation_error_rate: float = 1e-6
+    jwt_revocation_rebuild_interval_in_seconds: float = 300
+
+    # signs device tokens, the JWT secret is used when unset
+    device_token_secret_key: str | None = None
+    device_token_expire_in_seconds: int = 30 * 24 * 60 * 60
 
     rate_limiter_times: int = 1000
     rate_limiter_seconds: int = 60
-
-    def postgres_dsn(self) -> str:
+    # requests a worker takes from the shared budget of a key at a time
+    rate_limiter_batch_size: int = 10
+    rate_limiter_fail_open: bool = True
+    rate_limiter_retry_after_error_in_seconds: float = 1
+    rate_limiter_local_max_size: int = 100_000
+    # `rate_limiter_times` per `rate_limiter_seconds` for groups without one
+    rate_limiter_policies: RateLimitPolicies = {}
+    # by user id, takes precedence over the group policies
+    rate_limiter_tenant_policies: dict[str, RateLimitPolicies] = {}
+    # by device type id, takes precedence over the tenant policies
+    rate_limiter_device_type_policies: dict[str, RateLimitPolicies] = {}
+    # a page costs a unit per this many rows, a download per this many bytes
+    rate_limiter_cost_rows: int = 100
+    rate_limiter_cost_bytes: int = 1024 * 1024
+
+    devices_bulk_batch_size: int = 5000
+    # longer lines are reported as failed rows without being buffered
+    devices_bulk_max_line_size: int = 64 * 1024
+
+    firmware_storage_backend: FirmwareStorageBackend = FirmwareStorageBackend.LOCAL
+    firmware_storage_dir: Path = BASE_DIR / "firmware_storage"
+    firmware_chunk_size: int = 256 * 1024
+
+    firmware_download_mode: FirmwareDownloadMode = FirmwareDownloadMode.STREAM
+    firmware_download_url_expire_in_seconds: int = 300
+    # streamed downloads are refused once this many bytes per second have been
+    # admitted over the last `firmware_egress_window_in_seconds`
+    firmware_egress_max_bytes_per_second: int | None = None
+    firmware_egress_window_in_seconds: int = 10
+    firmware_accel_redirect_location: str = "/protected/firmware"
+    firmware_public_url: str | None = None
+    firmware_secure_link_secret: str | None = None
+
+    # every part but the last one has exactly this size, S3 requires >= 5 MiB
+    firmware_upload_part_size: int = 8 * 1024 * 1024
+    firmware_upload_max_size: int = 4 * 1024 * 1024 * 1024
+    # resumable uploads a worker keeps the running hash of, the least recently
+    # used one is dropped and rehashed from its stored parts on completion
+    firmware_upload_digests_max_size: int = 1024
+    # firmware whose image is not stored after this long and resumable uploads
+    # not completed after this long are reaped with what they stored
+    firmware_pending_expire_in_seconds: int = 60 * 60
+    firmware_upload_expire_in_seconds: int = 7 * 24 * 60 * 60
+    firmware_reaper_interval_in_seconds: int = 5 * 60
+    firmware_reaper_batch_size: int = 100
+
+    # images are hashed in chunks of this size for their integrity manifest,
+    # signed with this base64 encoded Ed25519 private key if set
+    firmware_manifest_chunk_size: int = 1024 * 1024
+    firmware_signing_key: str | None = None
+
+    firmware_delta_workers: int = 2
+    firmware_delta_max_size: int = 64 * 1024 * 1024
+
+    s3_endpoint_url: str | None = None
+    s3_region: str = "us-east-1"
+    s3_access_key_id: str | None = None
+    s3_secret_access_key: str | None = None
+    s3_bucket: str = "firmware"
+    s3_max_pool_connections: int = 50
+    # S3 refuses parts under 5 MiB but for the last one
+    s3_multipart_part_size: int = Field(default=8 * 1024 * 1024, ge=5 * 1024 * 1024)
+    s3_multipart_concurrency: int = 4
+
+    def postgres_dsn(self, host: str | None = None, port: int | None = None) -> str:
         return (
             f"postgresql+asyncpg://{self.postgres_user}:{self.postgres_password}"
-            f"@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}"
+            f"@{host or self.postgres_host}:{port or self.postgres_port}"
+            f"/{self.postgres_db}"
         )
 
     def redis_dsn(self) -> str:
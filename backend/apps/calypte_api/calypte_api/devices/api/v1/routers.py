@@ -1,17 +1,55 @@
+import http
+
 from uuid import UUID
 
-from calypte_api.common.dependencies import JwtClaims, RateLimiterType, check_permission
+from calypte_api.common.cache import dump_response
+from calypte_api.common.dependencies import (
+    BulkRateLimiterType,
+    CheckInRateLimiterType,
+    DeviceClaims,
+    JwtClaims,
+    PageRateLimiterType,
+    RateLimiterType,
+    check_device_or_permission,
+    check_permission,
+    get_owner_id,
+)
+from calypte_api.common.pagination import CursorPage, CursorParams
+from calypte_api.common.replicas import use_primary
+from calypte_api.common.responses import RequestStreamingResponse
 from calypte_api.common.user_roles import UserRole
 from calypte_api.devices import schemas as device_schemas
 from calypte_api.devices.service import DeviceServiceType
+from calypte_api.rollouts.service import RolloutServiceType
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from fastapi_pagination import Page
 
 
 router = APIRouter()
 
 
+def get_selection_params(
+    cursor_params: CursorParams = Depends(CursorParams),
+    type_id: UUID | None = Query(None, description="Devices of this type"),
+    tags: list[UUID] = Query([], description="Devices with all of these tags"),
+    any_tags: list[UUID] = Query(
+        [], description="Devices with at least one of these tags"
+    ),
+    exclude_tags: list[UUID] = Query(
+        [], description="Devices with none of these tags"
+    ),
+) -> device_schemas.DeviceSelectionParams:
+    # list query parameters are only read from function signatures
+    return device_schemas.DeviceSelectionParams(
+        type_id=type_id,
+        tags=tags,
+        any_tags=any_tags,
+        exclude_tags=exclude_tags,
+        **cursor_params.model_dump(),
+    )
+
+
 @router.post(
     path="/devices",
     response_model=device_schemas.CreateDeviceResponse,
@@ -32,6 +70,43 @@ async def create_device(
     )
 
 
+@router.post(
+    path="/devices/bulk",
+    summary="Register or update devices in bulk",
+    description=(
+        "Stream devices as NDJSON or as CSV with an `id,type_id,tags` header, "
+        "tags separated by spaces. A row without id registers a device, a row "
+        "with an id creates or updates that device. Rows are written in "
+        "batches and reported with one NDJSON line per input line."
+    ),
+    response_description="result per input line",
+    status_code=200,
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                device_schemas.BulkDeviceFormat.NDJSON: {"schema": {"type": "string"}},
+                device_schemas.BulkDeviceFormat.CSV: {"schema": {"type": "string"}},
+            },
+        }
+    },
+)
+async def bulk_upsert_devices(
+    _: BulkRateLimiterType,
+    request: Request,
+    device_service: DeviceServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> RequestStreamingResponse:
+    report = await device_service.bulk_upsert_devices(
+        user_id=jwt_claims.user.id,
+        media_type=request.headers.get("content-type", ""),
+        body=request.stream(),
+    )
+    return RequestStreamingResponse(
+        report, media_type=device_schemas.BulkDeviceFormat.NDJSON
+    )
+
+
 @router.get(
     path="/devices",
     response_model=Page[device_schemas.GetDeviceResponse],
@@ -41,19 +116,70 @@ async def create_device(
     status_code=200,
 )
 async def retrieve_devices(
-    _: RateLimiterType,
+    _: PageRateLimiterType,
     device_service: DeviceServiceType,
     query_params: device_schemas.GetDeviceQueryParams = Depends(
         device_schemas.GetDeviceQueryParams
     ),
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> Page[device_schemas.GetDeviceResponse]:
+) -> Response:
     return await device_service.get_devices(
         user_id=jwt_claims.user.id,
         query_params=query_params,
     )
 
 
+@router.get(
+    path="/devices/cursor",
+    response_model=CursorPage[device_schemas.GetDeviceResponse],
+    summary="get cursor-paginated list of devices",
+    description=(
+        "get a page of devices after the cursor, "
+        "the cost of a page does not depend on how deep it is"
+    ),
+    response_description="page of devices",
+    status_code=200,
+)
+async def retrieve_devices_by_cursor(
+    _: PageRateLimiterType,
+    device_service: DeviceServiceType,
+    query_params: device_schemas.GetDeviceCursorParams = Depends(
+        device_schemas.GetDeviceCursorParams
+    ),
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> Response:
+    return await device_service.get_devices_by_cursor(
+        user_id=jwt_claims.user.id,
+        query_params=query_params,
+    )
+
+
+@router.get(
+    path="/devices/select",
+    response_model=CursorPage[UUID],
+    summary="select devices by type and tags",
+    description=(
+        "get a page of the ids of the devices of a type that have all of "
+        "`tags`, at least one of `any_tags` and none of `exclude_tags`, "
+        "computed on bitmap indexes"
+    ),
+    response_description="page of device ids",
+    status_code=200,
+)
+async def select_devices(
+    _: PageRateLimiterType,
+    device_service: DeviceServiceType,
+    query_params: device_schemas.DeviceSelectionParams = Depends(
+        get_selection_params
+    ),
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> CursorPage[UUID]:
+    return await device_service.select_devices(
+        user_id=jwt_claims.user.id,
+        query_params=query_params,
+    )
+
+
 @router.get(
     path="/devices/{device_id:uuid}",
     response_model=device_schemas.GetDeviceResponse,
@@ -67,13 +193,90 @@ async def retrieve_device(
     device_id: UUID,
     device_service: DeviceServiceType,
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> device_schemas.GetDeviceResponse:
+) -> Response:
     return await device_service.get_device(
         user_id=jwt_claims.user.id,
         device_id=device_id,
     )
 
 
+@router.get(
+    path="/devices/{device_id:uuid}/check-in",
+    response_model=device_schemas.DeviceCheckInResponse,
+    summary="check for a firmware update",
+    description=(
+        "get the firmware the device should install, from the newest "
+        "rollout that reaches it or else the latest firmware of its type, "
+        "304 if it already runs the target firmware"
+    ),
+    response_description="the firmware to install",
+    status_code=200,
+    responses={304: {"description": "The device is up to date"}},
+    # records the check-in
+    dependencies=[Depends(use_primary)],
+)
+async def check_in_device(
+    _: CheckInRateLimiterType,
+    device_id: UUID,
+    request: Request,
+    rollout_service: RolloutServiceType,
+    query_params: device_schemas.DeviceCheckInQueryParams = Depends(
+        device_schemas.DeviceCheckInQueryParams
+    ),
+    token: JwtClaims | DeviceClaims = Depends(
+        check_device_or_permission(UserRole.USER)
+    ),
+) -> Response:
+    if isinstance(token, DeviceClaims) and token.device_id != str(device_id):
+        raise HTTPException(
+            status_code=http.HTTPStatus.FORBIDDEN,
+            detail="The token belongs to another device.",
+        )
+
+    firmware = await rollout_service.check_in(
+        user_id=get_owner_id(token),
+        device_id=device_id,
+        version=query_params.version,
+    )
+    if firmware is None:
+        return Response(status_code=http.HTTPStatus.NOT_MODIFIED)
+
+    download_url = request.url_for(
+        "download_firmware", firmware_id=firmware.id
+    ).include_query_params(from_version=query_params.version)
+    return Response(
+        content=dump_response(
+            device_schemas.DeviceCheckInResponse(
+                firmware=firmware, download_url=str(download_url)
+            )
+        ),
+        media_type="application/json",
+    )
+
+
+@router.post(
+    path="/devices/{device_id:uuid}/token",
+    response_model=device_schemas.CreateDeviceTokenResponse,
+    summary="issue a device token",
+    description=(
+        "issue a token the device checks in and downloads firmware with, "
+        "instead of holding a user token"
+    ),
+    response_description="the device token",
+    status_code=201,
+)
+async def create_device_token(
+    _: RateLimiterType,
+    device_id: UUID,
+    device_service: DeviceServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> device_schemas.CreateDeviceTokenResponse:
+    return await device_service.create_device_token(
+        user_id=jwt_claims.user.id,
+        device_id=device_id,
+    )
+
+
 @router.put(
     path="/devices/{device_id:uuid}",
     response_model=device_schemas.UpdateDeviceResponse,
@@ -96,6 +299,31 @@ async def update_device(
     )
 
 
+@router.patch(
+    path="/devices/{device_id:uuid}/tags",
+    response_model=device_schemas.UpdateDeviceTagsResponse,
+    summary="add and remove tags of a device",
+    description=(
+        "add and remove tags of a device without sending all of them, "
+        "tags the device already has or has not are skipped"
+    ),
+    response_description="number of added and removed tags",
+    status_code=200,
+)
+async def update_device_tags(
+    _: RateLimiterType,
+    device_id: UUID,
+    update_device_tags_request_body: device_schemas.UpdateDeviceTagsRequestBody,
+    device_service: DeviceServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> device_schemas.UpdateDeviceTagsResponse:
+    return await device_service.update_device_tags(
+        user_id=jwt_claims.user.id,
+        device_id=device_id,
+        request_body=update_device_tags_request_body,
+    )
+
+
 @router.delete(
     path="/devices/{device_id:uuid}",
     summary="delete a device",
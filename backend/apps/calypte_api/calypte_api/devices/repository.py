@@ -1,20 +1,47 @@
-import random
+import http
 
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Any
 from uuid import UUID, uuid4
 
+from calypte_api.common.bitmaps import Bitmap
+from calypte_api.common.databases import releases_connection
 from calypte_api.common.dependencies import DBSessionType
+from calypte_api.common.models import Device, Tag, TagDeviceLookUp, Type
+from calypte_api.common.pagination import Keyset, estimate_count, paginate_by_keyset
 from calypte_api.devices.schemas import (
+    BulkDeviceBatchResult,
+    BulkDeviceResult,
+    BulkDeviceRow,
+    BulkDeviceStatus,
     CreateDeviceResponse,
+    DeviceFilterParams,
     GetDeviceQueryParams,
     GetDeviceResponse,
     UpdateDeviceResponse,
 )
 
-from fastapi import Depends
+import asyncpg
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import (
+    Column,
+    MetaData,
+    Select,
+    Table,
+    any_,
+    bindparam,
+    delete,
+    exists,
+    func,
+    literal,
+    select,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 
 class IDeviceRepo(ABC):
@@ -43,10 +70,45 @@ class IDeviceRepo(ABC):
             query_params (GetDeviceQueryParams): query params
         """
 
+    @abstractmethod
+    async def get_devices_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: DeviceFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetDeviceResponse]:
+        """
+        Get devices created after the keyset, ordered by `(created_at, id)`
+
+        Args:
+            user_id (UUID): user id
+            query_params (DeviceFilterParams): filters
+            keyset (Keyset | None): last device of the previous page
+            size (int): page size, up to `size + 1` devices are returned
+        """
+
+    @abstractmethod
+    async def count_devices(
+        self,
+        user_id: UUID,
+        query_params: DeviceFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        """
+        Count devices matching query params
+
+        Args:
+            user_id (UUID): user id
+            query_params (DeviceFilterParams): filters
+            estimate (bool): estimate from the planner statistics
+        """
+
     @abstractmethod
     async def create_device(
         self,
         user_id: UUID,
+        type_id: UUID,
         tags: list[UUID],
     ) -> CreateDeviceResponse:
         """
@@ -54,7 +116,7 @@ class IDeviceRepo(ABC):
 
         Args:
             user_id (UUID): user id
-            name (str): device name
+            type_id (UUID): device type id
             tags (list[UUID]): device tags
         """
 
@@ -72,6 +134,41 @@ class IDeviceRepo(ABC):
             tags (list[UUID]): device tags
         """
 
+    @abstractmethod
+    async def bulk_upsert_devices(
+        self, user_id: UUID, rows: list[tuple[int, BulkDeviceRow]]
+    ) -> BulkDeviceBatchResult:
+        """
+        Register or update a batch of devices in one transaction
+
+        Rows that reference a missing type, tag or device fail on their own,
+        the rest is written.
+
+        Args:
+            user_id (UUID): user id
+            rows (list[tuple[int, BulkDeviceRow]]): input line and row
+        """
+
+    @abstractmethod
+    async def update_device_tags(
+        self, user_id: UUID, device_id: UUID, add: list[UUID], remove: list[UUID]
+    ) -> tuple[list[UUID], list[UUID]]:
+        """
+        Add and remove tags of a device in a single statement
+
+        Tags of other users and tags the device already has, or has not, are
+        skipped.
+
+        Args:
+            user_id (UUID): user id
+            device_id (UUID): device id
+            add (list[UUID]): tags to add
+            remove (list[UUID]): tags to remove
+
+        returns:
+            tuple[list[UUID], list[UUID]]: added and removed tags
+        """
+
     @abstractmethod
     async def delete_device(self, user_id: UUID, device_id: UUID) -> None:
         """
@@ -82,78 +179,526 @@ class IDeviceRepo(ABC):
             device_id (UUID): device id
         """
 
+    @abstractmethod
+    async def get_type_bitmap(self, user_id: UUID, type_id: UUID | None) -> Bitmap:
+        """
+        Get the dense ids of the devices of a type
+
+        Args:
+            user_id (UUID): user id
+            type_id (UUID | None): type id, None for all devices of the user
+        """
+
+    @abstractmethod
+    async def get_tag_bitmap(self, user_id: UUID, tag_id: UUID) -> Bitmap:
+        """
+        Get the dense ids of the devices with a tag
+
+        Args:
+            user_id (UUID): user id
+            tag_id (UUID): tag id
+        """
+
+    @abstractmethod
+    async def get_device_ids_by_seqs(
+        self, user_id: UUID, seqs: list[int]
+    ) -> list[UUID]:
+        """
+        Map dense ids back to device ids
+
+        Args:
+            user_id (UUID): user id
+            seqs (list[int]): dense ids, ascending
+
+        returns:
+            list[UUID]: device ids in the order of `seqs`
+        """
+
+
+# scratch tables the bulk rows are copied into, they live until the batch
+# transaction ends
+_bulk_metadata = MetaData()
+_bulk_devices = Table(
+    "bulk_devices",
+    _bulk_metadata,
+    Column("id", PG_UUID(), primary_key=True),
+    Column("type_id", PG_UUID(), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
+_bulk_device_tags = Table(
+    "bulk_device_tags",
+    _bulk_metadata,
+    Column("device_id", PG_UUID(), nullable=False),
+    Column("tag_id", PG_UUID(), nullable=False),
+    prefixes=["TEMPORARY"],
+    postgresql_on_commit="DROP",
+)
 
+
+def _any_uuid(name: str, values: list[UUID]) -> Any:
+    # one array parameter instead of a bind per value
+    return any_(bindparam(name, values, type_=ARRAY(PG_UUID())))
+
+
+@releases_connection
 class DeviceRepo(IDeviceRepo):
     def __init__(self, db_session: AsyncSession) -> None:
         self.db_session = db_session
 
-    # TODO: implement
+    @staticmethod
+    def _select_devices(user_id: UUID) -> Select:
+        # tags and firmware history are loaded with one `IN` query each for
+        # the whole page instead of a lazy load per device
+        return (
+            select(Device)
+            .where(Device.user_id == user_id)
+            .options(
+                selectinload(Device.tag_lookups),
+                selectinload(Device.firmware_info_lookups),
+            )
+        )
+
+    @staticmethod
+    def _device_fields(device: Device) -> dict[str, Any]:
+        return {
+            "id": device.id,
+            "type_id": device.type_id,
+            "tags": [lookup.tag_id for lookup in device.tag_lookups],
+            "firmware_info": [
+                lookup.firmware_info_id for lookup in device.firmware_info_lookups
+            ],
+            "registered_at": device.registered_at,
+            "created_at": device.created_at,
+            "updated_at": device.modified_at,
+        }
+
+    async def _get_device(self, user_id: UUID, device_id: UUID) -> Device:
+        device = await self.db_session.scalar(
+            self._select_devices(user_id)
+            .where(Device.id == device_id)
+            .execution_options(populate_existing=True)
+        )
+        if device is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Device not found.",
+            )
+
+        return device
+
+    async def _check_tags(self, user_id: UUID, tags: list[UUID]) -> None:
+        if not tags:
+            return
+
+        found = await self.db_session.scalar(
+            select(func.count()).where(Tag.id.in_(tags), Tag.user_id == user_id)
+        )
+        if found != len(set(tags)):
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Tag not found.",
+            )
+
+    async def _set_tags(self, device_id: UUID, tags: list[UUID]) -> None:
+        await self.db_session.execute(
+            delete(TagDeviceLookUp).where(
+                TagDeviceLookUp.device_id == device_id,
+                TagDeviceLookUp.tag_id.not_in(tags),
+            )
+        )
+        if not tags:
+            return
+
+        # one INSERT ... SELECT for all tags instead of a row per tag
+        await self.db_session.execute(
+            insert(TagDeviceLookUp)
+            .from_select(
+                ["id", "tag_id", "device_id"],
+                select(func.gen_random_uuid(), Tag.id, literal(device_id)).where(
+                    Tag.id.in_(tags)
+                ),
+            )
+            .on_conflict_do_nothing()
+        )
+
     async def get_device_by_id(
         self, user_id: UUID, device_id: UUID
     ) -> GetDeviceResponse:
-        return GetDeviceResponse(
-            id=device_id,
-            registered_at=None,
-            type_id=uuid4(),
-            tags=[uuid4(), uuid4(), uuid4()],
-            firmware_info=[uuid4(), uuid4()],
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
-        )
+        device = await self._get_device(user_id, device_id)
+        return GetDeviceResponse(**self._device_fields(device))
 
-    # TODO: implement
     async def get_devices(
         self, user_id: UUID, query_params: GetDeviceQueryParams
     ) -> list[GetDeviceResponse]:
-        tags = [uuid4() for _ in range(10)]
-        firmware_info = [uuid4() for _ in range(10)]
-        return [
-            GetDeviceResponse(
-                id=uuid4(),
-                registered_at=None if random.randint(0, 1) == 0 else datetime.now(),
-                type_id=uuid4(),
-                tags=[random.choice(tags) for _ in range(random.randint(1, 3))],
-                firmware_info=[random.choice(firmware_info) for _ in range(3)],
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-            )
-            for _ in range(query_params.size)
-        ]
-
-    # TODO: implement
+        devices = await self.db_session.scalars(
+            self._select_devices(user_id)
+            .order_by(Device.created_at, Device.id)
+            .offset((query_params.page - 1) * query_params.size)
+            .limit(query_params.size)
+        )
+        return [GetDeviceResponse(**self._device_fields(device)) for device in devices]
+
+    async def get_devices_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: DeviceFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetDeviceResponse]:
+        devices = await self.db_session.scalars(
+            paginate_by_keyset(self._select_devices(user_id), Device, keyset, size)
+        )
+        return [GetDeviceResponse(**self._device_fields(device)) for device in devices]
+
+    async def count_devices(
+        self,
+        user_id: UUID,
+        query_params: DeviceFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        if estimate:
+            return await estimate_count(
+                self.db_session, select(Device.id).where(Device.user_id == user_id)
+            )
+
+        return await self.db_session.scalar(
+            select(func.count()).where(Device.user_id == user_id)
+        )
+
     async def create_device(
         self,
         user_id: UUID,
+        type_id: UUID,
         tags: list[UUID],
     ) -> CreateDeviceResponse:
-        return CreateDeviceResponse(
-            id=uuid4(),
-            registered_at=None,
-            type_id=uuid4(),
-            tags=tags,
-            firmware_info=[uuid4(), uuid4()],
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+        type_exists = await self.db_session.scalar(
+            select(Type.id).where(Type.id == type_id, Type.user_id == user_id)
         )
+        if type_exists is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Type not found.",
+            )
+        await self._check_tags(user_id, tags)
+
+        device = Device(id=uuid4(), user_id=user_id, type_id=type_id)
+        self.db_session.add(device)
+        await self.db_session.flush()
+        await self._set_tags(device.id, tags)
+        await self.db_session.commit()
+
+        device = await self._get_device(user_id, device.id)
+        return CreateDeviceResponse(**self._device_fields(device))
 
-    # TODO: implement
     async def update_device(
         self, user_id: UUID, device_id: UUID, tags: list[UUID]
     ) -> UpdateDeviceResponse:
-        registered_at = None if random.randint(0, 1) == 0 else datetime.now()
-        return UpdateDeviceResponse(
-            id=device_id,
-            registered_at=registered_at,
-            type_id=uuid4(),
-            tags=tags,
-            firmware_info=[uuid4(), uuid4()],
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
-        )
-
-    # TODO: implement
+        await self._get_device(user_id, device_id)
+        await self._check_tags(user_id, tags)
+        await self._set_tags(device_id, tags)
+        await self.db_session.commit()
+
+        device = await self._get_device(user_id, device_id)
+        return UpdateDeviceResponse(**self._device_fields(device))
+
+    async def bulk_upsert_devices(
+        self, user_id: UUID, rows: list[tuple[int, BulkDeviceRow]]
+    ) -> BulkDeviceBatchResult:
+        type_ids = list({row.type_id for _, row in rows})
+        tag_ids = list({tag for _, row in rows for tag in row.tags})
+        device_ids = list({row.id for _, row in rows if row.id is not None})
+
+        known_types = set(
+            await self.db_session.scalars(
+                select(Type.id).where(
+                    Type.user_id == user_id, Type.id == _any_uuid("type_ids", type_ids)
+                )
+            )
+        )
+        known_tags = set()
+        if tag_ids:
+            known_tags = set(
+                await self.db_session.scalars(
+                    select(Tag.id).where(
+                        Tag.user_id == user_id, Tag.id == _any_uuid("tag_ids", tag_ids)
+                    )
+                )
+            )
+        existing = {}
+        if device_ids:
+            existing = {
+                device.id: device
+                for device in await self.db_session.execute(
+                    select(
+                        Device.id,
+                        Device.type_id,
+                        (Device.user_id == user_id).label("owned"),
+                    ).where(Device.id == _any_uuid("device_ids", device_ids))
+                )
+            }
+
+        results = []
+        accepted: dict[UUID, BulkDeviceResult] = {}
+        devices_records = []
+        tags_records = []
+        for line, row in rows:
+            device = existing.get(row.id)
+            detail = None
+            if row.id in accepted:
+                detail = "Duplicate device."
+            elif row.type_id not in known_types:
+                detail = "Type not found."
+            elif not known_tags.issuperset(row.tags):
+                detail = "Tag not found."
+            elif device is not None and not device.owned:
+                detail = "Device not found."
+            elif device is not None and device.type_id != row.type_id:
+                detail = "Device type can not be changed."
+
+            if detail is not None:
+                results.append(
+                    BulkDeviceResult.model_construct(
+                        line=line,
+                        status=BulkDeviceStatus.FAILED,
+                        id=row.id,
+                        detail=detail,
+                    )
+                )
+                continue
+
+            device_id = row.id or uuid4()
+            result = BulkDeviceResult.model_construct(
+                line=line,
+                status=(
+                    BulkDeviceStatus.CREATED
+                    if device is None
+                    else BulkDeviceStatus.UPDATED
+                ),
+                id=device_id,
+            )
+            results.append(result)
+            accepted[device_id] = result
+            devices_records.append((device_id, row.type_id))
+            tags_records.extend((device_id, tag) for tag in set(row.tags))
+
+        if not accepted:
+            return BulkDeviceBatchResult(results=results, tags=[])
+
+        # rows left out of the merge lost a race with another writer
+        detail = "Device not found."
+        try:
+            written, changed_tags = await self._write_bulk_batch(
+                user_id=user_id,
+                devices_records=devices_records,
+                tags_records=tags_records,
+                has_updates=bool(existing),
+            )
+        except (SQLAlchemyError, asyncpg.PostgresError):
+            await self.db_session.rollback()
+            written, changed_tags = set(), set()
+            detail = "Batch could not be written."
+
+        for device_id in accepted.keys() - written:
+            accepted[device_id].status = BulkDeviceStatus.FAILED
+            accepted[device_id].detail = detail
+
+        return BulkDeviceBatchResult(results=results, tags=list(changed_tags))
+
+    async def _write_bulk_batch(
+        self,
+        user_id: UUID,
+        devices_records: list[tuple[UUID, UUID]],
+        tags_records: list[tuple[UUID, UUID]],
+        has_updates: bool,
+    ) -> tuple[set[UUID], set[UUID]]:
+        """
+        COPY the checked rows into scratch tables and merge them
+
+        Args:
+            user_id (UUID): user id
+            devices_records (list[tuple[UUID, UUID]]): device ids and types
+            tags_records (list[tuple[UUID, UUID]]): device ids and their tags
+            has_updates (bool): whether any of the devices exists already
+
+        returns:
+            tuple[set[UUID], set[UUID]]: written devices and the tags that
+                gained or lost devices
+        """
+        connection = await self.db_session.connection()
+        await connection.run_sync(_bulk_metadata.create_all, checkfirst=False)
+        raw_connection = (await connection.get_raw_connection()).driver_connection
+        await raw_connection.copy_records_to_table(
+            _bulk_devices.name, records=devices_records, columns=["id", "type_id"]
+        )
+        if tags_records:
+            await raw_connection.copy_records_to_table(
+                _bulk_device_tags.name,
+                records=tags_records,
+                columns=["device_id", "tag_id"],
+            )
+
+        # the ownership and type checks are repeated in the conflict clause,
+        # a device changed since they ran is left out of `written`
+        upsert = insert(Device).from_select(
+            ["id", "user_id", "type_id", "created_at", "modified_at"],
+            select(
+                _bulk_devices.c.id,
+                literal(user_id, PG_UUID()),
+                _bulk_devices.c.type_id,
+                func.now(),
+                func.now(),
+            ),
+        )
+        written = set(
+            await self.db_session.scalars(
+                upsert.on_conflict_do_update(
+                    index_elements=[Device.id],
+                    set_={"modified_at": func.now()},
+                    where=(Device.user_id == user_id)
+                    & (Device.type_id == upsert.excluded.type_id),
+                ).returning(Device.id)
+            )
+        )
+        lost = [record[0] for record in devices_records if record[0] not in written]
+        if lost:
+            await self.db_session.execute(
+                delete(_bulk_devices).where(
+                    _bulk_devices.c.id == _any_uuid("lost", lost)
+                )
+            )
+            await self.db_session.execute(
+                delete(_bulk_device_tags).where(
+                    _bulk_device_tags.c.device_id == _any_uuid("lost", lost)
+                )
+            )
+
+        # the scratch tables are joined rather than matched against an array
+        # of ids, and only the distinct tags travel back
+        changed_tags = set()
+        if has_updates:
+            removed = (
+                delete(TagDeviceLookUp)
+                .where(
+                    TagDeviceLookUp.device_id.in_(select(_bulk_devices.c.id)),
+                    ~exists().where(
+                        _bulk_device_tags.c.device_id == TagDeviceLookUp.device_id,
+                        _bulk_device_tags.c.tag_id == TagDeviceLookUp.tag_id,
+                    ),
+                )
+                .returning(TagDeviceLookUp.tag_id)
+                .cte("removed")
+            )
+            changed_tags.update(
+                await self.db_session.scalars(select(removed.c.tag_id).distinct())
+            )
+        if tags_records:
+            added = (
+                insert(TagDeviceLookUp)
+                .from_select(
+                    ["id", "tag_id", "device_id"],
+                    select(
+                        func.gen_random_uuid(),
+                        _bulk_device_tags.c.tag_id,
+                        _bulk_device_tags.c.device_id,
+                    ),
+                )
+                .on_conflict_do_nothing()
+                .returning(TagDeviceLookUp.tag_id)
+                .cte("added")
+            )
+            changed_tags.update(
+                await self.db_session.scalars(select(added.c.tag_id).distinct())
+            )
+        await self.db_session.commit()
+
+        return written, changed_tags
+
+    async def update_device_tags(
+        self, user_id: UUID, device_id: UUID, add: list[UUID], remove: list[UUID]
+    ) -> tuple[list[UUID], list[UUID]]:
+        device_exists = exists().where(
+            Device.id == device_id, Device.user_id == user_id
+        )
+        removed = (
+            delete(TagDeviceLookUp)
+            .where(
+                TagDeviceLookUp.device_id == device_id,
+                TagDeviceLookUp.tag_id == _any_uuid("remove", remove),
+                device_exists,
+            )
+            .returning(TagDeviceLookUp.tag_id)
+            .cte("removed")
+        )
+        added = (
+            insert(TagDeviceLookUp)
+            .from_select(
+                ["id", "tag_id", "device_id"],
+                select(func.gen_random_uuid(), Tag.id, literal(device_id)).where(
+                    Tag.id == _any_uuid("add", add),
+                    Tag.user_id == user_id,
+                    device_exists,
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(TagDeviceLookUp.tag_id)
+            .cte("added")
+        )
+        row = (
+            await self.db_session.execute(
+                select(
+                    device_exists.label("device_exists"),
+                    select(func.array_agg(added.c.tag_id))
+                    .scalar_subquery()
+                    .label("added"),
+                    select(func.array_agg(removed.c.tag_id))
+                    .scalar_subquery()
+                    .label("removed"),
+                )
+            )
+        ).one()
+        if not row.device_exists:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Device not found.",
+            )
+
+        await self.db_session.commit()
+        return row.added or [], row.removed or []
+
     async def delete_device(self, user_id: UUID, device_id: UUID) -> None:
-        return None
+        await self.db_session.execute(
+            delete(Device).where(Device.id == device_id, Device.user_id == user_id)
+        )
+        await self.db_session.commit()
+
+    async def get_type_bitmap(self, user_id: UUID, type_id: UUID | None) -> Bitmap:
+        query = select(Device.seq).where(Device.user_id == user_id)
+        if type_id is not None:
+            query = query.where(Device.type_id == type_id)
+
+        return Bitmap.from_values(await self.db_session.scalars(query))
+
+    async def get_tag_bitmap(self, user_id: UUID, tag_id: UUID) -> Bitmap:
+        seqs = await self.db_session.scalars(
+            select(Device.seq)
+            .join(TagDeviceLookUp, TagDeviceLookUp.device_id == Device.id)
+            .where(TagDeviceLookUp.tag_id == tag_id, Device.user_id == user_id)
+        )
+        return Bitmap.from_values(seqs)
+
+    async def get_device_ids_by_seqs(
+        self, user_id: UUID, seqs: list[int]
+    ) -> list[UUID]:
+        if not seqs:
+            return []
+
+        devices_ids = await self.db_session.scalars(
+            select(Device.id)
+            .where(Device.seq.in_(seqs), Device.user_id == user_id)
+            .order_by(Device.seq)
+        )
+        return list(devices_ids)
 
 
 def get_device_repo(db_session: DBSessionType) -> IDeviceRepo:
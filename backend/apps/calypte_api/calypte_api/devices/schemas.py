@@ -1,20 +1,43 @@
 from datetime import datetime
+from enum import StrEnum
 from uuid import UUID
 
+from calypte_api.common.pagination import CursorParams
+from calypte_api.firmware_info.schemas import GetFirmwareInfoResponse
+
 from fastapi_pagination import Params
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class BaseDeviceRequestSchema(BaseModel):
     ...
 
 
-class GetDeviceQueryParams(BaseDeviceRequestSchema, Params):
+class DeviceFilterParams(BaseDeviceRequestSchema):
     # TODO: figure out how to define a list in query params
     # tags: list[UUID] | None = Field(alias="tags")
     ...
 
 
+class GetDeviceQueryParams(DeviceFilterParams, Params):
+    ...
+
+
+class GetDeviceCursorParams(DeviceFilterParams, CursorParams):
+    ...
+
+
+class DeviceSelectionParams(CursorParams):
+    type_id: UUID | None = Field(default=None)
+    tags: list[UUID] = Field(default_factory=list)
+    any_tags: list[UUID] = Field(default_factory=list)
+    exclude_tags: list[UUID] = Field(default_factory=list)
+
+
+class DeviceCheckInQueryParams(BaseDeviceRequestSchema):
+    version: str
+
+
 class CreateDeviceRequestBody(BaseDeviceRequestSchema):
     type_id: UUID
     tags: list[UUID]
@@ -24,6 +47,31 @@ class UpdateDeviceRequestBody(BaseDeviceRequestSchema):
     tags: list[UUID]
 
 
+class UpdateDeviceTagsRequestBody(BaseDeviceRequestSchema):
+    add: list[UUID] = Field(default_factory=list)
+    remove: list[UUID] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def check_disjoint(self) -> "UpdateDeviceTagsRequestBody":
+        if set(self.add) & set(self.remove):
+            raise ValueError("A tag can not be both added and removed.")
+
+        return self
+
+
+class BulkDeviceFormat(StrEnum):
+    NDJSON = "application/x-ndjson"
+    CSV = "text/csv"
+
+
+class BulkDeviceRow(BaseDeviceRequestSchema):
+    # a row without id registers a new device, a row with the id of an
+    # existing device replaces its tags
+    id: UUID | None = None
+    type_id: UUID
+    tags: list[UUID] = Field(default_factory=list)
+
+
 class BaseDeviceResponseSchema(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
@@ -62,3 +110,37 @@ class GetDeviceResponse(BaseDeviceResponseSchema):
     registered_at: datetime | None = Field(alias="registeredAt")
     created_at: datetime = Field(alias="createdAt")
     updated_at: datetime = Field(alias="updatedAt")
+
+
+class UpdateDeviceTagsResponse(BaseDeviceResponseSchema):
+    added: int
+    removed: int
+
+
+class DeviceCheckInResponse(BaseDeviceResponseSchema):
+    firmware: GetFirmwareInfoResponse
+    download_url: str = Field(alias="downloadUrl")
+
+
+class CreateDeviceTokenResponse(BaseDeviceResponseSchema):
+    token: str
+    expires_at: datetime = Field(alias="expiresAt")
+
+
+class BulkDeviceStatus(StrEnum):
+    CREATED = "created"
+    UPDATED = "updated"
+    FAILED = "failed"
+
+
+class BulkDeviceResult(BaseDeviceResponseSchema):
+    line: int
+    status: BulkDeviceStatus
+    id: UUID | None = None
+    detail: str | None = None
+
+
+class BulkDeviceBatchResult(BaseDeviceResponseSchema):
+    results: list[BulkDeviceResult]
+    # tags that gained or lost devices
+    tags: list[UUID]
@@ -1,19 +1,63 @@
+import csv
+import http
+import time
+
 from abc import ABC, abstractmethod
-from typing import Annotated
+from collections.abc import AsyncIterator, Iterable
+from datetime import UTC, datetime
+from itertools import islice
+from typing import Annotated, Any
 from uuid import UUID
 
+from calypte_api.common.authorization import (
+    create_device_token,
+    revoke_device_tokens,
+)
+from calypte_api.common.bitmaps import Bitmap
+from calypte_api.common.cache import (
+    CacheResource,
+    IResponseCache,
+    ResponseCacheType,
+    dump_response,
+)
+from calypte_api.common.dependencies import RedisClientType
+from calypte_api.common.pagination import (
+    CursorPage,
+    PageTotal,
+    create_cursor_page,
+    decode_keyset,
+    decode_position,
+)
+from calypte_api.common.settings import get_settings
 from calypte_api.devices.repository import DeviceRepositoryType, IDeviceRepo
 from calypte_api.devices.schemas import (
+    BulkDeviceFormat,
+    BulkDeviceResult,
+    BulkDeviceRow,
+    BulkDeviceStatus,
     CreateDeviceRequestBody,
     CreateDeviceResponse,
+    CreateDeviceTokenResponse,
+    DeviceSelectionParams,
+    GetDeviceCursorParams,
     GetDeviceQueryParams,
     GetDeviceResponse,
     UpdateDeviceRequestBody,
     UpdateDeviceResponse,
+    UpdateDeviceTagsRequestBody,
+    UpdateDeviceTagsResponse,
 )
 
-from fastapi import Depends
+import orjson
+
+from fastapi import Depends, HTTPException, Response
 from fastapi_pagination import Page
+from fastapi_pagination.cursor import decode_cursor
+from pydantic import ValidationError
+from redis.asyncio import Redis
+
+
+settings = get_settings()
 
 
 class IDeviceService(ABC):
@@ -22,26 +66,65 @@ class IDeviceService(ABC):
         self,
         user_id: UUID,
         device_id: UUID,
-    ) -> GetDeviceResponse:
+    ) -> Response:
         """
-        Get device by id
+        Get device by id, served from the response cache
 
         Args:
             user_id (UUID): user id
             device_id (UUID): device id
 
+        returns:
+            Response: serialized GetDeviceResponse
         """
 
     @abstractmethod
     async def get_devices(
         self, user_id: UUID, query_params: GetDeviceQueryParams
-    ) -> Page[GetDeviceResponse]:
+    ) -> Response:
+        """
+        Get all devices, served from the response cache
+
+        Args:
+            user_id (UUID): user id
+
+        returns:
+            Response: serialized Page[GetDeviceResponse]
         """
-        Get all devices
+
+    @abstractmethod
+    async def get_devices_by_cursor(
+        self, user_id: UUID, query_params: GetDeviceCursorParams
+    ) -> Response:
+        """
+        Get a page of devices after the cursor, served from the response cache
 
         Args:
             user_id (UUID): user id
+            query_params (GetDeviceCursorParams): cursor, page size and
+                whether to count the devices
 
+        returns:
+            Response: serialized CursorPage[GetDeviceResponse]
+        """
+
+    @abstractmethod
+    async def select_devices(
+        self, user_id: UUID, query_params: DeviceSelectionParams
+    ) -> CursorPage[UUID]:
+        """
+        Get a page of the devices matching a combination of type and tags
+
+        The selection is computed on the cached bitmap indexes of the type and
+        the tags, only the page is read from the database.
+
+        Args:
+            user_id (UUID): user id
+            query_params (DeviceSelectionParams): type, tags, cursor, page size
+                and whether to count the devices
+
+        returns:
+            CursorPage[UUID]: ids of the devices
         """
 
     @abstractmethod
@@ -73,10 +156,76 @@ class IDeviceService(ABC):
             request_body (CreateDeviceRequestBody): request body
         """
 
+    @abstractmethod
+    async def update_device_tags(
+        self,
+        user_id: UUID,
+        device_id: UUID,
+        request_body: UpdateDeviceTagsRequestBody,
+    ) -> UpdateDeviceTagsResponse:
+        """
+        Add and remove tags of a device without sending all of them
+
+        Args:
+            user_id (UUID): user id
+            device_id (UUID): device id
+            request_body (UpdateDeviceTagsRequestBody): request body
+
+        returns:
+            UpdateDeviceTagsResponse: number of added and removed tags
+        """
+
+    @abstractmethod
+    async def bulk_upsert_devices(
+        self, user_id: UUID, media_type: str, body: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        """
+        Register or update devices from an NDJSON or CSV stream
+
+        The rows are written in batches of `devices_bulk_batch_size`, each in
+        its own transaction, and reported as soon as their batch is written.
+
+        Args:
+            user_id (UUID): user id
+            media_type (str): media type of the body
+            body (AsyncIterator[bytes]): request body
+
+        Raises:
+            HTTPException: 415 if the body is neither NDJSON nor CSV
+
+        returns:
+            AsyncIterator[bytes]: NDJSON report with a result per input line
+        """
+
+    @abstractmethod
+    async def create_device_token(
+        self, user_id: UUID, device_id: UUID
+    ) -> CreateDeviceTokenResponse:
+        """
+        Issue a token the device downloads its firmware with
+
+        The token is valid for `device_token_expire_in_seconds`, issuing a new
+        one does not invalidate the previous ones. They are revoked when the
+        device is deleted.
+
+        Args:
+            user_id (UUID): user id
+            device_id (UUID): device id
+
+        Raises:
+            HTTPException: 404 if the device does not exist
+
+        returns:
+            CreateDeviceTokenResponse: the token and its expiry
+        """
+
     @abstractmethod
     async def delete_device(self, user_id: UUID, device_id: UUID) -> None:
         """
-        Delete device
+        Delete device and revoke its tokens
+
+        The type of a device can not change, a device registered again with
+        the same id needs a new token.
 
         Args:
             user_id (UUID): user id
@@ -85,37 +234,160 @@ class IDeviceService(ABC):
 
 
 class DeviceService(IDeviceService):
-    def __init__(self, device_repo: IDeviceRepo):
+    def __init__(
+        self,
+        device_repo: IDeviceRepo,
+        response_cache: IResponseCache,
+        redis_client: Redis,
+    ):
         self.device_repo = device_repo
+        self.response_cache = response_cache
+        self.redis_client = redis_client
 
     async def get_device(
         self,
         user_id: UUID,
         device_id: UUID,
-    ) -> GetDeviceResponse:
-        return await self.device_repo.get_device_by_id(
-            user_id=user_id, device_id=device_id
+    ) -> Response:
+        content = await self.response_cache.get_item(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            item_id=device_id,
+            load=lambda: self.device_repo.get_device_by_id(
+                user_id=user_id, device_id=device_id
+            ),
         )
+        return Response(content=content, media_type="application/json")
 
     async def get_devices(
         self, user_id: UUID, query_params: GetDeviceQueryParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            query_params=query_params,
+            load=lambda: self._load_devices(
+                user_id=user_id, query_params=query_params
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def get_devices_by_cursor(
+        self, user_id: UUID, query_params: GetDeviceCursorParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            query_params=query_params,
+            load=lambda: self._load_devices_by_cursor(
+                user_id=user_id, query_params=query_params
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def _load_devices(
+        self, user_id: UUID, query_params: GetDeviceQueryParams
     ) -> Page[GetDeviceResponse]:
         devices = await self.device_repo.get_devices(
             user_id=user_id, query_params=query_params
         )
+        total = await self.device_repo.count_devices(
+            user_id=user_id, query_params=query_params
+        )
         return Page.create(
             items=devices,
             params=query_params,
-            total=query_params.size,
+            total=total,
+        )
+
+    async def _load_devices_by_cursor(
+        self, user_id: UUID, query_params: GetDeviceCursorParams
+    ) -> CursorPage[GetDeviceResponse]:
+        devices = await self.device_repo.get_devices_by_keyset(
+            user_id=user_id,
+            query_params=query_params,
+            keyset=decode_keyset(query_params.cursor),
+            size=query_params.size,
+        )
+        total = None
+        if query_params.total != PageTotal.NONE:
+            total = await self.device_repo.count_devices(
+                user_id=user_id,
+                query_params=query_params,
+                estimate=query_params.total == PageTotal.ESTIMATE,
+            )
+
+        return create_cursor_page(items=devices, params=query_params, total=total)
+
+    async def select_devices(
+        self, user_id: UUID, query_params: DeviceSelectionParams
+    ) -> CursorPage[UUID]:
+        selection = await self._get_type_bitmap(
+            user_id=user_id, type_id=query_params.type_id
+        )
+        for tag_id in query_params.tags:
+            selection &= await self._get_tag_bitmap(user_id=user_id, tag_id=tag_id)
+        if query_params.any_tags:
+            any_tags = Bitmap()
+            for tag_id in query_params.any_tags:
+                any_tags |= await self._get_tag_bitmap(user_id=user_id, tag_id=tag_id)
+            selection &= any_tags
+        for tag_id in query_params.exclude_tags:
+            selection -= await self._get_tag_bitmap(user_id=user_id, tag_id=tag_id)
+
+        after = decode_position(query_params.cursor)
+        seqs = list(
+            islice(
+                selection.iter_from(0 if after is None else after + 1),
+                query_params.size + 1,
+            )
+        )
+        next_page = None
+        if len(seqs) > query_params.size:
+            seqs = seqs[: query_params.size]
+            next_page = str(seqs[-1])
+
+        devices_ids = await self.device_repo.get_device_ids_by_seqs(
+            user_id=user_id, seqs=seqs
+        )
+        return CursorPage.create(
+            items=devices_ids,
+            params=query_params,
+            current=decode_cursor(query_params.cursor),
+            next_=next_page,
+            total=None if query_params.total == PageTotal.NONE else len(selection),
+        )
+
+    async def _get_type_bitmap(self, user_id: UUID, type_id: UUID | None) -> Bitmap:
+        return await self.response_cache.get_bitmap(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            name=f"type:{type_id or 'all'}",
+            load=lambda: self.device_repo.get_type_bitmap(
+                user_id=user_id, type_id=type_id
+            ),
+        )
+
+    async def _get_tag_bitmap(self, user_id: UUID, tag_id: UUID) -> Bitmap:
+        return await self.response_cache.get_bitmap(
+            user_id=user_id,
+            resource=CacheResource.TAGS,
+            name=f"tag:{tag_id}",
+            load=lambda: self.device_repo.get_tag_bitmap(
+                user_id=user_id, tag_id=tag_id
+            ),
         )
 
     async def create_device(
         self, user_id: UUID, request_body: CreateDeviceRequestBody
     ) -> CreateDeviceResponse:
-        return await self.device_repo.create_device(
+        device = await self.device_repo.create_device(
             user_id=user_id,
+            type_id=request_body.type_id,
             tags=request_body.tags,
         )
+        await self._invalidate(user_id=user_id, device_id=device.id, tags=device.tags)
+        return device
 
     async def update_device(
         self,
@@ -123,20 +395,262 @@ class DeviceService(IDeviceService):
         device_id: UUID,
         request_body: UpdateDeviceRequestBody,
     ) -> UpdateDeviceResponse:
-        return await self.device_repo.update_device(
+        previous = await self.device_repo.get_device_by_id(
+            user_id=user_id, device_id=device_id
+        )
+        device = await self.device_repo.update_device(
             user_id=user_id,
             device_id=device_id,
             tags=request_body.tags,
         )
+        await self._invalidate(
+            user_id=user_id,
+            device_id=device_id,
+            tags=set(previous.tags) ^ set(device.tags),
+        )
+        return device
+
+    async def create_device_token(
+        self, user_id: UUID, device_id: UUID
+    ) -> CreateDeviceTokenResponse:
+        device = await self.device_repo.get_device_by_id(
+            user_id=user_id, device_id=device_id
+        )
+        exp = int(time.time()) + settings.device_token_expire_in_seconds
+        return CreateDeviceTokenResponse(
+            token=create_device_token(
+                user_id=str(user_id),
+                device_id=str(device_id),
+                type_id=str(device.type_id),
+                exp=exp,
+            ),
+            expires_at=datetime.fromtimestamp(exp, UTC),
+        )
 
     async def delete_device(self, user_id: UUID, device_id: UUID) -> None:
-        return await self.device_repo.delete_device(
+        previous = await self.device_repo.get_device_by_id(
             user_id=user_id, device_id=device_id
         )
+        # revoked first, a failed delete leaves a device that needs a new token
+        await revoke_device_tokens(self.redis_client, str(device_id))
+        await self.device_repo.delete_device(user_id=user_id, device_id=device_id)
+        await self._invalidate(
+            user_id=user_id, device_id=device_id, tags=previous.tags
+        )
+
+    async def update_device_tags(
+        self,
+        user_id: UUID,
+        device_id: UUID,
+        request_body: UpdateDeviceTagsRequestBody,
+    ) -> UpdateDeviceTagsResponse:
+        added, removed = await self.device_repo.update_device_tags(
+            user_id=user_id,
+            device_id=device_id,
+            add=request_body.add,
+            remove=request_body.remove,
+        )
+        await self._invalidate(
+            user_id=user_id, device_id=device_id, tags=added + removed
+        )
+        return UpdateDeviceTagsResponse(added=len(added), removed=len(removed))
+
+    async def bulk_upsert_devices(
+        self, user_id: UUID, media_type: str, body: AsyncIterator[bytes]
+    ) -> AsyncIterator[bytes]:
+        try:
+            body_format = BulkDeviceFormat(media_type.partition(";")[0].strip().lower())
+        except ValueError:
+            raise HTTPException(
+                status_code=http.HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                detail="Expected application/x-ndjson or text/csv.",
+            )
+
+        return self._bulk_upsert_devices(
+            user_id=user_id, rows=_parse_bulk_rows(body_format, body)
+        )
+
+    async def _bulk_upsert_devices(
+        self,
+        user_id: UUID,
+        rows: AsyncIterator[tuple[int, BulkDeviceRow | str]],
+    ) -> AsyncIterator[bytes]:
+        batch: list[tuple[int, BulkDeviceRow]] = []
+        failed: list[BulkDeviceResult] = []
+        async for line, row in rows:
+            if isinstance(row, str):
+                failed.append(
+                    BulkDeviceResult(
+                        line=line, status=BulkDeviceStatus.FAILED, detail=row
+                    )
+                )
+            else:
+                batch.append((line, row))
+
+            if len(batch) >= settings.devices_bulk_batch_size:
+                yield await self._write_bulk_batch(user_id, batch, failed)
+                batch, failed = [], []
+
+        if batch or failed:
+            yield await self._write_bulk_batch(user_id, batch, failed)
+
+    async def _write_bulk_batch(
+        self,
+        user_id: UUID,
+        rows: list[tuple[int, BulkDeviceRow]],
+        failed: list[BulkDeviceResult],
+    ) -> bytes:
+        results = failed
+        if rows:
+            batch = await self.device_repo.bulk_upsert_devices(
+                user_id=user_id, rows=rows
+            )
+            results = sorted([*failed, *batch.results], key=lambda r: r.line)
+
+            # created devices can not be cached yet, only the pages are dropped
+            updated = [
+                result.id
+                for result in batch.results
+                if result.status == BulkDeviceStatus.UPDATED
+            ]
+            if any(
+                result.status != BulkDeviceStatus.FAILED for result in batch.results
+            ):
+                await self.response_cache.invalidate(
+                    user_id=user_id, resource=CacheResource.DEVICES, item_ids=updated
+                )
+            if batch.tags:
+                await self.response_cache.invalidate(
+                    user_id=user_id, resource=CacheResource.TAGS, item_ids=batch.tags
+                )
+
+        return b"".join(dump_response(result) + b"\n" for result in results)
+
+    async def _invalidate(
+        self, user_id: UUID, device_id: UUID, tags: Iterable[UUID]
+    ) -> None:
+        """
+        Drop the cached device and the tags whose devices changed with it
+
+        Args:
+            user_id (UUID): user id
+            device_id (UUID): changed device
+            tags (Iterable[UUID]): tags the device joined or left
+        """
+        await self.response_cache.invalidate(
+            user_id=user_id, resource=CacheResource.DEVICES, item_ids=[device_id]
+        )
+        if tags := list(tags):
+            await self.response_cache.invalidate(
+                user_id=user_id, resource=CacheResource.TAGS, item_ids=tags
+            )
+
+
+async def _read_lines(
+    body: AsyncIterator[bytes], max_line_size: int
+) -> AsyncIterator[tuple[int, bytes | None]]:
+    # a line longer than `max_line_size` is skipped up to its end instead of
+    # being buffered and yielded as None
+    line_number = 0
+    buffer = bytearray()
+    too_long = False
+    async for chunk in body:
+        view = memoryview(chunk)
+        start = 0
+        while (end := chunk.find(b"\n", start)) != -1:
+            line_number += 1
+            if too_long or len(buffer) + end - start > max_line_size:
+                yield line_number, None
+            else:
+                buffer += view[start:end]
+                yield line_number, bytes(buffer)
+            buffer.clear()
+            too_long = False
+            start = end + 1
+
+        if not too_long:
+            buffer += view[start:]
+            if len(buffer) > max_line_size:
+                buffer.clear()
+                too_long = True
+
+    if too_long:
+        yield line_number + 1, None
+    elif buffer:
+        yield line_number + 1, bytes(buffer)
+
+
+async def _parse_bulk_rows(
+    body_format: BulkDeviceFormat, body: AsyncIterator[bytes]
+) -> AsyncIterator[tuple[int, BulkDeviceRow | str]]:
+    """
+    Parse the bulk body line by line
+
+    A CSV body starts with a header naming the `id`, `type_id` and `tags`
+    columns, tags are separated by spaces. A line longer than
+    `devices_bulk_max_line_size` bytes is invalid.
+
+    Args:
+        body_format (BulkDeviceFormat): format of the body
+        body (AsyncIterator[bytes]): request body
+
+    returns:
+        AsyncIterator[tuple[int, BulkDeviceRow | str]]: line number and row,
+            or why the line is invalid
+    """
+    columns = None
+    async for line_number, line in _read_lines(
+        body, settings.devices_bulk_max_line_size
+    ):
+        if line is None:
+            yield (
+                line_number,
+                f"Line is longer than {settings.devices_bulk_max_line_size} bytes.",
+            )
+            continue
+
+        line = line.strip()
+        if not line:
+            continue
+
+        data: Any
+        try:
+            if body_format == BulkDeviceFormat.NDJSON:
+                data = orjson.loads(line)
+            else:
+                values = next(csv.reader([line.decode()]))
+                if columns is None:
+                    columns = [column.strip() for column in values]
+                    continue
+                data = dict(zip(columns, values))
+                data["id"] = data.get("id") or None
+                data["tags"] = (data.get("tags") or "").split()
+        except (orjson.JSONDecodeError, UnicodeDecodeError, csv.Error):
+            yield line_number, "Malformed line."
+            continue
+
+        try:
+            row = BulkDeviceRow.model_validate(data)
+        except ValidationError as e:
+            yield line_number, "; ".join(
+                f"{'.'.join(map(str, error['loc']))}: {error['msg']}"
+                for error in e.errors()
+            )
+            continue
+
+        yield line_number, row
 
 
-def get_device_service(device_repo: DeviceRepositoryType) -> IDeviceService:
-    return DeviceService(device_repo=device_repo)
+def get_device_service(
+    device_repo: DeviceRepositoryType,
+    response_cache: ResponseCacheType,
+    redis_client: RedisClientType,
+) -> IDeviceService:
+    return DeviceService(
+        device_repo=device_repo,
+        response_cache=response_cache,
+        redis_client=redis_client,
+    )
 
 
 DeviceServiceType = Annotated[IDeviceService, Depends(get_device_service)]
@@ -1,19 +1,71 @@
+import http
+
 from typing import Annotated
 from uuid import UUID
 
-from calypte_api.common.dependencies import JwtClaims, RateLimiterType, check_permission
+from calypte_api.common.dependencies import (
+    DeviceClaims,
+    DownloadRateLimiterType,
+    JwtClaims,
+    RateLimiterType,
+    RedisClientType,
+    check_device_or_permission,
+    check_permission,
+    get_owner_id,
+)
+from calypte_api.common.rate_limiting import bytes_cost, egress_admission
 from calypte_api.common.user_roles import UserRole
 from calypte_api.firmware import schemas as firmware_schemas
 from calypte_api.firmware.serivce import FirmwareServiceType
 from calypte_api.firmware_info import schemas as firmware_info_schemas
 from calypte_api.firmware_info.service import FirmwareInfoServiceType
 
-from fastapi import APIRouter, Depends
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    Depends,
+    Header,
+    HTTPException,
+    Path,
+    Request,
+    Response,
+)
 
 
 router = APIRouter()
 
 
+async def _schedule_delta(
+    background_tasks: BackgroundTasks,
+    firmware_info_service: FirmwareInfoServiceType,
+    firmware_service: FirmwareServiceType,
+    user_id: UUID,
+    firmware_id: UUID,
+) -> None:
+    """
+    Generate the delta from the previous version of a new firmware after the
+    response is sent
+
+    Args:
+        background_tasks (BackgroundTasks): tasks of the request
+        firmware_info_service (FirmwareInfoServiceType): firmware info service
+        firmware_service (FirmwareServiceType): firmware service
+        user_id (UUID): id of the owner of the firmware
+        firmware_id (UUID): id of the new firmware
+    """
+    previous_firmware = await firmware_info_service.get_previous_firmware(
+        user_id=user_id,
+        firmware_id=firmware_id,
+    )
+    if previous_firmware is not None:
+        background_tasks.add_task(
+            firmware_service.generate_delta,
+            user_id=user_id,
+            base_firmware_id=previous_firmware.id,
+            firmware_id=firmware_id,
+        )
+
+
 @router.post(
     path="/firmware",
     response_model=firmware_schemas.UploadFirmwareResponse,
@@ -29,27 +81,271 @@ async def upload_firmware(
     ],
     firmware_info_service: FirmwareInfoServiceType,
     firmware_service: FirmwareServiceType,
+    background_tasks: BackgroundTasks,
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
 ) -> firmware_schemas.UploadFirmwareResponse:
-    # TODO: combine these two calls into one transaction
-    firmware_info = await firmware_info_service.create_firmware(
+    async with firmware_info_service.create_firmware(
         user_id=jwt_claims.user.id,
         request_body=firmware_info_schemas.CreateFirmwareInfoRequestBody(
+            type_id=create_firmware_request_body.type_id,
             name=create_firmware_request_body.name,
             version=create_firmware_request_body.version,
             description=create_firmware_request_body.description,
         ),
+    ) as firmware_info:
+        await firmware_service.upload_firmware(
+            user_id=jwt_claims.user.id,
+            firmware_id=firmware_info.id,
+            firmware=create_firmware_request_body.firmware,
+            sha256=create_firmware_request_body.sha256,
+        )
+
+    await _schedule_delta(
+        background_tasks=background_tasks,
+        firmware_info_service=firmware_info_service,
+        firmware_service=firmware_service,
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_info.id,
     )
 
-    await firmware_service.upload_firmware(
+    return firmware_info
+
+
+@router.post(
+    path="/firmware/by-hash",
+    response_model=firmware_schemas.UploadFirmwareResponse,
+    summary="Create a firmware from an already uploaded image",
+    description=(
+        "Create a firmware referencing an already uploaded image by its SHA-256, "
+        "responds with 404 if the image has to be uploaded"
+    ),
+    response_description="An information of the created firmware",
+    status_code=201,
+)
+async def link_firmware(
+    _: RateLimiterType,
+    link_firmware_request_body: firmware_schemas.LinkFirmwareRequestBody,
+    firmware_info_service: FirmwareInfoServiceType,
+    firmware_service: FirmwareServiceType,
+    background_tasks: BackgroundTasks,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.UploadFirmwareResponse:
+    async with firmware_info_service.create_firmware(
+        user_id=jwt_claims.user.id,
+        request_body=firmware_info_schemas.CreateFirmwareInfoRequestBody(
+            type_id=link_firmware_request_body.type_id,
+            name=link_firmware_request_body.name,
+            version=link_firmware_request_body.version,
+            description=link_firmware_request_body.description,
+        ),
+    ) as firmware_info:
+        await firmware_service.link_firmware(
+            user_id=jwt_claims.user.id,
+            firmware_id=firmware_info.id,
+            sha256=link_firmware_request_body.sha256,
+        )
+
+    await _schedule_delta(
+        background_tasks=background_tasks,
+        firmware_info_service=firmware_info_service,
+        firmware_service=firmware_service,
         user_id=jwt_claims.user.id,
         firmware_id=firmware_info.id,
-        firmware=create_firmware_request_body.firmware.file,
     )
 
     return firmware_info
 
 
+@router.post(
+    path="/firmware/uploads",
+    response_model=firmware_schemas.FirmwareUploadResponse,
+    summary="Start a resumable firmware upload",
+    description=(
+        "Start a resumable upload, the image is then sent in parts of `partSize` "
+        "bytes which can be uploaded in parallel and retried independently"
+    ),
+    response_description="The upload with its part layout",
+    status_code=201,
+)
+async def create_firmware_upload(
+    _: RateLimiterType,
+    initiate_upload_request_body: firmware_schemas.InitiateFirmwareUploadRequestBody,
+    firmware_service: FirmwareServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.FirmwareUploadResponse:
+    return await firmware_service.create_upload(
+        user_id=jwt_claims.user.id,
+        request_body=initiate_upload_request_body,
+    )
+
+
+@router.get(
+    path="/firmware/uploads/{upload_id:uuid}",
+    response_model=firmware_schemas.FirmwareUploadResponse,
+    summary="Get a resumable firmware upload",
+    description="Get a resumable upload with the parts received so far",
+    response_description="The upload with its received parts",
+    status_code=200,
+)
+async def get_firmware_upload(
+    _: RateLimiterType,
+    upload_id: UUID,
+    firmware_service: FirmwareServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.FirmwareUploadResponse:
+    return await firmware_service.get_upload(
+        user_id=jwt_claims.user.id,
+        upload_id=upload_id,
+    )
+
+
+@router.put(
+    path="/firmware/uploads/{upload_id:uuid}/parts/{part_number}",
+    response_model=firmware_schemas.FirmwareUploadPartResponse,
+    summary="Upload a part of a resumable firmware upload",
+    description=(
+        "Upload a part as the raw request body, "
+        "a part that has already been received is replaced"
+    ),
+    response_description="The received part with its SHA-256",
+    status_code=200,
+)
+async def upload_firmware_part(
+    _: RateLimiterType,
+    upload_id: UUID,
+    part_number: Annotated[int, Path(ge=1)],
+    request: Request,
+    firmware_service: FirmwareServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.FirmwareUploadPartResponse:
+    return await firmware_service.upload_part(
+        user_id=jwt_claims.user.id,
+        upload_id=upload_id,
+        part_number=part_number,
+        body=request.stream(),
+    )
+
+
+@router.post(
+    path="/firmware/uploads/{upload_id:uuid}/complete",
+    response_model=firmware_schemas.UploadFirmwareResponse,
+    summary="Complete a resumable firmware upload",
+    description="Create the firmware from a resumable upload with all its parts",
+    response_description="An information of the uploaded firmware",
+    status_code=201,
+)
+async def complete_firmware_upload(
+    _: RateLimiterType,
+    upload_id: UUID,
+    firmware_info_service: FirmwareInfoServiceType,
+    firmware_service: FirmwareServiceType,
+    background_tasks: BackgroundTasks,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.UploadFirmwareResponse:
+    upload = await firmware_service.get_upload(
+        user_id=jwt_claims.user.id,
+        upload_id=upload_id,
+        completed=True,
+    )
+
+    async with firmware_info_service.create_firmware(
+        user_id=jwt_claims.user.id,
+        request_body=firmware_info_schemas.CreateFirmwareInfoRequestBody(
+            type_id=upload.type_id,
+            name=upload.name,
+            version=upload.version,
+            description=upload.description,
+        ),
+    ) as firmware_info:
+        await firmware_service.complete_upload(
+            user_id=jwt_claims.user.id,
+            upload_id=upload_id,
+            firmware_id=firmware_info.id,
+        )
+
+    await _schedule_delta(
+        background_tasks=background_tasks,
+        firmware_info_service=firmware_info_service,
+        firmware_service=firmware_service,
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_info.id,
+    )
+
+    return firmware_info
+
+
+@router.delete(
+    path="/firmware/uploads/{upload_id:uuid}",
+    summary="Abort a resumable firmware upload",
+    description="Abort a resumable upload and drop the received parts",
+    status_code=204,
+)
+async def abort_firmware_upload(
+    _: RateLimiterType,
+    upload_id: UUID,
+    firmware_service: FirmwareServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> None:
+    await firmware_service.abort_upload(
+        user_id=jwt_claims.user.id,
+        upload_id=upload_id,
+    )
+
+
+@router.post(
+    path="/firmware/{firmware_id:uuid}/verify",
+    response_model=firmware_schemas.VerifyFirmwareResponse,
+    summary="Verify a stored firmware",
+    description=(
+        "Check the stored image against the chunk hashes recorded at upload, "
+        "images unchanged in storage since their last successful check are "
+        "not read again"
+    ),
+    response_description="The indexes of the corrupted chunks",
+    status_code=200,
+)
+async def verify_firmware(
+    _: RateLimiterType,
+    firmware_id: UUID,
+    firmware_service: FirmwareServiceType,
+    firmware_info_service: FirmwareInfoServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.VerifyFirmwareResponse:
+    # only the owner of the firmware may read its image
+    await firmware_info_service.get_firmware_info_by_id(
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_id,
+    )
+    return await firmware_service.verify_firmware(
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_id,
+    )
+
+
+@router.delete(
+    path="/firmware/{firmware_id:uuid}",
+    summary="Delete a firmware",
+    description=(
+        "Delete a firmware with its rollouts, its image is deleted once no "
+        "other firmware references it"
+    ),
+    status_code=204,
+)
+async def delete_firmware(
+    _: RateLimiterType,
+    firmware_id: UUID,
+    firmware_service: FirmwareServiceType,
+    firmware_info_service: FirmwareInfoServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> None:
+    firmware = await firmware_info_service.delete_firmware(
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_id,
+    )
+    if firmware.sha256 is not None:
+        await firmware_service.delete_blob(sha256=firmware.sha256)
+
+
 @router.get(
     path="/firmware/{firmware_id:uuid}",
     summary="Download a firmware",
@@ -59,12 +355,53 @@ async def upload_firmware(
     response_class=firmware_schemas.DownloadFirmwareResponse,
 )
 async def download_firmware(
-    _: RateLimiterType,
+    rate_limit: DownloadRateLimiterType,
+    redis_client: RedisClientType,
     firmware_id: UUID,
     firmware_service: FirmwareServiceType,
-    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> firmware_schemas.DownloadFirmwareResponse:
-    return await firmware_service.get_firmware_by_id(
-        user_id=jwt_claims.user.id,
+    firmware_info_service: FirmwareInfoServiceType,
+    from_version: str | None = None,
+    range_header: Annotated[str | None, Header(alias="Range")] = None,
+    if_range: Annotated[str | None, Header()] = None,
+    if_none_match: Annotated[str | None, Header()] = None,
+    token: JwtClaims | DeviceClaims = Depends(
+        check_device_or_permission(UserRole.USER)
+    ),
+) -> Response:
+    user_id = get_owner_id(token)
+    if isinstance(token, DeviceClaims):
+        firmware_info = await firmware_info_service.get_firmware_info_by_id(
+            user_id=user_id,
+            firmware_id=firmware_id,
+        )
+        if str(firmware_info.type_id) != token.type_id:
+            raise HTTPException(
+                status_code=http.HTTPStatus.FORBIDDEN,
+                detail="The firmware is for devices of another type.",
+            )
+
+    base_firmware = None
+    if from_version is not None:
+        base_firmware = await firmware_info_service.get_firmware_by_version(
+            user_id=user_id,
+            firmware_id=firmware_id,
+            version=from_version,
+        )
+
+    response = await firmware_service.get_firmware_by_id(
+        user_id=user_id,
         firmware_id=firmware_id,
+        range_header=range_header,
+        if_range=if_range,
+        if_none_match=if_none_match,
+        base_firmware_id=base_firmware.id if base_firmware else None,
     )
+
+    # only streamed bodies leave through this service and know their size
+    if "content-length" in response.headers:
+        size = int(response.headers["content-length"])
+        # the request already paid for one unit
+        await rate_limit.consume(bytes_cost(size) - 1)
+        await egress_admission.admit(redis_client, size)
+
+    return response
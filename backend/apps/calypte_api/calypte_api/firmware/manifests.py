@@ -0,0 +1,209 @@
+import base64
+import hashlib
+
+from calypte_api.common.settings import get_settings
+from calypte_api.firmware.models import FirmwareBlob
+from calypte_api.firmware_info.schemas import FirmwareManifest
+
+from cryptography.hazmat.primitives.asymmetric.ed25519 import (
+    Ed25519PrivateKey,
+    Ed25519PublicKey,
+)
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+
+settings = get_settings()
+
+MANIFEST_VERSION = "v1"
+
+# prefix of the inner nodes of the Merkle tree, a node can not be taken for a
+# chunk hash
+_NODE_PREFIX = b"\x01"
+
+
+class ChunkedDigest:
+    """
+    SHA-256 of an image and of each of its chunks of `chunk_size` bytes
+
+    Fed like a hashlib digest, with pieces of any size, so it replaces the
+    digest of a streamed upload without reading the image again.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.size = 0
+        self._digest = hashlib.sha256()
+        self._chunk = hashlib.sha256()
+        self._chunk_filled = 0
+        self._chunk_hashes = bytearray()
+
+    def update(self, data: bytes) -> None:
+        self._digest.update(data)
+        self.size += len(data)
+
+        view = memoryview(data)
+        while view:
+            taken = min(self.chunk_size - self._chunk_filled, len(view))
+            self._chunk.update(view[:taken])
+            self._chunk_filled += taken
+            view = view[taken:]
+            if self._chunk_filled == self.chunk_size:
+                self._chunk_hashes += self._chunk.digest()
+                self._chunk = hashlib.sha256()
+                self._chunk_filled = 0
+
+    def hexdigest(self) -> str:
+        return self._digest.hexdigest()
+
+    def chunk_hashes(self) -> bytes:
+        """
+        Concatenated SHA-256 digests of the chunks, the last one may be short
+        """
+        if self._chunk_filled:
+            return bytes(self._chunk_hashes + self._chunk.digest())
+
+        return bytes(self._chunk_hashes)
+
+
+def _hex_chunks(chunk_hashes: bytes) -> list[str]:
+    return [chunk_hashes[i : i + 32].hex() for i in range(0, len(chunk_hashes), 32)]
+
+
+def merkle_root(chunk_hashes: bytes) -> bytes:
+    """
+    Root of the Merkle tree over the chunk hashes
+
+    A parent is the SHA-256 of 0x01 followed by its two children, the last
+    node of a level without a sibling moves up unchanged. The root of a
+    single chunk is its hash, the one of an empty image the hash of nothing.
+
+    Args:
+        chunk_hashes (bytes): concatenated SHA-256 digests of the chunks
+    """
+    level = [chunk_hashes[i : i + 32] for i in range(0, len(chunk_hashes), 32)]
+    if not level:
+        return hashlib.sha256().digest()
+
+    while len(level) > 1:
+        parents = [
+            hashlib.sha256(_NODE_PREFIX + level[i] + level[i + 1]).digest()
+            for i in range(0, len(level) - 1, 2)
+        ]
+        if len(level) % 2:
+            parents.append(level[-1])
+        level = parents
+
+    return level[0]
+
+
+def manifest_statement(sha256: str, size: int, chunk_size: int, root: str) -> bytes:
+    """
+    Bytes the signature of a manifest covers
+
+    Args:
+        sha256 (str): SHA-256 of the image
+        size (int): size of the image
+        chunk_size (int): size of every chunk but the last one
+        root (str): Merkle root of the chunk hashes
+    """
+    return (
+        f"calypte-firmware-manifest:{MANIFEST_VERSION}:"
+        f"{sha256}:{size}:{chunk_size}:{root}"
+    ).encode()
+
+
+def _load_signing_key() -> tuple[Ed25519PrivateKey, str] | None:
+    if settings.firmware_signing_key is None:
+        return None
+
+    private_key = Ed25519PrivateKey.from_private_bytes(
+        base64.b64decode(settings.firmware_signing_key)
+    )
+    return private_key, public_key_id(private_key.public_key())
+
+
+def public_key_id(public_key: Ed25519PublicKey) -> str:
+    """
+    Short id of a signing key, devices pick the key to verify with by it
+
+    Args:
+        public_key (Ed25519PublicKey): public key
+    """
+    raw = public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return hashlib.sha256(raw).hexdigest()[:16]
+
+
+_signing_key = _load_signing_key()
+
+
+def build_manifest(
+    sha256: str, size: int, chunk_size: int, chunk_hashes: bytes
+) -> FirmwareManifest:
+    """
+    Build the manifest of an image, signed if `firmware_signing_key` is set
+
+    Args:
+        sha256 (str): SHA-256 of the image
+        size (int): size of the image
+        chunk_size (int): size of every chunk but the last one
+        chunk_hashes (bytes): concatenated SHA-256 digests of the chunks
+    """
+    root = merkle_root(chunk_hashes).hex()
+    signature = key_id = None
+    if _signing_key is not None:
+        private_key, key_id = _signing_key
+        signature = base64.b64encode(
+            private_key.sign(manifest_statement(sha256, size, chunk_size, root))
+        ).decode()
+
+    return FirmwareManifest(
+        version=MANIFEST_VERSION,
+        sha256=sha256,
+        size=size,
+        chunk_size=chunk_size,
+        chunks=_hex_chunks(chunk_hashes),
+        merkle_root=root,
+        signature=signature,
+        key_id=key_id,
+    )
+
+
+def load_manifest(blob: FirmwareBlob) -> FirmwareManifest | None:
+    """
+    Get the manifest recorded for a blob, None if it has none
+
+    Args:
+        blob (FirmwareBlob): blob with its chunk hashes loaded
+    """
+    if blob.chunk_size is None or blob.chunk_hashes is None:
+        return None
+
+    return FirmwareManifest(
+        version=MANIFEST_VERSION,
+        sha256=blob.sha256,
+        size=blob.size,
+        chunk_size=blob.chunk_size,
+        chunks=_hex_chunks(blob.chunk_hashes),
+        merkle_root=blob.merkle_root,
+        signature=blob.signature,
+        key_id=blob.key_id,
+    )
+
+
+def corrupted_chunks(expected: bytes, actual: bytes) -> list[int]:
+    """
+    Indexes of the chunks whose hash differs from the recorded one
+
+    Chunks missing from either side count as corrupted.
+
+    Args:
+        expected (bytes): concatenated SHA-256 digests recorded at upload
+        actual (bytes): concatenated SHA-256 digests of the stored chunks
+    """
+    count = max(len(expected), len(actual)) // 32
+    return [
+        index
+        for index in range(count)
+        if expected[index * 32 : (index + 1) * 32]
+        != actual[index * 32 : (index + 1) * 32]
+    ]
@@ -0,0 +1,127 @@
+import uuid
+
+from datetime import datetime
+
+from calypte_api.common.models import Base, UUIDMixin
+
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    ForeignKey,
+    Index,
+    LargeBinary,
+    String,
+    event,
+    text,
+)
+from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.sql import func
+
+
+class FirmwareBlob(Base):
+    __tablename__ = "firmware_blobs"
+    __table_args__ = (
+        Index(
+            "ix_firmware_blobs_unreferenced_at",
+            "unreferenced_at",
+            postgresql_where=text("ref_count = 0"),
+        ),
+    )
+
+    sha256: Mapped[str] = mapped_column(String(64), primary_key=True)
+    size: Mapped[int] = mapped_column(BigInteger)
+    ref_count: Mapped[int] = mapped_column(default=0)
+
+    # integrity manifest, blobs stored before manifests have none until an
+    # audit records one; the chunk hashes are only loaded when asked for
+    chunk_size: Mapped[int | None]
+    chunk_hashes: Mapped[bytes | None] = mapped_column(LargeBinary, deferred=True)
+    merkle_root: Mapped[str | None] = mapped_column(String(64))
+    signature: Mapped[str | None]
+    key_id: Mapped[str | None] = mapped_column(String(16))
+    # storage etag of the blob when its chunks last matched the manifest
+    verified_etag: Mapped[str | None]
+
+    # set while no firmware references the blob, its image is deleted after
+    # the commit that dropped the last reference or by the reaper
+    unreferenced_at: Mapped[datetime | None]
+
+    created_at: Mapped[datetime] = mapped_column(default=func.now())
+
+
+class FirmwareBlobRef(Base):
+    __tablename__ = "firmware_blob_refs"
+
+    # references go with their firmware, also when its type is deleted
+    firmware_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("firmware_info.id", ondelete="CASCADE"), primary_key=True
+    )
+    sha256: Mapped[str] = mapped_column(
+        ForeignKey("firmware_blobs.sha256"), index=True
+    )
+
+
+# a deleted reference is released by the database, so cascades count too;
+# the image of a blob left unreferenced is deleted after the commit or by
+# the reaper
+event.listen(
+    FirmwareBlobRef.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE OR REPLACE FUNCTION release_firmware_blob() RETURNS trigger AS $$
+        BEGIN
+            UPDATE firmware_blobs
+            SET ref_count = ref_count - 1,
+                unreferenced_at = CASE WHEN ref_count = 1 THEN now() END
+            WHERE sha256 = OLD.sha256;
+            RETURN OLD;
+        END
+        $$ LANGUAGE plpgsql
+        """
+    ),
+)
+event.listen(
+    FirmwareBlobRef.__table__,
+    "after_create",
+    DDL(
+        """
+        CREATE TRIGGER release_firmware_blob
+        AFTER DELETE ON firmware_blob_refs
+        FOR EACH ROW EXECUTE FUNCTION release_firmware_blob()
+        """
+    ),
+)
+
+
+class FirmwareUpload(UUIDMixin, Base):
+    __tablename__ = "firmware_uploads"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(UUID(), index=True)
+    type_id: Mapped[uuid.UUID] = mapped_column(UUID())
+    name: Mapped[str]
+    version: Mapped[str]
+    description: Mapped[str]
+
+    size: Mapped[int] = mapped_column(BigInteger)
+    part_size: Mapped[int]
+    sha256: Mapped[str | None] = mapped_column(String(64))
+
+    # uploads older than `firmware_upload_expire_in_seconds` are reaped
+    created_at: Mapped[datetime] = mapped_column(default=func.now(), index=True)
+
+    @property
+    def part_count(self) -> int:
+        return -(-self.size // self.part_size)
+
+
+class FirmwareUploadPart(Base):
+    __tablename__ = "firmware_upload_parts"
+
+    upload_id: Mapped[uuid.UUID] = mapped_column(
+        ForeignKey("firmware_uploads.id", ondelete="CASCADE"), primary_key=True
+    )
+    part_number: Mapped[int] = mapped_column(primary_key=True)
+    size: Mapped[int]
+    sha256: Mapped[str] = mapped_column(String(64))
@@ -1,25 +1,108 @@
+import base64
+import hashlib
+import http
+import os
+import time
+
 from abc import ABC, abstractmethod
-from collections.abc import Generator
-from typing import Annotated, BinaryIO
-from uuid import UUID
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Annotated, Any, BinaryIO
+from urllib.parse import urlsplit
+from uuid import UUID, uuid4
+
+from calypte_api.common.databases import get_s3_client, releases_connection
+from calypte_api.common.dependencies import DBSessionType
+from calypte_api.common.models import FirmwareInfo, FirmwareStatus
+from calypte_api.common.settings import FirmwareStorageBackend, get_settings
+from calypte_api.firmware.manifests import ChunkedDigest, build_manifest
+from calypte_api.firmware.models import (
+    FirmwareBlob,
+    FirmwareBlobRef,
+    FirmwareUpload,
+    FirmwareUploadPart,
+)
+from calypte_api.firmware.schemas import (
+    FirmwareBlobInfo,
+    FirmwareIntegrity,
+    FirmwareUploadPartResponse,
+    FirmwareUploadResponse,
+    InitiateFirmwareUploadRequestBody,
+)
+
+import anyio
+
+from aiobotocore.client import AioBaseClient
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import Depends, HTTPException, UploadFile
+from sqlalchemy import Select, case, delete, func, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import undefer
+
+
+settings = get_settings()
 
-from fastapi import Depends
+# failures of the storage a deletion is left to the reaper for
+_STORAGE_ERRORS = (OSError, BotoCoreError, ClientError)
+
+# columns of a blob that hold its manifest
+_MANIFEST_COLUMNS = ("chunk_size", "chunk_hashes", "merkle_root", "signature", "key_id")
 
 
 class IFirmwareRepo(ABC):
     @abstractmethod
-    async def get_firmware_by_id(
+    async def get_firmware_info(
         self,
         user_id: UUID,
         firmware_id: UUID,
-    ) -> Generator[None, None, str]:
+        base_firmware_id: UUID | None = None,
+    ) -> FirmwareBlobInfo:
         """
-        Get firmware by id
+        Get size and etag of the stored firmware
 
         Args:
+            user_id (UUID): user id
             firmware_id (UUID): firmware id
+            base_firmware_id (UUID | None): get the delta from this firmware
+                instead of the full image
+
+        Raises:
+            HTTPException: 404 if the firmware does not exist
+        """
+
+    @abstractmethod
+    def get_firmware_by_id(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        start: int = 0,
+        end: int | None = None,
+        base_firmware_id: UUID | None = None,
+    ) -> AsyncIterator[bytes]:
+        """
+        Stream firmware bytes in fixed-size chunks
+
+        Args:
             user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            start (int): first byte to stream
+            end (int | None): last byte to stream (inclusive), None for EOF
+            base_firmware_id (UUID | None): stream the delta from this firmware
+                instead of the full image
+
+        """
+
+    @abstractmethod
+    async def read_firmware(self, user_id: UUID, firmware_id: UUID) -> bytes:
+        """
+        Read the whole firmware image into memory
 
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
         """
 
     @abstractmethod
@@ -27,40 +110,1563 @@ class IFirmwareRepo(ABC):
         self,
         user_id: UUID,
         firmware_id: UUID,
-        firmware: BinaryIO,
+        firmware: UploadFile,
+        sha256: str | None = None,
+    ) -> FirmwareBlobInfo:
+        """
+        Upload firmware, streaming it in bounded chunks
+
+        Identical images are stored once, the firmware only references
+        the blob with the same SHA-256. The pending firmware turns ready in
+        the transaction that references the blob.
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): pending firmware id
+            firmware (UploadFile): firmware
+            sha256 (str | None): SHA-256 announced by the client, the body is
+                not read at all if a blob with this digest is already stored
+
+        Raises:
+            HTTPException: 400 if the body does not match the announced SHA-256,
+                409 if the firmware is not pending
+
+        returns:
+            FirmwareBlobInfo: size and SHA-256 of the stored firmware
+        """
+
+    @abstractmethod
+    async def link_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        sha256: str,
+    ) -> FirmwareBlobInfo | None:
+        """
+        Reference an already stored blob from the pending firmware and make
+        it ready
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): pending firmware id
+            sha256 (str): SHA-256 of the blob
+
+        Raises:
+            HTTPException: 409 if the firmware is not pending
+
+        returns:
+            FirmwareBlobInfo | None: the blob, None if it is not stored
+        """
+
+    @abstractmethod
+    async def delete_blob(self, sha256: str) -> None:
+        """
+        Delete a blob no firmware references anymore
+
+        Its references go with their firmware, the image is deleted after
+        that has been committed. One the storage fails to delete, or that
+        is referenced again meanwhile, is left to the reaper.
+
+        Args:
+            sha256 (str): SHA-256 of the blob
+        """
+
+    @abstractmethod
+    async def upload_delta(
+        self,
+        user_id: UUID,
+        base_firmware_id: UUID,
+        firmware_id: UUID,
+        delta: bytes,
+    ) -> None:
+        """
+        Store a binary delta between two firmware images
+
+        Args:
+            user_id (UUID): user id
+            base_firmware_id (UUID): firmware the delta applies to
+            firmware_id (UUID): firmware the delta produces
+            delta (bytes): bsdiff patch
+        """
+
+    @abstractmethod
+    async def create_upload(
+        self,
+        user_id: UUID,
+        request_body: InitiateFirmwareUploadRequestBody,
+        part_size: int,
+    ) -> FirmwareUploadResponse:
+        """
+        Start a resumable upload
+
+        Args:
+            user_id (UUID): user id
+            request_body (InitiateFirmwareUploadRequestBody): firmware info,
+                size and optionally SHA-256 of the image
+            part_size (int): size of every part but the last one
+        """
+
+    @abstractmethod
+    async def get_upload(
+        self, user_id: UUID, upload_id: UUID
+    ) -> FirmwareUploadResponse:
+        """
+        Get a resumable upload with the parts received so far
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+
+        Raises:
+            HTTPException: 404 if the upload does not exist
+        """
+
+    @abstractmethod
+    async def upload_part(
+        self,
+        user_id: UUID,
+        upload_id: UUID,
+        part_number: int,
+        data: bytes,
+    ) -> FirmwareUploadPartResponse:
+        """
+        Store a part of a resumable upload, a part can be uploaded again
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+            part_number (int): 1-based part number
+            data (bytes): part, already checked to have the expected size
+
+        Raises:
+            HTTPException: 404 if the upload does not exist
+        """
+
+    @abstractmethod
+    async def complete_upload(
+        self, user_id: UUID, upload_id: UUID, firmware_id: UUID
+    ) -> FirmwareBlobInfo:
+        """
+        Store the uploaded parts as the image of the pending firmware, make
+        it ready and drop the upload
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id, all parts must have been received
+            firmware_id (UUID): pending firmware id
+
+        Raises:
+            HTTPException: 400 if the image does not match the announced SHA-256,
+                409 if the firmware is not pending
+
+        returns:
+            FirmwareBlobInfo: size and SHA-256 of the stored firmware
+        """
+
+    @abstractmethod
+    async def abort_upload(self, user_id: UUID, upload_id: UUID) -> None:
+        """
+        Drop a resumable upload with all its parts
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+        """
+
+    @abstractmethod
+    async def delete_abandoned_uploads(
+        self,
+        pending_expire_in_seconds: int,
+        upload_expire_in_seconds: int,
+        limit: int,
+    ) -> int:
+        """
+        Delete a batch of the firmware still pending and of the resumable
+        uploads not completed after their expiry, with what they stored, and
+        of the blobs unreferenced for as long as a pending firmware lives
+
+        Rows being worked on by another transaction are skipped, workers can
+        reap concurrently.
+
+        Args:
+            pending_expire_in_seconds (int): age of the pending firmware and
+                of the unreferenced blobs
+            upload_expire_in_seconds (int): age of the resumable uploads
+            limit (int): most pending firmware, uploads and blobs deleted each
+
+        returns:
+            int: number of deleted pending firmware, uploads and blobs
+        """
+
+    @abstractmethod
+    async def get_integrity(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> FirmwareIntegrity:
+        """
+        Get the recorded chunk hashes of the firmware image and the etags of
+        its stored blob now and when it last passed an audit
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+        """
+
+    @abstractmethod
+    async def save_verification(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        storage_etag: str,
+        digest: ChunkedDigest | None = None,
     ) -> None:
         """
-        Upload firmware
+        Record that the stored blob of the firmware matched its hashes
 
         Args:
             user_id (UUID): user id
             firmware_id (UUID): firmware id
-            firmware (bytes): firmware
+            storage_etag (str): etag of the blob that has been read
+            digest (ChunkedDigest | None): hashes of the blob, recorded as its
+                manifest if it has none yet
         """
 
+    @abstractmethod
+    async def get_download_url(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        expire_in_seconds: int,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        """
+        Get a short-lived signed URL the firmware can be fetched from directly
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            expire_in_seconds (int): lifetime of the URL
+            base_firmware_id (UUID | None): sign the delta from this firmware
+                instead of the full image
+        """
+
+    @abstractmethod
+    async def get_internal_path(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        """
+        Get the firmware path relative to the X-Accel-Redirect location
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            base_firmware_id (UUID | None): get the path of the delta from
+                this firmware instead of the full image
+        """
+
+
+class _UploadDigest:
+    """
+    SHA-256 and chunk hashes of the contiguous prefix of a resumable upload
+    hashed so far
+
+    Parts are folded in once they are committed, so completing an upload
+    only reads back the parts that arrived out of order or in another
+    process. The SHA-256 of every folded part is kept, a prefix that no
+    longer matches the stored parts is hashed again from the start.
+    The hash state can not leave the process, a missing digest is
+    rebuilt from the stored parts on completion. Completing without
+    reading the image back therefore only holds for a single worker or
+    uploads routed to one worker, e.g. by a sticky load balancer.
+    """
+
+    def __init__(self, chunk_size: int) -> None:
+        self.lock = anyio.Lock()
+        self.reset(chunk_size)
+
+    @property
+    def next_part(self) -> int:
+        return len(self.part_sha256s) + 1
+
+    def reset(self, chunk_size: int) -> None:
+        self.digest = ChunkedDigest(chunk_size)
+        self.part_sha256s: list[str] = []
+
+    def update(self, data: bytes, sha256: str) -> None:
+        self.digest.update(data)
+        self.part_sha256s.append(sha256)
+
+    def update_checked(self, data: bytes, sha256: str) -> bool:
+        # a part read back may be overwritten by an upload of it that has
+        # not committed yet, it is only folded in if it matches its row
+        if hashlib.sha256(data).hexdigest() != sha256:
+            return False
+
+        self.update(data, sha256)
+        return True
+
+
+class _UploadDigests:
+    """
+    Bounded LRU of the digests of the resumable uploads of this process
+
+    An upload completed, aborted or reaped elsewhere leaves its digest
+    here until it is evicted, an evicted upload is hashed from its stored
+    parts when it is completed.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._entries: OrderedDict[UUID, _UploadDigest] = OrderedDict()
+
+    def get(self, upload_id: UUID) -> _UploadDigest | None:
+        upload_digest = self._entries.get(upload_id)
+        if upload_digest is not None:
+            self._entries.move_to_end(upload_id)
+        return upload_digest
+
+    def set(self, upload_id: UUID, upload_digest: _UploadDigest) -> None:
+        self._entries[upload_id] = upload_digest
+        self._entries.move_to_end(upload_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def pop(self, upload_id: UUID) -> None:
+        self._entries.pop(upload_id, None)
+
+
+_upload_digests = _UploadDigests(max_size=settings.firmware_upload_digests_max_size)
+
+
+class BaseFirmwareRepo(IFirmwareRepo):
+    """
+    Content-addressed firmware storage
+
+    Images are stored once per SHA-256 under `blobs/`, the database keeps
+    which firmware references which blob and how many references a blob has.
+    Subclasses only implement the storage primitives.
+    """
+
+    def __init__(
+        self, db_session: AsyncSession, chunk_size: int, manifest_chunk_size: int
+    ) -> None:
+        self.db_session = db_session
+        self.chunk_size = chunk_size
+        self.manifest_chunk_size = manifest_chunk_size
+        self._blobs: dict[tuple[UUID, UUID], FirmwareBlob] = {}
+
+    @staticmethod
+    def _blob_key(sha256: str) -> str:
+        return f"blobs/{sha256[:2]}/{sha256}"
+
+    @staticmethod
+    def _delta_key(base_firmware_id: UUID, firmware_id: UUID) -> str:
+        return f"deltas/{base_firmware_id}/{firmware_id}"
+
+    @staticmethod
+    def _upload_key(upload_id: UUID) -> str:
+        return f"uploads/{upload_id}"
+
+    @staticmethod
+    def _temp_key(firmware_id: UUID) -> str:
+        # named after the firmware, the reaper finds what a pending firmware
+        # left behind without listing the storage
+        return f"tmp/{firmware_id}"
+
+    @abstractmethod
+    async def _stat(self, key: str) -> FirmwareBlobInfo:
+        ...
+
+    @abstractmethod
+    def _stream(self, key: str, start: int, end: int | None) -> AsyncIterator[bytes]:
+        ...
+
+    @abstractmethod
+    async def _read(self, key: str) -> bytes:
+        ...
+
+    @abstractmethod
+    async def _write(self, key: str, data: bytes) -> None:
+        ...
+
+    @abstractmethod
+    async def _write_temp(self, temp_key: str, firmware: UploadFile) -> ChunkedDigest:
+        ...
+
+    @abstractmethod
+    async def _commit_temp(self, temp_key: str, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete(self, key: str) -> None:
+        ...
+
+    @abstractmethod
+    async def _delete_temps(self, temp_keys: list[str]) -> None:
+        ...
+
+    @abstractmethod
+    async def _create_upload(self, upload_id: UUID, size: int) -> None:
+        ...
+
+    @abstractmethod
+    async def _write_part(
+        self, upload_id: UUID, part_number: int, offset: int, data: bytes
+    ) -> None:
+        ...
+
+    @abstractmethod
+    async def _read_part(
+        self, upload_id: UUID, part_number: int, offset: int, size: int
+    ) -> bytes:
+        ...
+
+    @abstractmethod
+    async def _complete_upload(
+        self, upload_id: UUID, part_count: int, key: str
+    ) -> None:
+        ...
+
+    @abstractmethod
+    async def _abort_upload(self, upload_id: UUID, part_count: int) -> None:
+        ...
+
+    @staticmethod
+    def _select_blob(user_id: UUID, firmware_id: UUID) -> Select:
+        # blobs are shared between users, a firmware is only found through
+        # the firmware info of its owner
+        return (
+            select(FirmwareBlob)
+            .join(FirmwareBlobRef)
+            .join(FirmwareInfo, FirmwareInfo.id == FirmwareBlobRef.firmware_id)
+            .where(
+                FirmwareBlobRef.firmware_id == firmware_id,
+                FirmwareInfo.user_id == user_id,
+            )
+        )
+
+    async def _get_blob(self, user_id: UUID, firmware_id: UUID) -> FirmwareBlob:
+        if (user_id, firmware_id) not in self._blobs:
+            blob = await self.db_session.scalar(
+                self._select_blob(user_id, firmware_id)
+            )
+            if blob is None:
+                raise HTTPException(
+                    status_code=http.HTTPStatus.NOT_FOUND,
+                    detail="Firmware not found.",
+                )
+            self._blobs[user_id, firmware_id] = blob
+
+        return self._blobs[user_id, firmware_id]
+
+    async def _get_key(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        # deltas are only generated between firmware of the same owner,
+        # owning the target is enough to read one
+        blob = await self._get_blob(user_id, firmware_id)
+        if base_firmware_id is not None:
+            return self._delta_key(base_firmware_id, firmware_id)
+
+        return self._blob_key(blob.sha256)
+
+    @staticmethod
+    def _blob_values(digest: ChunkedDigest) -> dict[str, Any]:
+        sha256 = digest.hexdigest()
+        manifest = build_manifest(
+            sha256=sha256,
+            size=digest.size,
+            chunk_size=digest.chunk_size,
+            chunk_hashes=digest.chunk_hashes(),
+        )
+        return {
+            "sha256": sha256,
+            "size": digest.size,
+            "chunk_size": manifest.chunk_size,
+            "chunk_hashes": digest.chunk_hashes(),
+            "merkle_root": manifest.merkle_root,
+            "signature": manifest.signature,
+            "key_id": manifest.key_id,
+        }
+
+    async def _record_blob(self, digest: ChunkedDigest) -> None:
+        # committed on its own before the image is moved to its key, so an
+        # upload whose transaction fails leaves an unreferenced row the
+        # reaper deletes the image by; a known blob only restarts the grace
+        # period of an unreferenced one
+        async with AsyncSession(self.db_session.bind) as db_session:
+            await db_session.execute(
+                insert(FirmwareBlob)
+                .values(
+                    **self._blob_values(digest),
+                    ref_count=0,
+                    unreferenced_at=func.now(),
+                )
+                .on_conflict_do_update(
+                    index_elements=[FirmwareBlob.sha256],
+                    set_={"unreferenced_at": func.now()},
+                    where=FirmwareBlob.ref_count == 0,
+                )
+            )
+            await db_session.commit()
+
+    async def _add_blob_ref(self, firmware_id: UUID, digest: ChunkedDigest) -> None:
+        statement = insert(FirmwareBlob).values(
+            **self._blob_values(digest), ref_count=1
+        )
+        # the upsert keeps the blob row locked until commit, so a concurrent
+        # delete of the last reference can not remove the blob under us,
+        # blobs stored before manifests were recorded get this one
+        await self.db_session.execute(
+            statement.on_conflict_do_update(
+                index_elements=[FirmwareBlob.sha256],
+                set_={
+                    "ref_count": FirmwareBlob.ref_count + 1,
+                    "unreferenced_at": None,
+                    **{
+                        column: case(
+                            (
+                                FirmwareBlob.chunk_hashes.is_(None),
+                                statement.excluded[column],
+                            ),
+                            else_=FirmwareBlob.__table__.c[column],
+                        )
+                        for column in _MANIFEST_COLUMNS
+                    },
+                },
+            )
+        )
+        await self.db_session.execute(
+            insert(FirmwareBlobRef).values(
+                firmware_id=firmware_id, sha256=digest.hexdigest()
+            )
+        )
+
+    async def _delete_blob(self, sha256: str, unreferenced_at: datetime) -> None:
+        # the row stays locked until the image is gone, so an upload of the
+        # same image waits for us; an upload that recorded the blob since
+        # moved `unreferenced_at` and keeps it, a failure leaves the row to
+        # the reaper
+        deleted = await self.db_session.scalar(
+            delete(FirmwareBlob)
+            .where(
+                FirmwareBlob.sha256 == sha256,
+                FirmwareBlob.ref_count == 0,
+                FirmwareBlob.unreferenced_at == unreferenced_at,
+            )
+            .returning(FirmwareBlob.sha256)
+        )
+        try:
+            if deleted is not None:
+                await self._delete(self._blob_key(sha256))
+            await self.db_session.commit()
+        except _STORAGE_ERRORS:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+            raise
+
+    async def _make_ready(self, firmware_id: UUID) -> None:
+        ready = await self.db_session.scalar(
+            update(FirmwareInfo)
+            .where(
+                FirmwareInfo.id == firmware_id,
+                FirmwareInfo.status == FirmwareStatus.PENDING,
+            )
+            .values(status=FirmwareStatus.READY)
+            .returning(FirmwareInfo.id)
+        )
+        if ready is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.CONFLICT,
+                detail="Firmware is not pending, it may have expired.",
+            )
+
+    async def get_firmware_info(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        base_firmware_id: UUID | None = None,
+    ) -> FirmwareBlobInfo:
+        blob = await self._get_blob(user_id, firmware_id)
+        if base_firmware_id is not None:
+            return await self._stat(self._delta_key(base_firmware_id, firmware_id))
+
+        return FirmwareBlobInfo(
+            size=blob.size, etag=f'"{blob.sha256}"', sha256=blob.sha256
+        )
+
+    async def get_integrity(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> FirmwareIntegrity:
+        blob = await self.db_session.scalar(
+            self._select_blob(user_id, firmware_id).options(
+                undefer(FirmwareBlob.chunk_hashes)
+            )
+        )
+        if blob is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware not found.",
+            )
+
+        storage_info = await self._stat(self._blob_key(blob.sha256))
+        return FirmwareIntegrity(
+            sha256=blob.sha256,
+            size=blob.size,
+            chunk_size=blob.chunk_size or self.manifest_chunk_size,
+            chunk_hashes=blob.chunk_hashes,
+            storage_etag=storage_info.etag,
+            verified_etag=blob.verified_etag,
+        )
+
+    async def save_verification(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        storage_etag: str,
+        digest: ChunkedDigest | None = None,
+    ) -> None:
+        blob = await self._get_blob(user_id, firmware_id)
+        await self.db_session.execute(
+            update(FirmwareBlob)
+            .where(FirmwareBlob.sha256 == blob.sha256)
+            .values(verified_etag=storage_etag)
+        )
+        if digest is not None:
+            manifest = build_manifest(
+                sha256=blob.sha256,
+                size=blob.size,
+                chunk_size=digest.chunk_size,
+                chunk_hashes=digest.chunk_hashes(),
+            )
+            await self.db_session.execute(
+                update(FirmwareBlob)
+                .where(
+                    FirmwareBlob.sha256 == blob.sha256,
+                    FirmwareBlob.chunk_hashes.is_(None),
+                )
+                .values(
+                    chunk_size=manifest.chunk_size,
+                    chunk_hashes=digest.chunk_hashes(),
+                    merkle_root=manifest.merkle_root,
+                    signature=manifest.signature,
+                    key_id=manifest.key_id,
+                )
+            )
+        await self.db_session.commit()
 
-class FirmwareRepo(IFirmwareRepo):
     async def get_firmware_by_id(
         self,
         user_id: UUID,
         firmware_id: UUID,
-    ) -> Generator[None, None, str]:
-        with open(f"./{firmware_id}.txt") as f:
-            for line in f:
-                yield line
+        start: int = 0,
+        end: int | None = None,
+        base_firmware_id: UUID | None = None,
+    ) -> AsyncIterator[bytes]:
+        key = await self._get_key(user_id, firmware_id, base_firmware_id)
+        async for chunk in self._stream(key, start, end):
+            yield chunk
+
+    async def read_firmware(self, user_id: UUID, firmware_id: UUID) -> bytes:
+        return await self._read(await self._get_key(user_id, firmware_id))
 
     async def upload_firmware(
         self,
         user_id: UUID,
         firmware_id: UUID,
-        firmware: BinaryIO,
+        firmware: UploadFile,
+        sha256: str | None = None,
+    ) -> FirmwareBlobInfo:
+        if sha256 is not None:
+            blob_info = await self.link_firmware(
+                user_id=user_id, firmware_id=firmware_id, sha256=sha256
+            )
+            if blob_info is not None:
+                return blob_info
+
+        temp_key = self._temp_key(firmware_id)
+        digest = await self._write_temp(temp_key, firmware)
+        blob_info = FirmwareBlobInfo(
+            size=digest.size,
+            etag=f'"{digest.hexdigest()}"',
+            sha256=digest.hexdigest(),
+        )
+        try:
+            if sha256 is not None and sha256 != blob_info.sha256:
+                raise HTTPException(
+                    status_code=http.HTTPStatus.BAD_REQUEST,
+                    detail="Firmware does not match the given SHA-256.",
+                )
+
+            await self._record_blob(digest)
+            await self._add_blob_ref(firmware_id, digest)
+            await self._make_ready(firmware_id)
+            await self._commit_temp(temp_key, self._blob_key(blob_info.sha256))
+            await self.db_session.commit()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+                await self._delete(temp_key)
+            raise
+
+        return blob_info
+
+    async def link_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        sha256: str,
+    ) -> FirmwareBlobInfo | None:
+        blob_size = await self.db_session.scalar(
+            update(FirmwareBlob)
+            # an unreferenced blob may already be gone from the storage
+            .where(FirmwareBlob.sha256 == sha256, FirmwareBlob.ref_count > 0)
+            .values(ref_count=FirmwareBlob.ref_count + 1)
+            .returning(FirmwareBlob.size)
+        )
+        if blob_size is None:
+            return None
+
+        await self.db_session.execute(
+            insert(FirmwareBlobRef).values(firmware_id=firmware_id, sha256=sha256)
+        )
+        await self._make_ready(firmware_id)
+        await self.db_session.commit()
+        return FirmwareBlobInfo(size=blob_size, etag=f'"{sha256}"', sha256=sha256)
+
+    async def delete_blob(self, sha256: str) -> None:
+        unreferenced_at = await self.db_session.scalar(
+            select(FirmwareBlob.unreferenced_at).where(
+                FirmwareBlob.sha256 == sha256, FirmwareBlob.ref_count == 0
+            )
+        )
+        if unreferenced_at is not None:
+            await self._delete_blob(sha256, unreferenced_at)
+
+    async def upload_delta(
+        self,
+        user_id: UUID,
+        base_firmware_id: UUID,
+        firmware_id: UUID,
+        delta: bytes,
+    ) -> None:
+        await self._write(self._delta_key(base_firmware_id, firmware_id), delta)
+
+    async def _lock_upload(
+        self, user_id: UUID, upload_id: UUID, read: bool = False
+    ) -> FirmwareUpload:
+        # parts hold a shared lock while they are written, completing and
+        # aborting wait for them with an exclusive one
+        upload = await self.db_session.scalar(
+            select(FirmwareUpload)
+            .where(FirmwareUpload.id == upload_id, FirmwareUpload.user_id == user_id)
+            .with_for_update(read=read)
+        )
+        if upload is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Upload not found.",
+            )
+
+        return upload
+
+    async def _upload_response(self, upload: FirmwareUpload) -> FirmwareUploadResponse:
+        parts = await self.db_session.scalars(
+            select(FirmwareUploadPart)
+            .where(FirmwareUploadPart.upload_id == upload.id)
+            .order_by(FirmwareUploadPart.part_number)
+        )
+        return FirmwareUploadResponse(
+            id=upload.id,
+            type_id=upload.type_id,
+            name=upload.name,
+            version=upload.version,
+            description=upload.description,
+            size=upload.size,
+            sha256=upload.sha256,
+            part_size=upload.part_size,
+            part_count=upload.part_count,
+            parts=[
+                FirmwareUploadPartResponse(
+                    part_number=part.part_number,
+                    offset=(part.part_number - 1) * upload.part_size,
+                    size=part.size,
+                    sha256=part.sha256,
+                )
+                for part in parts
+            ],
+            created_at=upload.created_at,
+        )
+
+    async def _fold_parts(
+        self, upload: FirmwareUpload, upload_digest: _UploadDigest
     ) -> None:
-        with open(f"./{firmware_id}.txt", "w") as f:
-            f.write(firmware.read().decode("utf-8"))
+        # feed the parts that follow the already hashed prefix, only parts
+        # that landed out of order or in another process are read back
+        part_sha256s = dict(
+            (
+                await self.db_session.execute(
+                    select(
+                        FirmwareUploadPart.part_number, FirmwareUploadPart.sha256
+                    ).where(FirmwareUploadPart.upload_id == upload.id)
+                )
+            )
+            .tuples()
+            .all()
+        )
+        # a hashed part may have been uploaded again since, in any process
+        if any(
+            part_sha256s.get(part_number) != sha256
+            for part_number, sha256 in enumerate(upload_digest.part_sha256s, 1)
+        ):
+            upload_digest.reset(self.manifest_chunk_size)
+
+        while (part_number := upload_digest.next_part) in part_sha256s:
+            offset = (part_number - 1) * upload.part_size
+            data = await self._read_part(
+                upload.id,
+                part_number,
+                offset,
+                min(upload.part_size, upload.size - offset),
+            )
+            if not await anyio.to_thread.run_sync(
+                upload_digest.update_checked, data, part_sha256s[part_number]
+            ):
+                break
+
+    async def create_upload(
+        self,
+        user_id: UUID,
+        request_body: InitiateFirmwareUploadRequestBody,
+        part_size: int,
+    ) -> FirmwareUploadResponse:
+        upload = FirmwareUpload(
+            id=uuid4(),
+            user_id=user_id,
+            type_id=request_body.type_id,
+            name=request_body.name,
+            version=request_body.version,
+            description=request_body.description,
+            size=request_body.size,
+            part_size=part_size,
+            sha256=request_body.sha256,
+        )
+        self.db_session.add(upload)
+        await self._create_upload(upload.id, upload.size)
+        await self.db_session.commit()
+        await self.db_session.refresh(upload)
+        _upload_digests.set(upload.id, _UploadDigest(self.manifest_chunk_size))
+        return await self._upload_response(upload)
+
+    async def get_upload(
+        self, user_id: UUID, upload_id: UUID
+    ) -> FirmwareUploadResponse:
+        upload = await self.db_session.scalar(
+            select(FirmwareUpload).where(
+                FirmwareUpload.id == upload_id, FirmwareUpload.user_id == user_id
+            )
+        )
+        if upload is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Upload not found.",
+            )
+
+        return await self._upload_response(upload)
+
+    async def upload_part(
+        self,
+        user_id: UUID,
+        upload_id: UUID,
+        part_number: int,
+        data: bytes,
+    ) -> FirmwareUploadPartResponse:
+        sha256 = (await anyio.to_thread.run_sync(hashlib.sha256, data)).hexdigest()
+        try:
+            upload = await self._lock_upload(user_id, upload_id, read=True)
+            offset = (part_number - 1) * upload.part_size
+            await self._write_part(upload_id, part_number, offset, data)
+            await self.db_session.execute(
+                insert(FirmwareUploadPart)
+                .values(
+                    upload_id=upload_id,
+                    part_number=part_number,
+                    size=len(data),
+                    sha256=sha256,
+                )
+                .on_conflict_do_update(
+                    index_elements=[
+                        FirmwareUploadPart.upload_id,
+                        FirmwareUploadPart.part_number,
+                    ],
+                    set_={"size": len(data), "sha256": sha256},
+                )
+            )
+            await self.db_session.commit()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+            raise
+
+        # only committed parts are hashed, a failed commit leaves the digest
+        # as it was
+        upload_digest = _upload_digests.get(upload_id)
+        if upload_digest is not None:
+            async with upload_digest.lock:
+                await self._advance_digest(
+                    upload, upload_digest, part_number, data, sha256
+                )
+
+        return FirmwareUploadPartResponse(
+            part_number=part_number, offset=offset, size=len(data), sha256=sha256
+        )
+
+    async def _advance_digest(
+        self,
+        upload: FirmwareUpload,
+        upload_digest: _UploadDigest,
+        part_number: int,
+        data: bytes,
+        sha256: str,
+    ) -> None:
+        # a replaced part that was already hashed is caught by `_fold_parts`
+        try:
+            if part_number == upload_digest.next_part:
+                await anyio.to_thread.run_sync(upload_digest.update, data, sha256)
+            await self._fold_parts(upload, upload_digest)
+        except BaseException:
+            _upload_digests.pop(upload.id)
+            raise
+
+    async def complete_upload(
+        self, user_id: UUID, upload_id: UUID, firmware_id: UUID
+    ) -> FirmwareBlobInfo:
+        try:
+            upload = await self._lock_upload(user_id, upload_id)
+            size, part_count = upload.size, upload.part_count
+
+            upload_digest = _upload_digests.get(upload_id) or _UploadDigest(
+                self.manifest_chunk_size
+            )
+            await self._fold_parts(upload, upload_digest)
+            _upload_digests.set(upload_id, upload_digest)
+            if upload_digest.next_part <= part_count:
+                raise HTTPException(
+                    status_code=http.HTTPStatus.CONFLICT,
+                    detail="Not all parts of the upload have been received.",
+                )
+
+            sha256 = upload_digest.digest.hexdigest()
+            if upload.sha256 is not None and upload.sha256 != sha256:
+                raise HTTPException(
+                    status_code=http.HTTPStatus.BAD_REQUEST,
+                    detail="Firmware does not match the given SHA-256.",
+                )
+
+            await self._record_blob(upload_digest.digest)
+            await self._add_blob_ref(firmware_id, upload_digest.digest)
+            await self._make_ready(firmware_id)
+            await self._complete_upload(upload_id, part_count, self._blob_key(sha256))
+            await self.db_session.delete(upload)
+            await self.db_session.commit()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+            raise
+
+        _upload_digests.pop(upload_id)
+        return FirmwareBlobInfo(size=size, etag=f'"{sha256}"', sha256=sha256)
+
+    async def abort_upload(self, user_id: UUID, upload_id: UUID) -> None:
+        upload = await self._lock_upload(user_id, upload_id)
+        await self._abort_upload(upload_id, upload.part_count)
+        await self.db_session.delete(upload)
+        await self.db_session.commit()
+        _upload_digests.pop(upload_id)
+
+    async def delete_abandoned_uploads(
+        self,
+        pending_expire_in_seconds: int,
+        upload_expire_in_seconds: int,
+        limit: int,
+    ) -> int:
+        # the rows stay locked until the storage is cleaned, a failure keeps
+        # them for the next round
+        firmware_ids = list(
+            await self.db_session.scalars(
+                select(FirmwareInfo.id)
+                .where(
+                    FirmwareInfo.status == FirmwareStatus.PENDING,
+                    FirmwareInfo.created_at
+                    < func.now() - timedelta(seconds=pending_expire_in_seconds),
+                )
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        uploads = list(
+            await self.db_session.scalars(
+                select(FirmwareUpload)
+                .where(
+                    FirmwareUpload.created_at
+                    < func.now() - timedelta(seconds=upload_expire_in_seconds)
+                )
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        blob_shas = list(
+            await self.db_session.scalars(
+                select(FirmwareBlob.sha256)
+                .where(
+                    FirmwareBlob.ref_count == 0,
+                    FirmwareBlob.unreferenced_at
+                    < func.now() - timedelta(seconds=pending_expire_in_seconds),
+                )
+                .limit(limit)
+                .with_for_update(skip_locked=True)
+            )
+        )
+        if not firmware_ids and not uploads and not blob_shas:
+            await self.db_session.rollback()
+            return 0
+
+        try:
+            await self._delete_temps(
+                [self._temp_key(firmware_id) for firmware_id in firmware_ids]
+            )
+            for upload in uploads:
+                await self._abort_upload(upload.id, upload.part_count)
+            for sha256 in blob_shas:
+                await self._delete(self._blob_key(sha256))
+
+            await self.db_session.execute(
+                delete(FirmwareInfo).where(FirmwareInfo.id.in_(firmware_ids))
+            )
+            await self.db_session.execute(
+                delete(FirmwareUpload).where(
+                    FirmwareUpload.id.in_([upload.id for upload in uploads])
+                )
+            )
+            await self.db_session.execute(
+                delete(FirmwareBlob).where(FirmwareBlob.sha256.in_(blob_shas))
+            )
+            await self.db_session.commit()
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.db_session.rollback()
+            raise
+
+        for upload in uploads:
+            _upload_digests.pop(upload.id)
+        return len(firmware_ids) + len(uploads) + len(blob_shas)
+
+
+@releases_connection
+class FirmwareRepo(BaseFirmwareRepo):
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        storage_dir: Path,
+        chunk_size: int,
+        manifest_chunk_size: int,
+        public_url: str | None = None,
+        secure_link_secret: str | None = None,
+    ) -> None:
+        super().__init__(
+            db_session=db_session,
+            chunk_size=chunk_size,
+            manifest_chunk_size=manifest_chunk_size,
+        )
+        self.storage_dir = storage_dir
+        self.public_url = public_url
+        self.secure_link_secret = secure_link_secret
+
+    async def get_internal_path(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        return await self._get_key(user_id, firmware_id, base_firmware_id)
+
+    async def get_download_url(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        expire_in_seconds: int,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        # the URL is verified by nginx with
+        # secure_link_md5 "$secure_link_expires$uri <secret>";
+        if self.public_url is None or self.secure_link_secret is None:
+            raise RuntimeError("Firmware public URL has not been defined.")
+
+        internal_path = await self.get_internal_path(
+            user_id, firmware_id, base_firmware_id
+        )
+        url = f"{self.public_url.rstrip('/')}/{internal_path}"
+        expires = int(time.time()) + expire_in_seconds
+        signature = hashlib.md5(
+            f"{expires}{urlsplit(url).path} {self.secure_link_secret}".encode()
+        ).digest()
+        token = base64.urlsafe_b64encode(signature).rstrip(b"=").decode()
+        return f"{url}?md5={token}&expires={expires}"
+
+    async def _stat(self, key: str) -> FirmwareBlobInfo:
+        try:
+            stat = await anyio.Path(self.storage_dir / key).stat()
+        except FileNotFoundError:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware not found.",
+            )
+
+        return FirmwareBlobInfo(
+            size=stat.st_size,
+            etag=f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+        )
+
+    async def _stream(
+        self, key: str, start: int, end: int | None
+    ) -> AsyncIterator[bytes]:
+        async with await anyio.open_file(self.storage_dir / key, "rb") as f:
+            await f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                size = (
+                    self.chunk_size
+                    if remaining is None
+                    else min(self.chunk_size, remaining)
+                )
+                chunk = await f.read(size)
+                if not chunk:
+                    break
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    async def _read(self, key: str) -> bytes:
+        return await anyio.Path(self.storage_dir / key).read_bytes()
+
+    async def _write(self, key: str, data: bytes) -> None:
+        path = self.storage_dir / key
+        await anyio.Path(path.parent).mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f".{path.name}.{uuid4().hex}.tmp")
+        try:
+            await anyio.Path(tmp_path).write_bytes(data)
+            await anyio.to_thread.run_sync(os.replace, tmp_path, path)
+        except BaseException:
+            await anyio.Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+    async def _write_temp(self, temp_key: str, firmware: UploadFile) -> ChunkedDigest:
+        tmp_path = self.storage_dir / temp_key
+        await anyio.Path(tmp_path.parent).mkdir(parents=True, exist_ok=True)
+        digest = ChunkedDigest(self.manifest_chunk_size)
+
+        try:
+            f = await anyio.to_thread.run_sync(open, tmp_path, "wb")
+            try:
+                while chunk := await firmware.read(self.chunk_size):
+                    await anyio.to_thread.run_sync(_write_chunk, f, digest, chunk)
+                await anyio.to_thread.run_sync(_fsync, f)
+            finally:
+                await anyio.to_thread.run_sync(f.close)
+        except BaseException:
+            await anyio.Path(tmp_path).unlink(missing_ok=True)
+            raise
+
+        return digest
+
+    async def _commit_temp(self, temp_key: str, key: str) -> None:
+        # replacing an identical blob is harmless, readers keep the old inode
+        path = self.storage_dir / key
+        await anyio.Path(path.parent).mkdir(parents=True, exist_ok=True)
+        await anyio.to_thread.run_sync(os.replace, self.storage_dir / temp_key, path)
+
+    async def _delete(self, key: str) -> None:
+        await anyio.Path(self.storage_dir / key).unlink(missing_ok=True)
+
+    async def _delete_temps(self, temp_keys: list[str]) -> None:
+        for temp_key in temp_keys:
+            await self._delete(temp_key)
+
+    async def _create_upload(self, upload_id: UUID, size: int) -> None:
+        # parts are written in place into a sparse file of the final size,
+        # completing the upload is a rename
+        path = self.storage_dir / self._upload_key(upload_id)
+        await anyio.Path(path.parent).mkdir(parents=True, exist_ok=True)
+        async with await anyio.open_file(path, "wb") as f:
+            await f.truncate(size)
+
+    async def _write_part(
+        self, upload_id: UUID, part_number: int, offset: int, data: bytes
+    ) -> None:
+        await anyio.to_thread.run_sync(
+            _write_at, self.storage_dir / self._upload_key(upload_id), offset, data
+        )
+
+    async def _read_part(
+        self, upload_id: UUID, part_number: int, offset: int, size: int
+    ) -> bytes:
+        return await anyio.to_thread.run_sync(
+            _read_at, self.storage_dir / self._upload_key(upload_id), offset, size
+        )
+
+    async def _complete_upload(
+        self, upload_id: UUID, part_count: int, key: str
+    ) -> None:
+        await self._commit_temp(self._upload_key(upload_id), key)
+
+    async def _abort_upload(self, upload_id: UUID, part_count: int) -> None:
+        await self._delete(self._upload_key(upload_id))
+
+
+@releases_connection
+class S3FirmwareRepo(BaseFirmwareRepo):
+    def __init__(
+        self,
+        db_session: AsyncSession,
+        s3_client: AioBaseClient,
+        bucket: str,
+        chunk_size: int,
+        manifest_chunk_size: int,
+        part_size: int,
+        concurrency: int,
+    ) -> None:
+        super().__init__(
+            db_session=db_session,
+            chunk_size=chunk_size,
+            manifest_chunk_size=manifest_chunk_size,
+        )
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.part_size = part_size
+        self.concurrency = concurrency
+
+    async def get_internal_path(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        key = await self._get_key(user_id, firmware_id, base_firmware_id)
+        return f"{self.bucket}/{key}"
+
+    async def get_download_url(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        expire_in_seconds: int,
+        base_firmware_id: UUID | None = None,
+    ) -> str:
+        return await self.s3_client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": await self._get_key(user_id, firmware_id, base_firmware_id),
+            },
+            ExpiresIn=expire_in_seconds,
+        )
+
+    async def _stat(self, key: str) -> FirmwareBlobInfo:
+        try:
+            response = await self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                raise HTTPException(
+                    status_code=http.HTTPStatus.NOT_FOUND,
+                    detail="Firmware not found.",
+                )
+            raise
+
+        return FirmwareBlobInfo(
+            size=response["ContentLength"],
+            etag=response["ETag"],
+        )
+
+    async def _stream(
+        self, key: str, start: int, end: int | None
+    ) -> AsyncIterator[bytes]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if start or end is not None:
+            params["Range"] = f"bytes={start}-{'' if end is None else end}"
+
+        response = await self.s3_client.get_object(**params)
+        async with response["Body"] as body:
+            async for chunk in body.iter_chunks(self.chunk_size):
+                yield chunk
+
+    async def _read(self, key: str) -> bytes:
+        response = await self.s3_client.get_object(Bucket=self.bucket, Key=key)
+        async with response["Body"] as body:
+            return await body.read()
+
+    async def _write(self, key: str, data: bytes) -> None:
+        await self.s3_client.put_object(Bucket=self.bucket, Key=key, Body=data)
+
+    async def _write_temp(self, temp_key: str, firmware: UploadFile) -> ChunkedDigest:
+        digest = ChunkedDigest(self.manifest_chunk_size)
+
+        chunk = await firmware.read(self.part_size)
+        await anyio.to_thread.run_sync(digest.update, chunk)
+
+        if digest.size < self.part_size:
+            await self._write(temp_key, chunk)
+            return digest
+
+        upload = await self.s3_client.create_multipart_upload(
+            Bucket=self.bucket, Key=temp_key
+        )
+        upload_id = upload["UploadId"]
+        etags: dict[int, str] = {}
+        # every in-flight part holds a permit, so at most `concurrency`
+        # parts are buffered in memory at once
+        permits = anyio.Semaphore(self.concurrency)
+
+        async def _upload_part(part_number: int, body: bytes) -> None:
+            try:
+                response = await self.s3_client.upload_part(
+                    Bucket=self.bucket,
+                    Key=temp_key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body,
+                )
+                etags[part_number] = response["ETag"]
+            finally:
+                permits.release()
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                part_number = 1
+                while chunk:
+                    await permits.acquire()
+                    task_group.start_soon(_upload_part, part_number, chunk)
+                    chunk = await firmware.read(self.part_size)
+                    await anyio.to_thread.run_sync(digest.update, chunk)
+                    part_number += 1
+
+            await self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=temp_key,
+                UploadId=upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": etag, "PartNumber": part_number}
+                        for part_number, etag in sorted(etags.items())
+                    ]
+                },
+            )
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.s3_client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=temp_key, UploadId=upload_id
+                )
+            raise
+
+        return digest
+
+    async def _commit_temp(self, temp_key: str, key: str) -> None:
+        try:
+            await self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            await self.s3_client.copy_object(
+                Bucket=self.bucket,
+                Key=key,
+                CopySource={"Bucket": self.bucket, "Key": temp_key},
+            )
+
+        await self._delete(temp_key)
+
+    async def _delete(self, key: str) -> None:
+        await self.s3_client.delete_object(Bucket=self.bucket, Key=key)
+
+    async def _delete_many(self, keys: list[str]) -> None:
+        # DeleteObjects takes at most 1000 keys per request
+        for i in range(0, len(keys), 1000):
+            await self.s3_client.delete_objects(
+                Bucket=self.bucket,
+                Delete={
+                    "Objects": [{"Key": key} for key in keys[i : i + 1000]],
+                    "Quiet": True,
+                },
+            )
+
+    async def _delete_temps(self, temp_keys: list[str]) -> None:
+        if not temp_keys:
+            return
+
+        await self._delete_many(temp_keys)
+
+        # a process that died while streaming a large image left its
+        # multipart upload behind
+        pending = set(temp_keys)
+        paginator = self.s3_client.get_paginator("list_multipart_uploads")
+        async for page in paginator.paginate(Bucket=self.bucket, Prefix="tmp/"):
+            for upload in page.get("Uploads", []):
+                if upload["Key"] in pending:
+                    await self.s3_client.abort_multipart_upload(
+                        Bucket=self.bucket,
+                        Key=upload["Key"],
+                        UploadId=upload["UploadId"],
+                    )
+
+    def _part_key(self, upload_id: UUID, part_number: int) -> str:
+        return f"{self._upload_key(upload_id)}/{part_number:05d}"
+
+    async def _create_upload(self, upload_id: UUID, size: int) -> None:
+        # parts are separate objects until the upload is completed, a pending
+        # multipart upload could not be read back to hash late parts
+        return None
+
+    async def _write_part(
+        self, upload_id: UUID, part_number: int, offset: int, data: bytes
+    ) -> None:
+        await self._write(self._part_key(upload_id, part_number), data)
+
+    async def _read_part(
+        self, upload_id: UUID, part_number: int, offset: int, size: int
+    ) -> bytes:
+        return await self._read(self._part_key(upload_id, part_number))
+
+    async def _complete_upload(
+        self, upload_id: UUID, part_count: int, key: str
+    ) -> None:
+        try:
+            await self.s3_client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] not in ("404", "NoSuchKey"):
+                raise
+            await self._copy_parts(upload_id, part_count, key)
+
+        await self._abort_upload(upload_id, part_count)
+
+    async def _copy_parts(self, upload_id: UUID, part_count: int, key: str) -> None:
+        if part_count == 1:
+            await self.s3_client.copy_object(
+                Bucket=self.bucket,
+                Key=key,
+                CopySource={"Bucket": self.bucket, "Key": self._part_key(upload_id, 1)},
+            )
+            return
+
+        # the parts are concatenated on the S3 side, no bytes pass through us
+        upload = await self.s3_client.create_multipart_upload(
+            Bucket=self.bucket, Key=key
+        )
+        multipart_upload_id = upload["UploadId"]
+        etags: dict[int, str] = {}
+        limiter = anyio.CapacityLimiter(self.concurrency)
+
+        async def _copy_part(part_number: int) -> None:
+            async with limiter:
+                response = await self.s3_client.upload_part_copy(
+                    Bucket=self.bucket,
+                    Key=key,
+                    UploadId=multipart_upload_id,
+                    PartNumber=part_number,
+                    CopySource={
+                        "Bucket": self.bucket,
+                        "Key": self._part_key(upload_id, part_number),
+                    },
+                )
+                etags[part_number] = response["CopyPartResult"]["ETag"]
+
+        try:
+            async with anyio.create_task_group() as task_group:
+                for part_number in range(1, part_count + 1):
+                    task_group.start_soon(_copy_part, part_number)
+
+            await self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=multipart_upload_id,
+                MultipartUpload={
+                    "Parts": [
+                        {"ETag": etag, "PartNumber": part_number}
+                        for part_number, etag in sorted(etags.items())
+                    ]
+                },
+            )
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.s3_client.abort_multipart_upload(
+                    Bucket=self.bucket, Key=key, UploadId=multipart_upload_id
+                )
+            raise
+
+    async def _abort_upload(self, upload_id: UUID, part_count: int) -> None:
+        await self._delete_many(
+            [
+                self._part_key(upload_id, part_number)
+                for part_number in range(1, part_count + 1)
+            ]
+        )
+
+
+def _write_chunk(f: BinaryIO, digest: ChunkedDigest, chunk: bytes) -> None:
+    digest.update(chunk)
+    f.write(chunk)
+
+
+def _fsync(f: BinaryIO) -> None:
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def _write_at(path: Path, offset: int, data: bytes) -> None:
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        view = memoryview(data)
+        while view:
+            written = os.pwrite(fd, view, offset)
+            view = view[written:]
+            offset += written
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _read_at(path: Path, offset: int, size: int) -> bytes:
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.pread(fd, size, offset)
+    finally:
+        os.close(fd)
+
 
+async def get_firmware_repo(db_session: DBSessionType) -> IFirmwareRepo:
+    if settings.firmware_storage_backend == FirmwareStorageBackend.S3:
+        return S3FirmwareRepo(
+            db_session=db_session,
+            s3_client=await get_s3_client(),
+            bucket=settings.s3_bucket,
+            chunk_size=settings.firmware_chunk_size,
+            manifest_chunk_size=settings.firmware_manifest_chunk_size,
+            part_size=settings.s3_multipart_part_size,
+            concurrency=settings.s3_multipart_concurrency,
+        )
 
-def get_firmware_repo() -> IFirmwareRepo:
-    return FirmwareRepo()
+    return FirmwareRepo(
+        db_session=db_session,
+        storage_dir=settings.firmware_storage_dir,
+        chunk_size=settings.firmware_chunk_size,
+        manifest_chunk_size=settings.firmware_manifest_chunk_size,
+        public_url=settings.firmware_public_url,
+        secure_link_secret=settings.firmware_secure_link_secret,
+    )
 
 
 FirmwareRepoType = Annotated[IFirmwareRepo, Depends(get_firmware_repo)]
@@ -6,6 +6,9 @@ from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, ConfigDict, Field
 
 
+SHA256_PATTERN = r"^[0-9a-f]{64}$"
+
+
 class BaseFirmwareRequestSchema(BaseModel):
     ...
 
@@ -14,14 +17,39 @@ class UploadFirmwareRequestBody:
     def __init__(
         self,
         firmware: UploadFile,
+        type_id: UUID = Form(),
         name: str = Form(),
         version: str = Form(),
         description: str = Form(),
+        sha256: str | None = Form(default=None, pattern=SHA256_PATTERN),
     ):
         self.firmware = firmware
+        self.type_id = type_id
         self.name = name
         self.version = version
         self.description = description
+        self.sha256 = sha256
+
+
+class LinkFirmwareRequestBody(BaseFirmwareRequestSchema):
+    type_id: UUID
+
+    name: str
+    version: str
+    description: str
+
+    sha256: str = Field(pattern=SHA256_PATTERN)
+
+
+class InitiateFirmwareUploadRequestBody(BaseFirmwareRequestSchema):
+    type_id: UUID
+
+    name: str
+    version: str
+    description: str
+
+    size: int = Field(gt=0)
+    sha256: str | None = Field(default=None, pattern=SHA256_PATTERN)
 
 
 class BaseFirmwareResponseSchema(BaseModel):
@@ -38,5 +66,55 @@ class UploadFirmwareResponse(BaseFirmwareResponseSchema):
     updated_at: datetime = Field(alias="updatedAt")
 
 
+class FirmwareUploadPartResponse(BaseFirmwareResponseSchema):
+    part_number: int = Field(alias="partNumber")
+    offset: int
+    size: int
+    sha256: str
+
+
+class FirmwareUploadResponse(BaseFirmwareResponseSchema):
+    id: UUID
+    type_id: UUID = Field(alias="typeId")
+    name: str
+    version: str
+    description: str
+
+    size: int
+    sha256: str | None = Field(default=None)
+    part_size: int = Field(alias="partSize")
+    part_count: int = Field(alias="partCount")
+    parts: list[FirmwareUploadPartResponse]
+
+    created_at: datetime = Field(alias="createdAt")
+
+    def get_part_size(self, part_number: int) -> int:
+        return min(self.part_size, self.size - (part_number - 1) * self.part_size)
+
+
+class FirmwareBlobInfo(BaseModel):
+    size: int
+    etag: str
+    sha256: str | None = Field(default=None)
+
+
+class FirmwareIntegrity(BaseModel):
+    sha256: str
+    size: int
+    chunk_size: int
+    # None for blobs stored before manifests were recorded
+    chunk_hashes: bytes | None = Field(default=None)
+    storage_etag: str
+    verified_etag: str | None = Field(default=None)
+
+
+class VerifyFirmwareResponse(BaseFirmwareResponseSchema):
+    sha256: str
+    valid: bool
+    # 0 when the blob is unchanged since its last successful audit
+    checked_chunks: int = Field(alias="checkedChunks")
+    corrupted_chunks: list[int] = Field(alias="corruptedChunks")
+
+
 class DownloadFirmwareResponse(StreamingResponse):
     ...
@@ -1,66 +1,594 @@
+import asyncio
+import http
+import logging
+
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from concurrent.futures import Executor
 from typing import Annotated
 from uuid import UUID
 
-from calypte_api.firmware.repository import FirmwareRepoType, IFirmwareRepo
-from calypte_api.firmware.schemas import DownloadFirmwareResponse
+from calypte_api.common import databases
+from calypte_api.common.executors import get_process_pool
+from calypte_api.common.http_ranges import etag_matches, parse_range_header
+from calypte_api.common.settings import FirmwareDownloadMode, get_settings
+from calypte_api.firmware.manifests import ChunkedDigest, corrupted_chunks
+from calypte_api.firmware.repository import (
+    FirmwareRepoType,
+    IFirmwareRepo,
+    get_firmware_repo,
+)
+from calypte_api.firmware.schemas import (
+    DownloadFirmwareResponse,
+    FirmwareBlobInfo,
+    FirmwareUploadPartResponse,
+    FirmwareUploadResponse,
+    InitiateFirmwareUploadRequestBody,
+    VerifyFirmwareResponse,
+)
+
+import anyio
+import bsdiff4
+
+from botocore.exceptions import BotoCoreError, ClientError
+from fastapi import Depends, HTTPException, Response, UploadFile
+from fastapi.responses import RedirectResponse
+from redis.exceptions import RedisError
+from sqlalchemy.exc import SQLAlchemyError
+
+
+settings = get_settings()
 
-from fastapi import Depends
+logger = logging.getLogger(__name__)
+logger.setLevel(settings.logging_level)
+
+# failures of the database or the storage the reaper retries in the next round
+_REAPER_RETRIED_ERRORS = (
+    SQLAlchemyError,
+    OSError,
+    BotoCoreError,
+    ClientError,
+    RedisError,
+)
 
 
 class IFirmwareService(ABC):
     @abstractmethod
     async def get_firmware_by_id(
-        self, user_id: UUID, firmware_id: UUID
-    ) -> DownloadFirmwareResponse:
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        if_none_match: str | None = None,
+        base_firmware_id: UUID | None = None,
+    ) -> Response:
         """
-        Get firmware by id
+        Get firmware by id, either streamed or as a redirect to be served
+        outside of the API, depending on the download mode
 
         Args:
             firmware_id (UUID): firmware id
             user_id (UUID): user id
+            range_header (str | None): value of the Range header
+            if_range (str | None): value of the If-Range header
+            if_none_match (str | None): value of the If-None-Match header
+            base_firmware_id (UUID | None): firmware installed on the device,
+                a delta from it is served when one has been generated
 
         """
 
     @abstractmethod
     async def upload_firmware(
-        self, user_id: UUID, firmware_id: UUID, firmware: bytes
-    ) -> None:
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        firmware: UploadFile,
+        sha256: str | None = None,
+    ) -> FirmwareBlobInfo:
         """
         Upload firmware
 
         Args:
             user_id (UUID): user id
             firmware_id (UUID): firmware id
-            firmware (bytes): firmware
+            firmware (UploadFile): firmware
+            sha256 (str | None): SHA-256 announced by the client
+
+        returns:
+            FirmwareBlobInfo: size and SHA-256 of the stored firmware
+        """
+
+    @abstractmethod
+    async def link_firmware(
+        self, user_id: UUID, firmware_id: UUID, sha256: str
+    ) -> FirmwareBlobInfo:
+        """
+        Reference an already stored image from the firmware
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            sha256 (str): SHA-256 of the image
+
+        Raises:
+            HTTPException: 404 if no image with this SHA-256 is stored
+
+        returns:
+            FirmwareBlobInfo: size and SHA-256 of the stored firmware
+        """
+
+    @abstractmethod
+    async def delete_blob(self, sha256: str) -> None:
+        """
+        Delete an image once no firmware references it
+
+        Args:
+            sha256 (str): SHA-256 of the image
+        """
+
+    @abstractmethod
+    async def create_upload(
+        self, user_id: UUID, request_body: InitiateFirmwareUploadRequestBody
+    ) -> FirmwareUploadResponse:
+        """
+        Start a resumable upload
+
+        Args:
+            user_id (UUID): user id
+            request_body (InitiateFirmwareUploadRequestBody): firmware info,
+                size and optionally SHA-256 of the image
+
+        Raises:
+            HTTPException: 413 if the image is larger than allowed
+        """
+
+    @abstractmethod
+    async def get_upload(
+        self, user_id: UUID, upload_id: UUID, completed: bool = False
+    ) -> FirmwareUploadResponse:
+        """
+        Get a resumable upload with the parts received so far
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+            completed (bool): require all parts to have been received
+
+        Raises:
+            HTTPException: 404 if the upload does not exist,
+                409 if a completed upload is required and parts are missing
+        """
+
+    @abstractmethod
+    async def upload_part(
+        self,
+        user_id: UUID,
+        upload_id: UUID,
+        part_number: int,
+        body: AsyncIterator[bytes],
+    ) -> FirmwareUploadPartResponse:
+        """
+        Upload a part of a resumable upload
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+            part_number (int): 1-based part number
+            body (AsyncIterator[bytes]): request body
+
+        Raises:
+            HTTPException: 400 if the part number or the part size is wrong
+        """
+
+    @abstractmethod
+    async def complete_upload(
+        self, user_id: UUID, upload_id: UUID, firmware_id: UUID
+    ) -> FirmwareBlobInfo:
+        """
+        Store the uploaded parts as the firmware image
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+            firmware_id (UUID): firmware id
+
+        returns:
+            FirmwareBlobInfo: size and SHA-256 of the stored firmware
+        """
+
+    @abstractmethod
+    async def abort_upload(self, user_id: UUID, upload_id: UUID) -> None:
+        """
+        Abort a resumable upload
+
+        Args:
+            user_id (UUID): user id
+            upload_id (UUID): upload id
+        """
+
+    @abstractmethod
+    async def generate_delta(
+        self, user_id: UUID, base_firmware_id: UUID, firmware_id: UUID
+    ) -> None:
+        """
+        Generate and store a bsdiff delta between two firmware images
+
+        Args:
+            user_id (UUID): user id
+            base_firmware_id (UUID): firmware the delta applies to
+            firmware_id (UUID): firmware the delta produces
+        """
+
+    @abstractmethod
+    async def verify_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> VerifyFirmwareResponse:
+        """
+        Check the stored image of the firmware against its chunk hashes
+
+        The image is read only if its blob changed in storage since it last
+        passed, the chunks that do not match are reported by index. An image
+        stored before manifests were recorded is checked against its SHA-256
+        and gets its manifest when it matches.
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        returns:
+            VerifyFirmwareResponse: result of the audit
         """
 
 
 class FirmwareService(IFirmwareService):
-    def __init__(self, firmware_repo: IFirmwareRepo):
+    def __init__(
+        self,
+        firmware_repo: IFirmwareRepo,
+        download_mode: FirmwareDownloadMode = FirmwareDownloadMode.STREAM,
+        download_url_expire_in_seconds: int = 300,
+        accel_redirect_location: str = "/protected/firmware",
+        process_pool: Executor | None = None,
+        delta_max_size: int = 64 * 1024 * 1024,
+        upload_part_size: int = 8 * 1024 * 1024,
+        upload_max_size: int = 4 * 1024 * 1024 * 1024,
+    ):
         self.firmware_repo = firmware_repo
+        self.download_mode = download_mode
+        self.download_url_expire_in_seconds = download_url_expire_in_seconds
+        self.accel_redirect_location = accel_redirect_location
+        self.process_pool = process_pool
+        self.delta_max_size = delta_max_size
+        self.upload_part_size = upload_part_size
+        self.upload_max_size = upload_max_size
 
     async def get_firmware_by_id(
-        self, user_id: UUID, firmware_id: UUID
-    ) -> DownloadFirmwareResponse:
-        firmware_stream = self.firmware_repo.get_firmware_by_id(
-            user_id=user_id, firmware_id=firmware_id
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        range_header: str | None = None,
+        if_range: str | None = None,
+        if_none_match: str | None = None,
+        base_firmware_id: UUID | None = None,
+    ) -> Response:
+        firmware_info = None
+        headers = {}
+        if base_firmware_id is not None:
+            try:
+                firmware_info = await self.firmware_repo.get_firmware_info(
+                    user_id=user_id,
+                    firmware_id=firmware_id,
+                    base_firmware_id=base_firmware_id,
+                )
+                headers["X-Firmware-Delta-Base"] = str(base_firmware_id)
+            except HTTPException as e:
+                if e.status_code != http.HTTPStatus.NOT_FOUND:
+                    raise
+                base_firmware_id = None
+
+        if self.download_mode == FirmwareDownloadMode.REDIRECT:
+            download_url = await self.firmware_repo.get_download_url(
+                user_id=user_id,
+                firmware_id=firmware_id,
+                expire_in_seconds=self.download_url_expire_in_seconds,
+                base_firmware_id=base_firmware_id,
+            )
+            headers["Cache-Control"] = "no-store"
+            return RedirectResponse(
+                download_url,
+                status_code=http.HTTPStatus.FOUND,
+                headers=headers,
+            )
+
+        if self.download_mode == FirmwareDownloadMode.ACCEL:
+            internal_path = await self.firmware_repo.get_internal_path(
+                user_id=user_id,
+                firmware_id=firmware_id,
+                base_firmware_id=base_firmware_id,
+            )
+            headers["X-Accel-Redirect"] = (
+                f"{self.accel_redirect_location.rstrip('/')}/{internal_path}"
+            )
+            return Response(headers=headers)
+
+        if firmware_info is None:
+            firmware_info = await self.firmware_repo.get_firmware_info(
+                user_id=user_id, firmware_id=firmware_id
+            )
+        headers["Accept-Ranges"] = "bytes"
+        headers["ETag"] = firmware_info.etag
+
+        if etag_matches(if_none_match, firmware_info.etag):
+            return Response(status_code=http.HTTPStatus.NOT_MODIFIED, headers=headers)
+
+        byte_range = None
+        if if_range is None or if_range.strip() == firmware_info.etag:
+            byte_range = parse_range_header(range_header, firmware_info.size)
+
+        if byte_range is None:
+            headers["Content-Length"] = str(firmware_info.size)
+            return DownloadFirmwareResponse(
+                self.firmware_repo.get_firmware_by_id(
+                    user_id=user_id,
+                    firmware_id=firmware_id,
+                    base_firmware_id=base_firmware_id,
+                ),
+                headers=headers,
+                media_type="application/octet-stream",
+            )
+
+        headers["Content-Length"] = str(byte_range.length)
+        headers["Content-Range"] = byte_range.content_range(firmware_info.size)
+        return DownloadFirmwareResponse(
+            self.firmware_repo.get_firmware_by_id(
+                user_id=user_id,
+                firmware_id=firmware_id,
+                start=byte_range.start,
+                end=byte_range.end,
+                base_firmware_id=base_firmware_id,
+            ),
+            status_code=http.HTTPStatus.PARTIAL_CONTENT,
+            headers=headers,
+            media_type="application/octet-stream",
         )
-        return DownloadFirmwareResponse(firmware_stream)
 
     async def upload_firmware(
         self,
         user_id: UUID,
         firmware_id: UUID,
-        firmware: bytes,
+        firmware: UploadFile,
+        sha256: str | None = None,
+    ) -> FirmwareBlobInfo:
+        return await self.firmware_repo.upload_firmware(
+            user_id=user_id,
+            firmware_id=firmware_id,
+            firmware=firmware,
+            sha256=sha256,
+        )
+
+    async def link_firmware(
+        self, user_id: UUID, firmware_id: UUID, sha256: str
+    ) -> FirmwareBlobInfo:
+        blob_info = await self.firmware_repo.link_firmware(
+            user_id=user_id, firmware_id=firmware_id, sha256=sha256
+        )
+        if blob_info is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware with the given SHA-256 has not been uploaded.",
+            )
+
+        return blob_info
+
+    async def delete_blob(self, sha256: str) -> None:
+        await self.firmware_repo.delete_blob(sha256=sha256)
+
+    async def create_upload(
+        self, user_id: UUID, request_body: InitiateFirmwareUploadRequestBody
+    ) -> FirmwareUploadResponse:
+        if request_body.size > self.upload_max_size:
+            raise HTTPException(
+                status_code=http.HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                detail=(
+                    f"Firmware must not be larger than {self.upload_max_size} bytes."
+                ),
+            )
+
+        return await self.firmware_repo.create_upload(
+            user_id=user_id,
+            request_body=request_body,
+            part_size=self.upload_part_size,
+        )
+
+    async def get_upload(
+        self, user_id: UUID, upload_id: UUID, completed: bool = False
+    ) -> FirmwareUploadResponse:
+        upload = await self.firmware_repo.get_upload(
+            user_id=user_id, upload_id=upload_id
+        )
+        if completed and len(upload.parts) < upload.part_count:
+            raise HTTPException(
+                status_code=http.HTTPStatus.CONFLICT,
+                detail="Not all parts of the upload have been received.",
+            )
+
+        return upload
+
+    async def upload_part(
+        self,
+        user_id: UUID,
+        upload_id: UUID,
+        part_number: int,
+        body: AsyncIterator[bytes],
+    ) -> FirmwareUploadPartResponse:
+        upload = await self.firmware_repo.get_upload(
+            user_id=user_id, upload_id=upload_id
+        )
+        if part_number > upload.part_count:
+            raise HTTPException(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                detail=f"Upload has only {upload.part_count} parts.",
+            )
+
+        # a part is at most `part_size` bytes, it is hashed and written
+        # from memory in one go
+        part_size = upload.get_part_size(part_number)
+        data = bytearray()
+        async for chunk in body:
+            data += chunk
+            if len(data) > part_size:
+                break
+        if len(data) != part_size:
+            raise HTTPException(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                detail=f"Part {part_number} must be exactly {part_size} bytes.",
+            )
+
+        return await self.firmware_repo.upload_part(
+            user_id=user_id,
+            upload_id=upload_id,
+            part_number=part_number,
+            data=bytes(data),
+        )
+
+    async def complete_upload(
+        self, user_id: UUID, upload_id: UUID, firmware_id: UUID
+    ) -> FirmwareBlobInfo:
+        return await self.firmware_repo.complete_upload(
+            user_id=user_id, upload_id=upload_id, firmware_id=firmware_id
+        )
+
+    async def abort_upload(self, user_id: UUID, upload_id: UUID) -> None:
+        await self.firmware_repo.abort_upload(user_id=user_id, upload_id=upload_id)
+
+    async def generate_delta(
+        self, user_id: UUID, base_firmware_id: UUID, firmware_id: UUID
     ) -> None:
-        await self.firmware_repo.upload_firmware(
-            user_id=user_id, firmware_id=firmware_id, firmware=firmware
+        base_info = await self.firmware_repo.get_firmware_info(
+            user_id=user_id, firmware_id=base_firmware_id
+        )
+        firmware_info = await self.firmware_repo.get_firmware_info(
+            user_id=user_id, firmware_id=firmware_id
         )
+        if max(base_info.size, firmware_info.size) > self.delta_max_size:
+            return
 
+        base = await self.firmware_repo.read_firmware(
+            user_id=user_id, firmware_id=base_firmware_id
+        )
+        firmware = await self.firmware_repo.read_firmware(
+            user_id=user_id, firmware_id=firmware_id
+        )
+        delta = await asyncio.get_running_loop().run_in_executor(
+            self.process_pool, bsdiff4.diff, base, firmware
+        )
+        if len(delta) >= len(firmware):
+            return
 
-def get_firmware_service(firmware_repo: FirmwareRepoType) -> IFirmwareService:
-    return FirmwareService(firmware_repo=firmware_repo)
+        await self.firmware_repo.upload_delta(
+            user_id=user_id,
+            base_firmware_id=base_firmware_id,
+            firmware_id=firmware_id,
+            delta=delta,
+        )
+
+    async def verify_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> VerifyFirmwareResponse:
+        integrity = await self.firmware_repo.get_integrity(
+            user_id=user_id, firmware_id=firmware_id
+        )
+        if (
+            integrity.chunk_hashes is not None
+            and integrity.verified_etag == integrity.storage_etag
+        ):
+            return VerifyFirmwareResponse(
+                sha256=integrity.sha256,
+                valid=True,
+                checked_chunks=0,
+                corrupted_chunks=[],
+            )
+
+        digest = ChunkedDigest(integrity.chunk_size)
+        async for chunk in self.firmware_repo.get_firmware_by_id(
+            user_id=user_id, firmware_id=firmware_id
+        ):
+            await anyio.to_thread.run_sync(digest.update, chunk)
+
+        checked_chunks = len(digest.chunk_hashes()) // 32
+        if integrity.chunk_hashes is not None:
+            corrupted = corrupted_chunks(integrity.chunk_hashes, digest.chunk_hashes())
+        elif digest.hexdigest() != integrity.sha256:
+            # without chunk hashes the damage can not be located
+            corrupted = list(range(checked_chunks))
+        else:
+            corrupted = []
+
+        if not corrupted:
+            await self.firmware_repo.save_verification(
+                user_id=user_id,
+                firmware_id=firmware_id,
+                storage_etag=integrity.storage_etag,
+                digest=digest if integrity.chunk_hashes is None else None,
+            )
+
+        return VerifyFirmwareResponse(
+            sha256=integrity.sha256,
+            valid=not corrupted,
+            checked_chunks=checked_chunks,
+            corrupted_chunks=corrupted,
+        )
+
+
+async def get_firmware_service(firmware_repo: FirmwareRepoType) -> IFirmwareService:
+    return FirmwareService(
+        firmware_repo=firmware_repo,
+        download_mode=settings.firmware_download_mode,
+        download_url_expire_in_seconds=(
+            settings.firmware_download_url_expire_in_seconds
+        ),
+        accel_redirect_location=settings.firmware_accel_redirect_location,
+        process_pool=await get_process_pool(),
+        delta_max_size=settings.firmware_delta_max_size,
+        upload_part_size=settings.firmware_upload_part_size,
+        upload_max_size=settings.firmware_upload_max_size,
+    )
 
 
 FirmwareServiceType = Annotated[IFirmwareService, Depends(get_firmware_service)]
+
+
+async def reap_abandoned_uploads() -> None:
+    """
+    Delete abandoned firmware uploads in batches until cancelled
+
+    Every `firmware_reaper_interval_in_seconds` the firmware still pending
+    after `firmware_pending_expire_in_seconds` and the resumable uploads not
+    completed after `firmware_upload_expire_in_seconds` are deleted with what
+    they stored. Only the rows of abandoned uploads are visited, the cost
+    grows with the failures and not with the stored firmware.
+
+    Database and storage errors are logged and retried in the next round,
+    any other error is logged and stops the reaper.
+    """
+    if databases.async_session is None:
+        raise RuntimeError("SQL client has not been defined.")
+
+    while True:
+        await asyncio.sleep(settings.firmware_reaper_interval_in_seconds)
+        try:
+            async with databases.async_session() as db_session:
+                firmware_repo = await get_firmware_repo(db_session)
+                while await firmware_repo.delete_abandoned_uploads(
+                    pending_expire_in_seconds=(
+                        settings.firmware_pending_expire_in_seconds
+                    ),
+                    upload_expire_in_seconds=settings.firmware_upload_expire_in_seconds,
+                    limit=settings.firmware_reaper_batch_size,
+                ):
+                    pass
+        except _REAPER_RETRIED_ERRORS:
+            logger.warning("Reaping abandoned uploads failed.", exc_info=True)
+        except Exception:
+            logger.exception("Reaper of abandoned uploads stopped.")
+            raise
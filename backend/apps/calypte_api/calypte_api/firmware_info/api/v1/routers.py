@@ -1,11 +1,17 @@
 from uuid import UUID
 
-from calypte_api.common.dependencies import JwtClaims, RateLimiterType, check_permission
+from calypte_api.common.dependencies import (
+    JwtClaims,
+    PageRateLimiterType,
+    RateLimiterType,
+    check_permission,
+)
+from calypte_api.common.pagination import CursorPage
 from calypte_api.common.user_roles import UserRole
 from calypte_api.firmware_info import schemas as firmware_schemas
 from calypte_api.firmware_info.service import FirmwareInfoServiceType
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from fastapi_pagination import Page
 
 
@@ -21,19 +27,44 @@ router = APIRouter()
     status_code=200,
 )
 async def retrieve_firmware_list(
-    _: RateLimiterType,
+    _: PageRateLimiterType,
     firmware_info_service: FirmwareInfoServiceType,
     query_params: firmware_schemas.GetFirmwareInfoQueryParams = Depends(
         firmware_schemas.GetFirmwareInfoQueryParams
     ),
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> Page[firmware_schemas.GetFirmwareInfoResponse]:
+) -> Response:
     return await firmware_info_service.get_firmware_list(
         user_id=jwt_claims.user.id,
         query_params=query_params,
     )
 
 
+@router.get(
+    path="/firmware-info/cursor",
+    response_model=CursorPage[firmware_schemas.GetFirmwareInfoResponse],
+    summary="get cursor-paginated firmware info list",
+    description=(
+        "get a page of firmware meta data after the cursor, "
+        "the cost of a page does not depend on how deep it is"
+    ),
+    response_description="the firmware meta data",
+    status_code=200,
+)
+async def retrieve_firmware_list_by_cursor(
+    _: PageRateLimiterType,
+    firmware_info_service: FirmwareInfoServiceType,
+    query_params: firmware_schemas.GetFirmwareInfoCursorParams = Depends(
+        firmware_schemas.GetFirmwareInfoCursorParams
+    ),
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> Response:
+    return await firmware_info_service.get_firmware_list_by_cursor(
+        user_id=jwt_claims.user.id,
+        query_params=query_params,
+    )
+
+
 @router.get(
     path="/firmware-info/{firmware_id:uuid}",
     response_model=firmware_schemas.GetFirmwareInfoResponse,
@@ -47,7 +78,7 @@ async def retrieve_firmware_info(
     firmware_id: UUID,
     firmware_info_service: FirmwareInfoServiceType,
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> firmware_schemas.GetFirmwareInfoResponse:
+) -> Response:
     return await firmware_info_service.get_firmware_info(
         user_id=jwt_claims.user.id,
         firmware_id=firmware_id,
@@ -74,3 +105,26 @@ async def update_firmware_info(
         firmware_id=firmware_id,
         request_body=update_request_body,
     )
+
+
+@router.post(
+    path="/firmware-info/{firmware_id:uuid}/release",
+    response_model=firmware_schemas.GetFirmwareInfoResponse,
+    summary="release a firmware",
+    description=(
+        "release a firmware to every device of its type, devices that no "
+        "rollout reaches get the most recently released firmware"
+    ),
+    response_description="the released firmware meta data",
+    status_code=200,
+)
+async def release_firmware(
+    _: RateLimiterType,
+    firmware_id: UUID,
+    firmware_info_service: FirmwareInfoServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> firmware_schemas.GetFirmwareInfoResponse:
+    return await firmware_info_service.release_firmware(
+        user_id=jwt_claims.user.id,
+        firmware_id=firmware_id,
+    )
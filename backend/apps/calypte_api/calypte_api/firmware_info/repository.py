@@ -1,18 +1,35 @@
+import http
+
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Any
 from uuid import UUID, uuid4
 
+from calypte_api.common.databases import releases_connection
 from calypte_api.common.dependencies import DBSessionType
+from calypte_api.common.models import (
+    FirmwareInfo,
+    FirmwareInfoDeviceLookUp,
+    FirmwareStatus,
+    Type,
+)
+from calypte_api.common.pagination import Keyset, estimate_count, paginate_by_keyset
+from calypte_api.firmware.manifests import load_manifest
+from calypte_api.firmware.models import FirmwareBlob, FirmwareBlobRef
 from calypte_api.firmware_info.schemas import (
     CreateFirmwareInfoResponse,
+    DeletedFirmwareInfo,
+    FirmwareInfoFilterParams,
+    FirmwareManifest,
     GetFirmwareInfoQueryParams,
     GetFirmwareInfoResponse,
     UpdateFirmwareInfoResponse,
 )
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException
+from sqlalchemy import Select, delete, func, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased, undefer
 
 
 class IFirmwareInfoRepo(ABC):
@@ -43,6 +60,40 @@ class IFirmwareInfoRepo(ABC):
             query_params (GetFirmwareQueryParams): query params
         """
 
+    @abstractmethod
+    async def get_firmware_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: FirmwareInfoFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetFirmwareInfoResponse]:
+        """
+        Get firmware created after the keyset, ordered by `(created_at, id)`
+
+        Args:
+            user_id (UUID): user id
+            query_params (FirmwareInfoFilterParams): filters
+            keyset (Keyset | None): last firmware of the previous page
+            size (int): page size, up to `size + 1` firmware are returned
+        """
+
+    @abstractmethod
+    async def count_firmware(
+        self,
+        user_id: UUID,
+        query_params: FirmwareInfoFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        """
+        Count firmware matching query params
+
+        Args:
+            user_id (UUID): user id
+            query_params (FirmwareInfoFilterParams): filters
+            estimate (bool): estimate from the planner statistics
+        """
+
     @abstractmethod
     async def update_firmware(
         self,
@@ -62,6 +113,21 @@ class IFirmwareInfoRepo(ABC):
             description (str): firmware description
         """
 
+    @abstractmethod
+    async def release_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> GetFirmwareInfoResponse:
+        """
+        Release firmware to every device of its type
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        Raises:
+            HTTPException: 404 if the firmware does not exist
+        """
+
     @abstractmethod
     async def create_firmware(
         self,
@@ -70,6 +136,7 @@ class IFirmwareInfoRepo(ABC):
         name: str,
         description: str,
         version: str,
+        status: FirmwareStatus = FirmwareStatus.READY,
     ) -> CreateFirmwareInfoResponse:
         """
         Create firmware
@@ -78,47 +145,228 @@ class IFirmwareInfoRepo(ABC):
             user_id (UUID): user id
             name (str): firmware name
             description (str): firmware description
+            status (FirmwareStatus): pending firmware is invisible until the
+                transaction that stores its image makes it ready
         """
 
+    @abstractmethod
+    async def delete_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> DeletedFirmwareInfo:
+        """
+        Delete firmware with its rollouts and its reference to its image
 
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        Raises:
+            HTTPException: 404 if the firmware does not exist
+        """
+
+    @abstractmethod
+    async def delete_pending_firmware(self, user_id: UUID, firmware_id: UUID) -> None:
+        """
+        Delete firmware whose image has not been stored
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+        """
+
+    @abstractmethod
+    async def get_previous_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the latest firmware of the same type created before the given one
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+        """
+
+    @abstractmethod
+    async def get_firmware_by_version(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the firmware of the same type as the given one by its version
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            version (str): firmware version
+        """
+
+    @abstractmethod
+    async def get_latest_firmware(
+        self,
+        user_id: UUID,
+        type_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the most recently released firmware of a type, unreleased
+        firmware only reaches the devices of its rollouts
+
+        Args:
+            user_id (UUID): user id
+            type_id (UUID): type id
+        """
+
+
+@releases_connection
 class FirmwareInfoRepo(IFirmwareInfoRepo):
     def __init__(self, db_session: AsyncSession) -> None:
         self.db_session = db_session
 
-    # TODO: implement
+    @staticmethod
+    def _filter_firmware(
+        query: Select, user_id: UUID, query_params: FirmwareInfoFilterParams
+    ) -> Select:
+        query = query.where(
+            FirmwareInfo.user_id == user_id,
+            FirmwareInfo.status == FirmwareStatus.READY,
+        )
+        if query_params.type_id is not None:
+            query = query.where(FirmwareInfo.type_id == query_params.type_id)
+        if query_params.name is not None:
+            query = query.where(FirmwareInfo.name.icontains(query_params.name))
+        if query_params.device is not None:
+            query = query.where(
+                FirmwareInfo.id.in_(
+                    select(FirmwareInfoDeviceLookUp.firmware_info_id).where(
+                        FirmwareInfoDeviceLookUp.device_id == query_params.device
+                    )
+                )
+            )
+
+        return query
+
+    @staticmethod
+    def _firmware_fields(firmware: FirmwareInfo) -> dict[str, Any]:
+        return {
+            "id": firmware.id,
+            "type_id": firmware.type_id,
+            "name": firmware.name,
+            "description": firmware.description,
+            "version": firmware.version,
+            "created_at": firmware.created_at,
+            "updated_at": firmware.modified_at,
+            "released_at": firmware.released_at,
+        }
+
+    async def _get_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        status: FirmwareStatus = FirmwareStatus.READY,
+    ) -> FirmwareInfo:
+        firmware = await self.db_session.scalar(
+            select(FirmwareInfo)
+            .where(
+                FirmwareInfo.id == firmware_id,
+                FirmwareInfo.user_id == user_id,
+                FirmwareInfo.status == status,
+            )
+            .execution_options(populate_existing=True)
+        )
+        if firmware is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware not found.",
+            )
+
+        return firmware
+
+    async def _get_manifest(self, firmware_id: UUID) -> FirmwareManifest | None:
+        blob = await self.db_session.scalar(
+            select(FirmwareBlob)
+            .join(FirmwareBlobRef)
+            .where(FirmwareBlobRef.firmware_id == firmware_id)
+            .options(undefer(FirmwareBlob.chunk_hashes))
+        )
+        if blob is None:
+            return None
+
+        return load_manifest(blob)
+
+    async def _commit_firmware(self) -> None:
+        try:
+            await self.db_session.commit()
+        except IntegrityError:
+            await self.db_session.rollback()
+            raise HTTPException(
+                status_code=http.HTTPStatus.CONFLICT,
+                detail="Firmware with this version already exists.",
+            )
+
     async def get_firmware_by_id(
         self,
         user_id: UUID,
         firmware_id: UUID,
     ) -> GetFirmwareInfoResponse:
+        firmware = await self._get_firmware(user_id, firmware_id)
         return GetFirmwareInfoResponse(
-            id=firmware_id,
-            type_id=uuid4(),
-            name="mocked firmware name",
-            description="mocked firmware description",
-            version="mocked firmware version",
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+            **self._firmware_fields(firmware),
+            manifest=await self._get_manifest(firmware.id),
         )
 
-    # TODO: implement
     async def get_firmware_list(
         self, user_id: UUID, query_params: GetFirmwareInfoQueryParams
     ) -> list[GetFirmwareInfoResponse]:
+        firmware_list = await self.db_session.scalars(
+            self._filter_firmware(select(FirmwareInfo), user_id, query_params)
+            .order_by(FirmwareInfo.created_at, FirmwareInfo.id)
+            .offset((query_params.page - 1) * query_params.size)
+            .limit(query_params.size)
+        )
+        return [
+            GetFirmwareInfoResponse(**self._firmware_fields(firmware))
+            for firmware in firmware_list
+        ]
+
+    async def get_firmware_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: FirmwareInfoFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetFirmwareInfoResponse]:
+        firmware_list = await self.db_session.scalars(
+            paginate_by_keyset(
+                self._filter_firmware(select(FirmwareInfo), user_id, query_params),
+                FirmwareInfo,
+                keyset,
+                size,
+            )
+        )
         return [
-            GetFirmwareInfoResponse(
-                id=uuid4(),
-                type_id=uuid4(),
-                name="mocked firmware name",
-                description="mocked firmware description",
-                version="mocked firmware version",
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
-            )
-            for i in range(query_params.size)
+            GetFirmwareInfoResponse(**self._firmware_fields(firmware))
+            for firmware in firmware_list
         ]
 
-    # TODO: implement
+    async def count_firmware(
+        self,
+        user_id: UUID,
+        query_params: FirmwareInfoFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        if estimate:
+            return await estimate_count(
+                self.db_session,
+                self._filter_firmware(select(FirmwareInfo.id), user_id, query_params),
+            )
+
+        return await self.db_session.scalar(
+            self._filter_firmware(select(func.count()), user_id, query_params)
+        )
+
     async def update_firmware(
         self,
         user_id: UUID,
@@ -127,15 +375,25 @@ class FirmwareInfoRepo(IFirmwareInfoRepo):
         description: str,
         version: str,
     ) -> UpdateFirmwareInfoResponse:
-        return UpdateFirmwareInfoResponse(
-            id=firmware_id,
-            type_id=uuid4(),
-            name=name,
-            description=description,
-            version=version,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
-        )
+        firmware = await self._get_firmware(user_id, firmware_id)
+        firmware.name = name
+        firmware.description = description
+        firmware.version = version
+        await self._commit_firmware()
+
+        firmware = await self._get_firmware(user_id, firmware_id)
+        return UpdateFirmwareInfoResponse(**self._firmware_fields(firmware))
+
+    async def release_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> GetFirmwareInfoResponse:
+        # releasing an older firmware again rolls the type back to it
+        firmware = await self._get_firmware(user_id, firmware_id)
+        firmware.released_at = func.now()
+        await self.db_session.commit()
+
+        firmware = await self._get_firmware(user_id, firmware_id)
+        return GetFirmwareInfoResponse(**self._firmware_fields(firmware))
 
     async def create_firmware(
         self,
@@ -144,15 +402,155 @@ class FirmwareInfoRepo(IFirmwareInfoRepo):
         name: str,
         description: str,
         version: str,
+        status: FirmwareStatus = FirmwareStatus.READY,
     ) -> CreateFirmwareInfoResponse:
-        return CreateFirmwareInfoResponse(
+        type_exists = await self.db_session.scalar(
+            select(Type.id).where(Type.id == type_id, Type.user_id == user_id)
+        )
+        if type_exists is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Type not found.",
+            )
+
+        firmware = FirmwareInfo(
             id=uuid4(),
+            user_id=user_id,
             type_id=type_id,
             name=name,
             description=description,
             version=version,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+            status=status,
+        )
+        self.db_session.add(firmware)
+        await self._commit_firmware()
+
+        firmware = await self._get_firmware(user_id, firmware.id, status)
+        return CreateFirmwareInfoResponse(**self._firmware_fields(firmware))
+
+    async def delete_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> DeletedFirmwareInfo:
+        sha256 = await self.db_session.scalar(
+            select(FirmwareBlobRef.sha256).where(
+                FirmwareBlobRef.firmware_id == firmware_id
+            )
+        )
+        device_ids = await self.db_session.scalars(
+            select(FirmwareInfoDeviceLookUp.device_id).where(
+                FirmwareInfoDeviceLookUp.firmware_info_id == firmware_id
+            )
+        )
+        # the reference to the image goes with the firmware, a trigger
+        # releases the blob in the same transaction
+        type_id = await self.db_session.scalar(
+            delete(FirmwareInfo)
+            .where(
+                FirmwareInfo.id == firmware_id,
+                FirmwareInfo.user_id == user_id,
+                FirmwareInfo.status == FirmwareStatus.READY,
+            )
+            .returning(FirmwareInfo.type_id)
+        )
+        if type_id is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware not found.",
+            )
+
+        await self.db_session.commit()
+        return DeletedFirmwareInfo(
+            id=firmware_id,
+            type_id=type_id,
+            sha256=sha256,
+            device_ids=list(device_ids),
+        )
+
+    async def delete_pending_firmware(self, user_id: UUID, firmware_id: UUID) -> None:
+        await self.db_session.execute(
+            delete(FirmwareInfo).where(
+                FirmwareInfo.id == firmware_id,
+                FirmwareInfo.user_id == user_id,
+                FirmwareInfo.status == FirmwareStatus.PENDING,
+            )
+        )
+        await self.db_session.commit()
+
+    async def get_previous_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        current = aliased(FirmwareInfo)
+        firmware = await self.db_session.scalar(
+            select(FirmwareInfo)
+            .join(
+                current,
+                (current.type_id == FirmwareInfo.type_id)
+                & (current.user_id == FirmwareInfo.user_id),
+            )
+            .where(
+                current.id == firmware_id,
+                current.user_id == user_id,
+                FirmwareInfo.status == FirmwareStatus.READY,
+                FirmwareInfo.created_at < current.created_at,
+            )
+            .order_by(FirmwareInfo.created_at.desc(), FirmwareInfo.id.desc())
+            .limit(1)
+        )
+        if firmware is None:
+            return None
+
+        return GetFirmwareInfoResponse(**self._firmware_fields(firmware))
+
+    async def get_firmware_by_version(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        current = aliased(FirmwareInfo)
+        firmware = await self.db_session.scalar(
+            select(FirmwareInfo)
+            .join(
+                current,
+                (current.type_id == FirmwareInfo.type_id)
+                & (current.user_id == FirmwareInfo.user_id),
+            )
+            .where(
+                current.id == firmware_id,
+                current.user_id == user_id,
+                FirmwareInfo.status == FirmwareStatus.READY,
+                FirmwareInfo.version == version,
+            )
+        )
+        if firmware is None:
+            return None
+
+        return GetFirmwareInfoResponse(**self._firmware_fields(firmware))
+
+    async def get_latest_firmware(
+        self,
+        user_id: UUID,
+        type_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        firmware = await self.db_session.scalar(
+            select(FirmwareInfo)
+            .where(
+                FirmwareInfo.user_id == user_id,
+                FirmwareInfo.type_id == type_id,
+                FirmwareInfo.status == FirmwareStatus.READY,
+                FirmwareInfo.released_at.is_not(None),
+            )
+            .order_by(FirmwareInfo.released_at.desc(), FirmwareInfo.id.desc())
+            .limit(1)
+        )
+        if firmware is None:
+            return None
+
+        return GetFirmwareInfoResponse(
+            **self._firmware_fields(firmware),
+            manifest=await self._get_manifest(firmware.id),
         )
 
 
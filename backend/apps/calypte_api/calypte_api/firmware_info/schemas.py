@@ -1,6 +1,8 @@
 from datetime import datetime
 from uuid import UUID
 
+from calypte_api.common.pagination import CursorParams
+
 from fastapi_pagination import Params
 from pydantic import BaseModel, ConfigDict, Field
 
@@ -23,16 +25,37 @@ class CreateFirmwareInfoRequestBody(BaseFirmwareRequestSchema):
     description: str
 
 
-class GetFirmwareInfoQueryParams(BaseFirmwareRequestSchema, Params):
+class FirmwareInfoFilterParams(BaseFirmwareRequestSchema):
     type_id: UUID | None = Field(default=None)
     name: str | None = Field(default=None)
-    device: str | None = Field(default=None)
+    device: UUID | None = Field(default=None)
+
+
+class GetFirmwareInfoQueryParams(FirmwareInfoFilterParams, Params):
+    ...
+
+
+class GetFirmwareInfoCursorParams(FirmwareInfoFilterParams, CursorParams):
+    ...
 
 
 class BaseFirmwareResponseSchema(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
 
+class FirmwareManifest(BaseFirmwareResponseSchema):
+    version: str
+    sha256: str
+    size: int
+    chunk_size: int = Field(alias="chunkSize")
+    # SHA-256 of every chunk, hex encoded
+    chunks: list[str]
+    merkle_root: str = Field(alias="merkleRoot")
+    # Ed25519 signature of the manifest statement, base64 encoded
+    signature: str | None = Field(default=None)
+    key_id: str | None = Field(default=None, alias="keyId")
+
+
 class UpdateFirmwareInfoResponse(BaseFirmwareResponseSchema):
     id: UUID
     type_id: UUID | None = Field(default=None)
@@ -67,3 +90,17 @@ class GetFirmwareInfoResponse(BaseFirmwareResponseSchema):
 
     created_at: datetime = Field(alias="createdAt")
     updated_at: datetime = Field(alias="updatedAt")
+    released_at: datetime | None = Field(default=None, alias="releasedAt")
+
+    # only set for a single firmware, not on pages
+    manifest: FirmwareManifest | None = Field(default=None)
+
+
+class DeletedFirmwareInfo(BaseModel):
+    id: UUID
+    type_id: UUID
+
+    # image the firmware referenced, it is deleted once unreferenced
+    sha256: str | None = Field(default=None)
+    # devices that reported the firmware as installed
+    device_ids: list[UUID] = Field(default_factory=list)
@@ -1,7 +1,22 @@
 from abc import ABC, abstractmethod
+from collections.abc import AsyncIterator
+from contextlib import AbstractAsyncContextManager, asynccontextmanager
 from typing import Annotated
 from uuid import UUID
 
+from calypte_api.common.cache import (
+    CacheResource,
+    IResponseCache,
+    ResponseCacheType,
+    type_rollouts_item,
+)
+from calypte_api.common.models import FirmwareStatus
+from calypte_api.common.pagination import (
+    CursorPage,
+    PageTotal,
+    create_cursor_page,
+    decode_keyset,
+)
 from calypte_api.firmware_info.repository import (
     FirmwareInfoRepositoryType,
     IFirmwareInfoRepo,
@@ -9,44 +24,105 @@ from calypte_api.firmware_info.repository import (
 from calypte_api.firmware_info.schemas import (
     CreateFirmwareInfoRequestBody,
     CreateFirmwareInfoResponse,
+    DeletedFirmwareInfo,
     FirmwareInfoUpdateRequestBody,
+    GetFirmwareInfoCursorParams,
     GetFirmwareInfoQueryParams,
     GetFirmwareInfoResponse,
     UpdateFirmwareInfoResponse,
 )
 
-from fastapi import Depends
+import anyio
+
+from fastapi import Depends, Response
 from fastapi_pagination import Page
 
 
+def latest_firmware_item(type_id: UUID | None) -> str:
+    return f"latest:{type_id}"
+
+
 class IFirmwareService(ABC):
     @abstractmethod
     async def get_firmware_info(
         self,
         user_id: UUID,
         firmware_id: UUID,
+    ) -> Response:
+        """
+        Get firmware by id, served from the response cache
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        returns:
+            Response: serialized GetFirmwareInfoResponse
+        """
+
+    @abstractmethod
+    async def get_firmware_info_by_id(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
     ) -> GetFirmwareInfoResponse:
         """
-        Get firmware by id
+        Get firmware by id, served from the local cache of the worker
 
         Args:
             user_id (UUID): user id
             firmware_id (UUID): firmware id
 
+        returns:
+            GetFirmwareInfoResponse: firmware info
+        """
+
+    @abstractmethod
+    async def get_latest_firmware(
+        self,
+        user_id: UUID,
+        type_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the most recently released firmware of a type, served from the
+        local cache of the worker
+
+        Args:
+            user_id (UUID): user id
+            type_id (UUID): type id
+
+        returns:
+            GetFirmwareInfoResponse | None: latest firmware info
         """
 
     @abstractmethod
     async def get_firmware_list(
         self, user_id: UUID, query_params: GetFirmwareInfoQueryParams
-    ) -> Page[GetFirmwareInfoResponse]:
+    ) -> Response:
         """
-        Get all firmwares
+        Get all firmwares, served from the response cache
 
         Args:
             user_id (UUID): user id
 
         returns:
-            list[GetFirmwareInfoResponse]: list of firmware info
+            Response: serialized Page[GetFirmwareInfoResponse]
+        """
+
+    @abstractmethod
+    async def get_firmware_list_by_cursor(
+        self, user_id: UUID, query_params: GetFirmwareInfoCursorParams
+    ) -> Response:
+        """
+        Get a page of firmwares after the cursor, served from the response cache
+
+        Args:
+            user_id (UUID): user id
+            query_params (GetFirmwareInfoCursorParams): filters, cursor,
+                page size and whether to count the firmwares
+
+        returns:
+            Response: serialized CursorPage[GetFirmwareInfoResponse]
         """
 
     @abstractmethod
@@ -69,48 +145,218 @@ class IFirmwareService(ABC):
         """
 
     @abstractmethod
-    async def create_firmware(
+    async def release_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> GetFirmwareInfoResponse:
+        """
+        Release firmware to every device of its type
+
+        Devices that no rollout reaches get the most recently released
+        firmware of their type, a new firmware reaches none of them before
+        it is released.
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        returns:
+            GetFirmwareInfoResponse: released firmware info
+        """
+
+    @abstractmethod
+    async def delete_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> DeletedFirmwareInfo:
+        """
+        Delete firmware with its rollouts
+
+        The image is kept as long as another firmware references it, the
+        caller deletes it through the firmware service once it is not.
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        returns:
+            DeletedFirmwareInfo: deleted firmware and the image it referenced
+        """
+
+    @abstractmethod
+    def create_firmware(
         self,
         user_id: UUID,
         request_body: CreateFirmwareInfoRequestBody,
-    ) -> CreateFirmwareInfoResponse:
+    ) -> AbstractAsyncContextManager[CreateFirmwareInfoResponse]:
         """
-        Create firmware
+        Create firmware as the unit of work that stores its image
+
+        The firmware is created pending, storing the image within the block
+        makes it ready in the same transaction. The pending firmware is
+        deleted if the block fails and reaped if the process dies first.
 
         Args:
             user_id (UUID): user id
             request_body (CreateFirmwareRequestBody): request body
 
         returns:
-            CreateFirmwareInfoResponse: created firmware info
+            AbstractAsyncContextManager[CreateFirmwareInfoResponse]: created
+                firmware info
+        """
+
+    @abstractmethod
+    async def get_previous_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the firmware a new firmware supersedes
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+
+        returns:
+            GetFirmwareInfoResponse | None: previous firmware of the same type
+        """
+
+    @abstractmethod
+    async def get_firmware_by_version(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the firmware of the same type as the given one by its version
+
+        Args:
+            user_id (UUID): user id
+            firmware_id (UUID): firmware id
+            version (str): firmware version
+
+        returns:
+            GetFirmwareInfoResponse | None: firmware info
         """
 
 
 class FirmwareService(IFirmwareService):
-    def __init__(self, firmware_repo: IFirmwareInfoRepo):
+    def __init__(
+        self, firmware_repo: IFirmwareInfoRepo, response_cache: IResponseCache
+    ):
         self.firmware_repo = firmware_repo
+        self.response_cache = response_cache
 
     async def get_firmware_info(
         self,
         user_id: UUID,
         firmware_id: UUID,
+    ) -> Response:
+        content = await self.response_cache.get_item(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_id=firmware_id,
+            load=lambda: self.firmware_repo.get_firmware_by_id(
+                user_id=user_id,
+                firmware_id=firmware_id,
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def get_firmware_info_by_id(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
     ) -> GetFirmwareInfoResponse:
-        return await self.firmware_repo.get_firmware_by_id(
+        return await self.response_cache.get_object(
             user_id=user_id,
-            firmware_id=firmware_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_id=firmware_id,
+            model=GetFirmwareInfoResponse,
+            load=lambda: self.firmware_repo.get_firmware_by_id(
+                user_id=user_id,
+                firmware_id=firmware_id,
+            ),
+        )
+
+    async def get_latest_firmware(
+        self,
+        user_id: UUID,
+        type_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        return await self.response_cache.get_object(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_id=latest_firmware_item(type_id),
+            model=GetFirmwareInfoResponse,
+            load=lambda: self.firmware_repo.get_latest_firmware(
+                user_id=user_id,
+                type_id=type_id,
+            ),
         )
 
     async def get_firmware_list(
         self, user_id: UUID, query_params: GetFirmwareInfoQueryParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            query_params=query_params,
+            load=lambda: self._load_firmware_list(
+                user_id=user_id, query_params=query_params
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def get_firmware_list_by_cursor(
+        self, user_id: UUID, query_params: GetFirmwareInfoCursorParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            query_params=query_params,
+            load=lambda: self._load_firmware_list_by_cursor(
+                user_id=user_id, query_params=query_params
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def _load_firmware_list(
+        self, user_id: UUID, query_params: GetFirmwareInfoQueryParams
     ) -> Page[GetFirmwareInfoResponse]:
         firmware_list = await self.firmware_repo.get_firmware_list(
             user_id=user_id,
             query_params=query_params,
         )
+        total = await self.firmware_repo.count_firmware(
+            user_id=user_id,
+            query_params=query_params,
+        )
         return Page.create(
             items=firmware_list,
             params=query_params,
-            total=query_params.size,
+            total=total,
+        )
+
+    async def _load_firmware_list_by_cursor(
+        self, user_id: UUID, query_params: GetFirmwareInfoCursorParams
+    ) -> CursorPage[GetFirmwareInfoResponse]:
+        firmware_list = await self.firmware_repo.get_firmware_by_keyset(
+            user_id=user_id,
+            query_params=query_params,
+            keyset=decode_keyset(query_params.cursor),
+            size=query_params.size,
+        )
+        total = None
+        if query_params.total != PageTotal.NONE:
+            total = await self.firmware_repo.count_firmware(
+                user_id=user_id,
+                query_params=query_params,
+                estimate=query_params.total == PageTotal.ESTIMATE,
+            )
+
+        return create_cursor_page(
+            items=firmware_list, params=query_params, total=total
         )
 
     async def update_firmware(
@@ -119,31 +365,112 @@ class FirmwareService(IFirmwareService):
         firmware_id: UUID,
         request_body: FirmwareInfoUpdateRequestBody,
     ) -> UpdateFirmwareInfoResponse:
-        return await self.firmware_repo.update_firmware(
+        firmware = await self.firmware_repo.update_firmware(
             user_id=user_id,
             firmware_id=firmware_id,
             name=request_body.name,
             description=request_body.description,
             version=request_body.version,
         )
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_ids=[firmware_id, latest_firmware_item(firmware.type_id)],
+        )
+        return firmware
+
+    async def release_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> GetFirmwareInfoResponse:
+        firmware = await self.firmware_repo.release_firmware(
+            user_id=user_id, firmware_id=firmware_id
+        )
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_ids=[firmware_id, latest_firmware_item(firmware.type_id)],
+        )
+        return firmware
+
+    async def delete_firmware(
+        self, user_id: UUID, firmware_id: UUID
+    ) -> DeletedFirmwareInfo:
+        firmware = await self.firmware_repo.delete_firmware(
+            user_id=user_id, firmware_id=firmware_id
+        )
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_ids=[firmware_id, latest_firmware_item(firmware.type_id)],
+        )
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.ROLLOUTS,
+            item_ids=[type_rollouts_item(firmware.type_id)],
+        )
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            item_ids=firmware.device_ids,
+        )
+        return firmware
 
+    @asynccontextmanager
     async def create_firmware(
         self,
         user_id: UUID,
         request_body: CreateFirmwareInfoRequestBody,
-    ) -> CreateFirmwareInfoResponse:
-        return await self.firmware_repo.create_firmware(
+    ) -> AsyncIterator[CreateFirmwareInfoResponse]:
+        firmware = await self.firmware_repo.create_firmware(
             user_id=user_id,
+            type_id=request_body.type_id,
             name=request_body.name,
             description=request_body.description,
             version=request_body.version,
+            status=FirmwareStatus.PENDING,
+        )
+        try:
+            yield firmware
+        except BaseException:
+            with anyio.CancelScope(shield=True):
+                await self.firmware_repo.delete_pending_firmware(
+                    user_id=user_id, firmware_id=firmware.id
+                )
+            raise
+
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.FIRMWARE_INFO,
+            item_ids=[latest_firmware_item(firmware.type_id)],
+        )
+
+    async def get_previous_firmware(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+    ) -> GetFirmwareInfoResponse | None:
+        return await self.firmware_repo.get_previous_firmware(
+            user_id=user_id,
+            firmware_id=firmware_id,
+        )
+
+    async def get_firmware_by_version(
+        self,
+        user_id: UUID,
+        firmware_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        return await self.firmware_repo.get_firmware_by_version(
+            user_id=user_id,
+            firmware_id=firmware_id,
+            version=version,
         )
 
 
 def get_firmware_info_service(
-    firmware_repo: FirmwareInfoRepositoryType
+    firmware_repo: FirmwareInfoRepositoryType, response_cache: ResponseCacheType
 ) -> IFirmwareInfoRepo:
-    return FirmwareService(firmware_repo=firmware_repo)
+    return FirmwareService(firmware_repo=firmware_repo, response_cache=response_cache)
 
 
 FirmwareInfoServiceType = Annotated[
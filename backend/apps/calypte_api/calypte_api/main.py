@@ -1,23 +1,40 @@
-from contextlib import asynccontextmanager
-
-from calypte_api.common import databases
-from calypte_api.common.settings import get_settings
+import asyncio
+
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import AsyncExitStack, asynccontextmanager, suppress
+from typing import Any
+
+from calypte_api.common import databases, executors
+from calypte_api.common.authorization import listen_for_revocations
+from calypte_api.common.cache import listen_for_invalidations, local_cache
+from calypte_api.common.dependencies import check_permission
+from calypte_api.common.models import Base
+from calypte_api.common.pool import PoolStatsMiddleware, create_engine, pool_stats
+from calypte_api.common.replicas import (
+    Replica,
+    WriteTrackingSession,
+    check_replicas,
+    listen_for_writes,
+    replicas,
+)
+from calypte_api.common.settings import FirmwareStorageBackend, get_settings
+from calypte_api.common.user_roles import UserRole
 from calypte_api.devices.api.v1.routers import router as devices_router
 from calypte_api.firmware.api.v1.routers import router as firmware_router
+from calypte_api.firmware.serivce import reap_abandoned_uploads
 from calypte_api.firmware_info.api.v1.routers import router as firmware_info_router
+from calypte_api.rollouts.api.v1.routers import router as rollouts_router
 from calypte_api.tags.api.v1.routers import router as tags_router
 
 import uvicorn
 
-from fastapi import FastAPI
+from aiobotocore.config import AioConfig
+from aiobotocore.session import get_session
+from fastapi import Depends, FastAPI
 from fastapi.responses import ORJSONResponse
-from fastapi_limiter import FastAPILimiter
 from fastapi_pagination import add_pagination
 from redis import asyncio as aioredis
-from sqlalchemy.ext.asyncio import (
-    async_sessionmaker,
-    create_async_engine,
-)
+from sqlalchemy.ext.asyncio import async_sessionmaker
 
 
 settings = get_settings()
@@ -25,23 +42,73 @@ settings = get_settings()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    databases.engine = create_async_engine(
-        settings.postgres_dsn(), echo=settings.debug, future=True
+    databases.engine = create_engine(settings)
+    replicas.extend(
+        Replica(
+            config=config,
+            engine=create_engine(
+                settings, settings.postgres_dsn(host=config.host, port=config.port)
+            ),
+        )
+        for config in settings.postgres_replicas
     )
     databases.async_session = async_sessionmaker(
-        databases.engine, expire_on_commit=False
+        databases.engine, class_=WriteTrackingSession, expire_on_commit=False
     )
+    if settings.debug:
+        async with databases.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
     databases.redis = aioredis.from_url(settings.redis_dsn(), encoding="utf-8")
-    await FastAPILimiter.init(databases.redis)
+    cache_invalidations = asyncio.create_task(
+        listen_for_invalidations(databases.redis)
+    )
+    token_revocations = asyncio.create_task(listen_for_revocations(databases.redis))
+    tasks = [cache_invalidations, token_revocations]
+    if replicas:
+        tasks.append(asyncio.create_task(check_replicas()))
+        tasks.append(asyncio.create_task(listen_for_writes(databases.redis)))
+    executors.process_pool = ProcessPoolExecutor(
+        max_workers=settings.firmware_delta_workers
+    )
 
-    yield
+    async with AsyncExitStack() as exit_stack:
+        if settings.firmware_storage_backend == FirmwareStorageBackend.S3:
+            databases.s3_client = await exit_stack.enter_async_context(
+                get_session().create_client(
+                    "s3",
+                    endpoint_url=settings.s3_endpoint_url,
+                    region_name=settings.s3_region,
+                    aws_access_key_id=settings.s3_access_key_id,
+                    aws_secret_access_key=settings.s3_secret_access_key,
+                    config=AioConfig(
+                        max_pool_connections=settings.s3_max_pool_connections
+                    ),
+                )
+            )
+
+        tasks.append(asyncio.create_task(reap_abandoned_uploads()))
+
+        yield
+
+        # before the S3 client is closed, the reaper uses it
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
 
     if databases.engine:
         await databases.engine.dispose()
 
+    for replica in replicas:
+        await replica.engine.dispose()
+    replicas.clear()
+
     if databases.redis:
         await databases.redis.close()
 
+    if executors.process_pool:
+        executors.process_pool.shutdown(cancel_futures=True)
+
 
 app = FastAPI(
     lifespan=lifespan,
@@ -52,12 +119,14 @@ app = FastAPI(
     default_response_class=ORJSONResponse,
     version="0.1.0",
 )
+app.add_middleware(PoolStatsMiddleware)
 
 
 app.include_router(devices_router, prefix="/api/v1", tags=["devices"])
 app.include_router(firmware_router, prefix="/api/v1", tags=["firmware"])
 app.include_router(tags_router, prefix="/api/v1", tags=["tags"])
 app.include_router(firmware_info_router, prefix="/api/v1", tags=["firmware-info"])
+app.include_router(rollouts_router, prefix="/api/v1", tags=["rollouts"])
 
 add_pagination(app)
 
@@ -67,6 +136,32 @@ def pong() -> dict[str, str]:
     return {"ping": "pong!"}
 
 
+@app.get("/cache/stats", dependencies=[Depends(check_permission(UserRole.ADMIN))])
+def cache_stats() -> dict[str, int]:
+    return local_cache.stats()
+
+
+@app.get("/db/stats", dependencies=[Depends(check_permission(UserRole.ADMIN))])
+def db_stats() -> dict[str, Any]:
+    if databases.engine is None:
+        raise RuntimeError("SQL client has not been defined.")
+
+    return {
+        **pool_stats(databases.engine),
+        "replicas": [
+            {
+                "host": replica.config.host,
+                "port": replica.config.port,
+                "weight": replica.config.weight,
+                "healthy": replica.healthy,
+                "lag_seconds": replica.lag_seconds,
+                **pool_stats(replica.engine),
+            }
+            for replica in replicas
+        ],
+    }
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "calypte_api.main:app",
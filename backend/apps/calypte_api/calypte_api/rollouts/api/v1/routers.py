@@ -0,0 +1,98 @@
+from uuid import UUID
+
+from calypte_api.common.dependencies import JwtClaims, RateLimiterType, check_permission
+from calypte_api.common.user_roles import UserRole
+from calypte_api.rollouts import schemas as rollout_schemas
+from calypte_api.rollouts.service import RolloutServiceType
+
+from fastapi import APIRouter, Depends
+
+
+router = APIRouter()
+
+
+@router.post(
+    path="/rollouts",
+    response_model=rollout_schemas.GetRolloutResponse,
+    summary="Roll a firmware out to a tag",
+    description=(
+        "Roll a firmware out to a percentage of the devices of a tag, "
+        "devices are picked by hashing their id"
+    ),
+    response_description="The created rollout",
+    status_code=201,
+)
+async def create_rollout(
+    _: RateLimiterType,
+    create_rollout_request_body: rollout_schemas.CreateRolloutRequestBody,
+    rollout_service: RolloutServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> rollout_schemas.GetRolloutResponse:
+    return await rollout_service.create_rollout(
+        user_id=jwt_claims.user.id,
+        request_body=create_rollout_request_body,
+    )
+
+
+@router.get(
+    path="/rollouts/{rollout_id:uuid}",
+    response_model=rollout_schemas.GetRolloutResponse,
+    summary="get a rollout",
+    description="get a rollout",
+    response_description="the rollout",
+    status_code=200,
+)
+async def retrieve_rollout(
+    _: RateLimiterType,
+    rollout_id: UUID,
+    rollout_service: RolloutServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> rollout_schemas.GetRolloutResponse:
+    return await rollout_service.get_rollout(
+        user_id=jwt_claims.user.id,
+        rollout_id=rollout_id,
+    )
+
+
+@router.patch(
+    path="/rollouts/{rollout_id:uuid}",
+    response_model=rollout_schemas.GetRolloutResponse,
+    summary="move a rollout to another stage",
+    description=(
+        "set the percentage of the tag that gets the firmware, devices that "
+        "got it at a lower percentage keep it"
+    ),
+    response_description="the updated rollout",
+    status_code=200,
+)
+async def update_rollout(
+    _: RateLimiterType,
+    rollout_id: UUID,
+    update_rollout_request_body: rollout_schemas.UpdateRolloutRequestBody,
+    rollout_service: RolloutServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> rollout_schemas.GetRolloutResponse:
+    return await rollout_service.update_rollout(
+        user_id=jwt_claims.user.id,
+        rollout_id=rollout_id,
+        request_body=update_rollout_request_body,
+    )
+
+
+@router.delete(
+    path="/rollouts/{rollout_id:uuid}",
+    summary="delete a rollout",
+    description="delete a rollout",
+    response_description="the deleted rollout",
+    status_code=204,
+)
+async def delete_rollout(
+    _: RateLimiterType,
+    rollout_id: UUID,
+    rollout_service: RolloutServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> None:
+    await rollout_service.delete_rollout(
+        user_id=jwt_claims.user.id,
+        rollout_id=rollout_id,
+    )
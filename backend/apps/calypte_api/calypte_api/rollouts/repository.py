@@ -0,0 +1,277 @@
+import http
+
+from abc import ABC, abstractmethod
+from typing import Annotated
+from uuid import UUID, uuid4
+
+from calypte_api.common.databases import releases_connection
+from calypte_api.common.dependencies import DBSessionType
+from calypte_api.common.models import (
+    Device,
+    FirmwareInfo,
+    FirmwareInfoDeviceLookUp,
+    FirmwareStatus,
+    Rollout,
+    Tag,
+)
+from calypte_api.rollouts.schemas import (
+    ActiveRollout,
+    GetRolloutResponse,
+    TypeRollouts,
+)
+
+from fastapi import Depends, HTTPException
+from sqlalchemy import delete, exists, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+class IRolloutRepo(ABC):
+    @abstractmethod
+    async def get_rollout_by_id(
+        self, user_id: UUID, rollout_id: UUID
+    ) -> GetRolloutResponse:
+        """
+        Get rollout by id
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+        """
+
+    @abstractmethod
+    async def get_type_rollouts(self, user_id: UUID, type_id: UUID) -> TypeRollouts:
+        """
+        Get the rollouts of a type that reach any device, newest first
+
+        Args:
+            user_id (UUID): user id
+            type_id (UUID): type id
+        """
+
+    @abstractmethod
+    async def create_rollout(
+        self,
+        user_id: UUID,
+        firmware_info_id: UUID,
+        tag_id: UUID,
+        percentage: float,
+    ) -> GetRolloutResponse:
+        """
+        Create rollout
+
+        Args:
+            user_id (UUID): user id
+            firmware_info_id (UUID): firmware to roll out
+            tag_id (UUID): tag of the devices to roll out to
+            percentage (float): share of the tag that gets the firmware
+        """
+
+    @abstractmethod
+    async def update_rollout(
+        self, user_id: UUID, rollout_id: UUID, percentage: float
+    ) -> GetRolloutResponse:
+        """
+        Move a rollout to another stage with a single row update
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+            percentage (float): share of the tag that gets the firmware
+        """
+
+    @abstractmethod
+    async def delete_rollout(self, user_id: UUID, rollout_id: UUID) -> None:
+        """
+        Delete rollout
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+        """
+
+    @abstractmethod
+    async def record_check_in(
+        self, device_id: UUID, firmware_info_id: UUID | None
+    ) -> None:
+        """
+        Mark the device as registered and record the firmware it runs
+
+        Args:
+            device_id (UUID): device id
+            firmware_info_id (UUID | None): firmware the device reported,
+                None to only mark it as registered
+        """
+
+
+@releases_connection
+class RolloutRepo(IRolloutRepo):
+    def __init__(self, db_session: AsyncSession) -> None:
+        self.db_session = db_session
+
+    @staticmethod
+    def _to_response(rollout: Rollout) -> GetRolloutResponse:
+        return GetRolloutResponse(
+            id=rollout.id,
+            type_id=rollout.type_id,
+            firmware_info_id=rollout.firmware_info_id,
+            tag_id=rollout.tag_id,
+            percentage=rollout.percentage,
+            created_at=rollout.created_at,
+            updated_at=rollout.modified_at,
+        )
+
+    async def _get_rollout(self, user_id: UUID, rollout_id: UUID) -> Rollout:
+        rollout = await self.db_session.scalar(
+            select(Rollout)
+            .where(Rollout.id == rollout_id, Rollout.user_id == user_id)
+            .execution_options(populate_existing=True)
+        )
+        if rollout is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Rollout not found.",
+            )
+
+        return rollout
+
+    async def get_rollout_by_id(
+        self, user_id: UUID, rollout_id: UUID
+    ) -> GetRolloutResponse:
+        return self._to_response(await self._get_rollout(user_id, rollout_id))
+
+    async def get_type_rollouts(self, user_id: UUID, type_id: UUID) -> TypeRollouts:
+        rollouts = await self.db_session.scalars(
+            select(Rollout)
+            .where(
+                Rollout.user_id == user_id,
+                Rollout.type_id == type_id,
+                Rollout.percentage > 0,
+            )
+            .order_by(Rollout.created_at.desc(), Rollout.id.desc())
+        )
+        return TypeRollouts(
+            rollouts=[
+                ActiveRollout(
+                    id=rollout.id,
+                    firmware_info_id=rollout.firmware_info_id,
+                    tag_id=rollout.tag_id,
+                    percentage=rollout.percentage,
+                )
+                for rollout in rollouts
+            ]
+        )
+
+    async def create_rollout(
+        self,
+        user_id: UUID,
+        firmware_info_id: UUID,
+        tag_id: UUID,
+        percentage: float,
+    ) -> GetRolloutResponse:
+        firmware_type_id = await self.db_session.scalar(
+            select(FirmwareInfo.type_id).where(
+                FirmwareInfo.id == firmware_info_id,
+                FirmwareInfo.user_id == user_id,
+                FirmwareInfo.status == FirmwareStatus.READY,
+            )
+        )
+        if firmware_type_id is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Firmware not found.",
+            )
+
+        tag_type_id = await self.db_session.scalar(
+            select(Tag.type_id).where(Tag.id == tag_id, Tag.user_id == user_id)
+        )
+        if tag_type_id is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Tag not found.",
+            )
+        if tag_type_id != firmware_type_id:
+            raise HTTPException(
+                status_code=http.HTTPStatus.BAD_REQUEST,
+                detail="Firmware and tag are of different types.",
+            )
+
+        rollout = Rollout(
+            id=uuid4(),
+            user_id=user_id,
+            type_id=firmware_type_id,
+            firmware_info_id=firmware_info_id,
+            tag_id=tag_id,
+            percentage=percentage,
+        )
+        self.db_session.add(rollout)
+        try:
+            await self.db_session.commit()
+        except IntegrityError:
+            await self.db_session.rollback()
+            raise HTTPException(
+                status_code=http.HTTPStatus.CONFLICT,
+                detail="Rollout of this firmware to this tag already exists.",
+            )
+
+        return self._to_response(await self._get_rollout(user_id, rollout.id))
+
+    async def update_rollout(
+        self, user_id: UUID, rollout_id: UUID, percentage: float
+    ) -> GetRolloutResponse:
+        rollout = await self.db_session.scalar(
+            update(Rollout)
+            .where(Rollout.id == rollout_id, Rollout.user_id == user_id)
+            .values(percentage=percentage)
+            .returning(Rollout)
+            .execution_options(populate_existing=True)
+        )
+        if rollout is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Rollout not found.",
+            )
+
+        await self.db_session.commit()
+        return self._to_response(rollout)
+
+    async def delete_rollout(self, user_id: UUID, rollout_id: UUID) -> None:
+        await self.db_session.execute(
+            delete(Rollout).where(Rollout.id == rollout_id, Rollout.user_id == user_id)
+        )
+        await self.db_session.commit()
+
+    async def record_check_in(
+        self, device_id: UUID, firmware_info_id: UUID | None
+    ) -> None:
+        await self.db_session.execute(
+            update(Device)
+            .where(Device.id == device_id, Device.registered_at.is_(None))
+            .values(registered_at=func.now())
+        )
+        if firmware_info_id is not None:
+            await self.db_session.execute(
+                insert(FirmwareInfoDeviceLookUp).from_select(
+                    ["id", "firmware_info_id", "device_id"],
+                    select(
+                        func.gen_random_uuid(),
+                        literal(firmware_info_id),
+                        literal(device_id),
+                    ).where(
+                        ~exists().where(
+                            FirmwareInfoDeviceLookUp.firmware_info_id
+                            == firmware_info_id,
+                            FirmwareInfoDeviceLookUp.device_id == device_id,
+                        )
+                    ),
+                )
+            )
+        await self.db_session.commit()
+
+
+def get_rollout_repo(db_session: DBSessionType) -> IRolloutRepo:
+    return RolloutRepo(db_session=db_session)
+
+
+RolloutRepositoryType = Annotated[IRolloutRepo, Depends(get_rollout_repo)]
@@ -0,0 +1,47 @@
+from datetime import datetime
+from uuid import UUID
+
+from pydantic import BaseModel, ConfigDict, Field
+
+
+class BaseRolloutRequestSchema(BaseModel):
+    ...
+
+
+class CreateRolloutRequestBody(BaseRolloutRequestSchema):
+    firmware_info_id: UUID
+    tag_id: UUID
+
+    percentage: float = Field(gt=0, le=100)
+
+
+class UpdateRolloutRequestBody(BaseRolloutRequestSchema):
+    percentage: float = Field(ge=0, le=100)
+
+
+class BaseRolloutResponseSchema(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+
+class GetRolloutResponse(BaseRolloutResponseSchema):
+    id: UUID
+
+    type_id: UUID
+    firmware_info_id: UUID
+    tag_id: UUID
+    percentage: float
+
+    created_at: datetime = Field(alias="createdAt")
+    updated_at: datetime = Field(alias="updatedAt")
+
+
+class ActiveRollout(BaseRolloutResponseSchema):
+    id: UUID
+
+    firmware_info_id: UUID
+    tag_id: UUID
+    percentage: float
+
+
+class TypeRollouts(BaseRolloutResponseSchema):
+    rollouts: list[ActiveRollout]
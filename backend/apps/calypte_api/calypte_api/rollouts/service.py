@@ -0,0 +1,274 @@
+import hashlib
+
+from abc import ABC, abstractmethod
+from typing import Annotated
+from uuid import UUID
+
+from calypte_api.common.cache import (
+    CacheResource,
+    IResponseCache,
+    ResponseCacheType,
+    type_rollouts_item,
+)
+from calypte_api.devices.repository import DeviceRepositoryType, IDeviceRepo
+from calypte_api.devices.schemas import GetDeviceResponse
+from calypte_api.firmware_info.schemas import GetFirmwareInfoResponse
+from calypte_api.firmware_info.service import (
+    FirmwareInfoServiceType,
+    IFirmwareService,
+)
+from calypte_api.rollouts.repository import IRolloutRepo, RolloutRepositoryType
+from calypte_api.rollouts.schemas import (
+    CreateRolloutRequestBody,
+    GetRolloutResponse,
+    TypeRollouts,
+    UpdateRolloutRequestBody,
+)
+
+from fastapi import Depends
+
+
+# a percentage is compared against a bucket out of 10000, 0.01% steps
+ROLLOUT_BUCKETS = 10_000
+
+
+def rollout_bucket(rollout_id: UUID, device_id: UUID) -> int:
+    """
+    Bucket of a device in a rollout
+
+    The bucket only depends on the two ids, a device that got the firmware at
+    one stage keeps it at every larger percentage. Salting with the rollout id
+    picks different devices for every rollout of the same tag.
+
+    Args:
+        rollout_id (UUID): rollout id
+        device_id (UUID): device id
+
+    returns:
+        int: bucket in `[0, ROLLOUT_BUCKETS)`
+    """
+    digest = hashlib.blake2b(rollout_id.bytes + device_id.bytes, digest_size=8)
+    return int.from_bytes(digest.digest()) % ROLLOUT_BUCKETS
+
+
+class IRolloutService(ABC):
+    @abstractmethod
+    async def get_rollout(
+        self, user_id: UUID, rollout_id: UUID
+    ) -> GetRolloutResponse:
+        """
+        Get rollout by id
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+        """
+
+    @abstractmethod
+    async def create_rollout(
+        self, user_id: UUID, request_body: CreateRolloutRequestBody
+    ) -> GetRolloutResponse:
+        """
+        Roll a firmware out to a share of the devices of a tag
+
+        Args:
+            user_id (UUID): user id
+            request_body (CreateRolloutRequestBody): request body
+        """
+
+    @abstractmethod
+    async def update_rollout(
+        self,
+        user_id: UUID,
+        rollout_id: UUID,
+        request_body: UpdateRolloutRequestBody,
+    ) -> GetRolloutResponse:
+        """
+        Move a rollout to another stage
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+            request_body (UpdateRolloutRequestBody): request body
+        """
+
+    @abstractmethod
+    async def delete_rollout(self, user_id: UUID, rollout_id: UUID) -> None:
+        """
+        Delete rollout, its devices fall back to the latest released firmware
+        of the type
+
+        Args:
+            user_id (UUID): user id
+            rollout_id (UUID): rollout id
+        """
+
+    @abstractmethod
+    async def check_in(
+        self,
+        user_id: UUID,
+        device_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        """
+        Get the firmware a device should install
+
+        The target is the firmware of the newest rollout that reaches the
+        device, else the latest released firmware of its type. The device, the rollouts
+        and the firmware come from the cache, the database is only written the
+        first time a device checks in and when it reports a new firmware.
+
+        Args:
+            user_id (UUID): user id
+            device_id (UUID): device id
+            version (str): firmware version the device runs
+
+        returns:
+            GetFirmwareInfoResponse | None: firmware to install, None if the
+                device is up to date
+
+        Raises:
+            HTTPException: 404 if the device does not exist
+        """
+
+
+class RolloutService(IRolloutService):
+    def __init__(
+        self,
+        rollout_repo: IRolloutRepo,
+        device_repo: IDeviceRepo,
+        firmware_info_service: IFirmwareService,
+        response_cache: IResponseCache,
+    ):
+        self.rollout_repo = rollout_repo
+        self.device_repo = device_repo
+        self.firmware_info_service = firmware_info_service
+        self.response_cache = response_cache
+
+    async def get_rollout(
+        self, user_id: UUID, rollout_id: UUID
+    ) -> GetRolloutResponse:
+        return await self.rollout_repo.get_rollout_by_id(
+            user_id=user_id, rollout_id=rollout_id
+        )
+
+    async def create_rollout(
+        self, user_id: UUID, request_body: CreateRolloutRequestBody
+    ) -> GetRolloutResponse:
+        rollout = await self.rollout_repo.create_rollout(
+            user_id=user_id,
+            firmware_info_id=request_body.firmware_info_id,
+            tag_id=request_body.tag_id,
+            percentage=request_body.percentage,
+        )
+        await self._invalidate(user_id=user_id, type_id=rollout.type_id)
+        return rollout
+
+    async def update_rollout(
+        self,
+        user_id: UUID,
+        rollout_id: UUID,
+        request_body: UpdateRolloutRequestBody,
+    ) -> GetRolloutResponse:
+        rollout = await self.rollout_repo.update_rollout(
+            user_id=user_id,
+            rollout_id=rollout_id,
+            percentage=request_body.percentage,
+        )
+        await self._invalidate(user_id=user_id, type_id=rollout.type_id)
+        return rollout
+
+    async def delete_rollout(self, user_id: UUID, rollout_id: UUID) -> None:
+        previous = await self.rollout_repo.get_rollout_by_id(
+            user_id=user_id, rollout_id=rollout_id
+        )
+        await self.rollout_repo.delete_rollout(user_id=user_id, rollout_id=rollout_id)
+        await self._invalidate(user_id=user_id, type_id=previous.type_id)
+
+    async def check_in(
+        self,
+        user_id: UUID,
+        device_id: UUID,
+        version: str,
+    ) -> GetFirmwareInfoResponse | None:
+        device = await self.response_cache.get_object(
+            user_id=user_id,
+            resource=CacheResource.DEVICES,
+            item_id=device_id,
+            model=GetDeviceResponse,
+            load=lambda: self.device_repo.get_device_by_id(
+                user_id=user_id, device_id=device_id
+            ),
+        )
+        firmware = await self._get_target_firmware(user_id=user_id, device=device)
+        up_to_date = firmware is None or firmware.version == version
+
+        installed = None
+        if up_to_date and firmware is not None:
+            if firmware.id not in device.firmware_info:
+                installed = firmware.id
+        if device.registered_at is None or installed is not None:
+            await self.rollout_repo.record_check_in(
+                device_id=device_id, firmware_info_id=installed
+            )
+            await self.response_cache.invalidate(
+                user_id=user_id, resource=CacheResource.DEVICES, item_ids=[device_id]
+            )
+
+        return None if up_to_date else firmware
+
+    async def _get_target_firmware(
+        self, user_id: UUID, device: GetDeviceResponse
+    ) -> GetFirmwareInfoResponse | None:
+        rollouts = await self.response_cache.get_object(
+            user_id=user_id,
+            resource=CacheResource.ROLLOUTS,
+            item_id=type_rollouts_item(device.type_id),
+            model=TypeRollouts,
+            load=lambda: self.rollout_repo.get_type_rollouts(
+                user_id=user_id, type_id=device.type_id
+            ),
+        )
+        tags = set(device.tags)
+        for rollout in rollouts.rollouts:
+            if rollout.tag_id not in tags:
+                continue
+            if rollout_bucket(rollout.id, device.id) < rollout.percentage * 100:
+                return await self.firmware_info_service.get_firmware_info_by_id(
+                    user_id=user_id, firmware_id=rollout.firmware_info_id
+                )
+
+        return await self.firmware_info_service.get_latest_firmware(
+            user_id=user_id, type_id=device.type_id
+        )
+
+    async def _invalidate(self, user_id: UUID, type_id: UUID) -> None:
+        """
+        Drop the cached rollouts of a type
+
+        Args:
+            user_id (UUID): user id
+            type_id (UUID): type of the changed rollout
+        """
+        await self.response_cache.invalidate(
+            user_id=user_id,
+            resource=CacheResource.ROLLOUTS,
+            item_ids=[type_rollouts_item(type_id)],
+        )
+
+
+def get_rollout_service(
+    rollout_repo: RolloutRepositoryType,
+    device_repo: DeviceRepositoryType,
+    firmware_info_service: FirmwareInfoServiceType,
+    response_cache: ResponseCacheType,
+) -> IRolloutService:
+    return RolloutService(
+        rollout_repo=rollout_repo,
+        device_repo=device_repo,
+        firmware_info_service=firmware_info_service,
+        response_cache=response_cache,
+    )
+
+
+RolloutServiceType = Annotated[IRolloutService, Depends(get_rollout_service)]
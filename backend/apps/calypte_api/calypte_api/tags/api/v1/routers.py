@@ -1,11 +1,19 @@
 from uuid import UUID
 
-from calypte_api.common.dependencies import JwtClaims, RateLimiterType, check_permission
+from calypte_api.common.dependencies import (
+    JwtClaims,
+    PageRateLimiterType,
+    RateLimiterType,
+    check_permission,
+)
+from calypte_api.common.pagination import CursorPage, CursorParams
 from calypte_api.common.user_roles import UserRole
+from calypte_api.devices.schemas import DeviceSelectionParams
+from calypte_api.devices.service import DeviceServiceType
 from calypte_api.tags import schemas as tags_schemas
 from calypte_api.tags.service import TagServiceType
 
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, Response
 from fastapi_pagination import Page
 
 
@@ -41,19 +49,44 @@ async def create_tag(
     status_code=200,
 )
 async def get_tags_page(
-    _: RateLimiterType,
+    _: PageRateLimiterType,
     tag_service: TagServiceType,
     query_params: tags_schemas.GetTagQueryParams = Depends(
         tags_schemas.GetTagQueryParams
     ),
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> Page[tags_schemas.GetTagResponse]:
+) -> Response:
     return await tag_service.get_tags(
         user_id=jwt_claims.user.id,
         query_params=query_params,
     )
 
 
+@router.get(
+    path="/tags/cursor",
+    response_model=CursorPage[tags_schemas.GetTagResponse],
+    summary="Get a cursor-paginated tags page",
+    description=(
+        "get a page of tags after the cursor, "
+        "the cost of a page does not depend on how deep it is"
+    ),
+    response_description="The page of tags",
+    status_code=200,
+)
+async def get_tags_page_by_cursor(
+    _: PageRateLimiterType,
+    tag_service: TagServiceType,
+    query_params: tags_schemas.GetTagCursorParams = Depends(
+        tags_schemas.GetTagCursorParams
+    ),
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> Response:
+    return await tag_service.get_tags_by_cursor(
+        user_id=jwt_claims.user.id,
+        query_params=query_params,
+    )
+
+
 @router.get(
     path="/tags/{tag_id:uuid}",
     response_model=tags_schemas.GetTagResponse,
@@ -67,13 +100,39 @@ async def get_tag(
     tag_id: UUID,
     tag_service: TagServiceType,
     jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
-) -> tags_schemas.GetTagResponse:
+) -> Response:
     return await tag_service.get_tag(
         user_id=jwt_claims.user.id,
         tag_id=tag_id,
     )
 
 
+@router.get(
+    path="/tags/{tag_id:uuid}/devices",
+    response_model=CursorPage[UUID],
+    summary="Get the devices of a tag",
+    description="get a page of the ids of the devices with the tag",
+    response_description="page of device ids",
+    status_code=200,
+)
+async def get_tag_devices(
+    _: PageRateLimiterType,
+    tag_id: UUID,
+    device_service: DeviceServiceType,
+    query_params: CursorParams = Depends(CursorParams),
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> CursorPage[UUID]:
+    return await device_service.select_devices(
+        user_id=jwt_claims.user.id,
+        query_params=DeviceSelectionParams(
+            tags=[tag_id],
+            cursor=query_params.cursor,
+            size=query_params.size,
+            total=query_params.total,
+        ),
+    )
+
+
 @router.put(
     path="/tags/{tag_id:uuid}",
     response_model=tags_schemas.UpdateTagResponse,
@@ -96,6 +155,31 @@ async def update_tag(
     )
 
 
+@router.patch(
+    path="/tags/{tag_id:uuid}/devices",
+    response_model=tags_schemas.UpdateTagDevicesResponse,
+    summary="Add and remove devices of a tag",
+    description=(
+        "add and remove devices of a tag without sending the whole membership, "
+        "devices that already are or are not members are skipped"
+    ),
+    response_description="Number of added and removed devices",
+    status_code=200,
+)
+async def update_tag_devices(
+    _: RateLimiterType,
+    tag_id: UUID,
+    update_tag_devices_request_body: tags_schemas.UpdateTagDevicesRequestBody,
+    tag_service: TagServiceType,
+    jwt_claims: JwtClaims = Depends(check_permission(UserRole.USER)),
+) -> tags_schemas.UpdateTagDevicesResponse:
+    return await tag_service.update_tag_devices(
+        user_id=jwt_claims.user.id,
+        tag_id=tag_id,
+        request_body=update_tag_devices_request_body,
+    )
+
+
 @router.delete(
     path="/tags/{tag_id:uuid}",
     response_model=None,
@@ -1,17 +1,25 @@
+import http
+
 from abc import ABC, abstractmethod
-from datetime import datetime
-from typing import Annotated
+from typing import Annotated, Any
 from uuid import UUID, uuid4
 
+from calypte_api.common.databases import releases_connection
 from calypte_api.common.dependencies import DBSessionType
+from calypte_api.common.models import Device, Tag, TagDeviceLookUp, Type
+from calypte_api.common.pagination import Keyset, estimate_count, paginate_by_keyset
 from calypte_api.tags.schemas import (
     CreateTagResponse,
     GetTagQueryParams,
     GetTagResponse,
+    TagFilterParams,
     UpdateTagResponse,
 )
 
-from fastapi import Depends
+from fastapi import Depends, HTTPException
+from sqlalchemy import Select, any_, bindparam, delete, exists, func, literal, select
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID
 from sqlalchemy.ext.asyncio import AsyncSession
 
 
@@ -43,6 +51,40 @@ class ITagRepo(ABC):
             query_params (GetTagQueryParams): query params
         """
 
+    @abstractmethod
+    async def get_tags_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: TagFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetTagResponse]:
+        """
+        Get tags created after the keyset, ordered by `(created_at, id)`
+
+        Args:
+            user_id (UUID): user id
+            query_params (TagFilterParams): filters
+            keyset (Keyset | None): last tag of the previous page
+            size (int): page size, up to `size + 1` tags are returned
+        """
+
+    @abstractmethod
+    async def count_tags(
+        self,
+        user_id: UUID,
+        query_params: TagFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        """
+        Count tags matching query params
+
+        Args:
+            user_id (UUID): user id
+            query_params (TagFilterParams): filters
+            estimate (bool): estimate from the planner statistics
+        """
+
     @abstractmethod
     async def create_tag(
         self,
@@ -50,7 +92,7 @@ class ITagRepo(ABC):
         type_id: UUID,
         devices_ids: list[UUID],
         user_id: UUID,
-    ) -> CreateTagResponse:
+    ) -> tuple[CreateTagResponse, set[UUID]]:
         """
         Create tag
 
@@ -58,12 +100,15 @@ class ITagRepo(ABC):
             user_id (UUID): user id
             name (str): tag name
             tags (list[UUID]): tag tags
+
+        returns:
+            tuple[CreateTagResponse, set[UUID]]: created tag and its devices
         """
 
     @abstractmethod
     async def update_tag(
         self, user_id: UUID, tag_id: UUID, name: str, devices_ids: list[UUID]
-    ) -> UpdateTagResponse:
+    ) -> tuple[UpdateTagResponse, set[UUID]]:
         """
         Update tag
 
@@ -72,87 +117,309 @@ class ITagRepo(ABC):
             tag_id (UUID): tag id
             name (str): tag name
             tags (list[UUID]): tag tags
+
+        returns:
+            tuple[UpdateTagResponse, set[UUID]]: updated tag and the devices
+                that joined or left it
+        """
+
+    @abstractmethod
+    async def update_tag_devices(
+        self, user_id: UUID, tag_id: UUID, add: list[UUID], remove: list[UUID]
+    ) -> tuple[list[UUID], list[UUID]]:
+        """
+        Add and remove devices of a tag in a single statement
+
+        Devices of other users and devices that already are, or are not,
+        members are skipped.
+
+        Args:
+            user_id (UUID): user id
+            tag_id (UUID): tag id
+            add (list[UUID]): devices to add
+            remove (list[UUID]): devices to remove
+
+        returns:
+            tuple[list[UUID], list[UUID]]: added and removed devices
         """
 
     @abstractmethod
-    async def delete_tag(self, user_id: UUID, tag_id: UUID) -> None:
+    async def delete_tag(self, user_id: UUID, tag_id: UUID) -> list[UUID]:
         """
         Delete tag
 
         Args:
             user_id (UUID): user id
             tag_id (UUID): tag id
+
+        returns:
+            list[UUID]: devices the tag had
         """
 
 
+@releases_connection
 class TagRepo(ITagRepo):
     def __init__(self, db_session: AsyncSession) -> None:
         self.db_session = db_session
 
-    # TODO: implement
+    @staticmethod
+    def _filter_tags(
+        query: Select, user_id: UUID, query_params: TagFilterParams | None = None
+    ) -> Select:
+        query = query.where(Tag.user_id == user_id)
+        if query_params is not None and query_params.name is not None:
+            query = query.where(Tag.name.icontains(query_params.name))
+
+        return query
+
+    def _select_tags(
+        self, user_id: UUID, query_params: TagFilterParams | None = None
+    ) -> Select:
+        # members are counted on the `(tag_id, device_id)` index instead of
+        # being loaded, the devices of a tag are paged from its bitmap index
+        devices_count = (
+            select(func.count())
+            .where(TagDeviceLookUp.tag_id == Tag.id)
+            .correlate(Tag)
+            .scalar_subquery()
+        )
+        return self._filter_tags(
+            select(Tag, devices_count.label("devices_count")),
+            user_id,
+            query_params,
+        )
+
+    @staticmethod
+    def _tag_fields(tag: Tag, devices_count: int) -> dict[str, Any]:
+        return {
+            "id": tag.id,
+            "type_id": tag.type_id,
+            "devices_count": devices_count,
+            "name": tag.name,
+            "created_at": tag.created_at,
+            "updated_at": tag.modified_at,
+        }
+
+    async def _get_tag(self, user_id: UUID, tag_id: UUID) -> tuple[Tag, int]:
+        row = (
+            await self.db_session.execute(
+                self._select_tags(user_id)
+                .where(Tag.id == tag_id)
+                .execution_options(populate_existing=True)
+            )
+        ).first()
+        if row is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Tag not found.",
+            )
+
+        return row.Tag, row.devices_count
+
+    async def _check_devices(self, user_id: UUID, devices_ids: list[UUID]) -> None:
+        if not devices_ids:
+            return
+
+        found = await self.db_session.scalar(
+            select(func.count()).where(
+                Device.id.in_(devices_ids), Device.user_id == user_id
+            )
+        )
+        if found != len(set(devices_ids)):
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Device not found.",
+            )
+
+    async def _set_devices(self, tag_id: UUID, devices_ids: list[UUID]) -> set[UUID]:
+        removed = await self.db_session.scalars(
+            delete(TagDeviceLookUp)
+            .where(
+                TagDeviceLookUp.tag_id == tag_id,
+                TagDeviceLookUp.device_id.not_in(devices_ids),
+            )
+            .returning(TagDeviceLookUp.device_id)
+        )
+        changed = set(removed)
+        if not devices_ids:
+            return changed
+
+        # one INSERT ... SELECT for all devices instead of a row per device
+        added = await self.db_session.scalars(
+            insert(TagDeviceLookUp)
+            .from_select(
+                ["id", "tag_id", "device_id"],
+                select(func.gen_random_uuid(), literal(tag_id), Device.id).where(
+                    Device.id.in_(devices_ids)
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(TagDeviceLookUp.device_id)
+        )
+        return changed | set(added)
+
     async def get_tag_by_id(
         self,
         user_id: UUID,
         tag_id: UUID,
     ) -> GetTagResponse:
-        return GetTagResponse(
-            id=tag_id,
-            type_id=uuid4(),
-            device_id=[uuid4(), uuid4(), uuid4()],
-            name="mocked tag name",
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
-        )
+        return GetTagResponse(**self._tag_fields(*await self._get_tag(user_id, tag_id)))
 
-    # TODO: implement
     async def get_tags(
         self, user_id: UUID, query_params: GetTagQueryParams
     ) -> list[GetTagResponse]:
-        return [
-            GetTagResponse(
-                id=uuid4(),
-                type_id=uuid4(),
-                device_id=[uuid4(), uuid4(), uuid4()],
-                name="mocked tag name 1",
-                created_at=datetime.now(),
-                updated_at=datetime.now(),
+        rows = await self.db_session.execute(
+            self._select_tags(user_id, query_params)
+            .order_by(Tag.created_at, Tag.id)
+            .offset((query_params.page - 1) * query_params.size)
+            .limit(query_params.size)
+        )
+        return [GetTagResponse(**self._tag_fields(*row)) for row in rows]
+
+    async def get_tags_by_keyset(
+        self,
+        user_id: UUID,
+        query_params: TagFilterParams,
+        keyset: Keyset | None,
+        size: int,
+    ) -> list[GetTagResponse]:
+        rows = await self.db_session.execute(
+            paginate_by_keyset(
+                self._select_tags(user_id, query_params), Tag, keyset, size
             )
-            for i in range(query_params.size)
-        ]
+        )
+        return [GetTagResponse(**self._tag_fields(*row)) for row in rows]
+
+    async def count_tags(
+        self,
+        user_id: UUID,
+        query_params: TagFilterParams,
+        estimate: bool = False,
+    ) -> int:
+        if estimate:
+            return await estimate_count(
+                self.db_session,
+                self._filter_tags(select(Tag.id), user_id, query_params),
+            )
+
+        return await self.db_session.scalar(
+            self._filter_tags(select(func.count()), user_id, query_params)
+        )
 
-    # TODO: implement
     async def create_tag(
         self,
         user_id: UUID,
         type_id: UUID,
         devices_ids: list[UUID],
         name: str,
-    ) -> CreateTagResponse:
-        return CreateTagResponse(
-            id=uuid4(),
-            type_id=type_id,
-            devices_ids=devices_ids,
-            name=name,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+    ) -> tuple[CreateTagResponse, set[UUID]]:
+        type_exists = await self.db_session.scalar(
+            select(Type.id).where(Type.id == type_id, Type.user_id == user_id)
         )
+        if type_exists is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Type not found.",
+            )
+        await self._check_devices(user_id, devices_ids)
+
+        tag = Tag(id=uuid4(), user_id=user_id, type_id=type_id, name=name)
+        self.db_session.add(tag)
+        await self.db_session.flush()
+        changed = await self._set_devices(tag.id, devices_ids)
+        await self.db_session.commit()
+
+        fields = self._tag_fields(*await self._get_tag(user_id, tag.id))
+        return CreateTagResponse(**fields), changed
 
-    # TODO: implement
     async def update_tag(
         self, user_id: UUID, tag_id: UUID, name: str, devices_ids: list[UUID]
-    ) -> UpdateTagResponse:
-        return UpdateTagResponse(
-            id=tag_id,
-            type_id=uuid4(),
-            devices_ids=devices_ids,
-            name=name,
-            created_at=datetime.now(),
-            updated_at=datetime.now(),
+    ) -> tuple[UpdateTagResponse, set[UUID]]:
+        tag, _ = await self._get_tag(user_id, tag_id)
+        await self._check_devices(user_id, devices_ids)
+        tag.name = name
+        changed = await self._set_devices(tag_id, devices_ids)
+        await self.db_session.commit()
+
+        fields = self._tag_fields(*await self._get_tag(user_id, tag_id))
+        return UpdateTagResponse(**fields), changed
+
+    async def update_tag_devices(
+        self, user_id: UUID, tag_id: UUID, add: list[UUID], remove: list[UUID]
+    ) -> tuple[list[UUID], list[UUID]]:
+        tag_exists = exists().where(Tag.id == tag_id, Tag.user_id == user_id)
+        removed = (
+            delete(TagDeviceLookUp)
+            .where(
+                TagDeviceLookUp.tag_id == tag_id,
+                TagDeviceLookUp.device_id
+                == any_(bindparam("remove", remove, type_=ARRAY(PG_UUID()))),
+                tag_exists,
+            )
+            .returning(TagDeviceLookUp.device_id)
+            .cte("removed")
         )
+        added = (
+            insert(TagDeviceLookUp)
+            .from_select(
+                ["id", "tag_id", "device_id"],
+                select(func.gen_random_uuid(), literal(tag_id), Device.id).where(
+                    Device.id == any_(bindparam("add", add, type_=ARRAY(PG_UUID()))),
+                    Device.user_id == user_id,
+                    tag_exists,
+                ),
+            )
+            .on_conflict_do_nothing()
+            .returning(TagDeviceLookUp.device_id)
+            .cte("added")
+        )
+        row = (
+            await self.db_session.execute(
+                select(
+                    tag_exists.label("tag_exists"),
+                    select(func.array_agg(added.c.device_id))
+                    .scalar_subquery()
+                    .label("added"),
+                    select(func.array_agg(removed.c.device_id))
+                    .scalar_subquery()
+                    .label("removed"),
+                )
+            )
+        ).one()
+        if not row.tag_exists:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Tag not found.",
+            )
+
+        await self.db_session.commit()
+        return row.added or [], row.removed or []
+
+    async def delete_tag(self, user_id: UUID, tag_id: UUID) -> list[UUID]:
+        # the lookups go first, the cascade of the tag would not report them
+        removed = await self.db_session.scalars(
+            delete(TagDeviceLookUp)
+            .where(
+                TagDeviceLookUp.tag_id.in_(
+                    select(Tag.id).where(Tag.id == tag_id, Tag.user_id == user_id)
+                )
+            )
+            .returning(TagDeviceLookUp.device_id)
+        )
+        devices_ids = list(removed)
+        tag_exists = await self.db_session.scalar(
+            delete(Tag)
+            .where(Tag.id == tag_id, Tag.user_id == user_id)
+            .returning(Tag.id)
+        )
+        if tag_exists is None:
+            raise HTTPException(
+                status_code=http.HTTPStatus.NOT_FOUND,
+                detail="Tag not found.",
+            )
 
-    # TODO: implement
-    async def delete_tag(self, user_id: UUID, tag_id: UUID) -> None:
-        return None
+        await self.db_session.commit()
+        return devices_ids
 
 
 def get_tag_repo(db_session: DBSessionType) -> ITagRepo:
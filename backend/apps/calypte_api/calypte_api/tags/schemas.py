@@ -1,18 +1,28 @@
 from datetime import datetime
 from uuid import UUID
 
+from calypte_api.common.pagination import CursorParams
+
 from fastapi_pagination import Params
-from pydantic import BaseModel, ConfigDict, Field
+from pydantic import BaseModel, ConfigDict, Field, model_validator
 
 
 class BaseTagRequestSchema(BaseModel):
     ...
 
 
-class GetTagQueryParams(BaseTagRequestSchema, Params):
+class TagFilterParams(BaseTagRequestSchema):
     name: str | None = Field(default=None)
 
 
+class GetTagQueryParams(TagFilterParams, Params):
+    ...
+
+
+class GetTagCursorParams(TagFilterParams, CursorParams):
+    ...
+
+
 class CreateTagRequestBody(BaseTagRequestSchema):
     name: str
 
@@ -26,6 +36,18 @@ class UpdateTagRequestBody(BaseTagRequestSchema):
     devices_ids: list[UUID]
 
 
+class UpdateTagDevicesRequestBody(BaseTagRequestSchema):
+    add: list[UUID] = Field(default_factory=list)
+    remove: list[UUID] = Field(default_factory=list)
+
+    @model_validator(mode="after")
+    def check_disjoint(self) -> "UpdateTagDevicesRequestBody":
+        if set(self.add) & set(self.remove):
+            raise ValueError("A device can not be both added and removed.")
+
+        return self
+
+
 class BaseTagResponseSchema(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
 
@@ -35,7 +57,7 @@ class CreateTagResponse(BaseTagResponseSchema):
     name: str
 
     type_id: UUID
-    devices_ids: list[UUID]
+    devices_count: int
 
     created_at: datetime = Field(alias="createdAt")
     updated_at: datetime = Field(alias="updatedAt")
@@ -46,7 +68,7 @@ class UpdateTagResponse(BaseTagResponseSchema):
     name: str
 
     type_id: UUID
-    devices_ids: list[UUID]
+    devices_count: int
 
     created_at: datetime = Field(alias="createdAt")
     updated_at: datetime = Field(alias="updatedAt")
@@ -57,7 +79,12 @@ class GetTagResponse(BaseTagResponseSchema):
     name: str
 
     type_id: UUID
-    device_id: list[UUID]
+    devices_count: int
 
     created_at: datetime = Field(alias="createdAt")
     updated_at: datetime = Field(alias="updatedAt")
+
+
+class UpdateTagDevicesResponse(BaseTagResponseSchema):
+    added: int
+    removed: int
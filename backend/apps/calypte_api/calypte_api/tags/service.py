@@ -1,18 +1,29 @@
 from abc import ABC, abstractmethod
+from collections.abc import Iterable
 from typing import Annotated
 from uuid import UUID
 
+from calypte_api.common.cache import CacheResource, IResponseCache, ResponseCacheType
+from calypte_api.common.pagination import (
+    CursorPage,
+    PageTotal,
+    create_cursor_page,
+    decode_keyset,
+)
 from calypte_api.tags.repository import ITagRepo, TagRepositoryType
 from calypte_api.tags.schemas import (
     CreateTagRequestBody,
     CreateTagResponse,
+    GetTagCursorParams,
     GetTagQueryParams,
     GetTagResponse,
+    UpdateTagDevicesRequestBody,
+    UpdateTagDevicesResponse,
     UpdateTagRequestBody,
     UpdateTagResponse,
 )
 
-from fastapi import Depends
+from fastapi import Depends, Response
 from fastapi_pagination import Page
 
 
@@ -22,26 +33,46 @@ class ITagService(ABC):
         self,
         user_id: UUID,
         tag_id: UUID,
-    ) -> GetTagResponse:
+    ) -> Response:
         """
-        Get tag by id
+        Get tag by id, served from the response cache
 
         Args:
             user_id (UUID): user id
             tag_id (UUID): tag id
 
+        returns:
+            Response: serialized GetTagResponse
         """
 
     @abstractmethod
     async def get_tags(
         self, user_id: UUID, query_params: GetTagQueryParams
-    ) -> Page[GetTagResponse]:
+    ) -> Response:
+        """
+        Get all tags, served from the response cache
+
+        Args:
+            user_id (UUID): user id
+
+        returns:
+            Response: serialized Page[GetTagResponse]
         """
-        Get all tags
+
+    @abstractmethod
+    async def get_tags_by_cursor(
+        self, user_id: UUID, query_params: GetTagCursorParams
+    ) -> Response:
+        """
+        Get a page of tags after the cursor, served from the response cache
 
         Args:
             user_id (UUID): user id
+            query_params (GetTagCursorParams): filters, cursor, page size and
+                whether to count the tags
 
+        returns:
+            Response: serialized CursorPage[GetTagResponse]
         """
 
     @abstractmethod
@@ -73,6 +104,25 @@ class ITagService(ABC):
             request_body (CreateTagRequestBody): request body
         """
 
+    @abstractmethod
+    async def update_tag_devices(
+        self,
+        user_id: UUID,
+        tag_id: UUID,
+        request_body: UpdateTagDevicesRequestBody,
+    ) -> UpdateTagDevicesResponse:
+        """
+        Add and remove devices of a tag without sending the whole membership
+
+        Args:
+            user_id (UUID): user id
+            tag_id (UUID): tag id
+            request_body (UpdateTagDevicesRequestBody): request body
+
+        returns:
+            UpdateTagDevicesResponse: number of added and removed devices
+        """
+
     @abstractmethod
     async def delete_tag(self, user_id: UUID, tag_id: UUID) -> None:
         """
@@ -85,41 +135,94 @@ class ITagService(ABC):
 
 
 class TagService(ITagService):
-    def __init__(self, tag_repo: ITagRepo):
+    def __init__(self, tag_repo: ITagRepo, response_cache: IResponseCache):
         self.tag_repo = tag_repo
+        self.response_cache = response_cache
 
     async def get_tag(
         self,
         user_id: UUID,
         tag_id: UUID,
-    ) -> GetTagResponse:
-        return await self.tag_repo.get_tag_by_id(
+    ) -> Response:
+        content = await self.response_cache.get_item(
             user_id=user_id,
-            tag_id=tag_id,
+            resource=CacheResource.TAGS,
+            item_id=tag_id,
+            load=lambda: self.tag_repo.get_tag_by_id(user_id=user_id, tag_id=tag_id),
         )
+        return Response(content=content, media_type="application/json")
 
     async def get_tags(
         self, user_id: UUID, query_params: GetTagQueryParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.TAGS,
+            query_params=query_params,
+            load=lambda: self._load_tags(user_id=user_id, query_params=query_params),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def get_tags_by_cursor(
+        self, user_id: UUID, query_params: GetTagCursorParams
+    ) -> Response:
+        content = await self.response_cache.get_list(
+            user_id=user_id,
+            resource=CacheResource.TAGS,
+            query_params=query_params,
+            load=lambda: self._load_tags_by_cursor(
+                user_id=user_id, query_params=query_params
+            ),
+        )
+        return Response(content=content, media_type="application/json")
+
+    async def _load_tags(
+        self, user_id: UUID, query_params: GetTagQueryParams
     ) -> Page[GetTagResponse]:
         tags = await self.tag_repo.get_tags(
             user_id=user_id,
             query_params=query_params,
         )
+        total = await self.tag_repo.count_tags(
+            user_id=user_id,
+            query_params=query_params,
+        )
         return Page.create(
             items=tags,
             params=query_params,
-            total=query_params.size,
+            total=total,
         )
 
+    async def _load_tags_by_cursor(
+        self, user_id: UUID, query_params: GetTagCursorParams
+    ) -> CursorPage[GetTagResponse]:
+        tags = await self.tag_repo.get_tags_by_keyset(
+            user_id=user_id,
+            query_params=query_params,
+            keyset=decode_keyset(query_params.cursor),
+            size=query_params.size,
+        )
+        total = None
+        if query_params.total != PageTotal.NONE:
+            total = await self.tag_repo.count_tags(
+                user_id=user_id,
+                query_params=query_params,
+                estimate=query_params.total == PageTotal.ESTIMATE,
+            )
+
+        return create_cursor_page(items=tags, params=query_params, total=total)
+
     async def create_tag(
         self, user_id: UUID, request_body: CreateTagRequestBody
     ) -> CreateTagResponse:
-        return await self.tag_repo.create_tag(
+        tag, devices = await self.tag_repo.create_tag(
             user_id=user_id,
             name=request_body.name,
             type_id=request_body.type_id,
             devices_ids=request_body.devices_ids,
         )
+        await self._invalidate(user_id=user_id, tag_id=tag.id, devices=devices)
+        return tag
 
     async def update_tag(
         self,
@@ -127,19 +230,58 @@ class TagService(ITagService):
         tag_id: UUID,
         request_body: UpdateTagRequestBody,
     ) -> UpdateTagResponse:
-        return await self.tag_repo.update_tag(
+        tag, devices = await self.tag_repo.update_tag(
             user_id=user_id,
             tag_id=tag_id,
             name=request_body.name,
             devices_ids=request_body.devices_ids,
         )
+        await self._invalidate(user_id=user_id, tag_id=tag_id, devices=devices)
+        return tag
+
+    async def update_tag_devices(
+        self,
+        user_id: UUID,
+        tag_id: UUID,
+        request_body: UpdateTagDevicesRequestBody,
+    ) -> UpdateTagDevicesResponse:
+        added, removed = await self.tag_repo.update_tag_devices(
+            user_id=user_id,
+            tag_id=tag_id,
+            add=request_body.add,
+            remove=request_body.remove,
+        )
+        await self._invalidate(user_id=user_id, tag_id=tag_id, devices=added + removed)
+        return UpdateTagDevicesResponse(added=len(added), removed=len(removed))
 
     async def delete_tag(self, user_id: UUID, tag_id: UUID) -> None:
-        return await self.tag_repo.delete_tag(user_id=user_id, tag_id=tag_id)
+        devices = await self.tag_repo.delete_tag(user_id=user_id, tag_id=tag_id)
+        await self._invalidate(user_id=user_id, tag_id=tag_id, devices=devices)
+
+    async def _invalidate(
+        self, user_id: UUID, tag_id: UUID, devices: Iterable[UUID]
+    ) -> None:
+        """
+        Drop the cached tag and the devices whose tags changed with it
+
+        Args:
+            user_id (UUID): user id
+            tag_id (UUID): changed tag
+            devices (Iterable[UUID]): devices that joined or left the tag
+        """
+        await self.response_cache.invalidate(
+            user_id=user_id, resource=CacheResource.TAGS, item_ids=[tag_id]
+        )
+        if devices := list(devices):
+            await self.response_cache.invalidate(
+                user_id=user_id, resource=CacheResource.DEVICES, item_ids=devices
+            )
 
 
-def get_tag_service(tag_repo: TagRepositoryType) -> ITagService:
-    return TagService(tag_repo=tag_repo)
+def get_tag_service(
+    tag_repo: TagRepositoryType, response_cache: ResponseCacheType
+) -> ITagService:
+    return TagService(tag_repo=tag_repo, response_cache=response_cache)
 
 
 TagServiceType = Annotated[ITagService, Depends(get_tag_service)]
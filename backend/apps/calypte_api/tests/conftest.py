@@ -0,0 +1,196 @@
+import os
+import socket
+import tempfile
+import time
+
+from collections.abc import Callable, Iterator
+from typing import Any
+from uuid import UUID, uuid4
+
+import pytest
+
+
+# settings are read when the application modules are imported, the unit tests
+# do not connect to any of these services, the `client` tests skip when they
+# are not running, e.g. started with `scripts/dev.sh up -d calypteDB redis`
+_TEST_ENVIRONMENT = {
+    "POSTGRES_DB": "calypte_db",
+    "POSTGRES_USER": "calypte",
+    "POSTGRES_PASSWORD": "calypte",
+    "POSTGRES_HOST": "127.0.0.1",
+    "POSTGRES_PORT": "5431",
+    "REDIS_HOST": "127.0.0.1",
+    "REDIS_PORT": "6379",
+    "CACHE_EXPIRE_IN_SECONDS": "300",
+    "SERVICE_NAME": "Calypte API",
+    "SERVICE_DESCRIPTION": "API for the Calypte web client",
+    "SERVICE_HOST": "0.0.0.0",
+    "SERVICE_PORT": "8080",
+    "JWT_SECRET_KEY": "test-secret",
+    # creates the tables on startup
+    "DEBUG": "true",
+    "FIRMWARE_STORAGE_DIR": os.path.join(
+        tempfile.gettempdir(), "calypte-test-firmware"
+    ),
+    # uploads of a few parts stay small
+    "FIRMWARE_UPLOAD_PART_SIZE": str(64 * 1024),
+}
+
+for name, value in _TEST_ENVIRONMENT.items():
+    os.environ.setdefault(name, value)
+
+
+from calypte_api.common import databases  # noqa: E402
+from calypte_api.common.models import Type  # noqa: E402
+from calypte_api.common.settings import get_settings  # noqa: E402
+from calypte_api.common.user_roles import UserRole  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+from jose import jwt  # noqa: E402
+
+
+def _is_reachable(host: str, port: int) -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=1):
+            return True
+    except OSError:
+        return False
+
+
+@pytest.fixture(scope="session")
+def client() -> Iterator[TestClient]:
+    """
+    The application with its lifespan, connected to PostgreSQL and Redis
+
+    Every test works as a tenant of its own, they share the database.
+    """
+    settings = get_settings()
+    for service, host, port in (
+        ("PostgreSQL", settings.postgres_host, settings.postgres_port),
+        ("Redis", settings.redis_host, settings.redis_port),
+    ):
+        if not _is_reachable(host, port):
+            pytest.skip(f"{service} is not running at {host}:{port}")
+
+    from calypte_api.main import app
+
+    with TestClient(app) as client:
+        yield client
+
+
+def _create_auth_headers(
+    user_id: UUID, role: UserRole = UserRole.USER
+) -> dict[str, str]:
+    settings = get_settings()
+    now = int(time.time())
+    token = jwt.encode(
+        {
+            "user": {"id": str(user_id), "role": role},
+            "access_jti": str(uuid4()),
+            "refresh_jti": str(uuid4()),
+            "exp": now + 3600,
+            "iat": now,
+        },
+        settings.jwt_secret_key,
+        algorithm=settings.jwt_encoding_algorithm,
+    )
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def create_auth_headers() -> Callable[..., dict[str, str]]:
+    return _create_auth_headers
+
+
+@pytest.fixture
+def user_id() -> UUID:
+    return uuid4()
+
+
+@pytest.fixture
+def auth_headers(user_id: UUID) -> dict[str, str]:
+    return _create_auth_headers(user_id)
+
+
+@pytest.fixture
+def create_type(client: TestClient, user_id: UUID) -> Callable[[], UUID]:
+    # there is no API for types
+    async def _create_type() -> UUID:
+        async with databases.async_session() as db_session:
+            type_ = Type(user_id=user_id, name="type")
+            db_session.add(type_)
+            await db_session.commit()
+            return type_.id
+
+    return lambda: client.portal.call(_create_type)
+
+
+@pytest.fixture
+def type_id(create_type: Callable[[], UUID]) -> UUID:
+    return create_type()
+
+
+@pytest.fixture
+def upload_firmware(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> Callable[..., dict[str, Any]]:
+    def _upload_firmware(
+        firmware: bytes, version: str, type_id: UUID = type_id
+    ) -> dict[str, Any]:
+        response = client.post(
+            "/api/v1/firmware",
+            data={
+                "type_id": str(type_id),
+                "name": "firmware",
+                "version": version,
+                "description": "firmware",
+            },
+            files={"firmware": ("firmware.bin", firmware)},
+            headers=auth_headers,
+        )
+        assert response.status_code == 201, response.text
+        return response.json()
+
+    return _upload_firmware
+
+
+@pytest.fixture
+def create_tag(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> Callable[..., dict[str, Any]]:
+    def _create_tag(
+        devices_ids: list[UUID] | None = None, type_id: UUID = type_id
+    ) -> dict[str, Any]:
+        response = client.post(
+            "/api/v1/tags",
+            json={
+                "name": "tag",
+                "type_id": str(type_id),
+                "devices_ids": [str(device_id) for device_id in devices_ids or []],
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == 201, response.text
+        return response.json()
+
+    return _create_tag
+
+
+@pytest.fixture
+def create_device(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> Callable[..., dict[str, Any]]:
+    def _create_device(
+        tags: list[UUID] | None = None, type_id: UUID = type_id
+    ) -> dict[str, Any]:
+        response = client.post(
+            "/api/v1/devices",
+            json={
+                "type_id": str(type_id),
+                "tags": [str(tag) for tag in tags or []],
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == 201, response.text
+        return response.json()
+
+    return _create_device
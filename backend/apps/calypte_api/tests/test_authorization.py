@@ -0,0 +1,276 @@
+import os
+import time
+
+from collections.abc import Callable
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from calypte_api.common import databases
+from calypte_api.common.authorization import (
+    REVOKED_TOKENS_KEY,
+    DeviceClaims,
+    JwtClaims,
+    RevokedTokens,
+    TokenCache,
+    _decode_with_hmac,
+    create_device_token,
+    decode_device_token,
+    decode_token,
+    is_revoked,
+    revoke_token,
+    revoked_tokens,
+)
+from calypte_api.common.settings import get_settings
+from fastapi.testclient import TestClient
+from jose import jwt
+from redis.exceptions import ConnectionError
+
+
+def _claims(exp_in_seconds: int = 3600) -> dict:
+    now = int(time.time())
+    return {
+        "user": {"id": str(uuid4()), "role": "user"},
+        "access_jti": str(uuid4()),
+        "refresh_jti": str(uuid4()),
+        "exp": now + exp_in_seconds,
+        "iat": now,
+    }
+
+
+def _token(claims: dict, algorithm: str = "HS256") -> str:
+    return jwt.encode(claims, get_settings().jwt_secret_key, algorithm=algorithm)
+
+
+def test_decode_token() -> None:
+    claims = _claims()
+    token = _token(claims)
+
+    assert decode_token(token) == JwtClaims.model_validate(claims)
+    # the second decode is served by the token cache
+    assert decode_token(token) == JwtClaims.model_validate(claims)
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        _token(_claims(exp_in_seconds=-10)),
+        _token(_claims())[:-2] + "AA",
+        jwt.encode(_claims(), "another-secret", algorithm="HS256"),
+        _token({"user": {"id": "x"}}),
+        "not.a.token",
+        "",
+    ],
+)
+def test_decode_token_rejects(token: str) -> None:
+    assert decode_token(token) is None
+
+
+class _Redis:
+    """
+    The revoked token ids, in memory
+    """
+
+    def __init__(self, revoked: dict[str, float] | None = None) -> None:
+        self.revoked = revoked or {}
+        self.calls = 0
+        self.unavailable = False
+
+    async def zscore(self, key: str, member: str) -> float | None:
+        self.calls += 1
+        if self.unavailable:
+            raise ConnectionError("Redis is unavailable.")
+
+        assert key == REVOKED_TOKENS_KEY
+        return self.revoked.get(member)
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_is_revoked_skips_redis_for_unknown_ids() -> None:
+    claims = JwtClaims.model_validate(_claims())
+    redis_client = _Redis()
+
+    assert not await is_revoked(redis_client, claims)  # type: ignore[arg-type]
+    assert redis_client.calls == 0
+
+
+@pytest.mark.anyio
+async def test_is_revoked_confirms_filter_hits() -> None:
+    claims = JwtClaims.model_validate(_claims())
+    revoked_tokens.add(claims.access_jti)
+    redis_client = _Redis(revoked={claims.access_jti: claims.exp})
+
+    assert await is_revoked(redis_client, claims)  # type: ignore[arg-type]
+    assert redis_client.calls == 1
+
+
+@pytest.mark.anyio
+async def test_is_revoked_accepts_false_positives() -> None:
+    claims = JwtClaims.model_validate(_claims())
+    # known to the filter but not revoked
+    revoked_tokens.add(claims.access_jti)
+
+    assert not await is_revoked(_Redis(), claims)  # type: ignore[arg-type]
+
+
+@pytest.mark.anyio
+async def test_is_revoked_rejects_filter_hits_without_redis() -> None:
+    claims = JwtClaims.model_validate(_claims())
+    revoked_tokens.add(claims.access_jti)
+    redis_client = _Redis()
+    redis_client.unavailable = True
+
+    assert await is_revoked(redis_client, claims)  # type: ignore[arg-type]
+
+
+def test_decode_with_hmac_matches_jose() -> None:
+    claims = _claims()
+
+    assert _decode_with_hmac(_token(claims)) == claims
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        _token(_claims(), algorithm="HS512"),
+        jwt.encode(_claims(), "another-secret", algorithm="HS256"),
+        _token(_claims())[:-2] + "AA",
+        "e30.e30.",
+        "a.b",
+    ],
+)
+def test_decode_with_hmac_rejects(token: str) -> None:
+    with pytest.raises(ValueError):
+        _decode_with_hmac(token)
+
+
+def test_token_cache_drops_expired_entries() -> None:
+    cache = TokenCache(max_size=10)
+    claims = JwtClaims.model_validate(_claims(exp_in_seconds=60))
+    cache.set("token", claims)
+
+    assert cache.get("token", now=claims.exp) is claims
+    assert cache.get("token", now=claims.exp + 1) is None
+    assert cache.get("token", now=claims.exp) is None
+
+
+def test_token_cache_evicts_least_recently_used() -> None:
+    cache = TokenCache(max_size=2)
+    claims = JwtClaims.model_validate(_claims())
+    cache.set("first", claims)
+    cache.set("second", claims)
+
+    cache.get("first", now=time.time())
+    cache.set("third", claims)
+
+    assert cache.get("first", now=time.time()) is claims
+    assert cache.get("second", now=time.time()) is None
+    assert cache.get("third", now=time.time()) is claims
+
+
+def test_revoked_tokens_replace() -> None:
+    revoked = RevokedTokens(capacity=10, error_rate=1e-6)
+    revoked.add("expired")
+
+    revoked.replace([b"first", b"second"])
+
+    assert "first" in revoked
+    assert b"second" in revoked
+    assert "expired" not in revoked
+
+
+def test_decode_device_token() -> None:
+    user_id, device_id, type_id = str(uuid4()), str(uuid4()), str(uuid4())
+    exp = int(time.time()) + 60
+
+    token = create_device_token(user_id, device_id, type_id, exp)
+
+    assert decode_device_token(token) == DeviceClaims(
+        user_id=user_id, device_id=device_id, type_id=type_id, exp=exp
+    )
+
+
+def test_decode_device_token_rejects_expired() -> None:
+    token = create_device_token(
+        str(uuid4()), str(uuid4()), str(uuid4()), int(time.time()) - 1
+    )
+
+    assert decode_device_token(token) is None
+
+
+def test_decode_device_token_rejects_tampered() -> None:
+    user_id, device_id, type_id = str(uuid4()), str(uuid4()), str(uuid4())
+    exp = int(time.time()) + 60
+    token = create_device_token(user_id, device_id, type_id, exp)
+
+    assert decode_device_token(token.replace(type_id, str(uuid4()))) is None
+    assert decode_device_token(token.replace(str(exp), str(exp + 3600))) is None
+    assert decode_device_token(token[:-1] + ("A" if token[-1] != "A" else "B")) is None
+
+
+@pytest.mark.parametrize(
+    "token", ["dev.", "dev.x.y", "dev.é.ü", "dev.a.b.c.1.", "", "."]
+)
+def test_decode_device_token_rejects_garbage(token: str) -> None:
+    assert decode_device_token(token) is None
+
+
+@pytest.mark.anyio
+async def test_is_revoked_rejects_device_tokens_issued_before() -> None:
+    claims = DeviceClaims(
+        user_id=str(uuid4()),
+        device_id=str(uuid4()),
+        type_id=str(uuid4()),
+        exp=int(time.time()) + 60,
+    )
+    revoked_tokens.add(f"dev.{claims.device_id}")
+    redis_client = _Redis(revoked={f"dev.{claims.device_id}": claims.exp})
+
+    assert await is_revoked(redis_client, claims)  # type: ignore[arg-type]
+    # issued after the revocation
+    assert not await is_revoked(
+        redis_client,  # type: ignore[arg-type]
+        claims._replace(exp=claims.exp + 1),
+    )
+
+
+def test_revoked_token_is_rejected(
+    client: TestClient, auth_headers: dict[str, str]
+) -> None:
+    token = auth_headers["Authorization"].removeprefix("Bearer ")
+    claims = decode_token(token)
+    assert claims is not None
+    assert client.get("/api/v1/tags", headers=auth_headers).status_code == 200
+
+    client.portal.call(revoke_token, databases.redis, claims)
+
+    assert client.get("/api/v1/tags", headers=auth_headers).status_code == 403
+
+
+def test_deleted_device_token_is_rejected(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    device = create_device()
+    response = client.post(
+        f"/api/v1/devices/{device['id']}/token", headers=auth_headers
+    )
+    assert response.status_code == 201, response.text
+    device_headers = {"Authorization": f"Bearer {response.json()['token']}"}
+    response = client.get(f"/api/v1/firmware/{firmware['id']}", headers=device_headers)
+    assert response.status_code == 200
+
+    response = client.delete(f"/api/v1/devices/{device['id']}", headers=auth_headers)
+    assert response.status_code == 204
+
+    response = client.get(f"/api/v1/firmware/{firmware['id']}", headers=device_headers)
+    assert response.status_code == 403
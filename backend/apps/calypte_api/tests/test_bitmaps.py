@@ -0,0 +1,89 @@
+import random
+
+import pytest
+
+from calypte_api.common.bitmaps import Bitmap
+
+
+# sparse and dense containers, values in several containers and none at all
+VALUE_SETS = [
+    set(),
+    {0, 1, 65535},
+    {7, 65536, 65537, 10 * 65536 + 42},
+    set(range(0, 20_000, 2)),
+    set(range(65536)),
+    set(random.Random(1).sample(range(1 << 20), 5000)),
+]
+
+
+@pytest.mark.parametrize("values", VALUE_SETS)
+def test_serialize_round_trip(values: set[int]) -> None:
+    bitmap = Bitmap.from_values(values)
+
+    restored = Bitmap.deserialize(bitmap.serialize())
+
+    assert restored == bitmap
+    assert list(restored) == sorted(values)
+    assert len(restored) == len(values)
+
+
+def test_serialize_sparse_container_as_array() -> None:
+    # header, then a container header and a uint16 per value
+    assert len(Bitmap.from_values({1, 2, 3}).serialize()) == 4 + 6 + 3 * 2
+
+
+def test_serialize_dense_container_as_bitset() -> None:
+    assert len(Bitmap.from_values(range(5000)).serialize()) == 4 + 6 + 8192
+
+
+@pytest.mark.parametrize(
+    ("left", "right"),
+    [
+        (VALUE_SETS[1], VALUE_SETS[2]),
+        (VALUE_SETS[3], VALUE_SETS[4]),
+        (VALUE_SETS[4], VALUE_SETS[5]),
+        (VALUE_SETS[5], set(random.Random(2).sample(range(1 << 20), 5000))),
+        (VALUE_SETS[0], VALUE_SETS[3]),
+    ],
+)
+def test_set_operations(left: set[int], right: set[int]) -> None:
+    left_bitmap, right_bitmap = Bitmap.from_values(left), Bitmap.from_values(right)
+
+    assert list(left_bitmap & right_bitmap) == sorted(left & right)
+    assert list(left_bitmap | right_bitmap) == sorted(left | right)
+    assert list(left_bitmap - right_bitmap) == sorted(left - right)
+    assert list(right_bitmap - left_bitmap) == sorted(right - left)
+
+
+def test_set_operations_drop_empty_containers() -> None:
+    bitmap = Bitmap.from_values({1, 65536})
+
+    assert bitmap - bitmap == Bitmap()
+    assert not bitmap & Bitmap.from_values({2, 65537})
+
+
+def test_operators_return_new_bitmaps() -> None:
+    left, right = Bitmap.from_values({1, 2}), Bitmap.from_values({2, 3})
+
+    left | right
+    left - right
+
+    assert list(left) == [1, 2]
+    assert list(right) == [2, 3]
+
+
+def test_iter_from() -> None:
+    bitmap = Bitmap.from_values({3, 70, 65535, 65536, 200_000})
+
+    assert list(bitmap.iter_from(70)) == [70, 65535, 65536, 200_000]
+    assert list(bitmap.iter_from(65536)) == [65536, 200_000]
+    assert list(bitmap.iter_from(200_001)) == []
+
+
+def test_contains() -> None:
+    bitmap = Bitmap.from_values({3, 65536})
+
+    assert 3 in bitmap
+    assert 65536 in bitmap
+    assert 4 not in bitmap
+    assert 3 + 65536 not in bitmap
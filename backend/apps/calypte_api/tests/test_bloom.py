@@ -0,0 +1,39 @@
+import pytest
+
+from calypte_api.common.bloom import BloomFilter
+
+
+def test_added_items_are_present() -> None:
+    bloom = BloomFilter(capacity=1000, error_rate=0.01)
+    items = [f"jti-{i}" for i in range(1000)]
+    for item in items:
+        bloom.add(item)
+
+    assert all(item in bloom for item in items)
+
+
+def test_str_and_bytes_items_are_the_same() -> None:
+    bloom = BloomFilter(capacity=10, error_rate=0.01)
+    bloom.add("jti")
+
+    assert b"jti" in bloom
+
+
+def test_empty_filter_has_no_items() -> None:
+    bloom = BloomFilter(capacity=0, error_rate=0.01)
+
+    assert "jti" not in bloom
+    assert bloom.size >= 8
+    assert bloom.hash_count >= 1
+
+
+@pytest.mark.parametrize("error_rate", [0.1, 0.01, 0.001])
+def test_false_positive_rate(error_rate: float) -> None:
+    bloom = BloomFilter(capacity=5000, error_rate=error_rate)
+    for i in range(5000):
+        bloom.add(f"revoked-{i}")
+
+    false_positives = sum(f"valid-{i}" in bloom for i in range(50_000))
+
+    # a full filter stays within twice its target error rate
+    assert false_positives / 50_000 < 2 * error_rate
@@ -0,0 +1,534 @@
+import asyncio
+import time
+
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+import orjson
+import pytest
+
+from calypte_api.common import cache
+from calypte_api.common.cache import (
+    INVALIDATION_CHANNEL,
+    CacheResource,
+    LocalCache,
+    RedisResponseCache,
+    listen_for_invalidations,
+)
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+from redis.exceptions import ConnectionError
+
+
+class _Pipeline:
+    def __init__(self, redis_client: "_Redis"):
+        self.redis_client = redis_client
+        self.commands: list[tuple[str, tuple[Any, ...]]] = []
+
+    async def __aenter__(self) -> "_Pipeline":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    def delete(self, *keys: str) -> None:
+        self.commands.append(("delete", keys))
+
+    def publish(self, channel: str, message: bytes) -> None:
+        self.commands.append(("publish", (channel, message)))
+
+    def incr(self, key: str) -> None:
+        self.commands.append(("incr", (key,)))
+
+    async def execute(self) -> list[Any]:
+        self.redis_client.check()
+        results: list[Any] = []
+        for command, args in self.commands:
+            if command == "delete":
+                for key in args:
+                    self.redis_client.values.pop(key, None)
+            elif command == "publish":
+                self.redis_client.published.append(args)
+            else:
+                (key,) = args
+                self.redis_client.values[key] = (
+                    int(self.redis_client.values.get(key, 0)) + 1
+                )
+            results.append(True)
+        return results
+
+
+class _PubSub:
+    def __init__(self, redis_client: "_Redis"):
+        self.redis_client = redis_client
+
+    async def __aenter__(self) -> "_PubSub":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    async def subscribe(self, channel: str) -> None:
+        self.redis_client.check()
+        self.redis_client.subscribed.set()
+
+    async def listen(self) -> AsyncIterator[dict[str, Any]]:
+        while True:
+            message = await self.redis_client.messages.get()
+            self.redis_client.check()
+            yield {"type": "message", "data": message}
+
+
+class _Redis:
+    """
+    Keys, locks and published invalidations of the cache, in memory
+    """
+
+    def __init__(self) -> None:
+        self.values: dict[str, Any] = {}
+        self.published: list[tuple[str, bytes]] = []
+        self.messages: asyncio.Queue[bytes] = asyncio.Queue()
+        self.subscribed = asyncio.Event()
+        self.unavailable = False
+
+    def check(self) -> None:
+        if self.unavailable:
+            raise ConnectionError("Redis is unavailable.")
+
+    async def get(self, key: str) -> Any:
+        self.check()
+        return self.values.get(key)
+
+    async def set(self, key: str, value: Any, nx: bool = False, **_: Any) -> bool:
+        self.check()
+        if nx and key in self.values:
+            return False
+
+        self.values[key] = value
+        return True
+
+    async def eval(self, script: str, numkeys: int, *args: Any) -> None:
+        self.check()
+        keys, argv = args[:numkeys], args[numkeys:]
+        if script == cache._FILL_SCRIPT:
+            key, lock_key = keys
+            if self.values.get(lock_key) == argv[0]:
+                self.values[key] = argv[1]
+                del self.values[lock_key]
+        else:
+            (lock_key,) = keys
+            if self.values.get(lock_key) == argv[0]:
+                del self.values[lock_key]
+
+    def pipeline(self, transaction: bool = True) -> _Pipeline:
+        return _Pipeline(self)
+
+    def pubsub(self) -> _PubSub:
+        return _PubSub(self)
+
+
+class _Item(BaseModel):
+    id: UUID
+    name: str
+
+
+class _Query(BaseModel):
+    page: int
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def _reset_state(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(cache, "_inflight", {})
+    monkeypatch.setattr(
+        cache, "local_cache", LocalCache(max_size=100, expire_in_seconds=60)
+    )
+
+
+@pytest.fixture
+def redis_client() -> _Redis:
+    return _Redis()
+
+
+@pytest.fixture
+def response_cache(redis_client: _Redis) -> RedisResponseCache:
+    return RedisResponseCache(
+        redis_client=redis_client,  # type: ignore[arg-type]
+        expire_in_seconds=300,
+        fill_timeout_in_seconds=1,
+    )
+
+
+@pytest.fixture
+def loads() -> list[str]:
+    return []
+
+
+@pytest.fixture
+def load(loads: list[str]) -> Callable[[str], Any]:
+    def _load(name: str) -> Any:
+        async def _load_item() -> _Item:
+            loads.append(name)
+            return _Item(id=UUID(int=0), name=name)
+
+        return _load_item
+
+    return _load
+
+
+@pytest.mark.anyio
+async def test_item_is_loaded_once(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+
+    first = await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("first")
+    )
+    second = await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("second")
+    )
+
+    assert first == second
+    assert first == b'{"id":"%s","name":"first"}' % str(UUID(int=0)).encode()
+    assert loads == ["first"]
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_load(
+    response_cache: RedisResponseCache,
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    loaded = asyncio.Event()
+    calls = 0
+
+    async def _load() -> _Item:
+        nonlocal calls
+        calls += 1
+        await loaded.wait()
+        return _Item(id=item_id, name="item")
+
+    tasks = [
+        asyncio.create_task(
+            response_cache.get_item(user_id, CacheResource.TAGS, item_id, _load)
+        )
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0.01)
+    loaded.set()
+
+    assert len(set(await asyncio.gather(*tasks))) == 1
+    assert calls == 1
+
+
+@pytest.mark.anyio
+async def test_failed_load_is_raised_to_every_waiter(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    loaded = asyncio.Event()
+
+    async def _load() -> _Item:
+        await loaded.wait()
+        raise ValueError("load failed")
+
+    tasks = [
+        asyncio.create_task(
+            response_cache.get_item(user_id, CacheResource.TAGS, item_id, _load)
+        )
+        for _ in range(2)
+    ]
+    await asyncio.sleep(0.01)
+    loaded.set()
+
+    for result in await asyncio.gather(*tasks, return_exceptions=True):
+        assert isinstance(result, ValueError)
+    # the lock is released, the next request loads again
+    content = await response_cache.get_item(
+        user_id, CacheResource.TAGS, item_id, load("item")
+    )
+    assert b'"item"' in content
+
+
+@pytest.mark.anyio
+async def test_invalidate_drops_the_item(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("stale")
+    )
+
+    await response_cache.invalidate(user_id, CacheResource.DEVICES, [item_id])
+
+    content = await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("fresh")
+    )
+    assert b'"fresh"' in content
+    assert loads == ["stale", "fresh"]
+
+
+@pytest.mark.anyio
+async def test_value_read_before_a_write_is_not_cached(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+
+    async def _load() -> _Item:
+        # a write commits and invalidates while the old value is being read
+        await response_cache.invalidate(user_id, CacheResource.DEVICES, [item_id])
+        return _Item(id=item_id, name="stale")
+
+    content = await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, _load
+    )
+
+    assert b'"stale"' in content
+    content = await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("fresh")
+    )
+    assert b'"fresh"' in content
+
+
+@pytest.mark.anyio
+async def test_invalidate_drops_every_page(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id = uuid4()
+    for page in (1, 2, 1):
+        await response_cache.get_list(
+            user_id, CacheResource.TAGS, _Query(page=page), load(f"page {page}")
+        )
+    assert loads == ["page 1", "page 2"]
+
+    # a change of any item, or none in particular, e.g. a new one
+    await response_cache.invalidate(user_id, CacheResource.TAGS)
+
+    await response_cache.get_list(
+        user_id, CacheResource.TAGS, _Query(page=1), load("new page 1")
+    )
+    assert loads == ["page 1", "page 2", "new page 1"]
+
+
+@pytest.mark.anyio
+async def test_caches_are_per_user_and_resource(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    await response_cache.get_item(user_id, CacheResource.TAGS, item_id, load("tag"))
+
+    await response_cache.get_item(
+        user_id, CacheResource.DEVICES, item_id, load("device")
+    )
+    await response_cache.get_item(uuid4(), CacheResource.TAGS, item_id, load("other"))
+
+    assert loads == ["tag", "device", "other"]
+
+
+@pytest.mark.anyio
+async def test_loads_without_redis(
+    response_cache: RedisResponseCache,
+    redis_client: _Redis,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    redis_client.unavailable = True
+
+    for name in ("first", "second"):
+        await response_cache.get_item(user_id, CacheResource.TAGS, item_id, load(name))
+        await response_cache.get_list(
+            user_id, CacheResource.TAGS, _Query(page=1), load(name)
+        )
+    await response_cache.invalidate(user_id, CacheResource.TAGS, [item_id])
+
+    assert loads == ["first", "first", "second", "second"]
+
+
+def test_local_cache_evicts_the_least_recently_used() -> None:
+    local_cache = LocalCache(max_size=2, expire_in_seconds=60)
+    for key in ("a", "b"):
+        local_cache.set(key, key, version=local_cache.version)
+
+    assert local_cache.get("a") == (True, "a")
+    local_cache.set("c", "c", version=local_cache.version)
+
+    assert local_cache.get("b") == (False, None)
+    assert local_cache.get("a") == (True, "a")
+    assert local_cache.stats() == {
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+        "size": 2,
+        "max_size": 2,
+    }
+
+
+def test_local_cache_expires(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    local_cache = LocalCache(max_size=2, expire_in_seconds=60)
+    local_cache.set("a", "a", version=local_cache.version)
+
+    now[0] += 59
+    assert local_cache.get("a") == (True, "a")
+    now[0] += 1
+    assert local_cache.get("a") == (False, None)
+
+
+def test_local_cache_drops_a_value_read_before_an_invalidation() -> None:
+    local_cache = LocalCache(max_size=2, expire_in_seconds=60)
+    version = local_cache.version
+
+    local_cache.discard(["a"])
+    local_cache.set("a", "stale", version=version)
+
+    assert local_cache.get("a") == (False, None)
+
+
+@pytest.mark.anyio
+async def test_object_is_served_by_the_local_cache(
+    response_cache: RedisResponseCache,
+    redis_client: _Redis,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    item = await response_cache.get_object(
+        user_id, CacheResource.DEVICES, item_id, _Item, load("item")
+    )
+
+    redis_client.unavailable = True
+    cached = await response_cache.get_object(
+        user_id, CacheResource.DEVICES, item_id, _Item, load("other")
+    )
+
+    assert cached is item
+    assert loads == ["item"]
+
+
+@pytest.mark.anyio
+async def test_object_is_shared_with_the_serialized_item(
+    response_cache: RedisResponseCache,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    await response_cache.get_item(user_id, CacheResource.TAGS, item_id, load("item"))
+
+    item = await response_cache.get_object(
+        user_id, CacheResource.TAGS, item_id, _Item, load("other")
+    )
+
+    assert item == _Item(id=UUID(int=0), name="item")
+    assert loads == ["item"]
+
+
+@pytest.mark.anyio
+async def test_invalidate_is_published_to_every_worker(
+    response_cache: RedisResponseCache,
+    redis_client: _Redis,
+    load: Callable[[str], Any],
+    loads: list[str],
+) -> None:
+    user_id, item_id = uuid4(), uuid4()
+    await response_cache.get_object(
+        user_id, CacheResource.DEVICES, item_id, _Item, load("stale")
+    )
+
+    await response_cache.invalidate(user_id, CacheResource.DEVICES, [item_id])
+
+    key = f"cache:{user_id}:{CacheResource.DEVICES}:{item_id}"
+    assert redis_client.published == [(INVALIDATION_CHANNEL, orjson.dumps([key]))]
+    item = await response_cache.get_object(
+        user_id, CacheResource.DEVICES, item_id, _Item, load("fresh")
+    )
+    assert item is not None
+    assert item.name == "fresh"
+
+
+@pytest.mark.anyio
+async def test_invalidations_of_other_workers_are_applied(
+    redis_client: _Redis,
+) -> None:
+    listener = asyncio.create_task(listen_for_invalidations(redis_client))  # type: ignore[arg-type]
+    await redis_client.subscribed.wait()
+    for key in ("a", "b"):
+        cache.local_cache.set(key, key, version=cache.local_cache.version)
+
+    await redis_client.messages.put(orjson.dumps(["a"]))
+    await asyncio.sleep(0.01)
+
+    assert cache.local_cache.get("a") == (False, None)
+    assert cache.local_cache.get("b") == (True, "b")
+    listener.cancel()
+
+
+@pytest.mark.anyio
+async def test_local_cache_is_cleared_on_resubscribe(
+    monkeypatch: pytest.MonkeyPatch,
+    redis_client: _Redis,
+) -> None:
+    reconnecting, reconnect = asyncio.Event(), asyncio.Event()
+
+    async def _sleep(delay: float) -> None:
+        reconnecting.set()
+        await reconnect.wait()
+
+    monkeypatch.setattr(cache.asyncio, "sleep", _sleep)
+    listener = asyncio.create_task(listen_for_invalidations(redis_client))  # type: ignore[arg-type]
+    await redis_client.subscribed.wait()
+    redis_client.subscribed.clear()
+    cache.local_cache.set("a", "a", version=cache.local_cache.version)
+
+    redis_client.unavailable = True
+    await redis_client.messages.put(b"[]")
+    await reconnecting.wait()
+    assert cache.local_cache.get("a") == (False, None)
+
+    # invalidations published while disconnected are lost
+    cache.local_cache.set("b", "b", version=cache.local_cache.version)
+    redis_client.unavailable = False
+    reconnect.set()
+    await redis_client.subscribed.wait()
+
+    assert cache.local_cache.get("b") == (False, None)
+    listener.cancel()
+
+
+def test_write_invalidates_the_cached_responses(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    tag = create_tag()
+    # cached by the reads
+    client.get(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+    client.get("/api/v1/tags/", headers=auth_headers)
+
+    response = client.put(
+        f"/api/v1/tags/{tag['id']}",
+        json={"name": "renamed", "devices_ids": []},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200, response.text
+
+    response = client.get(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+    assert response.json()["name"] == "renamed"
+    response = client.get("/api/v1/tags/", headers=auth_headers)
+    assert [item["name"] for item in response.json()["items"]] == ["renamed"]
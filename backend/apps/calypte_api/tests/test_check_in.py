@@ -0,0 +1,158 @@
+import os
+
+from collections.abc import Callable
+from typing import Any
+from uuid import uuid4
+
+from fastapi.testclient import TestClient
+
+
+def _check_in(
+    client: TestClient,
+    headers: dict[str, str],
+    device: dict[str, Any],
+    version: str,
+) -> Any:
+    return client.get(
+        f"/api/v1/devices/{device['id']}/check-in",
+        params={"version": version},
+        headers=headers,
+    )
+
+
+def _release(
+    client: TestClient, auth_headers: dict[str, str], firmware: dict[str, Any]
+) -> None:
+    response = client.post(
+        f"/api/v1/firmware-info/{firmware['id']}/release", headers=auth_headers
+    )
+    assert response.status_code == 200, response.text
+
+
+def _get_device(
+    client: TestClient, auth_headers: dict[str, str], device: dict[str, Any]
+) -> Any:
+    response = client.get(f"/api/v1/devices/{device['id']}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_update_to_the_released_firmware(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    firmware = upload_firmware(os.urandom(1024), "1.0.1")
+    _release(client, auth_headers, firmware)
+
+    response = _check_in(client, auth_headers, device, "1.0.0")
+
+    assert response.status_code == 200, response.text
+    body = response.json()
+    assert body["firmware"]["id"] == firmware["id"]
+    assert body["firmware"]["version"] == "1.0.1"
+    # a delta from the running version when there is one
+    assert body["downloadUrl"].endswith(
+        f"/api/v1/firmware/{firmware['id']}?from_version=1.0.0"
+    )
+
+
+def test_up_to_date(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    _release(client, auth_headers, firmware)
+
+    response = _check_in(client, auth_headers, device, "1.0.0")
+
+    assert response.status_code == 304
+    assert response.content == b""
+    # the installed firmware is recorded
+    assert _get_device(client, auth_headers, device)["firmware_info"] == [
+        firmware["id"]
+    ]
+
+
+def test_nothing_released(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    # an uploaded firmware reaches no device before it is released
+    upload_firmware(os.urandom(1024), "1.0.1")
+
+    response = _check_in(client, auth_headers, device, "1.0.0")
+
+    assert response.status_code == 304
+
+
+def test_first_check_in_registers_the_device(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    assert device["registeredAt"] is None
+
+    _check_in(client, auth_headers, device, "1.0.0")
+
+    assert _get_device(client, auth_headers, device)["registeredAt"] is not None
+
+
+def test_latest_release_of_the_device_type(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_type: Callable[[], Any],
+    create_device: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    first = upload_firmware(os.urandom(1024), "1.0.1")
+    second = upload_firmware(os.urandom(1024), "1.0.2")
+    _release(client, auth_headers, second)
+    _release(client, auth_headers, first)
+    # of another type
+    _release(
+        client,
+        auth_headers,
+        upload_firmware(os.urandom(1024), "2.0.0", type_id=create_type()),
+    )
+
+    response = _check_in(client, auth_headers, device, "1.0.0")
+
+    # the most recently released, which rolls the type back
+    assert response.json()["firmware"]["id"] == first["id"]
+
+
+def test_device_of_another_user(
+    client: TestClient,
+    create_auth_headers: Callable[..., dict[str, str]],
+    create_device: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+
+    response = _check_in(client, create_auth_headers(uuid4()), device, "1.0.0")
+
+    assert response.status_code == 404
+
+
+def test_version_is_required(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+
+    response = client.get(
+        f"/api/v1/devices/{device['id']}/check-in", headers=auth_headers
+    )
+
+    assert response.status_code == 422
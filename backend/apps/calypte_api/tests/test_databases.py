@@ -0,0 +1,133 @@
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+
+import pytest
+
+from calypte_api.common.databases import releases_connection
+from fastapi.testclient import TestClient
+
+
+class _Session:
+    """
+    The state of a session the decorator uses, with its closes counted
+    """
+
+    def __init__(self) -> None:
+        self.info: dict[str, Any] = {}
+        self.closes = 0
+
+    async def close(self) -> None:
+        self.closes += 1
+
+
+@releases_connection
+class _Repo:
+    def __init__(self, db_session: _Session):
+        self.db_session = db_session
+
+    async def get(self) -> int:
+        return self.db_session.closes
+
+    async def get_twice(self) -> list[int]:
+        return [await self.get(), await self.get()]
+
+    async def fail(self) -> None:
+        raise ValueError("query failed")
+
+    async def stream(self) -> AsyncIterator[int]:
+        yield self.db_session.closes
+        yield self.db_session.closes
+
+    async def _get(self) -> int:
+        return self.db_session.closes
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture
+def db_session() -> _Session:
+    return _Session()
+
+
+@pytest.fixture
+def repo(db_session: _Session) -> _Repo:
+    return _Repo(db_session)
+
+
+@pytest.mark.anyio
+async def test_released_after_a_call(db_session: _Session, repo: _Repo) -> None:
+    # still open during the call
+    assert await repo.get() == 0
+    assert db_session.closes == 1
+
+    await repo.get()
+    assert db_session.closes == 2
+
+
+@pytest.mark.anyio
+async def test_released_after_the_outermost_call(
+    db_session: _Session, repo: _Repo
+) -> None:
+    assert await repo.get_twice() == [0, 0]
+    assert db_session.closes == 1
+    assert db_session.info["depth"] == 0
+
+
+@pytest.mark.anyio
+async def test_released_after_a_failed_call(db_session: _Session, repo: _Repo) -> None:
+    with pytest.raises(ValueError):
+        await repo.fail()
+
+    assert db_session.closes == 1
+
+
+@pytest.mark.anyio
+async def test_released_before_streaming(db_session: _Session, repo: _Repo) -> None:
+    assert [item async for item in repo.stream()] == [0, 1]
+    assert db_session.closes == 1
+
+
+@pytest.mark.anyio
+async def test_released_when_a_stream_is_not_started(
+    db_session: _Session, repo: _Repo
+) -> None:
+    stream = repo.stream()
+    await stream.aclose()
+
+    assert db_session.closes == 0
+    assert [item async for item in repo.stream()] == [0, 1]
+
+
+@pytest.mark.anyio
+async def test_private_methods_do_not_release(
+    db_session: _Session, repo: _Repo
+) -> None:
+    await repo._get()
+
+    assert db_session.closes == 0
+
+
+def _checkouts(response: Any) -> str | None:
+    server_timing = response.headers.get("server-timing")
+    if server_timing is None:
+        return None
+
+    return server_timing.rpartition("db-checkouts;desc=")[2].strip('"')
+
+
+def test_no_connection_before_the_first_query(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    path = f"/api/v1/devices/{device['id']}"
+
+    # rejected by the authorization
+    assert _checkouts(client.get(path)) is None
+    # the first read fills the cache, the second is served from it
+    assert _checkouts(client.get(path, headers=auth_headers)) == "1"
+    assert _checkouts(client.get(path, headers=auth_headers)) is None
@@ -0,0 +1,201 @@
+from collections.abc import AsyncIterator, Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+import orjson
+import pytest
+
+from calypte_api.common.settings import get_settings
+from calypte_api.devices.schemas import BulkDeviceFormat, BulkDeviceRow
+from calypte_api.devices.service import _parse_bulk_rows, _read_lines
+from fastapi.testclient import TestClient
+
+
+TYPE_ID = UUID("2f0a6c1e-5b3d-4a7e-9c8f-1d2e3f4a5b6c")
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+async def _chunks(*chunks: bytes) -> AsyncIterator[bytes]:
+    for chunk in chunks:
+        yield chunk
+
+
+async def _collect(rows: AsyncIterator[Any]) -> list[Any]:
+    return [row async for row in rows]
+
+
+@pytest.mark.anyio
+async def test_read_lines_across_chunks() -> None:
+    body = _chunks(b"fir", b"st\nsec", b"ond\n\nth", b"ird")
+
+    lines = await _collect(_read_lines(body, max_line_size=16))
+
+    assert lines == [(1, b"first"), (2, b"second"), (3, b""), (4, b"third")]
+
+
+@pytest.mark.anyio
+async def test_read_lines_skips_long_lines() -> None:
+    body = _chunks(b"short\n", b"x" * 10, b"x" * 10, b"\nshort\n", b"y" * 20)
+
+    lines = await _collect(_read_lines(body, max_line_size=16))
+
+    assert lines == [(1, b"short"), (2, None), (3, b"short"), (4, None)]
+
+
+@pytest.mark.anyio
+async def test_read_lines_at_the_limit() -> None:
+    body = _chunks(b"x" * 16 + b"\n" + b"y" * 17 + b"\n")
+
+    lines = await _collect(_read_lines(body, max_line_size=16))
+
+    assert lines == [(1, b"x" * 16), (2, None)]
+
+
+@pytest.mark.anyio
+async def test_parse_ndjson_rows() -> None:
+    body = _chunks(
+        orjson.dumps({"type_id": str(TYPE_ID)}) + b"\n",
+        b"{not json\n",
+        orjson.dumps({"type_id": "nope"}) + b"\n",
+    )
+
+    rows = await _collect(_parse_bulk_rows(BulkDeviceFormat.NDJSON, body))
+
+    assert rows[0] == (1, BulkDeviceRow(type_id=TYPE_ID))
+    assert rows[1] == (2, "Malformed line.")
+    assert rows[2][0] == 3
+    assert rows[2][1].startswith("type_id:")
+
+
+@pytest.mark.anyio
+async def test_parse_csv_rows() -> None:
+    device_id, tags = uuid4(), [uuid4(), uuid4()]
+    body = _chunks(
+        b"id,type_id,tags\n",
+        f",{TYPE_ID},\n".encode(),
+        f"{device_id},{TYPE_ID},{tags[0]} {tags[1]}\n".encode(),
+    )
+
+    rows = await _collect(_parse_bulk_rows(BulkDeviceFormat.CSV, body))
+
+    assert rows == [
+        (2, BulkDeviceRow(type_id=TYPE_ID)),
+        (3, BulkDeviceRow(id=device_id, type_id=TYPE_ID, tags=tags)),
+    ]
+
+
+@pytest.mark.anyio
+async def test_parse_long_line() -> None:
+    line_size = get_settings().devices_bulk_max_line_size
+    body = _chunks(b"x" * (line_size + 1) + b"\n")
+
+    rows = await _collect(_parse_bulk_rows(BulkDeviceFormat.NDJSON, body))
+
+    assert rows == [(1, f"Line is longer than {line_size} bytes.")]
+
+
+def _bulk(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    media_type: str,
+    body: bytes,
+) -> list[dict[str, Any]]:
+    response = client.post(
+        "/api/v1/devices/bulk",
+        content=body,
+        headers={**auth_headers, "Content-Type": media_type},
+    )
+    assert response.status_code == 200, response.text
+    return [orjson.loads(line) for line in response.content.splitlines()]
+
+
+def test_bulk_ndjson(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    tag = create_tag()
+    device_id = uuid4()
+    body = b"".join(
+        orjson.dumps(row) + b"\n"
+        for row in (
+            {"type_id": str(type_id)},
+            {"id": str(device_id), "type_id": str(type_id), "tags": [tag["id"]]},
+            {"type_id": str(uuid4())},
+            {"id": str(device_id), "type_id": str(type_id)},
+        )
+    )
+
+    results = _bulk(client, auth_headers, BulkDeviceFormat.NDJSON, body)
+
+    assert [(result["line"], result["status"]) for result in results] == [
+        (1, "created"),
+        (2, "created"),
+        (3, "failed"),
+        (4, "failed"),
+    ]
+    assert results[2]["detail"] == "Type not found."
+    assert results[3]["detail"] == "Duplicate device."
+    response = client.get(f"/api/v1/devices/{device_id}", headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_bulk_csv_updates_tags(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    tag = create_tag()
+    device_id = uuid4()
+    header = b"id,type_id,tags\n"
+    _bulk(
+        client,
+        auth_headers,
+        BulkDeviceFormat.CSV,
+        header + f"{device_id},{type_id},\n".encode(),
+    )
+
+    results = _bulk(
+        client,
+        auth_headers,
+        BulkDeviceFormat.CSV,
+        header + f"{device_id},{type_id},{tag['id']}\n".encode(),
+    )
+
+    assert [(result["line"], result["status"]) for result in results] == [
+        (2, "updated")
+    ]
+    response = client.get(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+    assert response.json()["devices_count"] == 1
+
+
+def test_bulk_reports_long_lines(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> None:
+    line_size = get_settings().devices_bulk_max_line_size
+    body = b"x" * (line_size + 1) + b"\n" + orjson.dumps({"type_id": str(type_id)})
+
+    results = _bulk(client, auth_headers, BulkDeviceFormat.NDJSON, body)
+
+    assert [(result["line"], result["status"]) for result in results] == [
+        (1, "failed"),
+        (2, "created"),
+    ]
+
+
+def test_bulk_rejects_other_media_types(
+    client: TestClient, auth_headers: dict[str, str]
+) -> None:
+    response = client.post(
+        "/api/v1/devices/bulk",
+        content=b"{}",
+        headers={**auth_headers, "Content-Type": "application/json"},
+    )
+
+    assert response.status_code == 415
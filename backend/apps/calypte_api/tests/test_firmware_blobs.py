@@ -0,0 +1,164 @@
+import hashlib
+import os
+
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from uuid import UUID, uuid4
+
+from calypte_api.common import databases
+from calypte_api.common.models import Type
+from calypte_api.common.settings import get_settings
+from calypte_api.firmware.models import FirmwareBlob
+from fastapi.testclient import TestClient
+from sqlalchemy import delete
+
+
+def _image() -> bytes:
+    # unique per test, the tests share the storage
+    return os.urandom(64 * 1024)
+
+
+def _blob_path(sha256: str) -> Path:
+    return get_settings().firmware_storage_dir / "blobs" / sha256[:2] / sha256
+
+
+def _ref_count(client: TestClient, sha256: str) -> int | None:
+    async def _get_ref_count() -> int | None:
+        async with databases.async_session() as db_session:
+            blob = await db_session.get(FirmwareBlob, sha256)
+            return None if blob is None else blob.ref_count
+
+    return client.portal.call(_get_ref_count)
+
+
+def test_same_image_is_stored_once(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+
+    first = upload_firmware(image, "1.0.0")
+    second = upload_firmware(image, "1.0.1")
+
+    assert _ref_count(client, sha256) == 2
+    for firmware in (first, second):
+        response = client.get(
+            f"/api/v1/firmware/{firmware['id']}", headers=auth_headers
+        )
+        assert response.status_code == 200
+        assert response.content == image
+
+
+def test_link_firmware_by_hash(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+    upload_firmware(image, "1.0.0")
+
+    body = {
+        "type_id": str(type_id),
+        "name": "firmware",
+        "version": "1.0.1",
+        "description": "firmware",
+    }
+    response = client.post(
+        "/api/v1/firmware/by-hash",
+        json={**body, "sha256": sha256},
+        headers=auth_headers,
+    )
+    assert response.status_code == 201, response.text
+    assert _ref_count(client, sha256) == 2
+
+    response = client.post(
+        "/api/v1/firmware/by-hash",
+        json={**body, "version": "1.0.2", "sha256": "0" * 64},
+        headers=auth_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_delete_firmware_keeps_a_shared_image(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+    first = upload_firmware(image, "1.0.0")
+    second = upload_firmware(image, "1.0.1")
+
+    response = client.delete(f"/api/v1/firmware/{first['id']}", headers=auth_headers)
+
+    assert response.status_code == 204
+    assert _ref_count(client, sha256) == 1
+    assert _blob_path(sha256).exists()
+    response = client.get(f"/api/v1/firmware/{first['id']}", headers=auth_headers)
+    assert response.status_code == 404
+    response = client.get(f"/api/v1/firmware/{second['id']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.content == image
+
+
+def test_delete_last_firmware_deletes_the_image(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+    firmware = upload_firmware(image, "1.0.0")
+    assert _blob_path(sha256).exists()
+
+    response = client.delete(f"/api/v1/firmware/{firmware['id']}", headers=auth_headers)
+
+    assert response.status_code == 204
+    assert _ref_count(client, sha256) is None
+    assert not _blob_path(sha256).exists()
+
+
+def test_delete_firmware_of_another_user(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_auth_headers: Callable[..., dict[str, str]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+    firmware = upload_firmware(image, "1.0.0")
+
+    response = client.delete(
+        f"/api/v1/firmware/{firmware['id']}", headers=create_auth_headers(uuid4())
+    )
+
+    assert response.status_code == 404
+    assert _ref_count(client, sha256) == 1
+    response = client.get(f"/api/v1/firmware/{firmware['id']}", headers=auth_headers)
+    assert response.status_code == 200
+
+
+def test_deleting_a_type_releases_its_images(
+    client: TestClient,
+    type_id: UUID,
+    create_type: Callable[[], UUID],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = _image()
+    sha256 = hashlib.sha256(image).hexdigest()
+    upload_firmware(image, "1.0.0")
+    upload_firmware(image, "1.0.0", type_id=create_type())
+
+    async def _delete_type() -> None:
+        async with databases.async_session() as db_session:
+            await db_session.execute(delete(Type).where(Type.id == type_id))
+            await db_session.commit()
+
+    client.portal.call(_delete_type)
+
+    assert _ref_count(client, sha256) == 1
@@ -0,0 +1,80 @@
+import os
+
+from collections.abc import Callable
+from typing import Any
+
+import bsdiff4
+
+from fastapi.testclient import TestClient
+
+
+def _next_version(image: bytes) -> bytes:
+    # a few patched bytes, its delta is far smaller than the image
+    return image[:1000] + b"patched" + image[1007:]
+
+
+def _download(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    firmware: dict[str, Any],
+    from_version: str,
+) -> Any:
+    response = client.get(
+        f"/api/v1/firmware/{firmware['id']}",
+        params={"from_version": from_version},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200
+    return response
+
+
+def test_delta_from_the_previous_version(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    base = os.urandom(64 * 1024)
+    image = _next_version(base)
+    base_firmware = upload_firmware(base, "1.0.0")
+    # the delta is generated once the response has been sent
+    firmware = upload_firmware(image, "1.0.1")
+
+    response = _download(client, auth_headers, firmware, "1.0.0")
+
+    assert response.headers["x-firmware-delta-base"] == base_firmware["id"]
+    assert len(response.content) < len(image)
+    assert bsdiff4.patch(base, response.content) == image
+
+
+def test_full_image_without_a_delta(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    base = os.urandom(64 * 1024)
+    upload_firmware(base, "1.0.0")
+    upload_firmware(_next_version(base), "1.0.1")
+    image = _next_version(_next_version(base))
+    firmware = upload_firmware(image, "1.0.2")
+
+    # only the delta from the previous version is generated
+    for from_version in ("1.0.0", "0.9.0"):
+        response = _download(client, auth_headers, firmware, from_version)
+
+        assert "x-firmware-delta-base" not in response.headers
+        assert response.content == image
+
+
+def test_no_delta_larger_than_the_image(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    upload_firmware(os.urandom(64 * 1024), "1.0.0")
+    image = os.urandom(64 * 1024)
+    firmware = upload_firmware(image, "1.0.1")
+
+    response = _download(client, auth_headers, firmware, "1.0.0")
+
+    assert "x-firmware-delta-base" not in response.headers
+    assert response.content == image
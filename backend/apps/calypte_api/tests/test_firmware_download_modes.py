@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import os
+import time
+
+from collections.abc import Callable
+from typing import Any
+from urllib.parse import parse_qs, urlsplit
+from uuid import uuid4
+
+import pytest
+
+from calypte_api.common.settings import FirmwareDownloadMode, get_settings
+from fastapi.testclient import TestClient
+
+
+PUBLIC_URL = "https://firmware.example.com/files"
+SECURE_LINK_SECRET = "secure-link-secret"
+
+
+@pytest.fixture
+def download_mode(monkeypatch: pytest.MonkeyPatch) -> Callable[[str], None]:
+    settings = get_settings()
+    monkeypatch.setattr(settings, "firmware_public_url", PUBLIC_URL)
+    monkeypatch.setattr(settings, "firmware_secure_link_secret", SECURE_LINK_SECRET)
+
+    def _download_mode(mode: str) -> None:
+        monkeypatch.setattr(settings, "firmware_download_mode", mode)
+
+    return _download_mode
+
+
+def _blob_path(image: bytes) -> str:
+    sha256 = hashlib.sha256(image).hexdigest()
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+
+def test_redirect_to_a_signed_url(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    download_mode: Callable[[str], None],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(1024)
+    firmware = upload_firmware(image, "1.0.0")
+    download_mode(FirmwareDownloadMode.REDIRECT)
+
+    response = client.get(
+        f"/api/v1/firmware/{firmware['id']}",
+        headers=auth_headers,
+        follow_redirects=False,
+    )
+
+    assert response.status_code == 302
+    assert response.headers["cache-control"] == "no-store"
+    url = urlsplit(response.headers["location"])
+    assert f"{url.scheme}://{url.netloc}{url.path}" == (
+        f"{PUBLIC_URL}/{_blob_path(image)}"
+    )
+    # the signature nginx checks with secure_link_md5
+    query = parse_qs(url.query)
+    expires = query["expires"][0]
+    assert int(expires) > time.time()
+    signature = hashlib.md5(
+        f"{expires}{url.path} {SECURE_LINK_SECRET}".encode()
+    ).digest()
+    assert query["md5"][0] == base64.urlsafe_b64encode(signature).rstrip(b"=").decode()
+
+
+def test_accel_redirect_to_the_internal_path(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    download_mode: Callable[[str], None],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(1024)
+    firmware = upload_firmware(image, "1.0.0")
+    download_mode(FirmwareDownloadMode.ACCEL)
+
+    response = client.get(f"/api/v1/firmware/{firmware['id']}", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert response.content == b""
+    assert response.headers["x-accel-redirect"] == (
+        f"{get_settings().firmware_accel_redirect_location}/{_blob_path(image)}"
+    )
+
+
+@pytest.mark.parametrize(
+    "mode",
+    [
+        FirmwareDownloadMode.STREAM,
+        FirmwareDownloadMode.REDIRECT,
+        FirmwareDownloadMode.ACCEL,
+    ],
+)
+def test_only_the_owner_downloads(
+    client: TestClient,
+    create_auth_headers: Callable[..., dict[str, str]],
+    download_mode: Callable[[str], None],
+    upload_firmware: Callable[..., dict[str, Any]],
+    mode: str,
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    download_mode(mode)
+
+    response = client.get(
+        f"/api/v1/firmware/{firmware['id']}",
+        headers=create_auth_headers(uuid4()),
+        follow_redirects=False,
+    )
+
+    assert response.status_code == 404
@@ -0,0 +1,98 @@
+import hashlib
+import os
+
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID
+
+from calypte_api.common.settings import get_settings
+from fastapi.testclient import TestClient
+
+
+def _temp_files() -> set[str]:
+    temp_dir = get_settings().firmware_storage_dir / "tmp"
+    return set(os.listdir(temp_dir)) if temp_dir.exists() else set()
+
+
+def test_upload_is_downloaded_as_sent(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    # spans several chunks of the storage
+    image = os.urandom(3 * get_settings().firmware_chunk_size + 123)
+
+    firmware = upload_firmware(image, "1.0.0")
+
+    response = client.get(f"/api/v1/firmware/{firmware['id']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.content == image
+    assert response.headers["etag"] == f'"{hashlib.sha256(image).hexdigest()}"'
+
+
+def test_upload_with_its_sha256(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+) -> None:
+    image = os.urandom(1024)
+
+    response = client.post(
+        "/api/v1/firmware",
+        data={
+            "type_id": str(type_id),
+            "name": "firmware",
+            "version": "1.0.0",
+            "description": "firmware",
+            "sha256": hashlib.sha256(image).hexdigest(),
+        },
+        files={"firmware": ("firmware.bin", image)},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 201, response.text
+
+
+def test_upload_with_another_sha256(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+) -> None:
+    temp_files = _temp_files()
+
+    response = client.post(
+        "/api/v1/firmware",
+        data={
+            "type_id": str(type_id),
+            "name": "firmware",
+            "version": "1.0.0",
+            "description": "firmware",
+            "sha256": "0" * 64,
+        },
+        files={"firmware": ("firmware.bin", os.urandom(1024))},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 400
+    # neither the firmware nor its temporary file are left behind
+    assert _temp_files() == temp_files
+    response = client.get("/api/v1/firmware-info/", headers=auth_headers)
+    assert response.json()["items"] == []
+
+
+def test_download_range(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(4096)
+    firmware = upload_firmware(image, "1.0.0")
+
+    response = client.get(
+        f"/api/v1/firmware/{firmware['id']}",
+        headers={**auth_headers, "Range": "bytes=1000-1999"},
+    )
+
+    assert response.status_code == 206
+    assert response.content == image[1000:2000]
+    assert response.headers["content-range"] == "bytes 1000-1999/4096"
@@ -0,0 +1,225 @@
+import hashlib
+import os
+
+from collections.abc import Awaitable, Callable
+from datetime import timedelta
+from typing import Any, TypeVar
+from uuid import UUID
+
+import pytest
+
+from calypte_api.common import databases
+from calypte_api.common.cache import get_response_cache
+from calypte_api.common.models import FirmwareInfo, FirmwareStatus
+from calypte_api.common.settings import get_settings
+from calypte_api.firmware.models import FirmwareBlob, FirmwareUpload
+from calypte_api.firmware.repository import get_firmware_repo
+from calypte_api.firmware_info.repository import get_firmware_info_repo
+from calypte_api.firmware_info.schemas import (
+    CreateFirmwareInfoRequestBody,
+    CreateFirmwareInfoResponse,
+)
+from calypte_api.firmware_info.service import get_firmware_info_service
+from fastapi.testclient import TestClient
+from sqlalchemy import delete, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+
+T = TypeVar("T")
+
+Run = Callable[[Callable[[AsyncSession], Awaitable[T]]], T]
+
+EXPIRE_IN_SECONDS = 60 * 60
+
+
+@pytest.fixture
+def run(client: TestClient) -> Run[Any]:
+    def _run(function: Callable[[AsyncSession], Awaitable[T]]) -> T:
+        async def _run_with_session() -> T:
+            async with databases.async_session() as db_session:
+                return await function(db_session)
+
+        return client.portal.call(_run_with_session)
+
+    return _run
+
+
+@pytest.fixture
+def create_pending_firmware(
+    run: Run[Any], user_id: UUID, type_id: UUID
+) -> Callable[..., CreateFirmwareInfoResponse]:
+    def _create_pending_firmware(version: str = "1.0.0") -> CreateFirmwareInfoResponse:
+        return run(
+            lambda db_session: get_firmware_info_repo(db_session).create_firmware(
+                user_id=user_id,
+                type_id=type_id,
+                name="firmware",
+                description="firmware",
+                version=version,
+                status=FirmwareStatus.PENDING,
+            )
+        )
+
+    return _create_pending_firmware
+
+
+def _expire(run: Run[Any], model: Any, column: str, key: Any) -> None:
+    async def _set_expired(db_session: AsyncSession) -> None:
+        primary_key = next(iter(model.__table__.primary_key))
+        await db_session.execute(
+            update(model)
+            .where(primary_key == key)
+            .values({column: func.now() - timedelta(seconds=EXPIRE_IN_SECONDS + 60)})
+        )
+        await db_session.commit()
+
+    run(_set_expired)
+
+
+def _reap(run: Run[Any]) -> None:
+    async def _delete_abandoned_uploads(db_session: AsyncSession) -> None:
+        firmware_repo = await get_firmware_repo(db_session)
+        # the tests share the database, other tests may have left some
+        while await firmware_repo.delete_abandoned_uploads(
+            pending_expire_in_seconds=EXPIRE_IN_SECONDS,
+            upload_expire_in_seconds=EXPIRE_IN_SECONDS,
+            limit=100,
+        ):
+            pass
+
+    run(_delete_abandoned_uploads)
+
+
+def _exists(run: Run[Any], model: Any, key: Any) -> bool:
+    async def _get(db_session: AsyncSession) -> bool:
+        return await db_session.get(model, key) is not None
+
+    return run(_get)
+
+
+def test_pending_firmware_is_invisible(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_pending_firmware: Callable[..., CreateFirmwareInfoResponse],
+) -> None:
+    firmware = create_pending_firmware()
+
+    for path in (f"firmware-info/{firmware.id}", f"firmware/{firmware.id}"):
+        response = client.get(f"/api/v1/{path}", headers=auth_headers)
+        assert response.status_code == 404, path
+    response = client.get("/api/v1/firmware-info/", headers=auth_headers)
+    assert response.json()["items"] == []
+
+
+def test_failed_unit_of_work_deletes_the_firmware(
+    run: Run[Any], user_id: UUID, type_id: UUID
+) -> None:
+    async def _fail(db_session: AsyncSession) -> UUID:
+        firmware_info_service = get_firmware_info_service(
+            firmware_repo=get_firmware_info_repo(db_session),
+            response_cache=get_response_cache(databases.redis),  # type: ignore[arg-type]
+        )
+        with pytest.raises(ValueError):
+            async with firmware_info_service.create_firmware(
+                user_id=user_id,
+                request_body=CreateFirmwareInfoRequestBody(
+                    type_id=type_id,
+                    name="firmware",
+                    version="1.0.0",
+                    description="firmware",
+                ),
+            ) as firmware:
+                raise ValueError("storing the image failed")
+
+        return firmware.id
+
+    firmware_id = run(_fail)
+
+    assert not _exists(run, FirmwareInfo, firmware_id)
+
+
+def test_reaper_deletes_expired_pending_firmware(
+    run: Run[Any],
+    create_pending_firmware: Callable[..., CreateFirmwareInfoResponse],
+) -> None:
+    expired = create_pending_firmware("1.0.0")
+    pending = create_pending_firmware("1.0.1")
+    _expire(run, FirmwareInfo, "created_at", expired.id)
+    # left behind by a process that died while storing the image
+    temp_path = get_settings().firmware_storage_dir / "tmp" / str(expired.id)
+    temp_path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path.write_bytes(b"partial image")
+
+    _reap(run)
+
+    assert not _exists(run, FirmwareInfo, expired.id)
+    assert not temp_path.exists()
+    # still being uploaded
+    assert _exists(run, FirmwareInfo, pending.id)
+
+
+def test_reaper_deletes_expired_uploads(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    run: Run[Any],
+    type_id: UUID,
+) -> None:
+    image = os.urandom(1024)
+    upload_ids = []
+    for _ in range(2):
+        response = client.post(
+            "/api/v1/firmware/uploads",
+            json={
+                "type_id": str(type_id),
+                "name": "firmware",
+                "version": "1.0.0",
+                "description": "firmware",
+                "size": len(image),
+                "sha256": hashlib.sha256(image).hexdigest(),
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == 201, response.text
+        upload_ids.append(UUID(response.json()["id"]))
+    expired, uploading = upload_ids
+    _expire(run, FirmwareUpload, "created_at", expired)
+
+    _reap(run)
+
+    assert not _exists(run, FirmwareUpload, expired)
+    assert _exists(run, FirmwareUpload, uploading)
+    response = client.put(
+        f"/api/v1/firmware/uploads/{expired}/parts/1",
+        content=image,
+        headers=auth_headers,
+    )
+    assert response.status_code == 404
+
+
+def test_reaper_deletes_expired_unreferenced_blobs(
+    run: Run[Any],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(1024)
+    sha256 = hashlib.sha256(image).hexdigest()
+    firmware = upload_firmware(image, "1.0.0")
+    blob_path = get_settings().firmware_storage_dir / "blobs" / sha256[:2] / sha256
+
+    async def _delete_firmware(db_session: AsyncSession) -> None:
+        # the image of a cascade is left to the reaper
+        await db_session.execute(
+            delete(FirmwareInfo).where(FirmwareInfo.id == UUID(firmware["id"]))
+        )
+        await db_session.commit()
+
+    run(_delete_firmware)
+    _reap(run)
+    # unreferenced for less than a pending firmware lives, it may be
+    # referenced again by a firmware being created
+    assert _exists(run, FirmwareBlob, sha256)
+
+    _expire(run, FirmwareBlob, "unreferenced_at", sha256)
+    _reap(run)
+
+    assert not _exists(run, FirmwareBlob, sha256)
+    assert not blob_path.exists()
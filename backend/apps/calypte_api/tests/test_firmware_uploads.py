@@ -0,0 +1,229 @@
+import hashlib
+import os
+
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+import pytest
+
+from calypte_api.firmware import repository
+from calypte_api.firmware.repository import _UploadDigest, _UploadDigests
+from fastapi.testclient import TestClient
+
+
+PART_COUNT = 3
+
+
+@pytest.fixture
+def image() -> bytes:
+    # the last part is shorter than the others
+    return os.urandom(64 * 1024 * (PART_COUNT - 1) + 1000)
+
+
+@pytest.fixture
+def create_upload(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> Callable[..., dict[str, Any]]:
+    def _create_upload(image: bytes, sha256: str | None = None) -> dict[str, Any]:
+        response = client.post(
+            "/api/v1/firmware/uploads",
+            json={
+                "type_id": str(type_id),
+                "name": "firmware",
+                "version": "1.0.0",
+                "description": "firmware",
+                "size": len(image),
+                "sha256": sha256 or hashlib.sha256(image).hexdigest(),
+            },
+            headers=auth_headers,
+        )
+        assert response.status_code == 201, response.text
+        return response.json()
+
+    return _create_upload
+
+
+@pytest.fixture
+def upload_part(
+    client: TestClient, auth_headers: dict[str, str]
+) -> Callable[[dict[str, Any], bytes, int], dict[str, Any]]:
+    def _upload_part(
+        upload: dict[str, Any], image: bytes, part_number: int
+    ) -> dict[str, Any]:
+        offset = (part_number - 1) * upload["partSize"]
+        response = client.put(
+            f"/api/v1/firmware/uploads/{upload['id']}/parts/{part_number}",
+            content=image[offset : offset + upload["partSize"]],
+            headers=auth_headers,
+        )
+        assert response.status_code == 200, response.text
+        return response.json()
+
+    return _upload_part
+
+
+def _complete(
+    client: TestClient, auth_headers: dict[str, str], upload: dict[str, Any]
+) -> Any:
+    return client.post(
+        f"/api/v1/firmware/uploads/{upload['id']}/complete", headers=auth_headers
+    )
+
+
+def _download(
+    client: TestClient, auth_headers: dict[str, str], firmware_id: str
+) -> bytes:
+    response = client.get(f"/api/v1/firmware/{firmware_id}", headers=auth_headers)
+    assert response.status_code == 200
+    return response.content
+
+
+def test_upload_in_order(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+    assert upload["partCount"] == PART_COUNT
+
+    parts = [
+        upload_part(upload, image, part_number)
+        for part_number in range(1, PART_COUNT + 1)
+    ]
+
+    assert [part["offset"] for part in parts] == [
+        (part_number - 1) * upload["partSize"]
+        for part_number in range(1, PART_COUNT + 1)
+    ]
+    assert parts[-1]["size"] == 1000
+    response = _complete(client, auth_headers, upload)
+    assert response.status_code == 201, response.text
+    assert _download(client, auth_headers, response.json()["id"]) == image
+
+
+def test_resume_lists_the_received_parts(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+    upload_part(upload, image, 2)
+
+    response = client.get(
+        f"/api/v1/firmware/uploads/{upload['id']}", headers=auth_headers
+    )
+
+    assert response.status_code == 200
+    assert [
+        (part["partNumber"], part["offset"]) for part in response.json()["parts"]
+    ] == [(2, upload["partSize"])]
+
+
+def test_upload_out_of_order_with_a_replaced_part(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+
+    # the first part is hashed with garbage and replaced afterwards
+    upload_part(upload, os.urandom(len(image)), 1)
+    for part_number in (3, 2, 1):
+        upload_part(upload, image, part_number)
+
+    response = _complete(client, auth_headers, upload)
+    assert response.status_code == 201, response.text
+    assert _download(client, auth_headers, response.json()["id"]) == image
+
+
+def test_upload_completed_by_another_worker(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+    for part_number in range(1, PART_COUNT + 1):
+        upload_part(upload, image, part_number)
+
+    # the running hash is only kept by the worker that received the parts
+    repository._upload_digests.pop(UUID(upload["id"]))
+
+    response = _complete(client, auth_headers, upload)
+    assert response.status_code == 201, response.text
+    assert _download(client, auth_headers, response.json()["id"]) == image
+
+
+def test_complete_with_a_missing_part(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+    upload_part(upload, image, 1)
+    upload_part(upload, image, 3)
+
+    response = _complete(client, auth_headers, upload)
+
+    assert response.status_code == 409
+
+
+def test_complete_with_another_sha256(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image, sha256="0" * 64)
+    for part_number in range(1, PART_COUNT + 1):
+        upload_part(upload, image, part_number)
+
+    response = _complete(client, auth_headers, upload)
+
+    assert response.status_code == 400
+
+
+def test_abort_upload(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    image: bytes,
+    create_upload: Callable[..., dict[str, Any]],
+    upload_part: Callable[[dict[str, Any], bytes, int], dict[str, Any]],
+) -> None:
+    upload = create_upload(image)
+    upload_part(upload, image, 1)
+
+    response = client.delete(
+        f"/api/v1/firmware/uploads/{upload['id']}", headers=auth_headers
+    )
+
+    assert response.status_code == 204
+    response = client.get(
+        f"/api/v1/firmware/uploads/{upload['id']}", headers=auth_headers
+    )
+    assert response.status_code == 404
+
+
+def test_upload_digests_drop_the_least_recently_used() -> None:
+    upload_digests = _UploadDigests(max_size=2)
+    first, second, third = uuid4(), uuid4(), uuid4()
+    upload_digests.set(first, _UploadDigest(chunk_size=1024))
+    upload_digests.set(second, _UploadDigest(chunk_size=1024))
+
+    upload_digests.get(first)
+    upload_digests.set(third, _UploadDigest(chunk_size=1024))
+
+    assert upload_digests.get(first) is not None
+    assert upload_digests.get(second) is None
+    assert upload_digests.get(third) is not None
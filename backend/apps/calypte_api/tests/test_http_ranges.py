@@ -0,0 +1,79 @@
+import http
+
+import pytest
+
+from calypte_api.common.http_ranges import (
+    ByteRange,
+    etag_matches,
+    parse_range_header,
+)
+from fastapi import HTTPException
+
+
+@pytest.mark.parametrize(
+    ("range_header", "expected"),
+    [
+        ("bytes=0-99", ByteRange(start=0, end=99)),
+        ("bytes=100-", ByteRange(start=100, end=999)),
+        ("bytes=-100", ByteRange(start=900, end=999)),
+        ("bytes=990-2000", ByteRange(start=990, end=999)),
+        ("bytes=-5000", ByteRange(start=0, end=999)),
+        ("BYTES = 5-5", ByteRange(start=5, end=5)),
+    ],
+)
+def test_parse_range_header(range_header: str, expected: ByteRange) -> None:
+    assert parse_range_header(range_header, 1000) == expected
+
+
+@pytest.mark.parametrize(
+    "range_header",
+    [
+        None,
+        "",
+        "items=0-10",
+        "bytes=0-10,20-30",
+        "bytes=10",
+        "bytes=-",
+        "bytes=a-10",
+        "bytes=0-b",
+        "bytes=20-10",
+    ],
+)
+def test_parse_range_header_serves_whole_representation(
+    range_header: str | None,
+) -> None:
+    assert parse_range_header(range_header, 1000) is None
+
+
+@pytest.mark.parametrize(
+    ("range_header", "size"),
+    [("bytes=1000-", 1000), ("bytes=-0", 1000), ("bytes=-10", 0)],
+)
+def test_parse_range_header_not_satisfiable(range_header: str, size: int) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        parse_range_header(range_header, size)
+
+    assert exc_info.value.status_code == http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE
+    assert exc_info.value.headers == {"Content-Range": f"bytes */{size}"}
+
+
+def test_byte_range_headers() -> None:
+    byte_range = ByteRange(start=100, end=199)
+
+    assert byte_range.length == 100
+    assert byte_range.content_range(1000) == "bytes 100-199/1000"
+
+
+@pytest.mark.parametrize(
+    ("header_value", "expected"),
+    [
+        (None, False),
+        ('"abc"', True),
+        ('W/"abc"', True),
+        ('"xyz", "abc"', True),
+        ("*", True),
+        ('"xyz"', False),
+    ],
+)
+def test_etag_matches(header_value: str | None, expected: bool) -> None:
+    assert etag_matches(header_value, '"abc"') is expected
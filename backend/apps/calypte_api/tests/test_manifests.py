@@ -0,0 +1,222 @@
+import base64
+import hashlib
+import os
+
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from calypte_api.common.settings import get_settings
+from calypte_api.firmware import manifests
+from calypte_api.firmware.manifests import (
+    ChunkedDigest,
+    build_manifest,
+    corrupted_chunks,
+    load_manifest,
+    manifest_statement,
+    merkle_root,
+    public_key_id,
+)
+from calypte_api.firmware.models import FirmwareBlob
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from fastapi.testclient import TestClient
+
+
+CHUNK_SIZE = 1024
+
+
+def _chunk_hashes(image: bytes) -> bytes:
+    return b"".join(
+        hashlib.sha256(image[i : i + CHUNK_SIZE]).digest()
+        for i in range(0, len(image), CHUNK_SIZE)
+    )
+
+
+def _node(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(b"\x01" + left + right).digest()
+
+
+@pytest.mark.parametrize("size", [0, CHUNK_SIZE, 3 * CHUNK_SIZE + 100])
+def test_chunked_digest(size: int) -> None:
+    image = os.urandom(size)
+    digest = ChunkedDigest(CHUNK_SIZE)
+
+    # fed in pieces that do not line up with the chunks
+    for i in range(0, size, 700):
+        digest.update(image[i : i + 700])
+
+    assert digest.size == size
+    assert digest.hexdigest() == hashlib.sha256(image).hexdigest()
+    assert digest.chunk_hashes() == _chunk_hashes(image)
+
+
+def test_merkle_root() -> None:
+    a, b, c = (hashlib.sha256(bytes([i])).digest() for i in range(3))
+
+    assert merkle_root(b"") == hashlib.sha256().digest()
+    assert merkle_root(a) == a
+    assert merkle_root(a + b) == _node(a, b)
+    # the odd node moves up unchanged
+    assert merkle_root(a + b + c) == _node(_node(a, b), c)
+
+
+def test_signed_manifest(monkeypatch: pytest.MonkeyPatch) -> None:
+    private_key = Ed25519PrivateKey.generate()
+    key_id = public_key_id(private_key.public_key())
+    monkeypatch.setattr(manifests, "_signing_key", (private_key, key_id))
+    image = os.urandom(2 * CHUNK_SIZE + 1)
+    sha256 = hashlib.sha256(image).hexdigest()
+
+    manifest = build_manifest(sha256, len(image), CHUNK_SIZE, _chunk_hashes(image))
+
+    assert len(manifest.chunks) == 3
+    assert manifest.key_id == key_id
+    assert manifest.signature is not None
+    public_key = private_key.public_key()
+    signature = base64.b64decode(manifest.signature)
+    merkle_root_ = manifest.merkle_root
+    public_key.verify(
+        signature, manifest_statement(sha256, len(image), CHUNK_SIZE, merkle_root_)
+    )
+    # the signature covers the image it was made for only
+    with pytest.raises(InvalidSignature):
+        public_key.verify(
+            signature,
+            manifest_statement(sha256, len(image) + 1, CHUNK_SIZE, merkle_root_),
+        )
+
+
+def test_unsigned_manifest(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(manifests, "_signing_key", None)
+    image = os.urandom(CHUNK_SIZE)
+
+    manifest = build_manifest(
+        hashlib.sha256(image).hexdigest(), len(image), CHUNK_SIZE, _chunk_hashes(image)
+    )
+
+    assert (manifest.signature, manifest.key_id) == (None, None)
+    assert manifest.merkle_root == _chunk_hashes(image).hex()
+
+
+def test_load_manifest() -> None:
+    image = os.urandom(2 * CHUNK_SIZE)
+    sha256 = hashlib.sha256(image).hexdigest()
+    manifest = build_manifest(sha256, len(image), CHUNK_SIZE, _chunk_hashes(image))
+
+    blob = FirmwareBlob(
+        sha256=sha256,
+        size=len(image),
+        chunk_size=CHUNK_SIZE,
+        chunk_hashes=_chunk_hashes(image),
+        merkle_root=manifest.merkle_root,
+        signature=manifest.signature,
+        key_id=manifest.key_id,
+    )
+
+    assert load_manifest(blob) == manifest
+    # stored before manifests were recorded
+    assert load_manifest(FirmwareBlob(sha256=sha256, size=len(image))) is None
+
+
+def test_corrupted_chunks() -> None:
+    a, b, c = (hashlib.sha256(bytes([i])).digest() for i in range(3))
+
+    assert corrupted_chunks(a + b + c, a + b + c) == []
+    assert corrupted_chunks(a + b + c, a + c + c) == [1]
+    # a truncated image misses its last chunks
+    assert corrupted_chunks(a + b + c, a) == [1, 2]
+
+
+@pytest.fixture
+def manifest_chunk_size(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(get_settings(), "firmware_manifest_chunk_size", CHUNK_SIZE)
+
+
+def _blob_path(image: bytes) -> Path:
+    sha256 = hashlib.sha256(image).hexdigest()
+    return get_settings().firmware_storage_dir / "blobs" / sha256[:2] / sha256
+
+
+def _verify(
+    client: TestClient, auth_headers: dict[str, str], firmware: dict[str, Any]
+) -> Any:
+    response = client.post(
+        f"/api/v1/firmware/{firmware['id']}/verify", headers=auth_headers
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+@pytest.mark.usefixtures("manifest_chunk_size")
+def test_manifest_of_an_upload(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(3 * CHUNK_SIZE + 10)
+    firmware = upload_firmware(image, "1.0.0")
+
+    response = client.get(
+        f"/api/v1/firmware-info/{firmware['id']}", headers=auth_headers
+    )
+
+    manifest = response.json()["manifest"]
+    assert manifest["sha256"] == hashlib.sha256(image).hexdigest()
+    assert (manifest["size"], manifest["chunkSize"]) == (len(image), CHUNK_SIZE)
+    assert manifest["chunks"] == [
+        hashlib.sha256(image[i : i + CHUNK_SIZE]).hexdigest()
+        for i in range(0, len(image), CHUNK_SIZE)
+    ]
+    assert manifest["merkleRoot"] == merkle_root(_chunk_hashes(image)).hex()
+
+
+@pytest.mark.usefixtures("manifest_chunk_size")
+def test_verify(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    image = os.urandom(3 * CHUNK_SIZE)
+    firmware = upload_firmware(image, "1.0.0")
+    blob_path = _blob_path(image)
+    mtime_ns = blob_path.stat().st_mtime_ns
+
+    assert _verify(client, auth_headers, firmware) == {
+        "sha256": hashlib.sha256(image).hexdigest(),
+        "valid": True,
+        "checkedChunks": 3,
+        "corruptedChunks": [],
+    }
+    # passed, it is not read again until it changes
+    assert _verify(client, auth_headers, firmware)["checkedChunks"] == 0
+
+    corrupted = bytearray(image)
+    corrupted[CHUNK_SIZE + 1] ^= 0xFF
+    blob_path.write_bytes(corrupted)
+    os.utime(blob_path, ns=(mtime_ns + 10**9, mtime_ns + 10**9))
+    result = _verify(client, auth_headers, firmware)
+    assert (result["valid"], result["corruptedChunks"]) == (False, [1])
+
+    blob_path.write_bytes(image)
+    os.utime(blob_path, ns=(mtime_ns + 2 * 10**9, mtime_ns + 2 * 10**9))
+    result = _verify(client, auth_headers, firmware)
+    assert (result["valid"], result["checkedChunks"]) == (True, 3)
+
+
+def test_verify_firmware_of_another_user(
+    client: TestClient,
+    create_auth_headers: Callable[..., dict[str, str]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(CHUNK_SIZE), "1.0.0")
+
+    response = client.post(
+        f"/api/v1/firmware/{firmware['id']}/verify",
+        headers=create_auth_headers(uuid4()),
+    )
+
+    assert response.status_code == 404
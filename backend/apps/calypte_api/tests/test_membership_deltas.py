@@ -0,0 +1,145 @@
+from collections.abc import Callable, Sequence
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from fastapi.testclient import TestClient
+
+
+def _get(client: TestClient, auth_headers: dict[str, str], path: str) -> Any:
+    response = client.get(f"/api/v1/{path}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def _patch(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    path: str,
+    add: Sequence[str] = (),
+    remove: Sequence[str] = (),
+) -> Any:
+    return client.patch(
+        f"/api/v1/{path}",
+        json={"add": list(add), "remove": list(remove)},
+        headers=auth_headers,
+    )
+
+
+def test_device_tag_deltas(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    first, second, third = create_tag(), create_tag(), create_tag()
+    device = create_device(tags=[first["id"]])
+    path = f"devices/{device['id']}/tags"
+
+    response = _patch(
+        client,
+        auth_headers,
+        path,
+        add=[first["id"], second["id"], third["id"]],
+    )
+
+    # only the changes are counted
+    assert response.status_code == 200, response.text
+    assert response.json() == {"added": 2, "removed": 0}
+
+    response = _patch(client, auth_headers, path, remove=[first["id"], str(uuid4())])
+
+    assert response.json() == {"added": 0, "removed": 1}
+    tags = _get(client, auth_headers, f"devices/{device['id']}")["tags"]
+    assert sorted(tags) == sorted([second["id"], third["id"]])
+    assert _get(client, auth_headers, f"tags/{first['id']}")["devices_count"] == 0
+    assert _get(client, auth_headers, f"tags/{second['id']}")["devices_count"] == 1
+
+
+def test_tag_device_deltas(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    first, second, third = create_device(), create_device(), create_device()
+    tag = create_tag(devices_ids=[first["id"], second["id"]])
+    path = f"tags/{tag['id']}/devices"
+
+    response = _patch(
+        client,
+        auth_headers,
+        path,
+        add=[third["id"]],
+        remove=[first["id"]],
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.json() == {"added": 1, "removed": 1}
+    devices = _get(client, auth_headers, f"tags/{tag['id']}/devices")["items"]
+    assert sorted(devices) == sorted([second["id"], third["id"]])
+    assert _get(client, auth_headers, f"tags/{tag['id']}")["devices_count"] == 2
+    assert _get(client, auth_headers, f"devices/{first['id']}")["tags"] == []
+    assert _get(client, auth_headers, f"devices/{third['id']}")["tags"] == [tag["id"]]
+
+
+def test_items_of_another_user(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_auth_headers: Callable[..., dict[str, str]],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    device, tag = create_device(), create_tag()
+    other_headers = create_auth_headers(uuid4())
+
+    for path, item_id in (
+        (f"devices/{device['id']}/tags", tag["id"]),
+        (f"tags/{tag['id']}/devices", device["id"]),
+    ):
+        response = _patch(client, other_headers, path, add=[item_id])
+
+        assert response.status_code == 404, path
+
+    assert _get(client, auth_headers, f"devices/{device['id']}")["tags"] == []
+
+
+def test_unknown_items_are_skipped(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    device, tag = create_device(), create_tag()
+
+    for path in (f"devices/{device['id']}/tags", f"tags/{tag['id']}/devices"):
+        response = _patch(client, auth_headers, path, add=[str(uuid4())])
+
+        assert response.json() == {"added": 0, "removed": 0}, path
+
+
+@pytest.mark.parametrize("path", ["devices/{}/tags", "tags/{}/devices"])
+def test_unknown_item(
+    client: TestClient, auth_headers: dict[str, str], path: str
+) -> None:
+    response = _patch(client, auth_headers, path.format(uuid4()), add=[str(uuid4())])
+
+    assert response.status_code == 404
+
+
+def test_added_and_removed_at_once(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    device, tag = create_device(), create_tag()
+
+    for path, item_id in (
+        (f"devices/{device['id']}/tags", tag["id"]),
+        (f"tags/{tag['id']}/devices", device["id"]),
+    ):
+        response = _patch(client, auth_headers, path, add=[item_id], remove=[item_id])
+
+        assert response.status_code == 422, path
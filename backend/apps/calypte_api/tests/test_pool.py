@@ -0,0 +1,145 @@
+from collections.abc import Callable
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from calypte_api.common import pool
+from calypte_api.common.pool import (
+    PoolMetrics,
+    RequestPoolStats,
+    create_engine,
+    pool_stats,
+    request_pool_stats,
+)
+from calypte_api.common.settings import Settings, get_settings
+from calypte_api.common.user_roles import UserRole
+from fastapi.testclient import TestClient
+from sqlalchemy import exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+
+def _settings(**update: Any) -> Settings:
+    return get_settings().model_copy(update={"debug": False, **update})
+
+
+def test_pool_of_the_settings() -> None:
+    engine = create_engine(_settings(postgres_pool_size=3, postgres_max_overflow=2))
+
+    stats = pool_stats(engine)
+
+    assert (stats["size"], stats["max_overflow"]) == (3, 2)
+    assert (stats["checked_out"], stats["saturation"]) == (0, 0.0)
+
+
+@pytest.mark.parametrize(
+    ("pgbouncer", "statement_cache_size"), [(False, None), (True, 0)]
+)
+def test_statement_caches(
+    monkeypatch: pytest.MonkeyPatch, pgbouncer: bool, statement_cache_size: int | None
+) -> None:
+    engines: list[dict[str, Any]] = []
+    monkeypatch.setattr(
+        pool,
+        "create_async_engine",
+        lambda *args, **kwargs: engines.append(kwargs),
+    )
+
+    create_engine(
+        _settings(postgres_pgbouncer=pgbouncer, postgres_statement_cache_size=64)
+    )
+
+    connect_args = engines[0]["connect_args"]
+    assert connect_args.get("statement_cache_size") == statement_cache_size
+    if pgbouncer:
+        # every prepared statement gets a name of its own
+        assert connect_args["prepared_statement_cache_size"] == 0
+        name_func = connect_args["prepared_statement_name_func"]
+        assert name_func() != name_func()
+    else:
+        assert connect_args["prepared_statement_cache_size"] == 64
+
+
+def test_pool_stats_of_another_pool() -> None:
+    engine = create_async_engine(get_settings().postgres_dsn(), poolclass=NullPool)
+
+    with pytest.raises(TypeError):
+        pool_stats(engine)
+
+
+def test_metrics_of_a_request() -> None:
+    metrics = PoolMetrics()
+    stats = RequestPoolStats()
+    token = request_pool_stats.set(stats)
+    try:
+        metrics.observe_checkout(0.005)
+        metrics.observe_checkout(0.5)
+        metrics.observe_checkin(20)
+    finally:
+        request_pool_stats.reset(token)
+    metrics.observe_checkout(0.0001)
+
+    assert metrics.checkouts == 3
+    assert metrics.wait_buckets == [1, 1, 0, 1, 0]
+    assert metrics.wait_seconds_max == 0.5
+    assert metrics.hold_buckets == [0, 0, 0, 0, 1]
+    # only the checkouts made while handling the request
+    assert stats.checkouts == 2
+    assert stats.wait_seconds == pytest.approx(0.505)
+    assert stats.hold_seconds == 20
+
+
+def test_exhausted_pool(client: TestClient) -> None:
+    engine = create_engine(
+        _settings(
+            postgres_pool_size=1,
+            postgres_max_overflow=0,
+            postgres_pool_timeout_in_seconds=0.1,
+        )
+    )
+
+    async def _exhaust() -> dict[str, Any]:
+        try:
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                with pytest.raises(exc.TimeoutError):
+                    async with engine.connect():
+                        pass
+                return pool_stats(engine)
+        finally:
+            await engine.dispose()
+
+    stats = client.portal.call(_exhaust)
+
+    assert stats["saturation"] == 1.0
+    assert stats["timeouts"] == 1
+    assert stats["checkouts"] == 1
+    assert stats["wait_seconds_buckets"]["inf"] == 0
+
+
+def test_request_reports_its_connections(
+    client: TestClient, create_auth_headers: Callable[..., dict[str, str]]
+) -> None:
+    response = client.get("/api/v1/devices/", headers=create_auth_headers(uuid4()))
+
+    server_timing = response.headers["server-timing"]
+    assert server_timing.startswith("db-wait;dur=")
+    assert 'db-checkouts;desc="' in server_timing
+    # no connection, no header
+    assert "server-timing" not in client.get("/ping").headers
+
+
+def test_db_stats(
+    client: TestClient, create_auth_headers: Callable[..., dict[str, str]]
+) -> None:
+    response = client.get(
+        "/db/stats", headers=create_auth_headers(uuid4(), UserRole.ADMIN)
+    )
+
+    assert response.status_code == 200
+    assert response.json()["checkouts"] > 0
+    assert response.json()["size"] == get_settings().postgres_pool_size
+
+    response = client.get("/db/stats", headers=create_auth_headers(uuid4()))
+    assert response.status_code == 403
@@ -0,0 +1,380 @@
+import asyncio
+import http
+import os
+
+from collections.abc import Callable
+from typing import Any
+from uuid import uuid4
+
+import pytest
+
+from calypte_api.common import rate_limiting
+from calypte_api.common.rate_limiting import (
+    EgressAdmission,
+    LocalBuckets,
+    RateLimit,
+    RateLimiter,
+    RateLimitIdentity,
+    bytes_cost,
+    get_rate_limit_policy,
+    page_cost,
+)
+from calypte_api.common.settings import RateLimitGroup, RateLimitPolicy, get_settings
+from fastapi import HTTPException, Request
+from fastapi.testclient import TestClient
+from redis.exceptions import ConnectionError
+
+
+class _Pipeline:
+    def __init__(self, redis_client: "_Redis"):
+        self.redis_client = redis_client
+        self.commands: list[tuple[str, tuple[Any, ...]]] = []
+
+    async def __aenter__(self) -> "_Pipeline":
+        return self
+
+    async def __aexit__(self, *exc_info: object) -> None:
+        pass
+
+    def incrby(self, key: str, amount: int) -> None:
+        self.commands.append(("incrby", (key, amount)))
+
+    def expire(self, key: str, seconds: int) -> None:
+        self.commands.append(("expire", (key, seconds)))
+
+    async def execute(self) -> list[Any]:
+        if self.redis_client.unavailable:
+            raise ConnectionError("Redis is unavailable.")
+
+        results: list[Any] = []
+        for command, args in self.commands:
+            self.redis_client.calls.append(command)
+            if command == "incrby":
+                key, amount = args
+                self.redis_client.values[key] = (
+                    self.redis_client.values.get(key, 0) + amount
+                )
+                results.append(self.redis_client.values[key])
+            else:
+                results.append(True)
+        return results
+
+
+class _Redis:
+    """
+    Counters of the commands the limiter sends, in memory
+    """
+
+    def __init__(self) -> None:
+        self.values: dict[str, int] = {}
+        self.calls: list[str] = []
+        self.unavailable = False
+
+    def pipeline(self, transaction: bool = True) -> _Pipeline:
+        return _Pipeline(self)
+
+    async def decrby(self, key: str, amount: int) -> int:
+        self.calls.append("decrby")
+        self.values[key] -= amount
+        return self.values[key]
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(autouse=True)
+def _reset_state(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(rate_limiting, "local_buckets", LocalBuckets(max_size=100))
+    monkeypatch.setattr(rate_limiting, "_redis_unavailable_until", 0.0)
+
+
+@pytest.fixture
+def now(monkeypatch: pytest.MonkeyPatch) -> list[float]:
+    # the start of a window, moved by the tests
+    now = [6000.0]
+    monkeypatch.setattr(rate_limiting.time, "time", lambda: now[0])
+    return now
+
+
+def _rate_limit(
+    redis_client: _Redis,
+    times: int = 10,
+    batch_size: int = 4,
+    fail_open: bool = True,
+) -> RateLimit:
+    return RateLimit(
+        limiter=RateLimiter(
+            batch_size=batch_size,
+            fail_open=fail_open,
+            retry_after_error_in_seconds=60,
+        ),
+        redis_client=redis_client,  # type: ignore[arg-type]
+        key=f"rate:user:{uuid4()}:read",
+        policy=RateLimitPolicy(times=times, seconds=60),
+    )
+
+
+@pytest.mark.anyio
+async def test_budget_of_the_window(now: list[float]) -> None:
+    rate_limit = _rate_limit(_Redis())
+    for _ in range(10):
+        await rate_limit.consume(1)
+
+    now[0] += 15
+    with pytest.raises(HTTPException) as exc_info:
+        await rate_limit.consume(1)
+
+    assert exc_info.value.status_code == http.HTTPStatus.TOO_MANY_REQUESTS
+    assert exc_info.value.headers == {"Retry-After": "45"}
+
+
+@pytest.mark.anyio
+async def test_next_window_gets_a_new_budget(now: list[float]) -> None:
+    rate_limit = _rate_limit(_Redis())
+    for _ in range(10):
+        await rate_limit.consume(1)
+    with pytest.raises(HTTPException):
+        await rate_limit.consume(1)
+
+    now[0] += 60
+
+    await rate_limit.consume(10)
+
+
+@pytest.mark.anyio
+async def test_leases_in_batches(now: list[float]) -> None:
+    redis_client = _Redis()
+    rate_limit = _rate_limit(redis_client, times=100, batch_size=4)
+
+    for _ in range(10):
+        await rate_limit.consume(1)
+
+    assert redis_client.calls.count("incrby") == 3
+
+
+@pytest.mark.anyio
+async def test_concurrent_requests_share_a_lease(now: list[float]) -> None:
+    redis_client = _Redis()
+    rate_limit = _rate_limit(redis_client, times=100, batch_size=4)
+
+    await asyncio.gather(*(rate_limit.consume(1) for _ in range(4)))
+
+    assert redis_client.calls.count("incrby") == 1
+
+
+@pytest.mark.anyio
+async def test_budget_is_shared_by_workers(
+    monkeypatch: pytest.MonkeyPatch, now: list[float]
+) -> None:
+    redis_client = _Redis()
+    rate_limit = _rate_limit(redis_client, times=10, batch_size=4)
+    served = 0
+    # two workers take turns, each with its own buckets
+    workers = [LocalBuckets(max_size=100), LocalBuckets(max_size=100)]
+    for i in range(30):
+        monkeypatch.setattr(rate_limiting, "local_buckets", workers[i % 2])
+        try:
+            await rate_limit.consume(1)
+        except HTTPException:
+            continue
+        served += 1
+
+    # the budget is never exceeded, a worker may be limited early
+    assert 10 - 4 <= served <= 10
+
+
+@pytest.mark.anyio
+async def test_cost_of_more_than_a_window(now: list[float]) -> None:
+    rate_limit = _rate_limit(_Redis(), times=10)
+
+    await rate_limit.consume(1000)
+
+    with pytest.raises(HTTPException):
+        await rate_limit.consume(1)
+
+
+@pytest.mark.anyio
+async def test_redis_unavailable_fail_open(now: list[float]) -> None:
+    redis_client = _Redis()
+    redis_client.unavailable = True
+    rate_limit = _rate_limit(redis_client, times=10, fail_open=True)
+
+    for _ in range(20):
+        await rate_limit.consume(1)
+
+
+@pytest.mark.anyio
+async def test_redis_unavailable_fail_closed(now: list[float]) -> None:
+    redis_client = _Redis()
+    redis_client.unavailable = True
+    rate_limit = _rate_limit(redis_client, fail_open=False)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await rate_limit.consume(1)
+
+    assert exc_info.value.status_code == http.HTTPStatus.SERVICE_UNAVAILABLE
+
+
+@pytest.mark.anyio
+async def test_redis_not_asked_again_after_an_error(
+    monkeypatch: pytest.MonkeyPatch, now: list[float]
+) -> None:
+    monotonic = [100.0]
+    monkeypatch.setattr(rate_limiting.time, "monotonic", lambda: monotonic[0])
+    redis_client = _Redis()
+    redis_client.unavailable = True
+    rate_limit = _rate_limit(redis_client, times=100, batch_size=1)
+    await rate_limit.consume(1)
+
+    redis_client.unavailable = False
+    await rate_limit.consume(1)
+    assert redis_client.calls == []
+
+    monotonic[0] += 60
+    await rate_limit.consume(1)
+    assert redis_client.calls.count("incrby") == 1
+
+
+@pytest.fixture
+def policies(monkeypatch: pytest.MonkeyPatch) -> None:
+    settings = get_settings()
+    monkeypatch.setattr(
+        settings,
+        "rate_limiter_policies",
+        {RateLimitGroup.READ: RateLimitPolicy(times=100, seconds=60)},
+    )
+    monkeypatch.setattr(
+        settings,
+        "rate_limiter_tenant_policies",
+        {"tenant": {RateLimitGroup.READ: RateLimitPolicy(times=200, seconds=60)}},
+    )
+    monkeypatch.setattr(
+        settings,
+        "rate_limiter_device_type_policies",
+        {"type": {RateLimitGroup.READ: RateLimitPolicy(times=300, seconds=60)}},
+    )
+
+
+@pytest.mark.parametrize(
+    ("group", "identity", "times"),
+    [
+        (RateLimitGroup.READ, RateLimitIdentity("ip:1.2.3.4"), 100),
+        (RateLimitGroup.READ, RateLimitIdentity("user:tenant", "tenant"), 200),
+        (RateLimitGroup.READ, RateLimitIdentity("device:1", "tenant", "type"), 300),
+        (RateLimitGroup.READ, RateLimitIdentity("device:1", "other", "other"), 100),
+        (RateLimitGroup.WRITE, RateLimitIdentity("device:1", "tenant", "type"), 7),
+    ],
+)
+@pytest.mark.usefixtures("policies")
+def test_policy_of_the_client(
+    monkeypatch: pytest.MonkeyPatch,
+    group: RateLimitGroup,
+    identity: RateLimitIdentity,
+    times: int,
+) -> None:
+    monkeypatch.setattr(get_settings(), "rate_limiter_times", 7)
+
+    assert get_rate_limit_policy(group, identity).times == times
+
+
+@pytest.mark.parametrize(
+    ("query_string", "cost"),
+    [(b"", 1), (b"size=100", 1), (b"size=101", 2), (b"size=1000", 10), (b"size=x", 1)],
+)
+def test_page_cost(
+    monkeypatch: pytest.MonkeyPatch, query_string: bytes, cost: int
+) -> None:
+    monkeypatch.setattr(get_settings(), "rate_limiter_cost_rows", 100)
+    request = Request({"type": "http", "query_string": query_string})
+
+    assert page_cost(request) == cost
+
+
+def test_bytes_cost(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(get_settings(), "rate_limiter_cost_bytes", 1024)
+
+    assert [bytes_cost(size) for size in (0, 1024, 1025, 10 * 1024)] == [1, 1, 2, 10]
+
+
+@pytest.mark.anyio
+async def test_egress_admission(now: list[float]) -> None:
+    redis_client = _Redis()
+    admission = EgressAdmission(max_bytes_per_second=100, window_in_seconds=10)
+    await admission.admit(redis_client, 600)  # type: ignore[arg-type]
+    await admission.admit(redis_client, 600)  # type: ignore[arg-type]
+
+    now[0] += 4
+    with pytest.raises(HTTPException) as exc_info:
+        await admission.admit(redis_client, 1)  # type: ignore[arg-type]
+
+    assert exc_info.value.status_code == http.HTTPStatus.SERVICE_UNAVAILABLE
+    assert exc_info.value.headers == {"Retry-After": "6"}
+    # a refused download does not count
+    assert list(redis_client.values.values()) == [1200]
+
+    now[0] += 6
+    await admission.admit(redis_client, 600)  # type: ignore[arg-type]
+
+
+@pytest.mark.anyio
+async def test_egress_admission_without_a_ceiling_or_redis(now: list[float]) -> None:
+    redis_client = _Redis()
+    unlimited = EgressAdmission(max_bytes_per_second=None, window_in_seconds=10)
+    await unlimited.admit(redis_client, 10**12)  # type: ignore[arg-type]
+    assert redis_client.calls == []
+
+    redis_client.unavailable = True
+    admission = EgressAdmission(max_bytes_per_second=1, window_in_seconds=10)
+    await admission.admit(redis_client, 10**12)  # type: ignore[arg-type]
+
+
+def test_download_is_charged_by_size(
+    monkeypatch: pytest.MonkeyPatch,
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    monkeypatch.setattr(get_settings(), "rate_limiter_cost_bytes", 1024)
+    monkeypatch.setattr(
+        get_settings(),
+        "rate_limiter_policies",
+        {RateLimitGroup.DOWNLOAD: RateLimitPolicy(times=5, seconds=60)},
+    )
+    firmware = upload_firmware(os.urandom(3 * 1024), "1.0.0")
+    path = f"/api/v1/firmware/{firmware['id']}"
+
+    assert client.get(path, headers=auth_headers).status_code == 200
+
+    # 3 units of 5 are spent, the metadata routes are not charged
+    response = client.get(path, headers=auth_headers)
+    assert response.status_code == http.HTTPStatus.TOO_MANY_REQUESTS
+    response = client.get(
+        f"/api/v1/firmware-info/{firmware['id']}", headers=auth_headers
+    )
+    assert response.status_code == 200
+
+
+def test_page_is_charged_by_size(
+    monkeypatch: pytest.MonkeyPatch,
+    client: TestClient,
+    auth_headers: dict[str, str],
+) -> None:
+    monkeypatch.setattr(get_settings(), "rate_limiter_cost_rows", 10)
+    monkeypatch.setattr(
+        get_settings(),
+        "rate_limiter_policies",
+        {RateLimitGroup.READ: RateLimitPolicy(times=25, seconds=60)},
+    )
+
+    for _ in range(2):
+        response = client.get(
+            "/api/v1/devices/", params={"size": 100}, headers=auth_headers
+        )
+        assert response.status_code == 200
+
+    response = client.get(
+        "/api/v1/devices/", params={"size": 100}, headers=auth_headers
+    )
+    assert response.status_code == http.HTTPStatus.TOO_MANY_REQUESTS
@@ -0,0 +1,177 @@
+import time
+
+from collections import Counter
+from collections.abc import Callable, Iterator
+from typing import Any
+from uuid import UUID
+
+import pytest
+
+from calypte_api.common import replicas
+from calypte_api.common.pool import create_engine, pool_stats
+from calypte_api.common.replicas import (
+    RecentWriters,
+    Replica,
+    _check_replica,
+    choose_replica,
+)
+from calypte_api.common.settings import PostgresReplica, get_settings
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(autouse=True)
+def _reset_state(monkeypatch: pytest.MonkeyPatch) -> Iterator[None]:
+    monkeypatch.setattr(
+        replicas,
+        "recent_writers",
+        RecentWriters(max_size=100, window_in_seconds=60),
+    )
+    monkeypatch.setattr(replicas, "_primary_only_until", 0.0)
+    # the list is shared with the application
+    yield
+    replicas.replicas.clear()
+
+
+def _replica(weight: int = 1, healthy: bool = True, port: int = 5432) -> Replica:
+    settings = get_settings().model_copy(update={"debug": False})
+    replica = Replica(
+        config=PostgresReplica(host="127.0.0.1", port=port, weight=weight),
+        engine=create_engine(
+            settings,
+            dsn=settings.postgres_dsn().replace(
+                f":{settings.postgres_port}/", f":{port}/"
+            ),
+        ),
+    )
+    replica.healthy = healthy
+    return replica
+
+
+@pytest.fixture
+def replica(client: TestClient) -> Iterator[Replica]:
+    # the primary serves as its own replica, reads are told apart by the
+    # checkouts of the replica pool
+    replica = _replica(port=get_settings().postgres_port)
+    replicas.replicas.append(replica)
+    yield replica
+    client.portal.call(replica.engine.dispose)
+
+
+def _replica_checkouts(replica: Replica) -> int:
+    return pool_stats(replica.engine)["checkouts"]
+
+
+def test_recent_writers(monkeypatch: pytest.MonkeyPatch) -> None:
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    recent_writers = RecentWriters(max_size=2, window_in_seconds=10)
+
+    for writer in ("a", "b", "c"):
+        recent_writers.add(writer)
+
+    # the oldest writer is dropped first
+    assert [writer in recent_writers for writer in "abc"] == [False, True, True]
+    now[0] += 10
+    assert "b" not in recent_writers
+
+
+def test_choose_replica_by_weight() -> None:
+    light, heavy = _replica(weight=1), _replica(weight=3)
+    replicas.replicas.extend([light, heavy, _replica(weight=100, healthy=False)])
+
+    chosen = Counter(choose_replica() for _ in range(4000))
+
+    assert set(chosen) == {light, heavy}
+    assert 2.5 < chosen[heavy] / chosen[light] < 3.5
+
+
+def test_choose_no_replica(monkeypatch: pytest.MonkeyPatch) -> None:
+    assert choose_replica() is None
+    replicas.replicas.append(_replica(healthy=False))
+    assert choose_replica() is None
+
+    replicas.replicas.append(_replica())
+    # while writes of other workers may have been missed
+    monkeypatch.setattr(replicas, "_primary_only_until", time.monotonic() + 60)
+    assert choose_replica() is None
+
+
+def test_replica_health(client: TestClient, replica: Replica) -> None:
+    unreachable = _replica(port=1)
+
+    for checked in (replica, unreachable):
+        checked.healthy = not checked.healthy
+        client.portal.call(_check_replica, checked)
+
+    # the primary replays nothing, it has no lag
+    assert (replica.healthy, replica.lag_seconds) == (True, 0.0)
+    assert (unreachable.healthy, unreachable.lag_seconds) == (False, None)
+
+
+def test_reads_go_to_a_replica(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    replica: Replica,
+) -> None:
+    checkouts = _replica_checkouts(replica)
+
+    response = client.get("/api/v1/devices/", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert _replica_checkouts(replica) > checkouts
+
+
+def test_writer_reads_from_the_primary(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    user_id: UUID,
+    replica: Replica,
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    checkouts = _replica_checkouts(replica)
+
+    tag = create_tag()
+
+    assert str(user_id) in replicas.recent_writers
+    response = client.get(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert _replica_checkouts(replica) == checkouts
+
+
+def test_failed_write_does_not_start_the_window(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    user_id: UUID,
+    replica: Replica,
+) -> None:
+    # a write route that fails before committing
+    response = client.put(
+        f"/api/v1/tags/{UUID(int=0)}",
+        json={"name": "tag", "devices_ids": []},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 404
+    assert str(user_id) not in replicas.recent_writers
+
+
+def test_route_on_the_primary(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    replica: Replica,
+) -> None:
+    device = create_device()
+    # as if the read-your-writes window of the write had passed
+    replicas.recent_writers = RecentWriters(max_size=100, window_in_seconds=60)
+    checkouts = _replica_checkouts(replica)
+
+    # records the first check-in
+    response = client.get(
+        f"/api/v1/devices/{device['id']}/check-in",
+        params={"version": "1.0.0"},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 304
+    assert _replica_checkouts(replica) == checkouts
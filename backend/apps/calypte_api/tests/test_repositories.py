@@ -0,0 +1,159 @@
+import os
+
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+from fastapi.testclient import TestClient
+
+
+def _get(client: TestClient, auth_headers: dict[str, str], path: str) -> Any:
+    response = client.get(f"/api/v1/{path}", headers=auth_headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def test_device_with_tags(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    first, second = create_tag(), create_tag()
+
+    device = create_device(tags=[first["id"], second["id"]])
+
+    tags = sorted([first["id"], second["id"]])
+    assert sorted(device["tags"]) == tags
+    assert sorted(_get(client, auth_headers, f"devices/{device['id']}")["tags"]) == tags
+    assert _get(client, auth_headers, f"tags/{first['id']}")["devices_count"] == 1
+
+
+def test_device_with_an_unknown_tag(
+    client: TestClient, auth_headers: dict[str, str], type_id: UUID
+) -> None:
+    response = client.post(
+        "/api/v1/devices",
+        json={"type_id": str(type_id), "tags": [str(uuid4())]},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 404
+
+
+def test_update_device_replaces_its_tags(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    first, second = create_tag(), create_tag()
+    device = create_device(tags=[first["id"]])
+
+    response = client.put(
+        f"/api/v1/devices/{device['id']}",
+        json={"tags": [second["id"]]},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.json()["tags"] == [second["id"]]
+    assert _get(client, auth_headers, f"tags/{first['id']}")["devices_count"] == 0
+    assert _get(client, auth_headers, f"tags/{second['id']}")["devices_count"] == 1
+
+
+def test_update_tag_replaces_its_devices(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    first, second, third = create_device(), create_device(), create_device()
+    tag = create_tag(devices_ids=[first["id"], second["id"]])
+    assert tag["devices_count"] == 2
+
+    response = client.put(
+        f"/api/v1/tags/{tag['id']}",
+        json={"name": "renamed", "devices_ids": [second["id"], third["id"]]},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.json()["name"] == "renamed"
+    assert response.json()["devices_count"] == 2
+    devices = _get(client, auth_headers, f"tags/{tag['id']}/devices")["items"]
+    assert sorted(devices) == sorted([second["id"], third["id"]])
+    assert _get(client, auth_headers, f"devices/{first['id']}")["tags"] == []
+
+
+def test_delete_tag_removes_it_from_its_devices(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+) -> None:
+    device = create_device()
+    tag = create_tag(devices_ids=[device["id"]])
+
+    response = client.delete(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+
+    assert response.status_code == 204
+    assert _get(client, auth_headers, f"devices/{device['id']}")["tags"] == []
+    response = client.get(f"/api/v1/tags/{tag['id']}", headers=auth_headers)
+    assert response.status_code == 404
+
+
+def test_firmware_info(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    type_id: UUID,
+    create_type: Callable[[], UUID],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    upload_firmware(os.urandom(1024), "1.0.0", type_id=create_type())
+
+    response = client.put(
+        f"/api/v1/firmware-info/{firmware['id']}",
+        json={"name": "renamed", "version": "1.0.1", "description": "updated"},
+        headers=auth_headers,
+    )
+
+    assert response.status_code == 200, response.text
+    firmware_info = _get(client, auth_headers, f"firmware-info/{firmware['id']}")
+    assert (firmware_info["name"], firmware_info["version"]) == ("renamed", "1.0.1")
+    page = _get(client, auth_headers, f"firmware-info/?type_id={type_id}")
+    assert [item["id"] for item in page["items"]] == [firmware["id"]]
+
+
+def test_resources_of_another_user(
+    client: TestClient,
+    create_auth_headers: Callable[..., dict[str, str]],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    other_headers = create_auth_headers(uuid4())
+    device = create_device()
+    tag = create_tag()
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+
+    for path in (
+        f"devices/{device['id']}",
+        f"tags/{tag['id']}",
+        f"firmware-info/{firmware['id']}",
+    ):
+        response = client.get(f"/api/v1/{path}", headers=other_headers)
+        assert response.status_code == 404, path
+
+    # nor can their devices be tagged
+    response = client.post(
+        "/api/v1/tags",
+        json={
+            "name": "tag",
+            "type_id": device["type_id"],
+            "devices_ids": [device["id"]],
+        },
+        headers=other_headers,
+    )
+    assert response.status_code == 404
@@ -0,0 +1,247 @@
+import os
+import random
+
+from collections import Counter
+from collections.abc import Callable
+from typing import Any
+from uuid import UUID, uuid4
+
+from calypte_api.rollouts.service import ROLLOUT_BUCKETS, rollout_bucket
+from fastapi.testclient import TestClient
+
+
+ROLLOUT_ID = UUID("6f1c3c4e-8d0a-4f6b-9b7e-3a2d1c0b9a88")
+DEVICE_ID = UUID("0b7e3f5a-2c1d-4e8f-a6b9-5d4c3b2a1f00")
+
+
+def _uuids(count: int, seed: int = 0) -> list[UUID]:
+    rng = random.Random(seed)
+    return [UUID(int=rng.getrandbits(128), version=4) for _ in range(count)]
+
+
+def test_rollout_bucket_is_deterministic() -> None:
+    assert rollout_bucket(ROLLOUT_ID, DEVICE_ID) == rollout_bucket(
+        UUID(str(ROLLOUT_ID)), UUID(str(DEVICE_ID))
+    )
+
+
+def test_rollout_bucket_is_in_range() -> None:
+    buckets = [rollout_bucket(ROLLOUT_ID, device_id) for device_id in _uuids(1000)]
+
+    assert all(0 <= bucket < ROLLOUT_BUCKETS for bucket in buckets)
+
+
+def test_rollout_bucket_is_roughly_uniform() -> None:
+    # every tenth of the buckets should get a tenth of 20000 devices, give or
+    # take well over four standard deviations
+    deciles = Counter(
+        rollout_bucket(ROLLOUT_ID, device_id) * 10 // ROLLOUT_BUCKETS
+        for device_id in _uuids(20_000)
+    )
+
+    assert sorted(deciles) == list(range(10))
+    assert all(1800 < count < 2200 for count in deciles.values())
+
+
+def test_rollout_bucket_differs_per_rollout() -> None:
+    devices = _uuids(100)
+    other_rollout_id = _uuids(1, seed=1)[0]
+
+    same = sum(
+        rollout_bucket(ROLLOUT_ID, device_id)
+        == rollout_bucket(other_rollout_id, device_id)
+        for device_id in devices
+    )
+
+    assert same < 5
+
+
+def test_rollout_bucket_keeps_devices_at_larger_percentages() -> None:
+    devices = _uuids(1000)
+
+    def selected(percentage: float) -> set[UUID]:
+        threshold = percentage * ROLLOUT_BUCKETS / 100
+        return {
+            device_id
+            for device_id in devices
+            if rollout_bucket(ROLLOUT_ID, device_id) < threshold
+        }
+
+    assert selected(1) <= selected(10) <= selected(50) <= selected(100)
+    assert selected(100) == set(devices)
+
+
+def _target(
+    client: TestClient, auth_headers: dict[str, str], device: dict[str, Any]
+) -> str | None:
+    # the firmware a device running 0.0.1 should install
+    response = client.get(
+        f"/api/v1/devices/{device['id']}/check-in",
+        params={"version": "0.0.1"},
+        headers=auth_headers,
+    )
+    if response.status_code == 304:
+        return None
+
+    assert response.status_code == 200, response.text
+    return response.json()["firmware"]["id"]
+
+
+def _create_rollout(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    firmware: dict[str, Any],
+    tag: dict[str, Any],
+    percentage: float,
+) -> Any:
+    return client.post(
+        "/api/v1/rollouts",
+        json={
+            "firmware_info_id": firmware["id"],
+            "tag_id": tag["id"],
+            "percentage": percentage,
+        },
+        headers=auth_headers,
+    )
+
+
+def _set_percentage(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    rollout: dict[str, Any],
+    percentage: float,
+) -> None:
+    response = client.patch(
+        f"/api/v1/rollouts/{rollout['id']}",
+        json={"percentage": percentage},
+        headers=auth_headers,
+    )
+    assert response.status_code == 200, response.text
+
+
+def test_release(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    response = client.get(
+        f"/api/v1/firmware-info/{firmware['id']}", headers=auth_headers
+    )
+    assert response.json()["releasedAt"] is None
+
+    response = client.post(
+        f"/api/v1/firmware-info/{firmware['id']}/release", headers=auth_headers
+    )
+
+    assert response.status_code == 200, response.text
+    assert response.json()["releasedAt"] is not None
+
+
+def test_release_firmware_of_another_user(
+    client: TestClient,
+    create_auth_headers: Callable[..., dict[str, str]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+
+    response = client.post(
+        f"/api/v1/firmware-info/{firmware['id']}/release",
+        headers=create_auth_headers(uuid4()),
+    )
+
+    assert response.status_code == 404
+
+
+def test_rollout_reaches_the_devices_of_its_tag(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    released = upload_firmware(os.urandom(1024), "1.0.0")
+    client.post(f"/api/v1/firmware-info/{released['id']}/release", headers=auth_headers)
+    firmware = upload_firmware(os.urandom(1024), "1.0.1")
+    tagged, untagged = create_device(), create_device()
+    tag = create_tag(devices_ids=[tagged["id"]])
+
+    response = _create_rollout(client, auth_headers, firmware, tag, percentage=100)
+
+    assert response.status_code == 201, response.text
+    assert _target(client, auth_headers, tagged) == firmware["id"]
+    assert _target(client, auth_headers, untagged) == released["id"]
+
+
+def test_rollout_stages(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.1")
+    device = create_device()
+    tag = create_tag(devices_ids=[device["id"]])
+    rollout = _create_rollout(client, auth_headers, firmware, tag, 1).json()
+    bucket = rollout_bucket(UUID(rollout["id"]), UUID(device["id"]))
+
+    # the device is reached once the percentage covers its bucket
+    _set_percentage(client, auth_headers, rollout, bucket * 100 / ROLLOUT_BUCKETS)
+    assert _target(client, auth_headers, device) is None
+    _set_percentage(client, auth_headers, rollout, (bucket + 1) * 100 / ROLLOUT_BUCKETS)
+    assert _target(client, auth_headers, device) == firmware["id"]
+    _set_percentage(client, auth_headers, rollout, 100)
+    assert _target(client, auth_headers, device) == firmware["id"]
+
+
+def test_deleted_rollout_falls_back_to_the_release(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_device: Callable[..., dict[str, Any]],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    released = upload_firmware(os.urandom(1024), "1.0.0")
+    client.post(f"/api/v1/firmware-info/{released['id']}/release", headers=auth_headers)
+    firmware = upload_firmware(os.urandom(1024), "1.0.1")
+    device = create_device()
+    tag = create_tag(devices_ids=[device["id"]])
+    rollout = _create_rollout(client, auth_headers, firmware, tag, 100).json()
+    assert _target(client, auth_headers, device) == firmware["id"]
+
+    response = client.delete(f"/api/v1/rollouts/{rollout['id']}", headers=auth_headers)
+
+    assert response.status_code == 204
+    # not to the aborted firmware
+    assert _target(client, auth_headers, device) == released["id"]
+
+
+def test_rollout_of_another_type(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_type: Callable[[], UUID],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    tag = create_tag(type_id=create_type())
+
+    response = _create_rollout(client, auth_headers, firmware, tag, 100)
+
+    assert response.status_code == 400
+
+
+def test_duplicate_rollout(
+    client: TestClient,
+    auth_headers: dict[str, str],
+    create_tag: Callable[..., dict[str, Any]],
+    upload_firmware: Callable[..., dict[str, Any]],
+) -> None:
+    firmware = upload_firmware(os.urandom(1024), "1.0.0")
+    tag = create_tag()
+    _create_rollout(client, auth_headers, firmware, tag, 10)
+
+    response = _create_rollout(client, auth_headers, firmware, tag, 50)
+
+    assert response.status_code == 409
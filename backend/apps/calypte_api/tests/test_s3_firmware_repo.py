@@ -0,0 +1,187 @@
+import hashlib
+import http
+import io
+import os
+
+from collections.abc import AsyncIterator, Iterator
+from uuid import uuid4
+
+import pytest
+
+from aiobotocore.session import get_session
+from calypte_api.common.settings import Settings
+from calypte_api.firmware.repository import S3FirmwareRepo
+from fastapi import HTTPException, UploadFile
+from moto.server import ThreadedMotoServer
+from pydantic import ValidationError
+
+
+# S3 rejects multipart parts smaller than 5 MiB, except the last one
+PART_SIZE = 5 * 1024 * 1024
+
+
+@pytest.fixture
+def anyio_backend() -> str:
+    return "asyncio"
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint_url() -> Iterator[str]:
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+async def s3_repo(s3_endpoint_url: str) -> AsyncIterator[S3FirmwareRepo]:
+    async with get_session().create_client(
+        "s3",
+        endpoint_url=s3_endpoint_url,
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    ) as s3_client:
+        bucket = f"firmware-{uuid4().hex}"
+        await s3_client.create_bucket(Bucket=bucket)
+        # the storage primitives do not touch the database
+        yield S3FirmwareRepo(
+            db_session=None,
+            s3_client=s3_client,
+            bucket=bucket,
+            chunk_size=1024,
+            manifest_chunk_size=1024 * 1024,
+            part_size=PART_SIZE,
+            concurrency=2,
+        )
+
+
+async def _keys(s3_repo: S3FirmwareRepo, prefix: str) -> list[str]:
+    response = await s3_repo.s3_client.list_objects_v2(
+        Bucket=s3_repo.bucket, Prefix=prefix
+    )
+    return [item["Key"] for item in response.get("Contents", [])]
+
+
+async def _multipart_uploads(s3_repo: S3FirmwareRepo) -> list[str]:
+    response = await s3_repo.s3_client.list_multipart_uploads(Bucket=s3_repo.bucket)
+    return [upload["Key"] for upload in response.get("Uploads", [])]
+
+
+class _BrokenFile(io.BytesIO):
+    """
+    Upload body whose connection drops after the first read
+    """
+
+    def __init__(self, data: bytes) -> None:
+        super().__init__(data)
+        self.reads = 0
+
+    def read(self, size: int | None = -1) -> bytes:
+        self.reads += 1
+        if self.reads > 1:
+            raise OSError("Connection reset by peer.")
+        return super().read(size)
+
+
+@pytest.mark.anyio
+async def test_put_and_stat(s3_repo: S3FirmwareRepo) -> None:
+    data = os.urandom(3000)
+
+    await s3_repo._write("blobs/firmware", data)
+    blob_info = await s3_repo._stat("blobs/firmware")
+
+    assert blob_info.size == len(data)
+    assert blob_info.etag == f'"{hashlib.md5(data).hexdigest()}"'
+    assert await s3_repo._read("blobs/firmware") == data
+
+
+@pytest.mark.anyio
+async def test_stat_missing_object(s3_repo: S3FirmwareRepo) -> None:
+    with pytest.raises(HTTPException) as exc_info:
+        await s3_repo._stat("blobs/missing")
+
+    assert exc_info.value.status_code == http.HTTPStatus.NOT_FOUND
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize(
+    ("start", "end", "expected"),
+    [
+        (0, None, slice(0, None)),
+        (100, 2099, slice(100, 2100)),
+        (2500, None, slice(2500, None)),
+    ],
+)
+async def test_range_read(
+    s3_repo: S3FirmwareRepo, start: int, end: int | None, expected: slice
+) -> None:
+    data = os.urandom(3000)
+    await s3_repo._write("blobs/firmware", data)
+
+    chunks = [chunk async for chunk in s3_repo._stream("blobs/firmware", start, end)]
+
+    assert b"".join(chunks) == data[expected]
+    assert all(len(chunk) <= s3_repo.chunk_size for chunk in chunks)
+
+
+@pytest.mark.anyio
+async def test_write_temp_completes_multipart_upload(
+    s3_repo: S3FirmwareRepo,
+) -> None:
+    data = os.urandom(2 * PART_SIZE + 100)
+
+    digest = await s3_repo._write_temp("tmp/firmware", UploadFile(io.BytesIO(data)))
+
+    assert digest.hexdigest() == hashlib.sha256(data).hexdigest()
+    assert digest.size == len(data)
+    assert await s3_repo._read("tmp/firmware") == data
+    assert await _multipart_uploads(s3_repo) == []
+
+
+@pytest.mark.anyio
+async def test_write_temp_aborts_multipart_upload(s3_repo: S3FirmwareRepo) -> None:
+    data = os.urandom(2 * PART_SIZE + 100)
+
+    with pytest.raises(OSError):
+        await s3_repo._write_temp("tmp/firmware", UploadFile(_BrokenFile(data)))
+
+    assert await _multipart_uploads(s3_repo) == []
+    assert await _keys(s3_repo, "tmp/") == []
+
+
+@pytest.mark.anyio
+async def test_complete_upload_concatenates_parts(s3_repo: S3FirmwareRepo) -> None:
+    upload_id = uuid4()
+    parts = [os.urandom(PART_SIZE), os.urandom(PART_SIZE), os.urandom(100)]
+    for part_number, part in enumerate(parts, 1):
+        offset = (part_number - 1) * PART_SIZE
+        await s3_repo._write_part(upload_id, part_number, offset, part)
+
+    await s3_repo._complete_upload(upload_id, len(parts), "blobs/firmware")
+
+    assert await s3_repo._read("blobs/firmware") == b"".join(parts)
+    assert await _keys(s3_repo, "uploads/") == []
+    assert await _multipart_uploads(s3_repo) == []
+
+
+@pytest.mark.anyio
+async def test_abort_upload_deletes_parts(s3_repo: S3FirmwareRepo) -> None:
+    upload_id = uuid4()
+    for part_number in (1, 2):
+        await s3_repo._write_part(upload_id, part_number, 0, os.urandom(100))
+    assert len(await _keys(s3_repo, "uploads/")) == 2
+
+    await s3_repo._abort_upload(upload_id, 2)
+
+    assert await _keys(s3_repo, "uploads/") == []
+
+
+def test_multipart_part_size_is_at_least_the_s3_minimum(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("S3_MULTIPART_PART_SIZE", str(PART_SIZE - 1))
+
+    with pytest.raises(ValidationError):
+        Settings()